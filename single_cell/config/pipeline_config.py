@@ -80,6 +80,13 @@ def get_hmmcopy_params(reference_dir, reference, binsize, smoothing_function, ve
         'docker': docker_containers,
         'igv_segs_quality_threshold': 0.75,
         'memory': {'med': 6},
+        'batch_read_counting': False,
+        'batch_plotting': False,
+        'max_cores': 8,
+        'compression_threads': 4,
+        'clustering_max_exact_cells': None,
+        'heatmap_image_size': [1000, 3000],
+        'ref_cache_dir': None,
         'good_cells': [
             ['median_hmmcopy_reads_per_bin', 'ge', 50],
             ['is_contaminated', 'in', ['False', 'false', False]],
@@ -119,6 +126,7 @@ def get_align_params(reference_dir, reference, version):
         'gc_windows': referencedata['gc_windows'],
         'fastq_screen_params': {
             'strict_validation': True,
+            'compression_threads': 1,
             'filter_contaminated_reads': False,
             'aligner': 'bwa',
             'genomes': [
@@ -145,12 +153,14 @@ def get_annotation_params(reference_dir, reference, version):
     params = {
         'docker': docker_containers,
         'memory': {'med': 6},
+        'max_cores': 8,
         'classifier_training_data': referencedata['classifier_training_data'],
         'fastqscreen_training_data': referencedata['fastqscreen_training_data'],
         'reference_gc': referencedata['reference_gc_qc'],
         'chromosomes': referencedata['chromosomes'],
         'num_states': 12,
         'map_cutoff': 0.9,
+        'heatmap_image_size': [1000, 3000],
         'ref_type': reference,
         'corrupt_tree_params': {
             'neighborhood_size': 2,
@@ -0,0 +1,107 @@
+'''
+sample info annotation of a synthetic metrics table: the per cell, per
+column .loc assignment that qc_annotation used before against
+csvutils.annotate_csv, which looks up all cells at once. checks that
+both write the same table.
+
+usage: python -m single_cell.tests.benchmarks.bench_annotate_metrics --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import csvutils
+from single_cell.utils import helpers
+
+from .utils import report
+from .utils import timer
+
+SAMPLE_INFO_DTYPES = {
+    'sample_type': 'str', 'index_sequence': 'str', 'column': 'int', 'row': 'int',
+    'img_col': 'int', 'primer_i5': 'str', 'index_i5': 'str', 'primer_i7': 'str',
+    'index_i7': 'str', 'pick_met': 'str', 'condition': 'str', 'library_id': 'str',
+    'sample_id': 'str',
+}
+
+
+def get_synthetic_inputs(tempdir, num_cells, num_metrics=40, seed=0):
+    rand = np.random.RandomState(seed)
+
+    cells = ['SA1-A1-R{:03d}-C{:03d}'.format(i // 100, i % 100) for i in range(num_cells)]
+
+    metrics = pd.DataFrame({'cell_id': cells})
+    dtypes = {'cell_id': 'str'}
+    for i in range(num_metrics):
+        metrics['metric_{}'.format(i)] = rand.rand(num_cells)
+        dtypes['metric_{}'.format(i)] = 'float'
+
+    metrics_file = os.path.join(tempdir, 'metrics.csv.gz')
+    csvutils.write_dataframe_to_csv_and_yaml(metrics, metrics_file, dtypes)
+
+    sample_info = {}
+    for i, cell in enumerate(cells):
+        sample_info[cell] = {
+            col: (i % 72 if dtype == 'int' else '{}_{}'.format(col, i % 17))
+            for col, dtype in SAMPLE_INFO_DTYPES.items()
+        }
+
+    dtypes.update(SAMPLE_INFO_DTYPES)
+
+    return metrics_file, sample_info, cells, dtypes
+
+
+def loop_annotation(metrics, output, sample_info, cells, dtypes):
+    metrics = csvutils.read_csv_and_yaml(metrics)
+
+    for cellid in cells:
+        cellinfo = sample_info[cellid]
+
+        for colname, value in cellinfo.items():
+            metrics.loc[metrics["cell_id"] == cellid, colname] = value
+
+    csvutils.write_dataframe_to_csv_and_yaml(metrics, output, dtypes)
+
+
+def bulk_annotation(metrics, output, sample_info, cells, dtypes):
+    annotation = {cellid: sample_info[cellid] for cellid in cells}
+
+    csvutils.annotate_csv(metrics, annotation, output, dtypes, chunksize=10 ** 5)
+
+
+def run_benchmark(tempdir, num_cells):
+    helpers.makedirs(tempdir)
+
+    metrics, sample_info, cells, dtypes = get_synthetic_inputs(tempdir, num_cells)
+
+    timings = collections.OrderedDict()
+    outputs = {}
+
+    for label, func in (('loop', loop_annotation), ('annotate_csv', bulk_annotation)):
+        outputs[label] = os.path.join(tempdir, '{}.csv.gz'.format(label))
+        with timer(label, timings):
+            func(metrics, outputs[label], sample_info, cells, dtypes)
+
+    reference = csvutils.read_csv_and_yaml(outputs['loop'])
+    annotated = csvutils.read_csv_and_yaml(outputs['annotate_csv'])
+    pd.testing.assert_frame_equal(reference, annotated)
+
+    report(timings, 'loop', label='sample info annotation, {} cells'.format(num_cells))
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=10000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells)
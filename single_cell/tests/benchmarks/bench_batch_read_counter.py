@@ -0,0 +1,116 @@
+'''
+compares one ReadCounter per cell against BatchReadCounter over
+per cell bams and over a single RG tagged bam. checks that all
+three write identical wigs.
+
+usage: python -m single_cell.tests.benchmarks.bench_batch_read_counter --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import filecmp
+import os
+
+import pysam
+from single_cell.utils import helpers
+from single_cell.workflows.hmmcopy.scripts import BatchReadCounter
+from single_cell.workflows.hmmcopy.scripts import ReadCounter
+
+from .bench_read_counter import write_exclude_list
+from .utils import report
+from .utils import timer
+from .utils import write_synthetic_bam
+
+
+def split_bam_by_tag(merged_bam, outputs, cell_tag):
+    with pysam.AlignmentFile(merged_bam, 'rb') as reader:
+        writers = {
+            cell: pysam.AlignmentFile(path, 'wb', template=reader)
+            for cell, path in outputs.items()
+        }
+        for read in reader:
+            writers[read.get_tag(cell_tag)].write(read)
+        for writer in writers.values():
+            writer.close()
+
+    for path in outputs.values():
+        pysam.index(path)
+
+
+def run_benchmark(tempdir, num_cells, reads_per_cell, bin_size, ncores=None):
+    helpers.makedirs(tempdir)
+
+    chromosomes = collections.OrderedDict(
+        (str(i), bin_size * 2000 + 137 * i) for i in range(1, 5)
+    )
+    cells = ['SA123_A123_R{0:02d}_C{0:02d}'.format(i) for i in range(num_cells)]
+
+    merged_bam = write_synthetic_bam(
+        os.path.join(tempdir, 'merged.bam'), chromosomes,
+        reads_per_cell * num_cells // len(chromosomes),
+        fs_tag_references=['grch37', 'mm10'], cell_tag='RG', cells=cells
+    )
+    cell_bams = {cell: os.path.join(tempdir, cell + '.bam') for cell in cells}
+    split_bam_by_tag(merged_bam, cell_bams, 'RG')
+
+    excluded = write_exclude_list(
+        os.path.join(tempdir, 'exclude.tsv'), chromosomes, bin_size
+    )
+
+    outputs = {
+        label: {cell: os.path.join(tempdir, '{}_{}.wig'.format(cell, label)) for cell in cells}
+        for label in ['per_cell', 'batch_cell_bams', 'batch_merged_bam']
+    }
+
+    timings = collections.OrderedDict()
+
+    with timer('per_cell', timings):
+        for cell in cells:
+            ReadCounter(
+                cell_bams[cell], outputs['per_cell'][cell], bin_size,
+                list(chromosomes.keys()), 20, excluded=excluded
+            ).main()
+
+    with timer('batch_cell_bams', timings):
+        BatchReadCounter(
+            cell_bams, bin_size, list(chromosomes.keys()), 20,
+            excluded=excluded, ncores=ncores
+        ).write_wigs(outputs['batch_cell_bams'])
+
+    with timer('batch_merged_bam', timings):
+        BatchReadCounter(
+            merged_bam, bin_size, list(chromosomes.keys()), 20,
+            excluded=excluded, cell_tag='RG', ncores=ncores
+        ).write_wigs(outputs['batch_merged_bam'])
+
+    for cell in cells:
+        for label in ['batch_cell_bams', 'batch_merged_bam']:
+            assert filecmp.cmp(outputs['per_cell'][cell], outputs[label][cell], shallow=False), \
+                'outputs differ for {}: {}'.format(cell, label)
+
+    report(timings, 'per_cell', label='{} cells, {} reads per cell'.format(num_cells, reads_per_cell))
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=200)
+
+    parser.add_argument('--reads_per_cell', type=int, default=20000)
+
+    parser.add_argument('--bin_size', type=int, default=500)
+
+    parser.add_argument('--ncores', type=int, default=None)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(
+        args.tempdir, args.num_cells, args.reads_per_cell, args.bin_size,
+        ncores=args.ncores
+    )
@@ -0,0 +1,142 @@
+'''
+clustering order of the hmmcopy heatmaps on a synthetic reads table:
+the previous pivot + pdist implementation against the int8 state
+matrix with tiled distances, and the approximate mode. checks that the
+exact mode reproduces the previous order.
+
+usage: python -m single_cell.tests.benchmarks.bench_clustering_order --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.cluster.hierarchy as hc
+import scipy.spatial as sp
+from single_cell.utils import csvutils
+from single_cell.utils import helpers
+from single_cell.workflows.hmmcopy import tasks
+from single_cell.workflows.hmmcopy.dtypes import dtypes
+
+from .utils import report
+from .utils import timer
+
+
+def write_reads(output, num_cells, num_bins, num_clones=5, seed=0):
+    """
+    writes a reads table with a few clones and per cell noise
+    """
+    rand = np.random.RandomState(seed)
+
+    chromosomes = [str(v) for v in range(1, 23)]
+    bins_per_chrom = num_bins // len(chromosomes)
+
+    bins = pd.DataFrame({
+        'chr': np.repeat(chromosomes, bins_per_chrom),
+        'start': np.tile(np.arange(bins_per_chrom) * 500000 + 1, len(chromosomes)),
+    })
+    bins['end'] = bins['start'] + 500000 - 1
+
+    clones = rand.choice([1, 2, 2, 2, 3, 4], (num_clones, len(bins)))
+
+    reads_dtypes = {k: v for k, v in dtypes()['reads'].items()
+                    if k in ('cell_id', 'chr', 'start', 'end', 'state')}
+
+    writer = csvutils.CsvOutput(output, dtypes=reads_dtypes, header=True)
+
+    def chunks():
+        for cell in range(num_cells):
+            states = clones[cell % num_clones].copy()
+            noise = rand.uniform(size=len(bins)) < 0.05
+            states[noise] = rand.randint(0, 8, noise.sum())
+
+            df = bins.copy()
+            df['cell_id'] = 'SA1090-A96213A-R{:04d}-C{:02d}'.format(cell // 60, cell % 60)
+            df['state'] = states
+            yield df[['cell_id', 'chr', 'start', 'end', 'state']]
+
+    writer.write_df(chunks(), chunks=True)
+
+    return output
+
+
+def legacy_clustering_order(reads_filename, chromosomes=None):
+    """
+    the pivot + pdist implementation, kept as the baseline
+    """
+    data = []
+    chunksize = 10 ** 5
+    for chunk in csvutils.read_csv_and_yaml(
+            reads_filename, chunksize=chunksize,
+            usecols=['cell_id', 'chr', 'start', 'end', 'state']):
+        chunk["bin"] = list(zip(chunk.chr, chunk.start, chunk.end))
+        chunk['state'] = chunk['state'].astype('float')
+        chunk = chunk.pivot(index='cell_id', columns='bin', values='state')
+        data.append(chunk)
+
+    table = pd.concat(data)
+    table = table.groupby(table.index).sum()
+
+    bins = pd.DataFrame(table.columns.values.tolist(), columns=['chr', 'start', 'end'])
+    bins['chr'] = bins['chr'].astype(str)
+    bins = tasks.clusteringutils.get_bin_index(bins, chromosomes)
+    bins = [tuple(v) for v in bins.values.tolist()]
+
+    table = table.sort_values(bins, axis=0)
+
+    data_mat = np.array(table.values)
+    data_mat[np.isnan(data_mat)] = -1
+
+    row_linkage = hc.linkage(sp.distance.pdist(data_mat, 'cityblock'), method='ward')
+
+    order = hc.leaves_list(row_linkage)
+
+    samps = table.index
+    order = [samps[i] for i in order]
+    return {v: i for i, v in enumerate(order)}
+
+
+def run_benchmark(tempdir, num_cells, num_bins, threads=1):
+    helpers.makedirs(tempdir)
+
+    reads = write_reads(os.path.join(tempdir, 'reads.csv.gz'), num_cells, num_bins)
+
+    timings = collections.OrderedDict()
+
+    with timer('legacy', timings):
+        legacy = legacy_clustering_order(reads)
+
+    with timer('exact', timings):
+        exact = tasks.get_hierarchical_clustering_order(reads, threads=threads)
+
+    with timer('approximate', timings):
+        tasks.get_hierarchical_clustering_order(reads, threads=threads, max_exact_cells=0)
+
+    assert legacy == exact, 'clustering order differs'
+
+    report(
+        timings, 'legacy',
+        label='clustering order, {} cells x {} bins'.format(num_cells, num_bins)
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=2000)
+
+    parser.add_argument('--num_bins', type=int, default=6000)
+
+    parser.add_argument('--threads', type=int, default=1)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells, args.num_bins, threads=args.threads)
@@ -0,0 +1,123 @@
+'''
+per cell timing of the modal gc correction with the statsmodels and
+batched quantile regression engines. checks that both select the same
+modal quantile and that modal_curve and cor_gc agree to within RTOL.
+
+usage: python -m single_cell.tests.benchmarks.bench_correct_read_count --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import helpers
+from single_cell.workflows.hmmcopy.scripts import CorrectReadCount
+
+from .utils import report
+from .utils import timer
+
+# statsmodels and the batched engine run the same iterations with a
+# different floating point summation order. converged fits agree to
+# ~1e-10, fits that stop at the 1000 iteration limit to ~1e-4
+RTOL = 1e-3
+
+
+def write_wig(output, chromosomes, bin_size, values, fmt):
+    with open(output, 'w') as wig:
+        offset = 0
+        for chrom, nbins in chromosomes.items():
+            wig.write('fixedStep chrom={0} start=1 step={1} span={1}\n'.format(chrom, bin_size))
+            wig.write(''.join(fmt.format(v) for v in values[offset:offset + nbins]))
+            offset += nbins
+    return output
+
+
+def write_reference(tempdir, chromosomes, bin_size, rand):
+    nbins = sum(chromosomes.values())
+    gc = np.clip(rand.normal(0.42, 0.05, nbins), 0, 1)
+    gc[rand.uniform(size=nbins) < 0.02] = -1
+    mapp = np.clip(rand.beta(8, 1, nbins), 0, 1)
+
+    gc_wig = write_wig(os.path.join(tempdir, 'gc.wig'), chromosomes, bin_size, gc, '{:.6f}\n')
+    map_wig = write_wig(os.path.join(tempdir, 'map.wig'), chromosomes, bin_size, mapp, '{:.6f}\n')
+
+    return gc_wig, map_wig, gc
+
+
+def write_cell(output, chromosomes, bin_size, gc, rand, depth):
+    # gc bias curve with copy number changes and overdispersion
+    curve = depth * np.clip(1 - 6 * (gc - 0.45) ** 2, 0.05, None)
+    copies = rand.choice([1, 2, 2, 2, 3, 4], len(gc)) / 2.0
+    reads = rand.poisson(rand.gamma(20, curve * copies / 20))
+    return write_wig(output, chromosomes, bin_size, reads, '{}\n')
+
+
+def compare(reference, data):
+    reference = pd.read_csv(reference)
+    data = pd.read_csv(data)
+
+    assert reference['modal_quantile'].equals(data['modal_quantile'])
+
+    for col in ['modal_curve', 'cor_gc', 'copy']:
+        assert np.allclose(reference[col], data[col], rtol=RTOL, equal_nan=True), col
+
+
+def run_benchmark(tempdir, num_cells, num_bins, seed=0):
+    helpers.makedirs(tempdir)
+    rand = np.random.RandomState(seed)
+
+    bin_size = 500000
+    chromosomes = collections.OrderedDict(
+        (str(i), num_bins // 4) for i in range(1, 5)
+    )
+
+    gc_wig, map_wig, gc = write_reference(tempdir, chromosomes, bin_size, rand)
+
+    timings = collections.OrderedDict()
+
+    for cell in range(num_cells):
+        wig = write_cell(
+            os.path.join(tempdir, 'cell_{}.wig'.format(cell)), chromosomes,
+            bin_size, gc, rand, depth=rand.uniform(20, 200)
+        )
+
+        outputs = {}
+        for engine in ['statsmodels', 'batched']:
+            outputs[engine] = os.path.join(tempdir, 'cell_{}_{}.csv'.format(cell, engine))
+            label = 'cell_{}_{}'.format(cell, engine)
+            with warnings.catch_warnings(), timer(label, timings):
+                warnings.simplefilter('ignore')
+                CorrectReadCount(
+                    gc_wig, map_wig, wig, outputs[engine], bin_size=bin_size,
+                    cache_dir=os.path.join(tempdir, 'cache'), quantreg_engine=engine
+                ).main()
+
+        compare(outputs['statsmodels'], outputs['batched'])
+
+    totals = collections.OrderedDict()
+    for engine in ['statsmodels', 'batched']:
+        engine_times = [v for k, v in timings.items() if k.endswith(engine)]
+        totals['per_cell_' + engine] = sum(engine_times) / len(engine_times)
+
+    report(totals, 'per_cell_statsmodels', label='CorrectReadCount, {} bins'.format(num_bins))
+
+    return totals
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=5)
+
+    parser.add_argument('--num_bins', type=int, default=6000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells, args.num_bins)
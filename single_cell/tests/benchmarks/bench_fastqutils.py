@@ -0,0 +1,198 @@
+'''
+fastq_screen post processing on a synthetic tagged fastq pair: the
+previous per read parsing (gather_counts + one re-tag pass per read end),
+the block reader with the same passes, and the fused single pass.
+checks that all three produce the same counts and fastqs.
+
+usage: python -m single_cell.tests.benchmarks.bench_fastqutils --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import filecmp
+import os
+import random
+import re
+from itertools import islice
+
+from single_cell.utils import fastqutils
+from single_cell.utils import helpers
+
+from .utils import report
+from .utils import timer
+
+GENOMES = ['grch37', 'mm10', 'salmon']
+
+
+def write_tagged_fastqs(output_r1, output_r2, num_reads, read_length=150, seed=0):
+    """
+    writes a read pair in the format of fastq_screen --tag
+    """
+    rand = random.Random(seed)
+
+    sequence = 'ACGT' * (read_length // 4) + 'A' * (read_length % 4)
+    quality = 'I' * read_length
+
+    # mostly human with some contamination, multi genome hits and no hits
+    flags = ['100'] * 80 + ['200', '010', '001', '110', '000', '000', '020', '101'] * 2
+
+    with open(output_r1, 'w') as writer_r1, open(output_r2, 'w') as writer_r2:
+        for i in range(num_reads):
+            for read_end, writer in ((1, writer_r1), (2, writer_r2)):
+                tag = rand.choice(flags)
+                if i == 0:
+                    tag = ':'.join(GENOMES + [tag])
+                writer.write(
+                    '@SIM:1:FCX:1:{0}:{1}:{2} {3}:N:0:ACGT#FQST:{4}\n{5}\n+\n{6}\n'.format(
+                        i // 10000, i % 10000, i, read_end, tag, sequence, quality
+                    )
+                )
+
+    return output_r1, output_r2
+
+
+class LegacyTaggedFastqReader(object):
+    """
+    the per read parsing that fastqutils used before the block reader,
+    kept here as the baseline
+    """
+
+    def __init__(self, filepath):
+        self.file_path = filepath
+        self.indices = None
+
+    def get_read_iterator(self):
+        with helpers.getFileHandle(self.file_path) as fq_reader:
+            while True:
+                fastq_read = list(islice(fq_reader, 4))
+                if not fastq_read:
+                    break
+                assert len(fastq_read) == 4
+                yield fastq_read
+
+    def get_read_tag(self, fastq_read):
+        read_id = fastq_read[0]
+        fq_tag = read_id[read_id.index('FQST:'):]
+        fq_tag = fq_tag.strip().split(':')
+
+        if not self.indices:
+            self.indices = {i: v for i, v in enumerate(fq_tag[1:-1])}
+
+        flag = map(int, list(fq_tag[-1]))
+
+        return {self.indices[i]: v for i, v in enumerate(flag)}
+
+    def add_tag_to_read_comment(self, read):
+        read_name = re.split('/| |\t|#FQST:', read[0].split()[0])[0].rstrip()
+        tag = self.get_read_tag(read)
+        tag = 'FS:Z:' + ','.join(['{}_{}'.format(k, v) for k, v in tag.items()])
+        read[0] = read_name + '\t' + tag + '\n'
+        return read
+
+
+def legacy_gather_counts(input_r1, input_r2):
+    reader_r1 = LegacyTaggedFastqReader(input_r1)
+    reader_r2 = LegacyTaggedFastqReader(input_r2)
+
+    key_order = None
+    counts = {'R1': collections.defaultdict(int), 'R2': collections.defaultdict(int)}
+
+    for read_1, read_2 in zip(reader_r1.get_read_iterator(), reader_r2.get_read_iterator()):
+        tags_r1 = reader_r1.get_read_tag(read_1)
+        tags_r2 = reader_r2.get_read_tag(read_2)
+
+        if not key_order:
+            key_order = sorted(tags_r1.keys())
+
+        counts["R1"][tuple(zip(key_order, [tags_r1[key] for key in key_order]))] += 1
+        counts["R2"][tuple(zip(key_order, [tags_r2[key] for key in key_order]))] += 1
+
+    return counts
+
+
+def legacy_re_tag_reads(infile, outfile):
+    reader = LegacyTaggedFastqReader(infile)
+    with open(outfile, 'w') as writer:
+        for read in reader.get_read_iterator():
+            for line in reader.add_tag_to_read_comment(read):
+                writer.write(line)
+
+
+def separate_passes(input_r1, input_r2, output_r1, output_r2):
+    counts = fastqutils.PairedTaggedFastqReader(input_r1, input_r2).gather_counts()
+
+    for infile, outfile in ((input_r1, output_r1), (input_r2, output_r2)):
+        reader = fastqutils.TaggedFastqReader(infile)
+        with open(outfile, 'w') as writer:
+            for read in reader.get_read_iterator():
+                writer.writelines(reader.add_tag_to_read_comment(read))
+
+    return counts
+
+
+def fused_pass(input_r1, input_r2, output_r1, output_r2):
+    counts = {'R1': collections.defaultdict(int), 'R2': collections.defaultdict(int)}
+
+    reader = fastqutils.PairedTaggedFastqReader(input_r1, input_r2)
+
+    with open(output_r1, 'w') as writer_r1, open(output_r2, 'w') as writer_r2:
+        for lines_r1, lines_r2 in reader.tag_and_count_blocks(counts):
+            writer_r1.writelines(lines_r1)
+            writer_r2.writelines(lines_r2)
+
+    return counts
+
+
+def run_benchmark(tempdir, num_reads):
+    helpers.makedirs(tempdir)
+
+    input_r1, input_r2 = write_tagged_fastqs(
+        os.path.join(tempdir, 'tagged_R1.fastq'),
+        os.path.join(tempdir, 'tagged_R2.fastq'),
+        num_reads
+    )
+
+    timings = collections.OrderedDict()
+    results = {}
+
+    def outputs(label):
+        return (
+            os.path.join(tempdir, '{}_R1.fastq'.format(label)),
+            os.path.join(tempdir, '{}_R2.fastq'.format(label)),
+        )
+
+    with timer('legacy', timings):
+        counts = legacy_gather_counts(input_r1, input_r2)
+        for infile, outfile in zip((input_r1, input_r2), outputs('legacy')):
+            legacy_re_tag_reads(infile, outfile)
+    results['legacy'] = counts
+
+    with timer('block_reader', timings):
+        results['block_reader'] = separate_passes(input_r1, input_r2, *outputs('block_reader'))
+
+    with timer('fused', timings):
+        results['fused'] = fused_pass(input_r1, input_r2, *outputs('fused'))
+
+    for label in ('block_reader', 'fused'):
+        assert results[label] == results['legacy'], 'counts differ: {}'.format(label)
+        for reference, output in zip(outputs('legacy'), outputs(label)):
+            assert filecmp.cmp(reference, output, shallow=False), \
+                'outputs differ: {} {}'.format(reference, output)
+
+    report(timings, 'legacy', label='fastq_screen post processing, {} read pairs'.format(num_reads))
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_reads', type=int, default=10000000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_reads)
@@ -0,0 +1,98 @@
+'''
+copy number heatmap rendering on a synthetic state matrix: every cell
+and bin drawn with pcolormesh against the downsampled image mode.
+reports the render time and the size of the pdf.
+
+usage: python -m single_cell.tests.benchmarks.bench_heatmap_render --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from single_cell.utils import helpers
+from single_cell.utils.singlecell_copynumber_plot_utils.heatmap import ClusterMap
+
+from .utils import report
+from .utils import timer
+
+CHROMOSOMES = [str(v) for v in range(1, 23)]
+
+
+def get_state_matrix(num_cells, num_bins, num_clones=5, seed=0):
+    rand = np.random.RandomState(seed)
+
+    bins_per_chrom = num_bins // len(CHROMOSOMES)
+    columns = pd.MultiIndex.from_arrays([
+        np.repeat(CHROMOSOMES, bins_per_chrom),
+        np.tile(np.arange(bins_per_chrom) * 500000 + 1, len(CHROMOSOMES)),
+        np.tile(np.arange(1, bins_per_chrom + 1) * 500000, len(CHROMOSOMES)),
+    ])
+
+    clones = rand.choice([1, 2, 2, 2, 3, 4], (num_clones, len(columns)))
+    states = clones[np.arange(num_cells) % num_clones].astype(np.float32)
+
+    noise = rand.uniform(size=states.shape) < 0.05
+    states[noise] = rand.randint(0, 12, noise.sum())
+
+    cells = ['SA1090-A96213A-R{:04d}-C{:02d}'.format(i // 60, i % 60) for i in range(num_cells)]
+
+    return pd.DataFrame(states, index=cells, columns=columns)
+
+
+def render(data, output, image_size=None):
+    colordata = {cell: 'C1' for cell in data.index}
+
+    with PdfPages(output) as pdfout:
+        ClusterMap(data, colordata, 11, chromosomes=CHROMOSOMES, image_size=image_size)
+        pdfout.savefig(pad_inches=0.2)
+        plt.close("all")
+
+
+def run_benchmark(tempdir, num_cells, num_bins, image_size):
+    helpers.makedirs(tempdir)
+
+    data = get_state_matrix(num_cells, num_bins)
+
+    timings = collections.OrderedDict()
+    sizes = collections.OrderedDict()
+
+    for label, size in (('pcolormesh', None), ('image', image_size)):
+        output = os.path.join(tempdir, 'heatmap_{}.pdf'.format(label))
+        with timer(label, timings):
+            render(data, output, image_size=size)
+        sizes[label] = os.path.getsize(output)
+
+    report(
+        timings, 'pcolormesh',
+        label='heatmap rendering, {} cells x {} bins'.format(num_cells, num_bins)
+    )
+    for label, size in sizes.items():
+        print('{:<40}{:>10.1f}MB'.format(label + ' pdf size', size / 1e6))
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=1000)
+
+    parser.add_argument('--num_bins', type=int, default=6000)
+
+    parser.add_argument('--image_size', type=int, nargs=2, default=[500, 3000])
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells, args.num_bins, args.image_size)
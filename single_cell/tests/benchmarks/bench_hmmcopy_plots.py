@@ -0,0 +1,214 @@
+'''
+per cell hmmcopy plots on synthetic hmmcopy outputs: one plot_hmmcopy
+call per cell followed by merge_pdf, against the batch mode that plots
+all cells from the merged tables into the tarballs. checks that both
+tarballs have the same members.
+
+the per cell baseline runs in this process, so it does not include the
+interpreter start and imports that every per cell job pays.
+
+usage: python -m single_cell.tests.benchmarks.bench_hmmcopy_plots --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import logging
+import os
+import tarfile
+import warnings
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import csvutils
+from single_cell.utils import helpers
+from single_cell.workflows.hmmcopy import tasks
+from single_cell.workflows.hmmcopy.dtypes import dtypes
+
+from .utils import report
+from .utils import timer
+
+CHROMOSOMES = [str(v) for v in range(1, 23)]
+
+CHROMOSOME_LENGTH = 100000000
+
+
+def write_reference(output):
+    """
+    fasta index only, the plots only read chromosome lengths
+    """
+    with open(output + '.fai', 'w') as writer:
+        for chrom in CHROMOSOMES:
+            writer.write('{}\t{}\t0\t60\t61\n'.format(chrom, CHROMOSOME_LENGTH))
+    return output
+
+
+def get_cell_tables(cell_id, bin_size, num_states, rand):
+    starts = np.arange(0, CHROMOSOME_LENGTH, bin_size) + 1
+
+    reads = pd.DataFrame({
+        'chr': np.repeat(CHROMOSOMES, len(starts)),
+        'start': np.tile(starts, len(CHROMOSOMES)),
+    })
+    reads['end'] = reads['start'] + bin_size - 1
+    reads['state'] = np.repeat(rand.choice([1, 2, 2, 3, 4], len(CHROMOSOMES)), len(starts))
+    reads['copy'] = reads['state'] + rand.normal(0, 0.2, len(reads))
+    reads['gc'] = rand.uniform(0.3, 0.6, len(reads))
+    reads['map'] = rand.uniform(0.8, 1, len(reads))
+    reads['reads'] = rand.poisson(50 * reads['state'] + 1)
+    reads['valid'] = True
+    reads['ideal'] = reads['map'] > 0.9
+    reads['modal_curve'] = 100.0
+    reads['cor_gc'] = reads['reads'] / 100.0
+    reads['cell_id'] = cell_id
+
+    segs = reads.groupby('chr', sort=False).agg(
+        {'start': 'min', 'end': 'max', 'state': 'first', 'copy': 'median'}
+    ).reset_index()
+    segs = segs.rename(columns={'copy': 'median'})
+    segs['multiplier'] = 1
+    segs['cell_id'] = cell_id
+
+    params = []
+    for parameter in ('mus', 'lambdas', 'nus'):
+        for state in range(num_states + 1):
+            params.append({
+                'iteration': 1.0, 'state': float(state), 'parameter': parameter,
+                'value': {'mus': state, 'lambdas': 20.0, 'nus': 2.1}[parameter],
+                'cell_id': cell_id
+            })
+    params = pd.DataFrame(params)
+
+    metrics = pd.DataFrame({
+        'cell_id': [cell_id],
+        'mad_neutral_state': [rand.uniform(0, 0.2)],
+        'MSRSI_non_integerness': [rand.uniform(0, 0.5)],
+        'total_mapped_reads_hmmcopy': [int(reads['reads'].sum())],
+    })
+
+    return collections.OrderedDict(
+        [('reads', reads), ('segs', segs), ('params', params), ('metrics', metrics)]
+    )
+
+
+def write_tables(tempdir, num_cells, bin_size, num_states, seed=0):
+    """
+    writes per cell and merged hmmcopy tables
+    :returns dict of table to dict of cell to path, dict of table to
+    merged path
+    """
+    rand = np.random.RandomState(seed)
+
+    all_dtypes = dtypes()
+    table_dtypes = {'reads': all_dtypes['reads'], 'segs': all_dtypes['segs'],
+                    'params': all_dtypes['params'], 'metrics': all_dtypes['metrics']}
+
+    per_cell = collections.defaultdict(dict)
+    merged = collections.defaultdict(list)
+
+    for cell in range(num_cells):
+        cell_id = 'SA1090-A96213A-R{:02d}-C{:02d}'.format(cell // 60, cell % 60)
+
+        for name, table in get_cell_tables(cell_id, bin_size, num_states, rand).items():
+            output = os.path.join(tempdir, 'cells', '{}_{}.csv.gz'.format(cell_id, name))
+            helpers.makedirs(output, isfile=True)
+            csvutils.write_dataframe_to_csv_and_yaml(table, output, table_dtypes[name])
+            per_cell[name][cell_id] = output
+            merged[name].append(table)
+
+    merged_paths = {}
+    for name, tables in merged.items():
+        merged_paths[name] = os.path.join(tempdir, 'merged_{}.csv.gz'.format(name))
+        csvutils.write_dataframe_to_csv_and_yaml(
+            pd.concat(tables, ignore_index=True), merged_paths[name], table_dtypes[name]
+        )
+
+    return per_cell, merged_paths
+
+
+def per_cell_plots(per_cell, ref_genome, tempdir, outputs, num_states):
+    pngs = {'segments': {}, 'bias': {}}
+
+    for cell_id in per_cell['reads']:
+        for label in pngs:
+            pngs[label][cell_id] = os.path.join(tempdir, 'pngs', '{}_{}.png'.format(cell_id, label))
+        helpers.makedirs(pngs['segments'][cell_id], isfile=True)
+
+        tasks.plot_hmmcopy(
+            per_cell['reads'][cell_id], per_cell['segs'][cell_id],
+            per_cell['params'][cell_id], per_cell['metrics'][cell_id],
+            ref_genome, pngs['segments'][cell_id], pngs['bias'][cell_id], cell_id,
+            num_states=num_states
+        )
+
+    metrics = os.path.join(tempdir, 'merged_metrics.csv.gz')
+
+    tasks.merge_pdf(
+        [pngs['segments'], pngs['bias']], outputs, metrics, None,
+        os.path.join(tempdir, 'merge_pdf'), ['segments', 'bias']
+    )
+
+
+def get_members(tarball):
+    with tarfile.open(tarball) as tar:
+        return sorted(tar.getnames())
+
+
+def run_benchmark(tempdir, num_cells, bin_size, processes, num_states=11):
+    helpers.makedirs(tempdir)
+
+    ref_genome = write_reference(os.path.join(tempdir, 'genome.fa'))
+
+    per_cell, merged = write_tables(tempdir, num_cells, bin_size, num_states)
+
+    timings = collections.OrderedDict()
+
+    outputs = {}
+    for label in ('per_cell', 'batch'):
+        outputs[label] = [
+            os.path.join(tempdir, '{}_segments.tar.gz'.format(label)),
+            os.path.join(tempdir, '{}_bias.tar.gz'.format(label)),
+        ]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+
+        with timer('per_cell', timings):
+            per_cell_plots(per_cell, ref_genome, tempdir, outputs['per_cell'], num_states)
+
+        with timer('batch', timings):
+            tasks.plot_hmmcopy_batch(
+                merged['reads'], merged['segs'], merged['params'], merged['metrics'],
+                ref_genome, outputs['batch'][0], outputs['batch'][1],
+                num_states=num_states, processes=processes
+            )
+
+    for per_cell_tar, batch_tar in zip(outputs['per_cell'], outputs['batch']):
+        assert get_members(per_cell_tar) == get_members(batch_tar), 'tarballs differ'
+
+    report(
+        timings, 'per_cell',
+        label='hmmcopy plots, {} cells, {} processes'.format(num_cells, processes)
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=50)
+
+    parser.add_argument('--bin_size', type=int, default=500000)
+
+    parser.add_argument('--processes', type=int, default=1)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # the plots ask for fonts that are usually not installed
+    logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells, args.bin_size, args.processes)
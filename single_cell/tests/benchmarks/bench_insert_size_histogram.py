@@ -0,0 +1,309 @@
+'''
+lumpy insert size histograms: the previous generate_histogram, which
+read the whole bam to count reads per read group and computed the
+histogram with python lists, against the index counts, early stop and
+numpy version, for one cell bam. then merging many cell histograms: the
+previous text files and merge_histograms against the array files.
+checks that both give the same histograms, means and stdevs.
+
+usage: python -m single_cell.tests.benchmarks.bench_insert_size_histogram --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+
+import numpy as np
+import pysam
+import yaml
+from single_cell.utils import helpers
+from single_cell.workflows.lumpy import generate_histogram
+from single_cell.workflows.lumpy import merge_histograms
+
+from .bench_lumpy_preprocess import HISTOGRAM_SETTINGS
+from .bench_lumpy_preprocess import write_bam
+from .utils import report
+from .utils import timer
+
+
+def legacy_read_bam_file(infile, readgroups, N, skip):
+    flag_mask = generate_histogram.get_flag_mask()
+    required = 97
+
+    skip_count = {rg: 0 for rg in readgroups}
+    with pysam.AlignmentFile(infile) as samfile:
+        data = {v: [] for v in readgroups}
+        counts = {v: 0 for v in readgroups}
+        reads_per_rg = {v: 0 for v in readgroups}
+        for read in samfile.fetch():
+            readgroup = read.get_tag('RG')
+            reads_per_rg[readgroup] += 1
+
+            if skip_count[readgroup] < (skip - 1):
+                skip_count[readgroup] += 1
+                continue
+
+            if all([val >= N for val in counts.values()]):
+                continue
+
+            isize = read.template_length
+            want = read.next_reference_id == read.reference_id and \
+                read.flag & flag_mask == required and isize >= 0
+            if want:
+                data[readgroup].append(isize)
+                counts[readgroup] += 1
+
+    return reads_per_rg, data, counts
+
+
+def legacy_median(L):
+    if len(L) % 2 == 1:
+        return L[int(len(L) / 2)]
+    mid = int(len(L) / 2) - 1
+    return (L[mid] + L[mid + 1]) / 2.0
+
+
+def legacy_calculate_histogram(readgroups, data, counts, min_elements, mads, read_length, X, reads_per_rg):
+    means = []
+    stdevs = []
+
+    finaldata = {v: None for v in readgroups}
+    for readgroup, rgdata in data.items():
+        if len(rgdata) < min_elements:
+            continue
+
+        rgdata.sort()
+        med = legacy_median(rgdata)
+        umad = legacy_median([x - med for x in rgdata if x > med])
+        upper_cutoff = med + mads * umad
+
+        L = [v for v in rgdata if v < upper_cutoff]
+
+        mean = sum(L) / float(len(L))
+        var = sum((v - mean) ** 2.0 for v in L) / float(len(L))
+        stdev = var ** 0.5
+
+        start = read_length
+        end = int(mean + X * stdev)
+
+        H = [0] * (end - start + 1)
+        s = 0
+        for x in L:
+            if (x >= start) and (x <= end):
+                H[int(x - start)] += 1
+                s += 1
+
+        finaldata[readgroup] = {i: (H[i], s) for i in range(end - start)}
+
+        means.append(mean * reads_per_rg[readgroup])
+        stdevs.append(stdev * reads_per_rg[readgroup])
+
+    mean = sum(means) / sum(reads_per_rg.values()) if means else 0
+    stdev = sum(stdevs) / sum(reads_per_rg.values()) if stdevs else 0
+
+    return finaldata, mean, stdev
+
+
+def legacy_merge_readgroups(readgroups, histogram_data):
+    keys = set()
+    for rgdata in histogram_data.values():
+        if rgdata:
+            keys.update(rgdata)
+    if not keys:
+        return
+
+    finalresult = []
+    for i in sorted(keys):
+        j = 0
+        k = 0
+        for rg in readgroups:
+            if not histogram_data[rg]:
+                continue
+            values = histogram_data[rg].get(i, None)
+            if not values:
+                continue
+            j += values[0]
+            k += values[1]
+
+            finalresult.append((i, (float(j) / k)))
+    return finalresult
+
+
+def legacy_write_output(data, mean, stdev, outfile, numreads):
+    with open(outfile, 'w') as output:
+        output.write('#mean:{}\n'.format(mean))
+        output.write('#stdev:{}\n'.format(stdev))
+        output.write("#numreads:{}\n".format(numreads))
+        if data:
+            for idx, value in data:
+                output.write("{},{}\n".format(idx, value))
+
+
+def legacy_gen_histogram(infile, outfile, N, skip, min_elements, mads, X, read_length):
+    readgroups = generate_histogram.get_read_groups(infile)
+    reads_per_rg, isizes, counts = legacy_read_bam_file(infile, readgroups, N, skip)
+    histodata, mean, stdev = legacy_calculate_histogram(
+        readgroups, isizes, counts, min_elements, mads, read_length, X, reads_per_rg
+    )
+    merged = legacy_merge_readgroups(readgroups, histodata)
+    legacy_write_output(merged, mean, stdev, outfile, sum(reads_per_rg.values()))
+
+
+def legacy_parse_histogram(infile):
+    data = []
+    with open(infile) as inputdata:
+        for line in inputdata:
+            if line.startswith('#'):
+                key, value = line.strip().split(':')
+                if key == '#numreads':
+                    numreads = int(value)
+                elif key == '#mean':
+                    mean = float(value)
+                elif key == '#stdev':
+                    stdev = float(value)
+                continue
+            i, val = line.strip().split(',')
+            data.append((int(i), float(val)))
+
+    return data, mean, stdev, numreads
+
+
+def legacy_merge_histograms(infiles, outfile, metadata):
+    merged_data = {}
+    total_reads = 0
+    means = 0
+    stdevs = 0
+
+    for infile in infiles:
+        data, mean, stdev, numreads = legacy_parse_histogram(infile)
+        for i, val in data:
+            merged_data[i] = merged_data.get(i, 0) + val * numreads
+        total_reads += numreads
+        means += mean * numreads
+        stdevs += stdev * numreads
+
+    histogram = [(idx, merged_data[idx] / total_reads) for idx in sorted(merged_data)]
+    if histogram:
+        for idx in range(len(histogram) - 1, -1, -1):
+            if float(histogram[idx][1]) >= 0.0001:
+                break
+        histogram = histogram[:idx]
+
+    with open(outfile, 'w') as histo_file:
+        for i, val in histogram:
+            histo_file.write("{}\t{}\n".format(i, val))
+
+    with open(metadata, 'w') as fileoutput:
+        yaml.safe_dump({'mean': means / total_reads, 'stdev': stdevs / total_reads}, fileoutput)
+
+
+def check_histogram(legacy_histogram, histogram):
+    data, mean, stdev, numreads = legacy_parse_histogram(legacy_histogram)
+    density, new_mean, new_stdev, new_numreads = merge_histograms.load_histogram(histogram)
+
+    assert [i for i, _ in data] == list(range(len(density))), 'histogram bins differ'
+    assert np.allclose([val for _, val in data], density), 'histograms differ'
+    assert np.isclose(mean, new_mean) and np.isclose(stdev, new_stdev), 'mean or stdev differ'
+    assert numreads == new_numreads, 'read counts differ'
+
+
+def check_merged(legacy_outputs, outputs):
+    histograms = []
+    for histogram, metadata in (legacy_outputs, outputs):
+        data = np.loadtxt(histogram, delimiter='\t', ndmin=2)
+        with open(metadata) as reader:
+            meta = yaml.safe_load(reader)
+        histograms.append((data, meta['mean'], meta['stdev']))
+
+    (expected, mean, stdev), (data, new_mean, new_stdev) = histograms
+    assert expected.shape == data.shape and np.allclose(expected, data), 'merged histograms differ'
+    assert np.isclose(mean, new_mean) and np.isclose(stdev, new_stdev), 'merged mean or stdev differ'
+
+
+def write_cell_histograms(tempdir, num_cells, read_length=101, seed=0):
+    """
+    cell histograms from sampled insert sizes, in both formats
+    """
+    rand = np.random.RandomState(seed)
+
+    legacy_files = []
+    files = []
+    for cell in range(num_cells):
+        readgroups = ['cell_{}'.format(cell)]
+        isizes = np.clip(rand.normal(300, 40, 10000), 0, None).astype(int)
+        reads_per_rg = {readgroups[0]: int(rand.randint(100000, 1000000))}
+        counts = {readgroups[0]: len(isizes)}
+
+        legacy_files.append(os.path.join(tempdir, 'cell_{}.csv'.format(cell)))
+        histodata, mean, stdev = legacy_calculate_histogram(
+            readgroups, {readgroups[0]: isizes.tolist()}, counts, 100, 10, read_length, 4,
+            reads_per_rg
+        )
+        legacy_write_output(
+            legacy_merge_readgroups(readgroups, histodata), mean, stdev, legacy_files[-1],
+            sum(reads_per_rg.values())
+        )
+
+        files.append(os.path.join(tempdir, 'cell_{}.npy'.format(cell)))
+        generate_histogram.write_histogram(
+            readgroups, reads_per_rg, {readgroups[0]: isizes}, counts, files[-1],
+            min_elements=100, mads=10, X=4, read_length=read_length
+        )
+
+    return legacy_files, files
+
+
+def run_benchmark(tempdir, num_pairs, num_cells):
+    helpers.makedirs(tempdir)
+
+    bam = write_bam(os.path.join(tempdir, 'input.bam'), num_pairs)
+
+    timings = collections.OrderedDict()
+
+    legacy_histogram = os.path.join(tempdir, 'legacy_histogram.csv')
+    with timer('legacy', timings):
+        legacy_gen_histogram(bam, legacy_histogram, **HISTOGRAM_SETTINGS)
+
+    histogram = os.path.join(tempdir, 'histogram.npy')
+    with timer('numpy', timings):
+        generate_histogram.gen_histogram(bam, histogram, **HISTOGRAM_SETTINGS)
+
+    check_histogram(legacy_histogram, histogram)
+
+    report(timings, 'legacy', label='cell histogram, {} read pairs'.format(num_pairs))
+
+    celldir = os.path.join(tempdir, 'cells')
+    helpers.makedirs(celldir)
+    legacy_files, files = write_cell_histograms(celldir, num_cells)
+
+    merge_timings = collections.OrderedDict()
+
+    legacy_outputs = [os.path.join(tempdir, 'legacy_merged.txt'), os.path.join(tempdir, 'legacy_merged.yaml')]
+    with timer('legacy', merge_timings):
+        legacy_merge_histograms(legacy_files, *legacy_outputs)
+
+    outputs = [os.path.join(tempdir, 'merged.txt'), os.path.join(tempdir, 'merged.yaml')]
+    with timer('numpy', merge_timings):
+        merge_histograms.merge_histograms(files, *outputs)
+
+    check_merged(legacy_outputs, outputs)
+
+    report(merge_timings, 'legacy', label='merging {} cell histograms'.format(num_cells))
+
+    return timings, merge_timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_pairs', type=int, default=1000000)
+
+    parser.add_argument('--num_cells', type=int, default=2000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_pairs, args.num_cells)
@@ -0,0 +1,152 @@
+'''
+ltm copy number matrix from hmmcopy h5 files: the pivot of the full
+reads table with the concat + transpose merge against the single scan
+builder with the bin key merge. checks that both give the same states
+for the same cells and bins.
+
+usage: python -m single_cell.tests.benchmarks.bench_ltm_cn_matrix --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import helpers
+from single_cell.utils import ltmutils
+
+from .utils import report
+from .utils import timer
+
+
+def write_hmmcopy_h5(output, library, num_cells, num_bins, seed=0):
+    rand = np.random.RandomState(seed)
+
+    chromosomes = [str(v) for v in range(1, 23)] + ['X']
+    bins_per_chrom = num_bins // len(chromosomes)
+
+    bins = pd.DataFrame({
+        'chr': np.repeat(chromosomes, bins_per_chrom),
+        'start': np.tile(np.arange(bins_per_chrom) * 500000 + 1, len(chromosomes)),
+    })
+    bins['end'] = bins['start'] + 500000 - 1
+    # mappability comes from the reference, same for all libraries
+    bins['map'] = np.clip(np.random.RandomState(0).beta(20, 0.3, len(bins)), 0, 1)
+
+    cells = ['{}-R{:02d}-C{:02d}'.format(library, i // 60, i % 60) for i in range(num_cells)]
+
+    reads = []
+    for cell in cells:
+        df = bins.copy()
+        df['cell_id'] = cell
+        df['state'] = rand.choice([1, 2, 2, 2, 3, 4], len(bins))
+        reads.append(df)
+    reads = pd.concat(reads, ignore_index=True)
+
+    metrics = pd.DataFrame({'cell_id': cells, 'quality': rand.uniform(0.5, 1, num_cells)})
+
+    with pd.HDFStore(output, 'w') as store:
+        store.put('/hmmcopy/reads/0', reads, format='table', data_columns=True)
+        store.put('/hmmcopy/metrics/0', metrics, format='table', data_columns=True)
+
+    return output
+
+
+def legacy_cn_matrix(hmmcopy):
+    """
+    the pivot and mask filters from generate_cn_matrices
+    """
+    df = pd.read_hdf(hmmcopy, '/hmmcopy/reads/0')
+    df["bin"] = list(zip(df.chr, df.start, df.end))
+    df = df.pivot(index='cell_id', columns='bin', values='state').T
+    df = df.loc[:, ~df.isna().all()].astype(int)
+    df = df.reset_index()
+    df['chr'] = [b[0] for b in df['bin']]
+    df['start'] = [b[1] for b in df['bin']]
+    df['end'] = [b[2] for b in df['bin']]
+    df['width'] = df['end'] - df['start'] + 1
+    df = df.drop(columns='bin')
+
+    metrics = pd.read_hdf(hmmcopy, '/hmmcopy/metrics/0')
+    df = df.drop(columns=metrics[metrics['quality'] < 0.75]['cell_id'])
+
+    reads = pd.read_hdf(hmmcopy, '/hmmcopy/reads/0')
+    first = reads[reads['cell_id'] == reads.iloc[0]['cell_id']]
+    good_bins = set(zip(first.chr[first['map'] >= 0.99], first.start[first['map'] >= 0.99]))
+    keep = [(c, s) in good_bins for c, s in zip(df.chr, df.start)]
+    return df[keep].reset_index(drop=True)
+
+
+def legacy_merge(matrices, tempdir):
+    # the matrices were passed between jobs as csv
+    for i, matrix in enumerate(matrices):
+        matrix.to_csv(os.path.join(tempdir, 'legacy_{}.csv'.format(i)), index=False)
+    matrices = [
+        pd.read_csv(os.path.join(tempdir, 'legacy_{}.csv'.format(i)))
+        for i in range(len(matrices))
+    ]
+
+    cn_matrix = pd.concat(matrices, axis=1, join='outer')
+    cn_matrix = cn_matrix.T.drop_duplicates().T
+    return cn_matrix.set_index(['chr', 'start', 'end', 'width'])
+
+
+def run_benchmark(tempdir, num_libraries, num_cells, num_bins):
+    helpers.makedirs(tempdir)
+
+    hmmcopy = [
+        write_hmmcopy_h5(
+            os.path.join(tempdir, 'hmmcopy_{}.h5'.format(i)), 'SA{}'.format(i),
+            num_cells, num_bins, seed=i
+        )
+        for i in range(num_libraries)
+    ]
+
+    timings = collections.OrderedDict()
+
+    with timer('legacy', timings):
+        legacy = legacy_merge([legacy_cn_matrix(h5) for h5 in hmmcopy], tempdir)
+
+    with timer('streaming', timings):
+        outputs = []
+        for i, h5 in enumerate(hmmcopy):
+            outputs.append(os.path.join(tempdir, 'cn_matrix_{}.csv'.format(i)))
+            ltmutils.write_cn_matrix(*ltmutils.get_cn_matrix_from_hdf(h5), outfile=outputs[-1])
+        bins, cells, matrix = ltmutils.merge_cn_matrices(
+            [ltmutils.read_cn_matrix(cn_matrix) for cn_matrix in outputs]
+        )
+
+    data = pd.DataFrame(matrix, columns=cells)
+    data.index = pd.MultiIndex.from_frame(bins)
+    legacy.index = legacy.index.set_levels(legacy.index.levels[0].astype(str), level=0)
+    legacy = legacy.loc[data.index, cells]
+    assert (legacy.values.astype(np.int8) == data.values).all(), 'states differ'
+
+    report(
+        timings, 'legacy',
+        label='ltm cn matrix, {} libraries x {} cells x {} bins'.format(
+            num_libraries, num_cells, num_bins)
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_libraries', type=int, default=2)
+
+    parser.add_argument('--num_cells', type=int, default=500)
+
+    parser.add_argument('--num_bins', type=int, default=6000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.getLogger('single_cell.helpers.ltmutils').setLevel(logging.ERROR)
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_libraries, args.num_cells, args.num_bins)
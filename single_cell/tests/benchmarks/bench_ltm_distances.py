@@ -0,0 +1,96 @@
+'''
+ltm distance calculation on a synthetic copy number matrix: the per
+pair calc_MI loop that the pair csv jobs ran against the vectorized
+engine that writes the condensed matrix. checks that both give the
+same distances.
+
+usage: python -m single_cell.tests.benchmarks.bench_ltm_distances --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import helpers
+from single_cell.workflows.ltm.scripts import calculate_distance
+
+from .utils import report
+from .utils import timer
+
+
+def write_cn_matrix(output, num_cells, num_bins, num_clones=5, seed=0):
+    rand = np.random.RandomState(seed)
+
+    clones = rand.choice([1, 2, 2, 2, 3, 4, 5], (num_clones, num_bins))
+
+    data = collections.OrderedDict()
+    data['chr'] = ['1'] * num_bins
+    data['start'] = np.arange(num_bins) * 500000 + 1
+    data['end'] = data['start'] + 500000 - 1
+    data['width'] = 500000
+    for cell in range(num_cells):
+        states = clones[cell % num_clones].copy()
+        noise = rand.uniform(size=num_bins) < 0.05
+        states[noise] = rand.randint(0, 9, noise.sum())
+        data['cell_{}'.format(cell)] = states
+
+    pd.DataFrame(data).to_csv(output, index=False)
+
+    return output
+
+
+def legacy_distances(cn_matrix):
+    _, data = calculate_distance.read_cn_matrix(cn_matrix)
+
+    distances = []
+    for i in range(len(data)):
+        for j in range(i + 1, len(data)):
+            distances.append(calculate_distance.calc_MI(data[i], data[j]))
+
+    return np.array(distances)
+
+
+def run_benchmark(tempdir, num_cells, num_bins, processes=1):
+    helpers.makedirs(tempdir)
+
+    cn_matrix = write_cn_matrix(os.path.join(tempdir, 'cn_matrix.csv'), num_cells, num_bins)
+    output = os.path.join(tempdir, 'distances.npy')
+
+    timings = collections.OrderedDict()
+
+    with timer('legacy', timings):
+        legacy = legacy_distances(cn_matrix)
+
+    with timer('vectorized', timings):
+        calculate_distance.calculate_distances(cn_matrix, output, processes=processes)
+
+    distances = np.load(output)
+    assert distances.dtype == np.float32
+    assert np.allclose(legacy, distances, atol=1e-6), 'distances differ'
+
+    report(
+        timings, 'legacy',
+        label='ltm distances, {} cells x {} bins'.format(num_cells, num_bins)
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=500)
+
+    parser.add_argument('--num_bins', type=int, default=6000)
+
+    parser.add_argument('--processes', type=int, default=1)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells, args.num_bins, processes=args.processes)
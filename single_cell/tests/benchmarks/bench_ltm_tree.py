@@ -0,0 +1,87 @@
+'''
+ltm tree from a condensed distance matrix: networkx
+minimum_spanning_tree on the full graph against dense prim's on the
+memory mapped matrix. checks that both trees have the same total weight.
+
+usage: python -m single_cell.tests.benchmarks.bench_ltm_tree --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+
+import networkx as nx
+import numpy as np
+from single_cell.utils import helpers
+from single_cell.workflows.ltm.scripts import calculate_distance
+from single_cell.workflows.ltm.scripts import learn_CL_from_distance
+
+from .bench_ltm_distances import write_cn_matrix
+from .utils import report
+from .utils import timer
+
+
+def legacy_tree(cn_matrix, distances, tree_path):
+    """
+    builds the networkx graph with all pairs, as the pair csv version did
+    """
+    cell_ids, _ = calculate_distance.read_cn_matrix(cn_matrix)
+    distances = np.load(distances)
+
+    G = nx.Graph()
+    k = 0
+    for i in range(len(cell_ids)):
+        for j in range(i + 1, len(cell_ids)):
+            G.add_edge(cell_ids[i], cell_ids[j], weight=float(distances[k]))
+            k += 1
+
+    T = nx.minimum_spanning_tree(G)
+    nx.write_gml(T, tree_path)
+
+
+def tree_weight(tree_path):
+    tree = nx.read_gml(tree_path)
+    return tree.number_of_nodes(), sum(w for _, _, w in tree.edges(data='weight'))
+
+
+def run_benchmark(tempdir, num_cells, num_bins):
+    helpers.makedirs(tempdir)
+
+    cn_matrix = write_cn_matrix(os.path.join(tempdir, 'cn_matrix.csv'), num_cells, num_bins)
+    distances = os.path.join(tempdir, 'distances.npy')
+    calculate_distance.calculate_distances(cn_matrix, distances)
+
+    timings = collections.OrderedDict()
+
+    with timer('networkx', timings):
+        legacy_tree(cn_matrix, distances, os.path.join(tempdir, 'legacy.gml'))
+
+    with timer('prim', timings):
+        learn_CL_from_distance.learn_CL_from_distance(
+            cn_matrix, distances, os.path.join(tempdir, 'prim.gml')
+        )
+
+    legacy_nodes, legacy_weight = tree_weight(os.path.join(tempdir, 'legacy.gml'))
+    nodes, weight = tree_weight(os.path.join(tempdir, 'prim.gml'))
+    assert legacy_nodes == nodes == num_cells
+    assert np.isclose(legacy_weight, weight), 'tree weights differ'
+
+    report(timings, 'networkx', label='ltm tree, {} cells'.format(num_cells))
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=2000)
+
+    parser.add_argument('--num_bins', type=int, default=1000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells, args.num_bins)
@@ -0,0 +1,258 @@
+'''
+lumpy preprocessing of a synthetic cell bam: the three passes that
+process_bam ran before (samtools view -F 1294, samtools view -h through
+extractSplitReads_BwaMem, ported here, and gen_histogram over fetch),
+each output sorted and re-read for the read name tags, against the
+single pass in preprocess.extract_reads. checks that both give the same
+discordants, split reads and histogram.
+
+usage: python -m single_cell.tests.benchmarks.bench_lumpy_preprocess --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+import random
+import re
+
+import numpy as np
+import pysam
+from single_cell.utils import helpers
+from single_cell.workflows.lumpy import generate_histogram
+from single_cell.workflows.lumpy import merge_histograms
+from single_cell.workflows.lumpy import tasks
+
+from .utils import report
+from .utils import timer
+
+HISTOGRAM_SETTINGS = dict(N=10000, skip=0, min_elements=100, mads=10, X=4, read_length=101)
+
+
+def write_bam(output, num_pairs, chrom_length=50000000, read_length=101, seed=0):
+    rand = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.0', 'SO': 'coordinate'},
+        'SQ': [{'SN': 'chr1', 'LN': chrom_length}, {'SN': 'chr2', 'LN': chrom_length}],
+        'RG': [{'ID': 'SA1-A1-R01-C01', 'SM': 'SA1'}],
+    }
+
+    sequence = ('ACGT' * read_length)[:read_length]
+    qualities = pysam.qualitystring_to_array('I' * read_length)
+
+    reads = []
+    for i in range(num_pairs):
+        tid = rand.randrange(2)
+        pos = rand.randint(0, chrom_length - 10000)
+        isize = int(rand.gauss(300, 30))
+        kind = rand.random()
+
+        if kind < 0.9:
+            # proper pair
+            reads.append((tid, pos, i, 99, tid, pos + isize - read_length, isize, None))
+            reads.append((tid, pos + isize - read_length, i, 147, tid, pos, -isize, None))
+        elif kind < 0.95:
+            # mates on different chromosomes
+            mate_tid = 1 - tid
+            mate_pos = rand.randint(0, chrom_length - 10000)
+            reads.append((tid, pos, i, 97, mate_tid, mate_pos, 0, None))
+            reads.append((mate_tid, mate_pos, i, 145, tid, pos, 0, None))
+        else:
+            # split read with a supplementary alignment elsewhere
+            clip = rand.randint(5, 60)
+            sa_strand = rand.choice('+-')
+            supplementary = 'chr{},{},{},{}S{}M,60,0;'.format(
+                2 - tid, rand.randint(1, chrom_length), sa_strand, read_length - clip, clip
+            )
+            reads.append((tid, pos, i, 99, tid, pos + isize - read_length, isize, (clip, supplementary)))
+            reads.append((tid, pos + isize - read_length, i, 147, tid, pos, -isize, None))
+
+    reads.sort()
+
+    with pysam.AlignmentFile(output, 'wb', header=header) as bam:
+        for tid, pos, i, flag, mate_tid, mate_pos, isize, split in reads:
+            read = pysam.AlignedSegment()
+            read.query_name = 'read_{}'.format(i)
+            read.query_sequence = sequence
+            read.query_qualities = qualities
+            read.flag = flag | (1024 if rand.random() < 0.05 else 0)
+            read.reference_id = tid
+            read.reference_start = pos
+            read.next_reference_id = mate_tid
+            read.next_reference_start = mate_pos
+            read.template_length = isize
+            read.mapping_quality = 60
+            if split:
+                clip, supplementary = split
+                read.cigartuples = [(0, read_length - clip), (4, clip)]
+                read.set_tag('SA', supplementary)
+            else:
+                read.cigartuples = [(0, read_length)]
+            read.set_tag('RG', 'SA1-A1-R01-C01')
+            bam.write(read)
+
+    pysam.index(output)
+
+    return output
+
+
+def legacy_extract_split_reads(infile, outfile, num_splits=2, min_non_overlap=20):
+    """
+    extractSplitReads_BwaMem on sam text, with its defaults
+    """
+    pattern = re.compile('([0-9]+)([MIDNSHP])')
+
+    def cigar_ops(cigar, flag):
+        ops = [(op, int(length)) for length, op in pattern.findall(cigar)]
+        return ops[::-1] if flag & 0x0010 else ops
+
+    def query_pos(ops):
+        qs = qe = 0
+        position = 0
+        for op, length in ops:
+            if position == 0 and op in ('H', 'S'):
+                qs += length
+                qe += length
+            elif op in ('M', 'I'):
+                qe += length
+                position += 1
+        return qs, qe
+
+    with open(infile) as reader, open(outfile, 'w') as writer:
+        for line in reader:
+            if line[0] == '@':
+                writer.write(line)
+                continue
+
+            fields = line.strip().split('\t')
+            flag = int(fields[1])
+            if flag & 1024:
+                continue
+
+            split = False
+            for el in fields[11:]:
+                if 'SA:' in el and len(el.split(';')) <= num_splits:
+                    split = True
+                    mate = el.split(',')
+                    mate_cigar = mate[3]
+                    mate_flag = 16 if mate[2] == '-' else 0
+
+            if not split:
+                continue
+
+            fields[0] += '_1' if flag & 64 else '_2'
+
+            qs1, qe1 = query_pos(cigar_ops(fields[5], flag))
+            qs2, qe2 = query_pos(cigar_ops(mate_cigar, mate_flag))
+            overlap = max(0, 1 + min(qe1, qe2) - max(qs1, qs2))
+
+            if min(1 + qe1 - qs1 - overlap, 1 + qe2 - qs2 - overlap) >= min_non_overlap:
+                writer.write('\t'.join(fields) + '\n')
+
+
+def legacy_tag_reads(infile, outfile, sample_id):
+    infile = pysam.AlignmentFile(infile, 'rb')
+    taggedreads = pysam.AlignmentFile(outfile, "wb", template=infile)
+    for read in infile.fetch():
+        read.query_name = "{}:{}".format(sample_id, read.query_name)
+        taggedreads.write(read)
+    infile.close()
+    taggedreads.close()
+
+
+def legacy_sort(infile, outfile):
+    pysam.sort(infile, '-o', outfile, catch_stdout=False)
+    pysam.index(outfile)
+
+
+def legacy_process_bam(input_bam, discordant_bam, split_bam, histogram, tempdir, tag):
+    helpers.makedirs(tempdir)
+
+    discordants = os.path.join(tempdir, 'discordants.bam')
+    pysam.view('-b', '-F', '1294', input_bam, '-o', discordants, catch_stdout=False)
+    sorted_discordants = os.path.join(tempdir, 'discordants.sorted.bam')
+    legacy_sort(discordants, sorted_discordants)
+    legacy_tag_reads(sorted_discordants, discordant_bam, tag)
+
+    # samtools view -h | extractSplitReads_BwaMem | samtools view -Sb
+    sam = os.path.join(tempdir, 'input.sam')
+    pysam.view('-h', input_bam, '-o', sam, catch_stdout=False)
+    split_sam = os.path.join(tempdir, 'split_reads.sam')
+    legacy_extract_split_reads(sam, split_sam)
+    split_reads = os.path.join(tempdir, 'split_reads.bam')
+    pysam.view('-Sb', split_sam, '-o', split_reads, catch_stdout=False)
+    sorted_split_reads = os.path.join(tempdir, 'split.sorted.bam')
+    legacy_sort(split_reads, sorted_split_reads)
+    legacy_tag_reads(sorted_split_reads, split_bam, tag)
+
+    generate_histogram.gen_histogram(input_bam, histogram, **HISTOGRAM_SETTINGS)
+
+
+def single_pass_process_bam(input_bam, discordant_bam, split_bam, histogram, tempdir, tag):
+    tasks.process_bam(
+        input_bam, discordant_bam, split_bam, histogram, tempdir, tag=tag,
+        **HISTOGRAM_SETTINGS
+    )
+
+
+def get_reads(bam):
+    """
+    reads in coordinate order, ties in name order: samtools sort breaks
+    ties on the strand, the single pass keeps the input order
+    """
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        reads = [
+            (read.reference_id, read.reference_start, read.to_string())
+            for read in reader.fetch(until_eof=True)
+        ]
+
+    assert [read[:2] for read in reads] == sorted(read[:2] for read in reads), \
+        'not coordinate sorted: {}'.format(bam)
+
+    return sorted(reads)
+
+
+def run_benchmark(tempdir, num_pairs):
+    helpers.makedirs(tempdir)
+
+    bam = write_bam(os.path.join(tempdir, 'input.bam'), num_pairs)
+
+    timings = collections.OrderedDict()
+    outputs = {}
+
+    for label, func in (('three_pass', legacy_process_bam), ('single_pass', single_pass_process_bam)):
+        outdir = os.path.join(tempdir, label)
+        helpers.makedirs(outdir)
+        outputs[label] = [
+            os.path.join(outdir, name)
+            for name in ('discordants.bam', 'split_reads.bam', 'histogram.npy')
+        ]
+
+        with timer(label, timings):
+            func(bam, *outputs[label], tempdir=os.path.join(outdir, 'temp'), tag='SA1-A1-R01-C01')
+
+    for expected, output in zip(outputs['three_pass'][:2], outputs['single_pass'][:2]):
+        assert get_reads(output) == get_reads(expected), 'reads differ: {}'.format(output)
+
+    expected = merge_histograms.load_histogram(outputs['three_pass'][2])
+    histogram = merge_histograms.load_histogram(outputs['single_pass'][2])
+    assert np.array_equal(histogram[0], expected[0]) and histogram[1:] == expected[1:], \
+        'histograms differ'
+
+    report(timings, 'three_pass', label='lumpy preprocessing, {} read pairs'.format(num_pairs))
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_pairs', type=int, default=500000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_pairs)
@@ -0,0 +1,174 @@
+'''
+merging cell bams into region bams: one samtools merge -R and one
+samtools index per region, as merge_bams ran them, against the single
+pass RegionBamMerger, for a growing number of cells. checks that every
+region gets the same reads in the same order.
+
+usage: python -m single_cell.tests.benchmarks.bench_merge_bams --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+
+import pysam
+from single_cell.utils import helpers
+from single_cell.utils import pysamutils
+
+from .utils import report
+from .utils import timer
+
+
+def write_cell_bams(tempdir, num_cells, chromosomes, reads_per_cell, read_length=150, seed=0):
+    rand = random.Random(seed)
+    helpers.makedirs(tempdir)
+
+    header = {
+        'HD': {'VN': '1.0', 'SO': 'coordinate'},
+        'SQ': [{'SN': chrom, 'LN': length} for chrom, length in chromosomes.items()],
+    }
+
+    sequence = 'ACGT' * (read_length // 4) + 'A' * (read_length % 4)
+    qualities = pysam.qualitystring_to_array('I' * read_length)
+    lengths = list(chromosomes.values())
+
+    bams = collections.OrderedDict()
+    for cell in range(num_cells):
+        cell_id = 'SA1-A1-R{:02d}-C{:02d}'.format(cell // 100, cell % 100)
+        bams[cell_id] = os.path.join(tempdir, '{}.bam'.format(cell_id))
+
+        cell_header = dict(header, RG=[{'ID': cell_id, 'SM': 'SA1', 'LB': 'A1'}])
+
+        reads = []
+        for i in range(reads_per_cell):
+            tid = rand.randrange(len(chromosomes))
+            pos = rand.randint(0, lengths[tid] - 1000)
+            reads.append((tid, pos, i))
+        reads.sort()
+
+        with pysam.AlignmentFile(bams[cell_id], 'wb', header=cell_header) as bam:
+            for tid, pos, i in reads:
+                read = pysam.AlignedSegment()
+                read.query_name = '{}_{}'.format(cell_id, i)
+                read.query_sequence = sequence
+                read.query_qualities = qualities
+                read.reference_id = tid
+                # coarse positions so that reads from different cells tie
+                read.reference_start = pos - pos % 50
+                read.mapping_quality = 60
+                read.cigartuples = [(0, read_length)]
+                read.flag = 16 if rand.random() < 0.5 else 0
+                read.set_tag('RG', cell_id)
+                bam.write(read)
+
+        pysam.index(bams[cell_id])
+
+    return bams
+
+
+def merge_region(bams, region, output):
+    chrom, start, end = pysamutils.parse_region(region)
+    pysam.merge(
+        '-f', '-R', '{}:{}-{}'.format(chrom, start + 1, end), output, *bams,
+        catch_stdout=False
+    )
+    pysam.index(output, output + '.bai')
+
+
+def merge_per_region(bams, outputs):
+    """
+    one process per region as in the pipeline, samtools run in process
+    through pysam does not free its buffers between calls
+    """
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for region, output in outputs.items():
+            pool.apply(merge_region, (list(bams.values()), region, output))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_reads(bam):
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        return [
+            read.to_string() for chrom in reader.references for read in reader.fetch(chrom)
+        ]
+
+
+def run_benchmark(tempdir, cell_counts, num_chroms, chrom_length, reads_per_cell, split_size):
+    helpers.makedirs(tempdir)
+
+    chromosomes = collections.OrderedDict(
+        ('chr{}'.format(i + 1), chrom_length) for i in range(num_chroms)
+    )
+    regions = pysamutils.get_regions(chromosomes, split_size)
+
+    all_timings = collections.OrderedDict()
+
+    for num_cells in cell_counts:
+        celldir = os.path.join(tempdir, str(num_cells))
+        helpers.makedirs(celldir)
+
+        bams = write_cell_bams(os.path.join(celldir, 'cells'), num_cells, chromosomes, reads_per_cell)
+
+        outputs = {}
+        for label in ('per_region', 'single_pass'):
+            outdir = os.path.join(celldir, label)
+            helpers.makedirs(outdir)
+            outputs[label] = {
+                region: os.path.join(outdir, '{}.bam'.format(region)) for region in regions
+            }
+
+        timings = collections.OrderedDict()
+
+        with timer('per_region', timings):
+            merge_per_region(bams, outputs['per_region'])
+
+        with timer('single_pass', timings):
+            pysamutils.RegionBamMerger(
+                list(bams.values()), outputs['single_pass'], os.path.join(celldir, 'temp')
+            ).merge()
+
+        for region in regions:
+            expected = get_reads(outputs['per_region'][region])
+            assert get_reads(outputs['single_pass'][region]) == expected, \
+                'reads differ: {}'.format(region)
+
+        report(
+            timings, 'per_region',
+            label='bam merge, {} cells, {} reads into {} regions'.format(
+                num_cells, num_cells * reads_per_cell, len(regions)
+            )
+        )
+
+        all_timings[num_cells] = timings
+
+    return all_timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--cell_counts', type=int, nargs='+', default=[500, 5000])
+
+    parser.add_argument('--num_chroms', type=int, default=3)
+
+    parser.add_argument('--chrom_length', type=int, default=10000000)
+
+    parser.add_argument('--reads_per_cell', type=int, default=200)
+
+    parser.add_argument('--split_size', type=int, default=1000000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(
+        args.tempdir, args.cell_counts, args.num_chroms, args.chrom_length,
+        args.reads_per_cell, args.split_size
+    )
@@ -0,0 +1,100 @@
+'''
+post processing of the fastq_screen output in organism_filter on a
+synthetic gzipped tagged fastq pair (fastq_screen writes plain gzip):
+the previous gather_counts pass followed by one re-tag pass per read
+end, against the single threaded pass in filter_and_count_reads.
+
+usage: python -m single_cell.tests.benchmarks.bench_organism_filter --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import gzip
+import os
+import shutil
+
+from single_cell.utils import helpers
+from single_cell.workflows.align import fastqscreen
+
+from .bench_fastqutils import LegacyTaggedFastqReader
+from .bench_fastqutils import legacy_gather_counts
+from .bench_fastqutils import write_tagged_fastqs
+from .utils import report
+from .utils import timer
+
+
+def gzip_file(infile, outfile):
+    with open(infile, 'rb') as reader, gzip.open(outfile, 'wb', compresslevel=6) as writer:
+        shutil.copyfileobj(reader, writer)
+    return outfile
+
+
+def legacy_re_tag_reads(infile, outfile, threads=None):
+    reader = LegacyTaggedFastqReader(infile)
+    with helpers.getFileHandle(outfile, 'wt', threads=threads) as writer:
+        for read in reader.get_read_iterator():
+            for line in reader.add_tag_to_read_comment(read):
+                writer.write(line)
+
+
+def read_lines(filepath):
+    with helpers.getFileHandle(filepath) as reader:
+        return reader.readlines()
+
+
+def run_benchmark(tempdir, num_reads, threads=1):
+    helpers.makedirs(tempdir)
+
+    input_r1, input_r2 = write_tagged_fastqs(
+        os.path.join(tempdir, 'tagged_R1.fastq'),
+        os.path.join(tempdir, 'tagged_R2.fastq'),
+        num_reads
+    )
+    input_r1 = gzip_file(input_r1, input_r1 + '.gz')
+    input_r2 = gzip_file(input_r2, input_r2 + '.gz')
+
+    timings = collections.OrderedDict()
+
+    def outputs(label):
+        return (
+            os.path.join(tempdir, '{}_R1.fastq.gz'.format(label)),
+            os.path.join(tempdir, '{}_R2.fastq.gz'.format(label)),
+        )
+
+    with timer('legacy', timings):
+        legacy_counts = legacy_gather_counts(input_r1, input_r2)
+        for infile, outfile in zip((input_r1, input_r2), outputs('legacy')):
+            legacy_re_tag_reads(infile, outfile, threads=threads)
+
+    with timer('filter_and_count_reads', timings):
+        counts = fastqscreen.filter_and_count_reads(
+            input_r1, input_r2, *outputs('fused'), threads=threads
+        )
+
+    assert counts == legacy_counts, 'counts differ'
+    for reference, output in zip(outputs('legacy'), outputs('fused')):
+        assert read_lines(reference) == read_lines(output), \
+            'outputs differ: {} {}'.format(reference, output)
+
+    report(
+        timings, 'legacy',
+        label='organism_filter post processing, {} gzipped read pairs'.format(num_reads)
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_reads', type=int, default=10000000)
+
+    parser.add_argument('--threads', type=int, default=1)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_reads, threads=args.threads)
@@ -0,0 +1,150 @@
+'''
+heatmap matrix loading for PlotPcolor on a synthetic reads table: the
+previous line by line parser with dicts keyed by bin tuples against the
+array backed loader. checks that both produce the same matrix.
+
+usage: python -m single_cell.tests.benchmarks.bench_pcolor_matrix --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import csvutils
+from single_cell.utils import helpers
+from single_cell.utils.singlecell_copynumber_plot_utils import PlotPcolor
+from single_cell.workflows.hmmcopy.dtypes import dtypes
+
+from .utils import report
+from .utils import timer
+
+CHROMOSOMES = [str(v) for v in range(1, 23)]
+
+
+def write_reads(output, num_cells, num_bins, seed=0):
+    """
+    writes a reads table with copy and map columns, some copy values
+    are missing
+    """
+    rand = np.random.RandomState(seed)
+
+    bins_per_chrom = num_bins // len(CHROMOSOMES)
+
+    bins = pd.DataFrame({
+        'chr': np.repeat(CHROMOSOMES, bins_per_chrom),
+        'start': np.tile(np.arange(bins_per_chrom) * 500000 + 1, len(CHROMOSOMES)),
+    })
+    bins['end'] = bins['start'] + 500000 - 1
+    bins['map'] = rand.uniform(0.5, 1, len(bins))
+
+    columns = ['cell_id', 'chr', 'start', 'end', 'map', 'copy']
+
+    reads_dtypes = {k: v for k, v in dtypes()['reads'].items() if k in columns}
+
+    writer = csvutils.CsvOutput(output, dtypes=reads_dtypes, header=True)
+
+    def chunks():
+        for cell in range(num_cells):
+            df = bins.copy()
+            df['cell_id'] = 'SA1090-A96213A-R{:04d}-C{:02d}'.format(cell // 60, cell % 60)
+            df['copy'] = rand.gamma(2, 1, len(bins))
+            df.loc[rand.uniform(size=len(bins)) < 0.02, 'copy'] = float('nan')
+            yield df[columns]
+
+    writer.write_df(chunks(), chunks=True)
+
+    return output
+
+
+def legacy_read_segs_csv(infile, column_name, mappability_threshold):
+    """
+    the line by line parser PlotPcolor used before the array loader,
+    kept as the baseline
+    """
+    data = {}
+    bins = {}
+
+    header, _, columns = csvutils.get_metadata(infile)
+    idxs = {val: i for i, val in enumerate(columns)}
+
+    with helpers.getFileHandle(infile, 'rt') as freader:
+        if header:
+            assert freader.readline().strip().split(',') == columns
+
+        for line in freader:
+            line = line.strip().split(',')
+
+            sample_id = line[idxs['cell_id']]
+
+            val = line[idxs[column_name]]
+            val = float('nan') if val in ("NA", "") else float(val)
+
+            chrom = line[idxs['chr']]
+            start = int(line[idxs['start']])
+            end = int(line[idxs['end']])
+
+            if mappability_threshold and float(line[idxs["map"]]) <= mappability_threshold:
+                val = float("nan")
+
+            bins.setdefault(chrom, set()).add((start, end))
+            data.setdefault(sample_id, {})[(chrom, start, end)] = val
+
+    samples = sorted(data.keys())
+    bins = [(chrom, start, end) for chrom in CHROMOSOMES for start, end in sorted(bins[chrom])]
+
+    outdata = {}
+    for sample in samples:
+        cndata = [data[sample][bin_v] for bin_v in bins]
+        if np.isnan(cndata).all() or np.isinf(cndata).all():
+            continue
+        outdata[sample] = cndata
+
+    df = pd.DataFrame(outdata).T
+    df.columns = bins
+    return df
+
+
+def run_benchmark(tempdir, num_cells, num_bins):
+    helpers.makedirs(tempdir)
+
+    reads = write_reads(os.path.join(tempdir, 'reads.csv.gz'), num_cells, num_bins)
+
+    timings = collections.OrderedDict()
+
+    with timer('legacy', timings):
+        legacy = legacy_read_segs_csv(reads, 'copy', 0.9)
+
+    with timer('array', timings):
+        array = PlotPcolor(
+            reads, None, None, column_name='copy', mappability_threshold=0.9,
+            chromosomes=CHROMOSOMES
+        ).read_segs()
+
+    assert list(legacy.index) == list(array.index), 'cells differ'
+    assert list(legacy.columns) == list(array.columns), 'bins differ'
+    assert np.allclose(legacy.values, array.values, equal_nan=True, rtol=1e-6), 'values differ'
+
+    report(
+        timings, 'legacy',
+        label='heatmap matrix, {} cells x {} bins'.format(num_cells, num_bins)
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_cells', type=int, default=1500)
+
+    parser.add_argument('--num_bins', type=int, default=6000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.num_cells, args.num_bins)
@@ -0,0 +1,147 @@
+'''
+hmmcopy quality metrics on synthetic reads and segments tables: the per
+cell ExtractHmmMetrics.compute_quality_metrics loop against the grouped
+computation over all cells. the per cell loop is timed on a subset of the
+cells and scaled to the full library, both are checked to give the same
+metrics on that subset.
+
+usage: python -m single_cell.tests.benchmarks.bench_quality_metrics --num_cells 500 2000 10000
+'''
+import argparse
+import collections
+
+import numpy as np
+import pandas as pd
+from single_cell.workflows.hmmcopy.scripts import batch_quality_metrics
+from single_cell.workflows.hmmcopy.scripts.extract_quality_metrics import ExtractHmmMetrics
+
+from .utils import report
+from .utils import timer
+
+CHROMOSOMES = list(map(str, range(1, 23))) + ['X', 'Y']
+
+
+def get_synthetic_tables(num_cells, bins_per_chrom, bin_size=500000, seed=0):
+    """
+    reads table with runs of states along each chromosome, and the
+    segments table with one segment per run
+    """
+    rand = np.random.RandomState(seed)
+
+    num_bins = len(CHROMOSOMES) * bins_per_chrom
+    num_rows = num_cells * num_bins
+
+    # object arrays share the string objects between rows, as read_csv does
+    cell_ids = np.array(['SA1-A1-R{:05d}'.format(i) for i in range(num_cells)], dtype=object)
+    cells = np.repeat(cell_ids, num_bins)
+    chroms = np.tile(np.repeat(np.array(CHROMOSOMES, dtype=object), bins_per_chrom), num_cells)
+    starts = np.tile(np.arange(bins_per_chrom) * bin_size + 1, num_cells * len(CHROMOSOMES))
+
+    # a state change every 20 bins on average, always at chromosome starts
+    change = rand.rand(num_rows) < 0.05
+    change[::bins_per_chrom] = True
+    seg_starts = np.flatnonzero(change)
+    seg_ends = np.append(seg_starts[1:], num_rows) - 1
+
+    seg_state = rand.randint(0, 7, size=len(seg_starts))
+    state = np.repeat(seg_state, np.diff(np.append(seg_starts, num_rows)))
+
+    copy = state + rand.normal(0, 0.3, num_rows)
+    copy[rand.rand(num_rows) < 0.05] = np.nan
+
+    # columns are added one at a time, building the frame from a dict
+    # stacks them into blocks and needs twice the memory
+    reads = pd.DataFrame({'cell_id': cells, 'chr': chroms})
+    reads['start'] = starts
+    reads['end'] = starts + bin_size - 1
+    reads['reads'] = rand.poisson(np.maximum(state, 0.1) * 40)
+    reads['copy'] = copy
+    reads['state'] = state
+    reads['integer_copy_scale'] = copy * 1.02
+    reads['integer_copy_number'] = state
+
+    segments = pd.DataFrame({
+        'cell_id': cells[seg_starts],
+        'chr': chroms[seg_starts],
+        'start': starts[seg_starts],
+        'end': starts[seg_ends] + bin_size - 1,
+        'integer_median': seg_state + rand.normal(0, 0.1, len(seg_starts)),
+        'integer_copy_number': seg_state,
+    })
+
+    return reads, segments
+
+
+def per_cell_metrics(reads, segments):
+    extractor = ExtractHmmMetrics(None, None, None, 'metrics.csv', None)
+
+    segments = dict(list(segments.groupby('cell_id')))
+
+    metrics = []
+    for cell_id, cell_reads in reads.groupby('cell_id'):
+        cell_segments = segments.get(cell_id)
+        if cell_segments is not None:
+            cell_segments = cell_segments.reset_index(drop=True)
+        metrics.append(
+            extractor.compute_quality_metrics(
+                cell_reads.reset_index(drop=True), cell_segments, cell_id
+            )
+        )
+
+    return pd.DataFrame(metrics).sort_values('cell_id').reset_index(drop=True)
+
+
+def run_benchmark(num_cells, bins_per_chrom, legacy_cells):
+    reads, segments = get_synthetic_tables(num_cells, bins_per_chrom)
+
+    legacy_cells = min(legacy_cells, num_cells)
+    subset = reads['cell_id'].unique()[:legacy_cells]
+    subset_reads = reads[reads['cell_id'].isin(subset)]
+    subset_segments = segments[segments['cell_id'].isin(subset)]
+
+    timings = collections.OrderedDict()
+
+    with timer('per_cell', timings):
+        reference = per_cell_metrics(subset_reads, subset_segments)
+    timings['per_cell'] *= num_cells / legacy_cells
+
+    with timer('grouped', timings):
+        metrics = batch_quality_metrics.compute_quality_metrics(reads, segments)
+
+    metrics = metrics[metrics['cell_id'].isin(subset)].reset_index(drop=True)
+
+    assert list(metrics.columns) == list(reference.columns)
+    assert (metrics['cell_id'].values == reference['cell_id'].values).all()
+    for column in batch_quality_metrics.METRICS_COLUMNS:
+        assert np.allclose(
+            metrics[column].values.astype(np.float64),
+            reference[column].values.astype(np.float64),
+            rtol=1e-9, atol=0, equal_nan=True
+        ), 'metrics differ: {}'.format(column)
+
+    report(
+        timings, 'per_cell',
+        label='quality metrics, {} cells x {} bins (per cell timed on {} cells)'.format(
+            num_cells, bins_per_chrom * len(CHROMOSOMES), legacy_cells
+        )
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--num_cells', type=int, nargs='+', default=[500, 2000, 10000])
+
+    parser.add_argument('--bins_per_chrom', type=int, default=100)
+
+    parser.add_argument('--legacy_cells', type=int, default=100)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for num_cells in args.num_cells:
+        run_benchmark(num_cells, args.bins_per_chrom, args.legacy_cells)
@@ -0,0 +1,84 @@
+'''
+compares the per read and vectorized ReadCounter backends on a
+synthetic bam. checks that both write identical wig and seg outputs.
+
+usage: python -m single_cell.tests.benchmarks.bench_read_counter --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import filecmp
+import os
+
+from single_cell.utils import helpers
+from single_cell.workflows.hmmcopy.scripts import ReadCounter
+
+from .utils import report
+from .utils import timer
+from .utils import write_synthetic_bam
+
+
+def write_exclude_list(output, chromosomes, bin_size):
+    with open(output, 'w') as outfile:
+        outfile.write('chrom\tstart\tend\n')
+        for chrom, length in chromosomes.items():
+            for start in range(bin_size // 2, length, bin_size * 7):
+                outfile.write('{}\t{}\t{}\n'.format(chrom, start, start + bin_size))
+    return output
+
+
+def run_benchmark(tempdir, reads_per_chrom, bin_size, num_chroms=3):
+    helpers.makedirs(tempdir)
+
+    # one chromosome length is an exact multiple of the bin size
+    chromosomes = collections.OrderedDict()
+    for i in range(1, num_chroms + 1):
+        chromosomes[str(i)] = bin_size * 1000 * i + (0 if i == 1 else 137)
+
+    bam = write_synthetic_bam(
+        os.path.join(tempdir, 'synthetic.bam'), chromosomes, reads_per_chrom,
+        fs_tag_references=['grch37', 'mm10'], bin_size=bin_size
+    )
+    excluded = write_exclude_list(
+        os.path.join(tempdir, 'exclude.tsv'), chromosomes, bin_size
+    )
+
+    timings = collections.OrderedDict()
+
+    for seg in (False, True):
+        outputs = {}
+        for vectorize in (False, True):
+            label = '{}_{}'.format(
+                'seg' if seg else 'wig', 'vectorized' if vectorize else 'per_read'
+            )
+            outputs[vectorize] = os.path.join(tempdir, label + '.txt')
+
+            with timer(label, timings):
+                ReadCounter(
+                    bam, outputs[vectorize], bin_size, list(chromosomes.keys()), 20,
+                    seg=seg, excluded=excluded, reference='grch37',
+                    vectorize=vectorize
+                ).main()
+
+        assert filecmp.cmp(outputs[False], outputs[True], shallow=False), \
+            'outputs differ: {} {}'.format(outputs[False], outputs[True])
+
+    report(timings, 'wig_per_read', label='ReadCounter, {} reads per chromosome'.format(reads_per_chrom))
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--reads_per_chrom', type=int, default=500000)
+
+    parser.add_argument('--bin_size', type=int, default=500)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.tempdir, args.reads_per_chrom, args.bin_size)
@@ -0,0 +1,188 @@
+'''
+splitting a coordinate sorted bam into regions: one samtools view and
+samtools index per region, as split_bam_file_one_job ran them, against
+the single pass RegionBamSplitter. checks that every region gets the
+same reads.
+
+samtools runs in process through pysam. per_region runs every region in
+a fresh forked process, as the pipeline ran one samtools process per
+region, without the exec and docker start up of the pipeline.
+per_region_in_process runs all regions in this process and is the lower
+bound for the per region approach.
+
+usage: python -m single_cell.tests.benchmarks.bench_split_bam --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+
+import pysam
+from single_cell.utils import helpers
+from single_cell.utils import pysamutils
+
+from .utils import report
+from .utils import timer
+
+
+def write_bam(output, chromosomes, reads_per_chrom, read_length=150, seed=0):
+    """
+    paired looking reads with deletions, soft clips and unmapped mates
+    placed at the position of the mapped mate
+    """
+    rand = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.0', 'SO': 'coordinate'},
+        'SQ': [{'SN': chrom, 'LN': length} for chrom, length in chromosomes.items()]
+    }
+
+    sequence = 'ACGT' * (read_length // 4) + 'A' * (read_length % 4)
+    qualities = pysam.qualitystring_to_array('I' * read_length)
+
+    cigars = [
+        [(0, read_length)],
+        [(4, 20), (0, read_length - 20)],
+        [(0, 50), (2, 5000), (0, read_length - 50)],
+        [(0, 60), (1, 10), (0, read_length - 70)],
+    ]
+
+    with pysam.AlignmentFile(output, 'wb', header=header) as bam:
+        for tid, (chrom, length) in enumerate(chromosomes.items()):
+            positions = sorted(rand.randint(0, length - 6000) for _ in range(reads_per_chrom))
+
+            for i, pos in enumerate(positions):
+                read = pysam.AlignedSegment()
+                read.query_name = 'read_{}_{}'.format(chrom, i)
+                read.query_sequence = sequence
+                read.query_qualities = qualities
+                read.reference_id = tid
+                read.reference_start = pos
+
+                if rand.random() < 0.02:
+                    read.flag = 4
+                else:
+                    read.mapping_quality = 60
+                    read.cigartuples = rand.choice(cigars)
+
+                bam.write(read)
+
+    pysam.index(output)
+
+    return output
+
+
+def split_region(bam, region, output):
+    chrom, start, end = pysamutils.parse_region(region)
+    pysam.view(
+        '-b', bam, '-o', output, '{}:{}-{}'.format(chrom, start + 1, end),
+        catch_stdout=False
+    )
+    pysam.index(output, output + '.bai')
+
+
+def split_per_region(bam, outputs):
+    """
+    one process per region as in the pipeline
+    """
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for region, output in outputs.items():
+            pool.apply(split_region, (bam, region, output))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def split_per_region_in_process(bam, outputs):
+    for region, output in outputs.items():
+        split_region(bam, region, output)
+
+
+def get_reads(bam):
+    """
+    reads through the index, so that the index is checked as well
+    """
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        return [
+            read.to_string() for chrom in reader.references for read in reader.fetch(chrom)
+        ]
+
+
+def run_benchmark(
+        tempdir, num_chroms, chrom_length, reads_per_chrom, split_size, processes=1
+):
+    helpers.makedirs(tempdir)
+
+    chromosomes = collections.OrderedDict(
+        ('chr{}'.format(i + 1), chrom_length) for i in range(num_chroms)
+    )
+    bam = write_bam(os.path.join(tempdir, 'input.bam'), chromosomes, reads_per_chrom)
+
+    # not every chromosome is split
+    regions = pysamutils.get_regions(
+        collections.OrderedDict(list(chromosomes.items())[:-1]), split_size
+    )
+
+    outputs = {}
+    for label in ('per_region', 'per_region_in_process', 'single_pass'):
+        outdir = os.path.join(tempdir, label)
+        helpers.makedirs(outdir)
+        outputs[label] = {
+            region: os.path.join(outdir, '{}.bam'.format(region)) for region in regions
+        }
+
+    timings = collections.OrderedDict()
+
+    with timer('per_region', timings):
+        split_per_region(bam, outputs['per_region'])
+
+    with timer('per_region_in_process', timings):
+        split_per_region_in_process(bam, outputs['per_region_in_process'])
+
+    with timer('single_pass', timings):
+        pysamutils.RegionBamSplitter(
+            bam, outputs['single_pass'], processes=processes
+        ).split()
+
+    for region in regions:
+        expected = get_reads(outputs['per_region'][region])
+        for label in ('per_region_in_process', 'single_pass'):
+            assert get_reads(outputs[label][region]) == expected, \
+                'reads differ: {} {}'.format(label, region)
+
+    report(
+        timings, 'per_region',
+        label='bam split, {} reads into {} regions'.format(
+            num_chroms * reads_per_chrom, len(regions)
+        )
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_chroms', type=int, default=4)
+
+    parser.add_argument('--chrom_length', type=int, default=50000000)
+
+    parser.add_argument('--reads_per_chrom', type=int, default=250000)
+
+    parser.add_argument('--split_size', type=int, default=200000)
+
+    parser.add_argument('--processes', type=int, default=1)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(
+        args.tempdir, args.num_chroms, args.chrom_length, args.reads_per_chrom,
+        args.split_size, args.processes
+    )
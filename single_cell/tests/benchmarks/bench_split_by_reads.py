@@ -0,0 +1,183 @@
+'''
+splitting a bam into read name grouped parts: the sam text route that
+split_bam_file_by_reads used (collate to sam, count lines, split the
+text, samtools view -Sb per part) against collating to an uncompressed
+bam and splitting the records with pysamutils.split_bam_by_read_name.
+checks that every record ends up in exactly one part, that read names
+are not split across parts and that the parts are balanced.
+
+usage: python -m single_cell.tests.benchmarks.bench_split_by_reads --tempdir /tmp/bench
+'''
+import argparse
+import collections
+import os
+import random
+
+import pysam
+from single_cell.utils import helpers
+from single_cell.utils import pysamutils
+
+from .utils import report
+from .utils import timer
+
+
+def write_bam(output, num_chroms, chrom_length, num_pairs, read_length=100, seed=0):
+    rand = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.0', 'SO': 'coordinate'},
+        'SQ': [{'SN': 'chr{}'.format(i + 1), 'LN': chrom_length} for i in range(num_chroms)],
+    }
+
+    sequence = 'ACGT' * (read_length // 4)
+    qualities = pysam.qualitystring_to_array('I' * len(sequence))
+
+    reads = []
+    for i in range(num_pairs):
+        tid = rand.randrange(num_chroms)
+        pos = rand.randint(0, chrom_length - 1000)
+        mate_pos = pos + rand.randint(100, 500)
+        reads.append((tid, pos, mate_pos, i, 99))
+        reads.append((tid, mate_pos, pos, i, 147))
+    reads.sort()
+
+    with pysam.AlignmentFile(output, 'wb', header=header) as bam:
+        for tid, pos, mate_pos, i, flag in reads:
+            read = pysam.AlignedSegment()
+            read.query_name = 'read_{}'.format(i)
+            read.query_sequence = sequence
+            read.query_qualities = qualities
+            read.flag = flag
+            read.reference_id = read.next_reference_id = tid
+            read.reference_start = pos
+            read.next_reference_start = mate_pos
+            read.mapping_quality = 60
+            read.cigartuples = [(0, len(sequence))]
+            bam.write(read)
+
+    pysam.index(output)
+
+    return output
+
+
+def text_split(bam, outputs, tempdir):
+    headerfile = os.path.join(tempdir, 'header.sam')
+    pysam.view('-H', bam, '-o', headerfile, catch_stdout=False)
+    with open(headerfile) as reader:
+        header = reader.readlines()
+
+    # collate -u -O | view, through a temp file
+    collated_bam = os.path.join(tempdir, 'collated.bam')
+    pysam.collate('-u', '-o', collated_bam, bam, os.path.join(tempdir, 'text_collate'))
+    collated = os.path.join(tempdir, 'collated.sam')
+    pysam.view(collated_bam, '-o', collated, catch_stdout=False)
+
+    with open(collated) as reader:
+        numlines = sum(block.count('\n') for block in iter(lambda: reader.read(65536), ''))
+
+    lines_per_file = numlines / len(outputs)
+    parts = [output + '.sam' for output in outputs]
+
+    with open(collated) as reader:
+        part = 0
+        writer = open(parts[part], 'w')
+        writer.writelines(header)
+
+        count = 0
+        last_name = None
+        for line in reader:
+            name = line.split('\t', 1)[0]
+            if count >= (part + 1) * lines_per_file and name != last_name and part < len(parts) - 1:
+                writer.close()
+                part += 1
+                writer = open(parts[part], 'w')
+                writer.writelines(header)
+            writer.write(line)
+            count += 1
+            last_name = name
+
+        writer.close()
+
+    for part, output in zip(parts, outputs):
+        pysam.view('-Sb', part, '-o', output, catch_stdout=False)
+
+
+def binary_split(bam, outputs, tempdir):
+    collated = os.path.join(tempdir, 'collated.bam')
+    pysam.collate('-u', '-o', collated, bam, os.path.join(tempdir, 'bam_collate'))
+
+    pysamutils.split_bam_by_read_name(
+        collated, outputs, num_reads=pysamutils.get_read_count(bam)
+    )
+
+
+def check_parts(bam, outputs):
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        expected = sorted(read.to_string() for read in reader.fetch(until_eof=True))
+
+    records = []
+    names = {}
+    sizes = []
+    for index, output in enumerate(outputs):
+        with pysam.AlignmentFile(output, 'rb', check_sq=False) as reader:
+            reads = list(reader.fetch(until_eof=True))
+
+        for read in reads:
+            assert names.setdefault(read.query_name, index) == index, \
+                'read name split across parts: {}'.format(read.query_name)
+
+        records.extend(read.to_string() for read in reads)
+        sizes.append(len(reads))
+
+    assert sorted(records) == expected, 'records differ'
+
+    # parts differ by at most a read name group
+    assert max(sizes) - min(sizes) <= 2 * 2, 'unbalanced parts: {}'.format(sizes)
+
+
+def run_benchmark(tempdir, num_chroms, chrom_length, num_pairs, num_parts):
+    helpers.makedirs(tempdir)
+
+    bam = write_bam(os.path.join(tempdir, 'input.bam'), num_chroms, chrom_length, num_pairs)
+
+    timings = collections.OrderedDict()
+
+    for label, func in (('sam_text', text_split), ('binary', binary_split)):
+        outdir = os.path.join(tempdir, label)
+        helpers.makedirs(outdir)
+        outputs = [os.path.join(outdir, 'part_{}.bam'.format(i)) for i in range(num_parts)]
+
+        with timer(label, timings):
+            func(bam, outputs, outdir)
+
+        check_parts(bam, outputs)
+
+    report(
+        timings, 'sam_text',
+        label='split by read name, {} records into {} parts'.format(2 * num_pairs, num_parts)
+    )
+
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--tempdir', required=True)
+
+    parser.add_argument('--num_chroms', type=int, default=4)
+
+    parser.add_argument('--chrom_length', type=int, default=50000000)
+
+    parser.add_argument('--num_pairs', type=int, default=500000)
+
+    parser.add_argument('--num_parts', type=int, default=24)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(
+        args.tempdir, args.num_chroms, args.chrom_length, args.num_pairs, args.num_parts
+    )
@@ -0,0 +1,103 @@
+'''
+helpers shared by the benchmark scripts
+'''
+import contextlib
+import logging
+import random
+import time
+
+import pysam
+
+
+@contextlib.contextmanager
+def timer(label, timings):
+    """
+    records wall time of the with block into timings dict
+    :param label: key in timings dict
+    :param timings: dict to update
+    """
+    start = time.time()
+    yield
+    timings[label] = time.time() - start
+    logging.getLogger("single_cell.benchmarks").info(
+        "{}: {:.3f}s".format(label, timings[label])
+    )
+
+
+def report(timings, baseline, label=None):
+    """
+    print timings along with speedup over baseline
+    :param timings: dict of label to seconds
+    :param baseline: key of the reference timing
+    :param label: title for the report
+    """
+    if label:
+        print(label)
+    for key, value in timings.items():
+        speedup = timings[baseline] / value if value else float('inf')
+        print('{:<40}{:>10.3f}s{:>10.2f}x'.format(key, value, speedup))
+
+
+def write_synthetic_bam(
+        output, chromosomes, reads_per_chrom, read_length=100,
+        duplicate_rate=0.1, fs_tag_references=None, seed=0,
+        cell_tag=None, cells=None, bin_size=None
+):
+    """
+    write a coordinate sorted and indexed bam with random single end reads
+    :param output: path to bam file
+    :param chromosomes: dict of chromosome name to length
+    :param reads_per_chrom: number of reads per chromosome
+    :param duplicate_rate: fraction of reads flagged as duplicates
+    :param fs_tag_references: list of genomes to add to FS tags
+    :param cell_tag: tag (CB/RG) used to label reads with a cell id
+    :param cells: list of cell ids to pick from for cell_tag
+    :param bin_size: if set, some reads are placed on bin boundaries
+    """
+    rand = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.0', 'SO': 'coordinate'},
+        'SQ': [{'SN': chrom, 'LN': length} for chrom, length in chromosomes.items()]
+    }
+    if cell_tag == 'RG':
+        header['RG'] = [{'ID': cell, 'SM': cell} for cell in cells]
+
+    sequence = 'A' * read_length
+    qualities = pysam.qualitystring_to_array('I' * read_length)
+
+    with pysam.AlignmentFile(output, 'wb', header=header) as bam:
+        for tid, (chrom, length) in enumerate(chromosomes.items()):
+            positions = [rand.randint(0, length - 1) for _ in range(reads_per_chrom)]
+            if bin_size:
+                # exercise the bin boundary handling
+                positions += list(range(0, length, bin_size))[:reads_per_chrom // 10]
+            positions.sort()
+
+            for i, pos in enumerate(positions):
+                read = pysam.AlignedSegment()
+                read.query_name = 'read_{}_{}'.format(chrom, i)
+                read.query_sequence = sequence
+                read.query_qualities = qualities
+                read.flag = 1024 if rand.random() < duplicate_rate else 0
+                read.reference_id = tid
+                read.reference_start = pos
+                read.mapping_quality = rand.choice([0, 10, 20, 60, 60, 60])
+                read.cigartuples = [(0, read_length)]
+
+                if fs_tag_references:
+                    read.set_tag(
+                        'FS', ','.join(
+                            '{}_{}'.format(ref, rand.choice([0, 1, 1, 2]))
+                            for ref in fs_tag_references
+                        )
+                    )
+
+                if cell_tag:
+                    read.set_tag(cell_tag, rand.choice(cells))
+
+                bam.write(read)
+
+    pysam.index(output)
+
+    return output
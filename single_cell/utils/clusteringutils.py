@@ -0,0 +1,261 @@
+'''
+hierarchical clustering of cells by copy number state.
+
+the hmmcopy reads table is loaded into a cells x bins int8 state matrix
+through a precomputed bin index, the same loader fills the float
+matrices for the heatmaps. cityblock distances are computed in
+tiles on a thread pool and clustered with ward linkage. for very large
+libraries an approximate mode clusters in pca space: cells are grouped
+with k-means, the groups are ordered by ward linkage on their centroids
+and cells within each group by ward linkage on their pca coordinates.
+'''
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.cluster.hierarchy as hc
+import scipy.spatial as sp
+from single_cell.utils import csvutils
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import PCA
+
+DEFAULT_CHROMOSOMES = list(map(str, range(1, 23))) + ['X', 'Y']
+
+
+def get_bin_index(bins, chromosomes=None):
+    """
+    sorts bins in genome order
+    :param bins: dataframe with chr, start and end columns, other
+    columns are kept
+    :param chromosomes: chromosome order, bins on other chromosomes
+    are placed at the end
+    :returns dataframe of unique bins in genome order, with a
+    default integer index
+    """
+    if not chromosomes:
+        chromosomes = DEFAULT_CHROMOSOMES
+
+    bins = bins.drop_duplicates(['chr', 'start', 'end'])
+    bins = bins.astype({'chr': str})
+
+    others = sorted(set(bins['chr']) - set(chromosomes))
+    bins['chr'] = pd.Categorical(bins['chr'], categories=list(chromosomes) + others)
+
+    bins = bins.sort_values(['chr', 'start', 'end'])
+    bins['chr'] = bins['chr'].astype(str)
+
+    return bins.reset_index(drop=True)
+
+
+def update_index(index, keys):
+    """
+    appends keys that are not in index
+    :returns updated index and the position of each key
+    """
+    positions = index.get_indexer(keys)
+
+    missing = positions < 0
+    if missing.any():
+        index = index.append(pd.Index(pd.unique(keys[missing])))
+        positions = index.get_indexer(keys)
+
+    return index, positions
+
+
+def get_cell_bin_matrix(chunks, column, dtype=np.float32, fill_value=np.nan, chromosomes=None):
+    """
+    fills a cells x bins matrix from a per cell, per bin table in one
+    pass. missing values are stored as fill_value
+    :param chunks: iterable of dataframes with cell_id, chr, start, end
+    and column
+    :param column: column with the matrix values
+    :param chromosomes: chromosome order for the bins
+    :returns sorted cell ids, bins dataframe (see get_bin_index) and
+    matrix
+    """
+    cells = pd.Index([], dtype=object)
+    chroms = pd.Index([], dtype=object)
+
+    # bins are keyed by chromosome position << 32 | start
+    bin_keys = pd.Index([], dtype=np.int64)
+    bins = []
+
+    matrix = np.full((0, 0), fill_value, dtype=dtype)
+
+    for chunk in chunks:
+        cells, cell_idx = update_index(cells, chunk['cell_id'].values)
+
+        chroms, chrom_idx = update_index(chroms, chunk['chr'].astype(str).values)
+        keys = (chrom_idx.astype(np.int64) << 32) | chunk['start'].values.astype(np.int64)
+
+        num_bins = len(bin_keys)
+        bin_keys, bin_idx = update_index(bin_keys, keys)
+        if len(bin_keys) > num_bins:
+            new_bins = chunk.loc[bin_idx >= num_bins, ['chr', 'start', 'end']]
+            bins.append(new_bins.drop_duplicates(['chr', 'start']))
+
+        # grow the matrix as new cells and bins show up, rows are
+        # doubled to keep the number of copies small
+        if len(cells) > matrix.shape[0] or len(bin_keys) > matrix.shape[1]:
+            shape = (
+                max(len(cells), min(2 * matrix.shape[0], 2 * len(cells))),
+                len(bin_keys)
+            )
+            resized = np.full(shape, fill_value, dtype=dtype)
+            resized[:matrix.shape[0], :matrix.shape[1]] = matrix
+            matrix = resized
+
+        matrix[cell_idx, bin_idx] = chunk[column].fillna(fill_value).values.astype(dtype)
+
+    # bins in the order they were added to bin_keys
+    bins = pd.concat(bins) if bins else pd.DataFrame(columns=['chr', 'start', 'end'])
+    bins = bins.astype({'chr': str}).reset_index(drop=True)
+    bins['position'] = np.arange(len(bins))
+
+    bins = get_bin_index(bins, chromosomes)
+    bin_order = bins.pop('position').values.astype(np.int64)
+
+    cell_order = np.argsort(cells.values, kind='mergesort')
+
+    matrix = matrix[cell_order][:, bin_order]
+
+    return cells[cell_order], bins, matrix
+
+
+def get_state_matrix(reads_filename, chromosomes=None, chunksize=10 ** 6):
+    """
+    reads the hmmcopy states into a cells x bins matrix in one pass.
+    missing states are stored as 0
+    :param reads_filename: hmmcopy reads table
+    :param chromosomes: chromosome order for the bins
+    :returns sorted cell ids, bins dataframe (see get_bin_index) and
+    int8 matrix
+    """
+    chunks = csvutils.read_csv_and_yaml(
+        reads_filename, chunksize=chunksize,
+        usecols=['cell_id', 'chr', 'start', 'end', 'state']
+    )
+
+    return get_cell_bin_matrix(
+        chunks, 'state', dtype=np.int8, fill_value=0, chromosomes=chromosomes
+    )
+
+
+def _condensed_offset(i, n):
+    """
+    position of distance(i, i + 1) in a condensed distance matrix
+    """
+    return n * i - i * (i + 1) // 2
+
+
+def cityblock_pdist(matrix, threads=1, tile_size=512):
+    """
+    same as scipy pdist with the cityblock metric, computed in tiles of
+    tile_size x tile_size rows so that only the tiles are converted to
+    float64
+    :param matrix: observations x features
+    :param threads: number of threads, scipy releases the GIL
+    :returns condensed distance matrix
+    """
+    n = matrix.shape[0]
+
+    distances = np.empty(n * (n - 1) // 2, dtype=np.float64)
+
+    def compute_tile(start_i, start_j):
+        end_i = min(start_i + tile_size, n)
+        end_j = min(start_j + tile_size, n)
+
+        tile = sp.distance.cdist(
+            matrix[start_i:end_i].astype(np.float64),
+            matrix[start_j:end_j].astype(np.float64),
+            'cityblock'
+        )
+
+        for row in range(start_i, end_i):
+            first = max(row + 1, start_j)
+            if first >= end_j:
+                continue
+            offset = _condensed_offset(row, n) + first - row - 1
+            distances[offset:offset + end_j - first] = tile[row - start_i, first - start_j:]
+
+    tiles = [
+        (start_i, start_j)
+        for start_i in range(0, n, tile_size)
+        for start_j in range(start_i, n, tile_size)
+    ]
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for result in [pool.submit(compute_tile, *tile) for tile in tiles]:
+            result.result()
+
+    return distances
+
+
+def ward_order(matrix, threads=1):
+    """
+    :returns leaf order of ward linkage on cityblock distances
+    """
+    if matrix.shape[0] < 2:
+        return np.arange(matrix.shape[0])
+
+    linkage = hc.linkage(cityblock_pdist(matrix, threads=threads), method='ward')
+
+    return hc.leaves_list(linkage)
+
+
+def approximate_ward_order(
+        matrix, max_clusters=2000, max_cluster_size=5000, n_components=50, seed=0
+):
+    """
+    approximates ward_order with memory linear in the number of cells
+    :param max_clusters: number of k-means groups
+    :param max_cluster_size: largest group that is ordered by ward
+    linkage, cells in larger groups are ordered by the first principal
+    component. bounds the quadratic memory of the linkage
+    :param n_components: number of principal components
+    :returns leaf order
+    """
+    n = matrix.shape[0]
+
+    n_components = min(n_components, *matrix.shape)
+    coords = PCA(
+        n_components=n_components, svd_solver='randomized', random_state=seed
+    ).fit_transform(matrix.astype(np.float32))
+
+    labels = MiniBatchKMeans(
+        n_clusters=min(max_clusters, n), random_state=seed
+    ).fit_predict(coords)
+
+    clusters = np.unique(labels)
+    centroids = np.array([coords[labels == cluster].mean(axis=0) for cluster in clusters])
+
+    if len(clusters) > 1:
+        clusters = clusters[hc.leaves_list(hc.linkage(centroids, method='ward'))]
+
+    order = []
+    for cluster in clusters:
+        members = np.flatnonzero(labels == cluster)
+
+        if 2 <= len(members) <= max_cluster_size:
+            members = members[hc.leaves_list(hc.linkage(coords[members], method='ward'))]
+        else:
+            members = members[np.argsort(coords[members, 0], kind='mergesort')]
+
+        order.append(members)
+
+    return np.concatenate(order)
+
+
+def get_clustering_order(matrix, threads=1, max_exact_cells=None):
+    """
+    orders cells by hierarchical clustering
+    :param matrix: cells x bins state matrix
+    :param threads: threads for the distance calculation
+    :param max_exact_cells: use approximate_ward_order above this many
+    cells, always exact if not set
+    :returns leaf order
+    """
+    if max_exact_cells is not None and matrix.shape[0] > max_exact_cells:
+        return approximate_ward_order(matrix)
+
+    return ward_order(matrix, threads=threads)
@@ -0,0 +1,163 @@
+'''
+chunked columnar storage for tables with a csvutils yaml sidecar.
+
+a table is an uncompressed zip archive with one .npy member per column
+per chunk, named <chunk>/<quoted column name>.npy. numeric and bool
+columns are stored as is, all other columns as int32 codes
+(<column>:codes.npy, -1 for NaN) into a unicode array of categories
+(<column>:categories.npy). columns can be loaded individually and no
+text is parsed on read.
+'''
+import shutil
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from urllib.parse import quote, unquote
+
+
+class ColumnarError(Exception):
+    pass
+
+
+NUMERIC_KINDS = 'biuf'
+
+# strings that the pandas csv reader loads as NaN. stored as NaN so that
+# tables read back the same as their csv equivalent
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null'
+])
+
+
+def _member_name(chunk, column, suffix=''):
+    return '{:08d}/{}{}.npy'.format(chunk, quote(str(column), safe=''), suffix)
+
+
+def _parse_member_name(name):
+    chunk, member = name.split('/', 1)
+    member = member[:-len('.npy')]
+    for suffix in (':codes', ':categories'):
+        if member.endswith(suffix):
+            return int(chunk), unquote(member[:-len(suffix)])
+    return int(chunk), unquote(member)
+
+
+def _write_array(archive, name, array):
+    with archive.open(name, 'w', force_zip64=True) as writer:
+        np.lib.format.write_array(writer, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def _read_array(archive, name):
+    with archive.open(name) as reader:
+        return np.lib.format.read_array(reader, allow_pickle=False)
+
+
+def _encode_strings(series):
+    codes, categories = pd.factorize(series)
+    categories = [str(v) for v in categories]
+
+    missing = [i for i, v in enumerate(categories) if v in NA_VALUES]
+    if missing:
+        codes[np.isin(codes, missing)] = -1
+
+    categories = np.array(categories, dtype=np.str_)
+    return codes.astype(np.int32), categories
+
+
+def _decode_strings(codes, categories):
+    values = categories.astype(object)
+    if not len(values):
+        return np.full(len(codes), np.nan, dtype=object)
+    values = values[codes]
+    values[codes < 0] = np.nan
+    return values
+
+
+def write_chunk(filepath, df, mode='a'):
+    """stores a dataframe as one chunk
+
+    :param filepath: output path
+    :param df: dataframe, already cast to the output dtypes
+    :param mode: 'w' to start a new file, 'a' to append a chunk
+    """
+    with zipfile.ZipFile(filepath, mode=mode, compression=zipfile.ZIP_STORED) as archive:
+        chunk = len(get_chunks(archive))
+
+        for column in df.columns.values:
+            values = df[column].values
+            if values.dtype.kind in NUMERIC_KINDS:
+                _write_array(archive, _member_name(chunk, column), values)
+            else:
+                codes, categories = _encode_strings(df[column])
+                _write_array(archive, _member_name(chunk, column, ':codes'), codes)
+                _write_array(archive, _member_name(chunk, column, ':categories'), categories)
+
+
+def get_chunks(archive):
+    """
+    :param archive: open zipfile.ZipFile
+    :returns list of chunks in file order, each a dict of column name
+        to the members with its data
+    """
+    chunks = {}
+    for name in archive.namelist():
+        chunk, column = _parse_member_name(name)
+        chunks.setdefault(chunk, {}).setdefault(column, []).append(name)
+    return [chunks[chunk] for chunk in sorted(chunks)]
+
+
+def read_column(archive, members):
+    """
+    :param archive: open zipfile.ZipFile
+    :param members: members with the data for one column in one chunk
+    :returns numpy array
+    """
+    if len(members) == 1:
+        return _read_array(archive, members[0])
+
+    members = sorted(members)
+    categories, codes = [_read_array(archive, name) for name in members]
+    return _decode_strings(codes, categories)
+
+
+def read_chunks(filepath, columns):
+    """loads the requested columns, one chunk at a time
+
+    :param filepath: input path
+    :param columns: columns to load, in output order
+    :returns generator of dataframes
+    """
+    with zipfile.ZipFile(filepath, mode='r') as archive:
+        for chunk in get_chunks(archive):
+            missing = [column for column in columns if column not in chunk]
+            if missing:
+                raise ColumnarError(
+                    "columns {} not found in {}".format(missing, filepath)
+                )
+
+            yield pd.DataFrame(
+                {column: read_column(archive, chunk[column]) for column in columns},
+                columns=columns
+            )
+
+
+def copy_chunks(infile, outfile):
+    """appends all chunks in infile to outfile without decoding them
+    """
+    with zipfile.ZipFile(infile, mode='r') as reader, \
+            zipfile.ZipFile(outfile, mode='a', compression=zipfile.ZIP_STORED) as writer:
+        offset = len(get_chunks(writer))
+
+        for name in reader.namelist():
+            chunk, member = name.split('/', 1)
+            outname = '{:08d}/{}'.format(int(chunk) + offset, member)
+            with reader.open(name) as source, \
+                    writer.open(outname, 'w', force_zip64=True) as dest:
+                shutil.copyfileobj(source, dest, length=16 * 1024 * 1024)
+
+
+def create_empty(filepath):
+    with zipfile.ZipFile(filepath, mode='w'):
+        pass
@@ -1,8 +1,9 @@
-import gzip
+import io
 import logging
 import os
 import shutil
 
+import numpy as np
 import pandas as pd
 import yaml
 
@@ -48,9 +49,31 @@ class CsvInputError(Exception):
     pass
 
 
+from single_cell.utils import columnarutils
+from single_cell.utils import gziputils
 from single_cell.utils import helpers
 
 
+def get_storage_format(filepath, error=CsvInputError):
+    """
+    storage format from the file extension, ignores the .tmp suffix
+    :param filepath: path to table
+    :param error: exception to raise for unsupported extensions
+    :return: 'csv' for gzipped csv, 'columnar' for columnarutils tables
+    """
+    if filepath.endswith('.tmp'):
+        filepath = filepath[:-4]
+
+    _, ext = os.path.splitext(filepath)
+
+    if ext == ".gz":
+        return 'csv'
+    elif ext == ".npz":
+        return 'columnar'
+    else:
+        raise error("{} is not supported".format(ext))
+
+
 def pandas_to_std_types():
     std_dict = {
         "bool": "bool",
@@ -216,23 +239,27 @@ class IrregularCsvInput(object):
 
 
 class CsvInput(object):
-    def __init__(self, filepath, na_rep='NaN'):
+    def __init__(self, filepath, na_rep='NaN', threads=None):
         """
         csv file and all related metadata
         :param filepath: path to csv
         :type filepath: str
         :param na_rep: replace na with this
         :type na_rep: str
+        :param threads: decompression threads, see gziputils
+        :type threads: int
         """
         self.filepath = filepath
 
         self.na_rep = na_rep
 
+        self.threads = threads
+
         metadata = self.__parse_metadata()
 
         self.header, self.dtypes, self.columns, self.sep = metadata
 
-        self.__confirm_compression_type_pandas()
+        self.storage = get_storage_format(self.filepath, CsvInputError)
 
     def cast_dataframe(self, df):
         for column_name in df.columns.values:
@@ -244,16 +271,6 @@ class CsvInput(object):
     def yaml_file(self):
         return self.filepath + '.yaml'
 
-    def __confirm_compression_type_pandas(self):
-        filepath = self.filepath
-        if filepath.endswith('.tmp'):
-            filepath = filepath[:-4]
-
-        _, ext = os.path.splitext(filepath)
-
-        if not ext == ".gz":
-            raise CsvInputError("{} is not supported".format(ext))
-
     def __parse_metadata(self):
         with open(self.filepath + '.yaml') as yamlfile:
             yamldata = yaml.safe_load(yamlfile)
@@ -272,49 +289,110 @@ class CsvInput(object):
 
         return header, dtypes, columns, sep
 
-    def __verify_data(self, df):
-        if not set(list(df.columns.values)) == set(self.columns):
+    def __verify_data(self, df, columns):
+        if not set(list(df.columns.values)) == set(columns):
             raise CsvParseError("metadata mismatch in {}".format(self.filepath))
 
-    def read_csv(self, chunksize=None):
-        def return_gen(df_iterator):
-            for df in df_iterator:
-                self.__verify_data(df)
-                yield df
+    def read_csv(self, chunksize=None, usecols=None):
+        """
+        :param chunksize: return a generator of dataframes with
+        at most chunksize rows if set
+        :param usecols: only load these columns
+        """
+        columns = self.columns
+        if usecols:
+            missing = set(usecols) - set(self.columns)
+            if missing:
+                raise CsvParseError(
+                    "columns {} not found in {}".format(sorted(missing), self.filepath)
+                )
+            columns = [col for col in self.columns if col in usecols]
 
-        dtypes = {k: v for k, v in self.dtypes.items() if v != "NA"}
+        if self.storage == 'columnar':
+            return self.__read_columnar(columns, chunksize)
+
+        dtypes = {
+            k: v for k, v in self.dtypes.items() if v != "NA" and k in columns
+        }
         # if header exists then use first line (0) as header
         header = 0 if self.header else None
         names = None if self.header else self.columns
 
-        try:
-            data = pd.read_csv(
-                self.filepath, compression='gzip', chunksize=chunksize,
-                sep=self.sep, header=header, names=names, dtype=dtypes)
-        except pd.errors.EmptyDataError:
-            data = pd.DataFrame(columns=self.columns)
-            data = self.cast_dataframe(data)
+        kwargs = dict(
+            sep=self.sep, header=header, names=names, dtype=dtypes,
+            usecols=usecols
+        )
 
         if chunksize:
-            return return_gen(data)
-        else:
-            self.__verify_data(data)
-            return data
+            return self.__read_csv_chunks(columns, chunksize, kwargs)
+
+        with gziputils.open(self.filepath, 'rt', threads=self.threads) as reader:
+            try:
+                data = pd.read_csv(reader, **kwargs)
+            except pd.errors.EmptyDataError:
+                data = pd.DataFrame(columns=columns)
+                data = self.cast_dataframe(data)
+
+        self.__verify_data(data, columns)
+        return data
+
+    def __read_csv_chunks(self, columns, chunksize, kwargs):
+        """
+        the file is opened at the first chunk and closed once the
+        generator is exhausted or closed, nothing is left open if the
+        generator is never consumed
+        """
+        with gziputils.open(self.filepath, 'rt', threads=self.threads) as reader:
+            try:
+                df_iterator = pd.read_csv(reader, chunksize=chunksize, **kwargs)
+            except pd.errors.EmptyDataError:
+                data = pd.DataFrame(columns=columns)
+                yield self.cast_dataframe(data)
+                return
+
+            with df_iterator:
+                for df in df_iterator:
+                    self.__verify_data(df, columns)
+                    yield df
+
+    def __read_columnar(self, columns, chunksize=None):
+        if chunksize:
+            return self.__read_columnar_chunks(columns, int(chunksize))
+
+        data = list(columnarutils.read_chunks(self.filepath, columns))
+
+        if not data:
+            data = pd.DataFrame(columns=columns)
+            return self.cast_dataframe(data)
+
+        data = pd.concat(data, ignore_index=True)
+        self.__verify_data(data, columns)
+        return data
+
+    def __read_columnar_chunks(self, columns, chunksize):
+        for data in columnarutils.read_chunks(self.filepath, columns):
+            self.__verify_data(data, columns)
+            for start in range(0, len(data), chunksize):
+                yield data.iloc[start:start + chunksize]
 
 
 class CsvOutput(object):
     def __init__(
             self, filepath, dtypes, header=True,
-            na_rep='NaN', columns=None
+            na_rep='NaN', columns=None, threads=None
     ):
+        """
+        :param threads: compression threads, see gziputils
+        """
         self.filepath = filepath
         self.header = header
         self.dtypes = dtypes
         self.na_rep = na_rep
+        self.threads = threads
 
         self.columns = columns
 
-        self.__confirm_compression_type_pandas()
+        self.storage = get_storage_format(self.filepath, CsvWriterError)
 
         self.sep = ','
 
@@ -326,16 +404,6 @@ class CsvOutput(object):
     def header_line(self):
         return self.sep.join(self.columns) + '\n'
 
-    def __confirm_compression_type_pandas(self):
-        filepath = self.filepath
-        if filepath.endswith('.tmp'):
-            filepath = filepath[:-4]
-
-        _, ext = os.path.splitext(filepath)
-
-        if not ext == ".gz":
-            raise CsvWriterError("{} is not supported".format(ext))
-
     def write_yaml(self):
         type_converter = pandas_to_std_types()
 
@@ -370,24 +438,51 @@ class CsvOutput(object):
 
         return df
 
-    def __write_df(self, df, header=True, mode='w'):
+    def __write_df(self, df, header=True, mode='w', writer=None):
+        """
+        :param writer: open text stream to write to instead of the output file
+        """
         df = self.__cast_df(df)
         if self.columns:
             assert self.columns == list(df.columns.values)
         else:
             self.columns = list(df.columns.values)
 
-        df.to_csv(
-            self.filepath, sep=self.sep, na_rep=self.na_rep,
-            index=False, compression='gzip', mode=mode, header=header
-        )
+        if self.storage == 'columnar':
+            columnarutils.write_chunk(self.filepath, df, mode=mode)
+            return
+
+        if writer is not None:
+            df.to_csv(
+                writer, sep=self.sep, na_rep=self.na_rep,
+                index=False, header=header
+            )
+            return
+
+        with gziputils.open(self.filepath, mode + 't', threads=self.threads) as writer:
+            df.to_csv(
+                writer, sep=self.sep, na_rep=self.na_rep,
+                index=False, header=header
+            )
+
+    def __write_columnar_chunks(self, dfs):
+        columnarutils.create_empty(self.filepath)
+        for df in dfs:
+            self.__write_df(df, mode='a')
 
     def __write_df_chunks(self, dfs, header=True):
-        for i, df in enumerate(dfs):
-            if i == 0 and self.header:
-                self.__write_df(df, header=header, mode='w')
-            else:
-                self.__write_df(df, header=False, mode='a')
+        if self.storage == 'columnar':
+            return self.__write_columnar_chunks(dfs)
+
+        # one gzip stream for all chunks
+        with gziputils.open(self.filepath, 'wt', threads=self.threads) as writer:
+            empty = True
+            for df in dfs:
+                self.__write_df(df, header=header and empty, writer=writer)
+                empty = False
+
+            if empty and header and self.columns:
+                self.write_header(writer)
 
     def write_df(self, df, chunks=False):
         if chunks:
@@ -402,16 +497,44 @@ class CsvOutput(object):
         header = header + '\n'
         writer.write(header)
 
+    def __read_chunks(self, csvfile):
+        for df in CsvInput(csvfile, threads=self.threads).read_csv(chunksize=10 ** 6):
+            yield df[list(self.columns)]
+
     def write_data_streams(self, csvfiles):
+        """
+        concatenates files with the same columns, data is copied
+        without parsing when the input and output formats match
+        """
         assert self.columns
         assert self.dtypes
-        with gzip.open(self.filepath, 'wt') as writer:
+
+        if self.storage == 'columnar':
+            columnarutils.create_empty(self.filepath)
+            for csvfile in csvfiles:
+                if get_storage_format(csvfile) == 'columnar':
+                    columnarutils.copy_chunks(csvfile, self.filepath)
+                else:
+                    for df in self.__read_chunks(csvfile):
+                        self.__write_df(df, mode='a')
+            self.write_yaml()
+            return
+
+        with gziputils.open(self.filepath, 'wt', threads=self.threads) as writer:
 
             if self.header:
                 self.write_header(writer)
 
             for csvfile in csvfiles:
-                with gzip.open(csvfile, 'rt') as data_stream:
+                if get_storage_format(csvfile) == 'columnar':
+                    for df in self.__read_chunks(csvfile):
+                        df.to_csv(
+                            writer, sep=self.sep, na_rep=self.na_rep,
+                            index=False, header=False
+                        )
+                    continue
+
+                with gziputils.open(csvfile, 'rt', threads=self.threads) as data_stream:
                     shutil.copyfileobj(
                         data_stream, writer, length=16 * 1024 * 1024
                     )
@@ -419,24 +542,23 @@ class CsvOutput(object):
         self.write_yaml()
 
     def rewrite_csv(self, csvfile):
-        assert self.columns
-        assert self.dtypes
-        with gzip.open(self.filepath, 'wt') as writer:
-            if self.header:
-                self.write_header(writer)
-
-            with gzip.open(csvfile, 'rt') as data_stream:
-                shutil.copyfileobj(
-                    data_stream, writer, length=16 * 1024 * 1024
-                )
-
-        self.write_yaml()
+        self.write_data_streams([csvfile])
 
     def write_text(self, text):
         assert self.columns
         assert self.dtypes
 
-        with gzip.open(self.filepath, 'wt') as writer:
+        if self.storage == 'columnar':
+            dtypes = {k: v for k, v in self.dtypes.items() if k in self.columns}
+            df = pd.read_csv(
+                io.StringIO(''.join(text)), sep=self.sep, header=None,
+                names=self.columns, dtype=dtypes
+            )
+            self.__write_df(df, mode='w')
+            self.write_yaml()
+            return
+
+        with gziputils.open(self.filepath, 'wt', threads=self.threads) as writer:
 
             if self.header:
                 self.write_header(writer)
@@ -474,7 +596,7 @@ def merge_dtypes(dtypes_all):
     return merged_dtypes
 
 
-def concatenate_csv(inputfiles, output, write_header=True):
+def concatenate_csv(inputfiles, output, write_header=True, threads=None):
     if inputfiles == [] or inputfiles == {}:
         raise CsvConcatException("nothing provided to concat")
 
@@ -498,10 +620,59 @@ def concatenate_csv(inputfiles, output, write_header=True):
 
     if low_memory:
         columns = columns[0]
-        concatenate_csv_files_quick_lowmem(inputfiles, output, dtypes, columns, write_header=write_header)
+        concatenate_csv_files_quick_lowmem(
+            inputfiles, output, dtypes, columns, write_header=write_header,
+            threads=threads
+        )
 
     else:
-        concatenate_csv_files_pandas(inputfiles, output, dtypes, write_header=write_header)
+        columns = get_union_columns(columns)
+        concatenate_csv_files_streaming(
+            inputfiles, output, dtypes, columns, write_header=write_header,
+            threads=threads
+        )
+
+
+def get_union_columns(columns_all):
+    """
+    all columns, in order of first appearance
+    :param columns_all: list of column lists
+    """
+    union = []
+    for columns in columns_all:
+        for column in columns:
+            if column not in union:
+                union.append(column)
+    return union
+
+
+def concatenate_csv_files_streaming(
+        in_filenames, out_filename, dtypes, columns, write_header=True,
+        chunksize=10 ** 6, threads=None
+):
+    """
+    concatenates one chunk at a time, so memory usage does not depend on
+    the number of inputs. chunks are reordered to columns, columns that are
+    missing from an input are filled with NaN
+    :param dtypes: merged dtypes of all inputs
+    :param columns: output columns, see get_union_columns
+    :param chunksize: max number of rows held in memory
+    :param threads: compression threads, see gziputils
+    """
+    if isinstance(in_filenames, dict):
+        in_filenames = in_filenames.values()
+
+    def read_chunks():
+        for in_filename in in_filenames:
+            csvinput = CsvInput(in_filename, threads=threads)
+            for df in csvinput.read_csv(chunksize=chunksize):
+                yield df.reindex(columns=columns)
+
+    csvoutput = CsvOutput(
+        out_filename, dtypes, header=write_header, columns=columns,
+        threads=threads
+    )
+    csvoutput.write_df(read_chunks(), chunks=True)
 
 
 def concatenate_csv_files_pandas(in_filenames, out_filename, dtypes, write_header=True):
@@ -516,43 +687,128 @@ def concatenate_csv_files_pandas(in_filenames, out_filename, dtypes, write_heade
     csvoutput.write_df(data)
 
 
-def concatenate_csv_files_quick_lowmem(inputfiles, output, dtypes, columns, write_header=True):
+def concatenate_csv_files_quick_lowmem(
+        inputfiles, output, dtypes, columns, write_header=True, threads=None
+):
     csvoutput = CsvOutput(
-        output, dtypes, header=write_header, columns=columns
+        output, dtypes, header=write_header, columns=columns, threads=threads
     )
     csvoutput.write_data_streams(inputfiles)
 
 
-# annotation_dtypes shouldnt be default, if it is None, it breaks
-def annotate_csv(infile, annotation_data, outfile, annotation_dtypes, on="cell_id", write_header=True):
-    csvinput = CsvInput(infile)
-    metrics_df = csvinput.read_csv()
+def get_annotation_frame(annotation_data, annotation_dtypes, on="cell_id"):
+    """
+    builds the annotation table once, cast to annotation_dtypes
+    :param annotation_data: dict of value in column on to dict of
+    column name to value
+    :param annotation_dtypes: dtypes, must include every annotation column
+    :returns dataframe indexed by the values in column on
+    """
+    ann = pd.DataFrame.from_dict(annotation_data, orient='index')
+    ann.index.name = on
 
-    ann = pd.DataFrame(annotation_data).T
+    missing = [col for col in ann.columns if col not in annotation_dtypes]
+    if missing:
+        raise CsvAnnotateError('no dtypes for annotation columns {}'.format(missing))
 
-    ann[on] = ann.index
+    for col in ann.columns:
+        dtype = annotation_dtypes[col]
 
-    # get annotation rows that correspond to rows in on
-    reformed_annotation = ann[ann[on].isin(metrics_df[on])]
+        if str(dtype) == 'bool' and ann[col].isnull().any():
+            raise CsvAnnotateError('NaN found in bool annotation column: {}'.format(col))
 
-    # do nothing if the annotation df is empty
-    if reformed_annotation.empty:  # so we dont add NaNs
-        return write_dataframe_to_csv_and_yaml(metrics_df, outfile,
-                                               csvinput.dtypes,
-                                               write_header=write_header)
+        try:
+            ann[col] = ann[col].astype(dtype)
+        except (TypeError, ValueError) as e:
+            raise CsvAnnotateError(
+                'cannot cast annotation column {} to {}: {}'.format(col, dtype, e)
+            )
 
-    metrics_df = metrics_df.merge(reformed_annotation, on=on, how='outer')
+    return ann
 
-    csv_dtypes = csvinput.dtypes
+
+def annotate_dataframe(df, annotation, on="cell_id"):
+    """
+    adds the annotation columns to df with one index lookup on column
+    on. rows without an annotation keep their values in existing
+    columns and get NaN in new columns
+    :param annotation: dataframe indexed by the values in on, see
+    get_annotation_frame
+    """
+    keys = df[on].values
+
+    values = annotation.reindex(keys)
+    found = annotation.index.get_indexer(keys) >= 0
+
+    for col in annotation.columns:
+        if col in df.columns and not found.all():
+            df[col] = np.where(found, values[col].values, df[col].values)
+        else:
+            df[col] = values[col].values
+
+    return df
+
+
+def _get_annotation_dtypes(csvinput, annotation_dtypes):
+    csv_dtypes = dict(csvinput.dtypes)
 
     for col, dtype in csv_dtypes.items():
-        if col in annotation_dtypes:
-            assert dtype == annotation_dtypes[col]
+        if col in annotation_dtypes and not dtype == annotation_dtypes[col]:
+            raise CsvAnnotateError(
+                'dtype of {} in {} is {}, annotation dtype is {}'.format(
+                    col, csvinput.filepath, dtype, annotation_dtypes[col]
+                )
+            )
 
     csv_dtypes.update(annotation_dtypes)
 
+    return csv_dtypes
+
+
+# annotation_dtypes shouldnt be default, if it is None, it breaks
+def annotate_csv(
+        infile, annotation_data, outfile, annotation_dtypes, on="cell_id",
+        write_header=True, chunksize=None
+):
+    """
+    adds the annotation to the rows of infile with a matching value in
+    column on. the output is a copy of infile if no row matches
+    :param annotation_data: dict of value in column on to dict of
+    column name to value
+    :param annotation_dtypes: dtypes for the annotation columns, columns
+    in both must have the same dtype in infile
+    :param chunksize: read and annotate chunksize rows at a time
+    """
+    csvinput = CsvInput(infile)
+
+    ann = get_annotation_frame(annotation_data, annotation_dtypes, on=on)
+
+    if chunksize:
+        keys = csvinput.read_csv(usecols=[on])[on]
+    else:
+        metrics_df = csvinput.read_csv()
+        keys = metrics_df[on]
+
+    # do nothing if no rows are annotated, so we dont add NaNs
+    if not keys.isin(ann.index).any():
+        if chunksize:
+            return rewrite_csv_file(infile, outfile, write_header=write_header)
+        return write_dataframe_to_csv_and_yaml(metrics_df, outfile,
+                                               csvinput.dtypes,
+                                               write_header=write_header)
+
+    csv_dtypes = _get_annotation_dtypes(csvinput, annotation_dtypes)
+
     output = CsvOutput(outfile, csv_dtypes, header=write_header)
-    output.write_df(metrics_df)
+
+    if chunksize:
+        chunks = csvinput.read_csv(chunksize=chunksize)
+        output.write_df(
+            (annotate_dataframe(chunk, ann, on=on) for chunk in chunks), chunks=True
+        )
+        return
+
+    output.write_df(annotate_dataframe(metrics_df, ann, on=on))
 
 
 def add_col_from_dict(infile, col_data, outfile, dtypes, write_header=True):
@@ -603,11 +859,11 @@ def rewrite_csv_file(filepath, outputfile, write_header=True, dtypes=None):
         csvoutput.rewrite_csv(filepath)
 
 
-def merge_csv(in_filenames, out_filename, how, on, write_header=True):
+def merge_csv(in_filenames, out_filename, how, on, write_header=True, threads=None):
     if isinstance(in_filenames, dict):
         in_filenames = in_filenames.values()
 
-    data = [CsvInput(infile) for infile in in_filenames]
+    data = [CsvInput(infile, threads=threads) for infile in in_filenames]
 
     dfs = [csvinput.read_csv() for csvinput in data]
 
@@ -619,7 +875,10 @@ def merge_csv(in_filenames, out_filename, how, on, write_header=True):
 
     columns = list(data.columns.values)
 
-    csvoutput = CsvOutput(out_filename, dtypes, header=write_header, columns=columns)
+    csvoutput = CsvOutput(
+        out_filename, dtypes, header=write_header, columns=columns,
+        threads=threads
+    )
     csvoutput.write_df(data)
 
 
@@ -690,14 +949,14 @@ def merge_frames(frames, how, on):
         return merged_frame
 
 
-def write_dataframe_to_csv_and_yaml(df, outfile, dtypes, write_header=True):
-    csvoutput = CsvOutput(outfile, dtypes, header=write_header)
+def write_dataframe_to_csv_and_yaml(df, outfile, dtypes, write_header=True, threads=None):
+    csvoutput = CsvOutput(outfile, dtypes, header=write_header, threads=threads)
 
     csvoutput.write_df(df)
 
 
-def read_csv_and_yaml(infile, chunksize=None):
-    return CsvInput(infile).read_csv(chunksize=chunksize)
+def read_csv_and_yaml(infile, chunksize=None, usecols=None):
+    return CsvInput(infile).read_csv(chunksize=chunksize, usecols=usecols)
 
 
 def get_metadata(input):
@@ -1,38 +1,61 @@
-import re
 from collections import defaultdict
-from itertools import islice
+from collections import namedtuple
 
 from single_cell.utils import helpers
 
+# lines read from the fastq at a time, in bytes
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
 
 class FastqReader(object):
 
     def __init__(self, filepath):
         self.file_path = filepath
 
-    def get_read_iterator(self):
+    def get_read_blocks(self):
+        """
+        reads the fastq in blocks of lines
+        :returns generator of lists of lines, the number of lines
+        in each list is a multiple of 4
+        """
         with helpers.getFileHandle(self.file_path) as fq_reader:
+            leftover = []
             while True:
-                fastq_read = list(islice(fq_reader, 4))
+                lines = fq_reader.readlines(READ_BLOCK_SIZE)
 
-                fastq_read = [line for line in fastq_read]
-
-                if not fastq_read:
+                if not lines:
                     break
 
-                assert len(fastq_read) == 4, 'fastq file format error'
+                if leftover:
+                    lines = leftover + lines
+
+                end = len(lines) - len(lines) % 4
+                leftover = lines[end:]
+                lines = lines[:end]
 
-                if not fastq_read[0].startswith('@'):
+                if not all(line.startswith('@') for line in lines[0::4]):
                     raise ValueError('Expected @ as first character of read name')
 
-                if not fastq_read[2].startswith('+'):
+                if not all(line.startswith('+') for line in lines[2::4]):
                     raise ValueError('Expected = as first character of read comment')
 
-                yield fastq_read
+                yield lines
+
+            assert not leftover, 'fastq file format error'
+
+    def get_read_iterator(self):
+        for lines in self.get_read_blocks():
+            for i in range(0, len(lines), 4):
+                yield lines[i:i + 4]
 
 
 def _get_read_name(fastq_line1):
-    return re.split('/| |\t|#FQST:', fastq_line1.split()[0])[0].rstrip()
+    read_name = fastq_line1.split(None, 1)[0]
+    for sep in ('/', '#FQST:'):
+        end = read_name.find(sep)
+        if end != -1:
+            read_name = read_name[:end]
+    return read_name
 
 
 class PairedFastqReader(object):
@@ -40,57 +63,137 @@ class PairedFastqReader(object):
         self.reader_r1 = FastqReader(r1_path)
         self.reader_r2 = FastqReader(r2_path)
 
+    def get_read_block_pairs(self, read_ahead=False):
+        """
+        reads both files in blocks
+        :param read_ahead: read and decompress each file in a
+        background thread
+        :returns generator of (lines_r1, lines_r2), with the same
+        number of reads in both
+        """
+        blocks_r1 = self.reader_r1.get_read_blocks()
+        blocks_r2 = self.reader_r2.get_read_blocks()
+
+        if read_ahead:
+            blocks_r1 = helpers.read_ahead(blocks_r1)
+            blocks_r2 = helpers.read_ahead(blocks_r2)
+
+        lines_r1 = []
+        lines_r2 = []
+        while True:
+            if not lines_r1:
+                lines_r1 = next(blocks_r1, None)
+            if not lines_r2:
+                lines_r2 = next(blocks_r2, None)
+
+            if lines_r1 is None and lines_r2 is None:
+                break
+
+            if lines_r1 is None or lines_r2 is None:
+                raise Exception('mismatching number of reads in R1 and R2')
+
+            end = min(len(lines_r1), len(lines_r2))
+            yield lines_r1[:end], lines_r2[:end]
+
+            lines_r1 = lines_r1[end:]
+            lines_r2 = lines_r2[end:]
+
     def get_read_pair_iterator(self):
-        read_r1_iter = self.reader_r1.get_read_iterator()
-        read_r2_iter = self.reader_r2.get_read_iterator()
+        for lines_r1, lines_r2 in self.get_read_block_pairs():
+            for i in range(0, len(lines_r1), 4):
+                read_r1 = lines_r1[i:i + 4]
+                read_r2 = lines_r2[i:i + 4]
 
-        for read_r1, read_r2 in zip(read_r1_iter, read_r2_iter):
+                assert _get_read_name(read_r1[0]) == _get_read_name(read_r2[0])
 
-            if not read_r1 and not read_r2:
-                break
+                yield read_r1, read_r2
 
-            if not read_r1 or not read_r2:
-                raise Exception('mismatching number of reads in R1 and R2')
 
-            assert _get_read_name(read_r1[0]) == _get_read_name(read_r2[0])
+class FqstTag(namedtuple('FqstTag', ['flags', 'mask', 'num_hits', 'counts_key', 'comment'])):
+    """
+    decoded fastq_screen tag
+    flags: dict of genome to flag value (0: no hit, 1: unique hit, 2: multiple hits)
+    mask: bit i is set if the read aligned to the ith genome
+    num_hits: number of genomes the read aligned to
+    counts_key: tuple of (genome, flag) pairs, sorted by genome
+    comment: FS tag for the read comment
+    """
+    __slots__ = ()
 
-            yield read_r1, read_r2
+    @classmethod
+    def from_flag(cls, genomes, flag):
+        if not len(flag) == len(genomes):
+            raise ValueError(
+                'FQST flag {} does not match genomes {}'.format(flag, genomes)
+            )
 
+        values = [int(v) for v in flag]
 
-class TaggedFastqReader(FastqReader):
-    def __init__(self, fastq_path):
-        super(TaggedFastqReader, self).__init__(fastq_path)
-        self.indices = None
+        flags = dict(zip(genomes, values))
 
-    def get_read_tag(self, fastq_read):
+        mask = 0
+        for i, value in enumerate(values):
+            if value:
+                mask |= 1 << i
+
+        comment = ','.join('{}_{}'.format(k, v) for k, v in flags.items())
+
+        return cls(
+            flags, mask, bin(mask).count('1'), tuple(sorted(flags.items())),
+            'FS:Z:' + comment
+        )
 
-        read_id = fastq_read[0]
-        fq_tag = read_id[read_id.index('FQST:'):]
-        fq_tag = fq_tag.strip().split(':')
 
-        if not self.indices:
-            if len(fq_tag) > 2:
-                self.indices = {i: v for i, v in enumerate(fq_tag[1:-1])}
+class FqstTagDecoder(object):
+    """
+    decodes the FQST tags that fastq_screen --tag adds to read names.
+    the first read lists the genomes, the following reads only have
+    the flag with one digit per genome. there are only a handful of
+    distinct flags, so decoded tags are cached by flag.
+    """
+
+    def __init__(self):
+        self.genomes = None
+        self.cache = {}
+
+    def get_genome_mask(self, genome):
+        return 1 << self.genomes.index(genome)
+
+    def decode(self, read_id):
+        tag = read_id[read_id.index('FQST:') + 5:].rstrip()
+
+        if self.genomes is None:
+            fields = tag.split(':')
+            if len(fields) > 1:
+                self.genomes = fields[:-1]
             else:
                 raise Exception('First line in fastq file should have filter explanation')
 
-        flag = map(int, list(fq_tag[-1]))
+        flag = tag[tag.rfind(':') + 1:]
 
-        flag_map = {self.indices[i]: v for i, v in enumerate(flag)}
+        try:
+            return self.cache[flag]
+        except KeyError:
+            self.cache[flag] = FqstTag.from_flag(self.genomes, flag)
+            return self.cache[flag]
 
-        return flag_map
 
-    def add_tag_to_read_comment(self, read, tag=None):
-        read_name = _get_read_name(read[0])
+class TaggedFastqReader(FastqReader):
+    def __init__(self, fastq_path):
+        super(TaggedFastqReader, self).__init__(fastq_path)
+        self.decoder = FqstTagDecoder()
 
-        if not tag:
-            tag = self.get_read_tag(read)
+    def get_read_tag(self, fastq_read):
+        return self.decoder.decode(fastq_read[0]).flags
 
-        tag = ['{}_{}'.format(k, v) for k, v in tag.items()]
-        tag = ','.join(tag)
-        tag = 'FS:Z:'+tag
+    def add_tag_to_read_comment(self, read, tag=None):
+        read_name = _get_read_name(read[0])
 
-        comment = tag
+        if tag:
+            comment = ','.join('{}_{}'.format(k, v) for k, v in tag.items())
+            comment = 'FS:Z:' + comment
+        else:
+            comment = self.decoder.decode(read[0]).comment
 
         read[0] = read_name + '\t' + comment + '\n'
 
@@ -98,29 +201,20 @@ class TaggedFastqReader(FastqReader):
 
     def filter_read_iterator(self, reference):
         for read in self.get_read_iterator():
-            read_tags = self.get_read_tag(read)
+            tag = self.decoder.decode(read[0])
 
             # skip if read maps to multiple genomes
-            if len([v for v in read_tags.values() if v]) > 1:
+            if tag.num_hits > 1:
                 continue
 
-            if read_tags[reference]:
+            if tag.mask & self.decoder.get_genome_mask(reference):
                 yield read
-                continue
 
     def gather_counts(self):
-        key_order = None
         counts = defaultdict(int)
 
         for read in self.get_read_iterator():
-
-            read_tags = self.get_read_tag(read)
-            if not key_order:
-                key_order = sorted(read_tags.keys())
-
-            flags = zip(key_order, [read_tags[key] for key in key_order])
-
-            counts[flags] += 1
+            counts[self.decoder.decode(read[0]).counts_key] += 1
 
         return counts
 
@@ -128,49 +222,100 @@ class TaggedFastqReader(FastqReader):
 class PairedTaggedFastqReader(PairedFastqReader, TaggedFastqReader):
     def __init__(self, fastq_r1, fastq_r2):
         super(PairedTaggedFastqReader, self).__init__(fastq_r1, fastq_r2)
-        self.indices = None
-
-    def filter_read_iterator(self, reference):
+        self.decoder = FqstTagDecoder()
+
+    def get_tagged_read_pair_iterator(self):
+        """
+        :returns generator of (read_1, read_2, tag_1, tag_2), tags
+        are FqstTag
+        """
+        decode = self.decoder.decode
         for read_1, read_2 in self.get_read_pair_iterator():
+            yield read_1, read_2, decode(read_1[0]), decode(read_2[0])
 
-            tags_r1 = self.get_read_tag(read_1)
-            tags_r2 = self.get_read_tag(read_2)
+    def _keep_pair(self, tag_r1, tag_r2, reference_mask):
+        r1_match = tag_r1.mask & reference_mask
+        r2_match = tag_r2.mask & reference_mask
 
-            # skip if doesnt match
-            if not tags_r1[reference] and not tags_r2[reference]:
-                continue
+        # skip if doesnt match
+        if not r1_match and not r2_match:
+            return False
 
-            # skip if read maps to multiple genomes
-            if len([v for v in tags_r1.values() if v]) > 1:
-                continue
-            if len([v for v in tags_r2.values() if v]) > 1:
-                continue
+        # skip if read maps to multiple genomes
+        if tag_r1.num_hits > 1 or tag_r2.num_hits > 1:
+            return False
 
-            r1_nomatch = set(tags_r1.values()) == {0}
-            r2_nomatch = set(tags_r2.values()) == {0}
+        if r1_match and r2_match:
+            return True
+        elif r1_match and not tag_r2.mask:
+            return True
+        elif not tag_r1.mask and r2_match:
+            return True
 
-            if tags_r1[reference] and tags_r2[reference]:
-                yield read_1, read_2
-            elif tags_r1[reference] and r2_nomatch:
-                yield read_1, read_2
-            elif r1_nomatch and tags_r2[reference]:
+        return False
+
+    def filter_read_iterator(self, reference):
+        reference_mask = None
+        for read_1, read_2, tag_r1, tag_r2 in self.get_tagged_read_pair_iterator():
+            if reference_mask is None:
+                reference_mask = self.decoder.get_genome_mask(reference)
+
+            if self._keep_pair(tag_r1, tag_r2, reference_mask):
                 yield read_1, read_2
 
     def gather_counts(self):
-        key_order = None
         counts = {'R1': defaultdict(int), 'R2': defaultdict(int)}
 
-        for read_1, read_2 in self.get_read_pair_iterator():
-            tags_r1 = self.get_read_tag(read_1)
-            tags_r2 = self.get_read_tag(read_2)
-
-            if not key_order:
-                key_order = sorted(tags_r1.keys())
-
-            r1_flags = tuple(zip(key_order, [tags_r1[key] for key in key_order]))
-            r2_flags = tuple(zip(key_order, [tags_r2[key] for key in key_order]))
-
-            counts["R1"][r1_flags] += 1
-            counts["R2"][r2_flags] += 1
+        for _, _, tag_r1, tag_r2 in self.get_tagged_read_pair_iterator():
+            counts["R1"][tag_r1.counts_key] += 1
+            counts["R2"][tag_r2.counts_key] += 1
 
         return counts
+
+    def tag_and_count_blocks(self, counts, reference=None, read_ahead=False):
+        """
+        gather_counts, filter_read_iterator and add_tag_to_read_comment
+        in a single pass over both files
+        :param counts: dict with R1 and R2 defaultdicts, updated in place
+        with the counts for all read pairs (see gather_counts)
+        :param reference: only keep pairs that pass filter_read_iterator
+        for this genome if set, keep all pairs otherwise
+        :param read_ahead: see get_read_block_pairs
+        :returns generator of (lines_r1, lines_r2) with the re-tagged reads
+        """
+        counts_r1 = counts['R1']
+        counts_r2 = counts['R2']
+        decode = self.decoder.decode
+
+        reference_mask = None
+        for lines_r1, lines_r2 in self.get_read_block_pairs(read_ahead=read_ahead):
+            keep = []
+
+            for i in range(0, len(lines_r1), 4):
+                header_r1 = lines_r1[i]
+                header_r2 = lines_r2[i]
+
+                read_name = _get_read_name(header_r1)
+                assert read_name == _get_read_name(header_r2)
+
+                tag_r1 = decode(header_r1)
+                tag_r2 = decode(header_r2)
+
+                counts_r1[tag_r1.counts_key] += 1
+                counts_r2[tag_r2.counts_key] += 1
+
+                if reference is not None:
+                    if reference_mask is None:
+                        reference_mask = self.decoder.get_genome_mask(reference)
+                    if not self._keep_pair(tag_r1, tag_r2, reference_mask):
+                        continue
+                    keep.append(i)
+
+                lines_r1[i] = read_name + '\t' + tag_r1.comment + '\n'
+                lines_r2[i] = read_name + '\t' + tag_r2.comment + '\n'
+
+            if reference is not None:
+                lines_r1 = [line for i in keep for line in lines_r1[i:i + 4]]
+                lines_r2 = [line for i in keep for line in lines_r2[i:i + 4]]
+
+            yield lines_r1, lines_r2
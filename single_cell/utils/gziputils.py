@@ -0,0 +1,242 @@
+'''
+block gzip (BGZF) reading and writing with a thread pool.
+
+output is a series of independent gzip members of at most 64kb of data
+each, the same layout as bgzip, so it can be read by any gzip reader.
+blocks are compressed and decompressed in parallel, zlib releases
+the GIL while it works on a block.
+'''
+import builtins
+import collections
+import gzip
+import io
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BgzfError(IOError):
+    pass
+
+
+# max uncompressed data per block, same as bgzip
+BLOCK_SIZE = 0xff00
+
+HEADER_SIZE = 18
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+BGZF_EXTRA = b'\x06\x00BC\x02\x00'
+
+# empty block that marks the end of a bgzf file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def get_default_threads():
+    """
+    number of threads for compression, SINGLE_CELL_COMPRESSION_THREADS overrides
+    the default of 1
+    """
+    return int(os.environ.get('SINGLE_CELL_COMPRESSION_THREADS', 1))
+
+
+def is_bgzf_header(header):
+    return header[:4] == BGZF_MAGIC and header[10:16] == BGZF_EXTRA
+
+
+def is_bgzf(filename):
+    with builtins.open(filename, 'rb') as reader:
+        return is_bgzf_header(reader.read(HEADER_SIZE))
+
+
+def compress_block(data, compresslevel=6):
+    """
+    :param data: at most BLOCK_SIZE bytes
+    :returns bgzf block
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+
+    bsize = HEADER_SIZE + len(cdata) + 8 - 1
+
+    header = BGZF_MAGIC + b'\x00\x00\x00\x00\x00\xff' + BGZF_EXTRA + struct.pack('<H', bsize)
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+    return header + cdata + trailer
+
+
+def decompress_block(block):
+    """
+    :param block: bgzf block without its 18 byte header
+    :returns uncompressed data
+    """
+    crc, size = struct.unpack('<II', block[-8:])
+    data = zlib.decompress(block[:-8], -15)
+
+    if not len(data) == size or not zlib.crc32(data) & 0xffffffff == crc:
+        raise BgzfError('corrupt bgzf block')
+
+    return data
+
+
+class BgzfWriter(io.RawIOBase):
+    def __init__(self, filename, mode='wb', threads=1, compresslevel=6):
+        """
+        :param mode: 'wb' or 'ab'
+        :param threads: number of compression threads
+        """
+        self.fileobj = builtins.open(filename, mode)
+        self.compresslevel = compresslevel
+        self.threads = threads
+
+        self.pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        # compressed blocks that are not written yet, in file order
+        self.pending = collections.deque()
+
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= BLOCK_SIZE:
+            self.__compress_buffer()
+        return len(data)
+
+    def __compress_buffer(self, final=False):
+        nblocks = len(self.buffer) // BLOCK_SIZE
+        if final and len(self.buffer) % BLOCK_SIZE:
+            nblocks += 1
+
+        for i in range(nblocks):
+            block = bytes(self.buffer[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE])
+            if self.pool is None:
+                self.fileobj.write(compress_block(block, self.compresslevel))
+            else:
+                self.pending.append(
+                    self.pool.submit(compress_block, block, self.compresslevel)
+                )
+
+        del self.buffer[:nblocks * BLOCK_SIZE]
+
+        # keep enough blocks in flight to keep all threads busy
+        max_pending = 0 if final else 4 * self.threads
+        while len(self.pending) > max_pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.__compress_buffer(final=True)
+            self.fileobj.write(BGZF_EOF)
+        finally:
+            self.fileobj.close()
+            if self.pool is not None:
+                self.pool.shutdown()
+            super(BgzfWriter, self).close()
+
+
+class BgzfReader(io.RawIOBase):
+    def __init__(self, filename, threads=1):
+        """
+        :param threads: number of decompression threads
+        """
+        self.fileobj = builtins.open(filename, 'rb')
+        self.threads = threads
+
+        self.pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        # blocks read ahead of the current one, in file order
+        self.pending = collections.deque()
+
+        self.current = b''
+        self.offset = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def __read_block(self):
+        header = self.fileobj.read(HEADER_SIZE)
+
+        if not header:
+            return None
+
+        if len(header) < HEADER_SIZE or not is_bgzf_header(header):
+            raise BgzfError('{} is not a bgzf file'.format(self.fileobj.name))
+
+        bsize = struct.unpack('<H', header[16:])[0]
+        return self.fileobj.read(bsize + 1 - HEADER_SIZE)
+
+    def __next_block(self):
+        if self.pool is None:
+            block = self.__read_block()
+            return None if block is None else decompress_block(block)
+
+        while not self.eof and len(self.pending) < 4 * self.threads:
+            block = self.__read_block()
+            if block is None:
+                self.eof = True
+            else:
+                self.pending.append(self.pool.submit(decompress_block, block))
+
+        if not self.pending:
+            return None
+
+        return self.pending.popleft().result()
+
+    def readinto(self, buf):
+        while self.offset >= len(self.current):
+            block = self.__next_block()
+            if block is None:
+                return 0
+            self.current = block
+            self.offset = 0
+
+        size = min(len(buf), len(self.current) - self.offset)
+        buf[:size] = self.current[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.fileobj.close()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
+            super(BgzfReader, self).close()
+
+
+def open(filename, mode='rt', threads=None, compresslevel=6):
+    """
+    drop in replacement for gzip.open. files are written as bgzf, files
+    that are not bgzf are read with the gzip module
+
+    :param filename: path to file
+    :param mode: r, w or a, binary unless t is added (as in gzip.open)
+    :param threads: number of threads, see get_default_threads
+    :param compresslevel: zlib compression level
+    :returns file object
+    """
+    if threads is None:
+        threads = get_default_threads()
+
+    if mode[0] in 'wa':
+        raw = BgzfWriter(filename, mode[0] + 'b', threads=threads, compresslevel=compresslevel)
+        handle = io.BufferedWriter(raw, buffer_size=BLOCK_SIZE)
+    elif mode[0] == 'r':
+        if not is_bgzf(filename):
+            return gzip.open(filename, mode)
+        raw = BgzfReader(filename, threads=threads)
+        handle = io.BufferedReader(raw, buffer_size=BLOCK_SIZE)
+    else:
+        raise ValueError('invalid mode: {}'.format(mode))
+
+    if 't' not in mode:
+        return handle
+
+    return io.TextIOWrapper(handle)
@@ -5,19 +5,25 @@ Created on Feb 19, 2018
 '''
 import errno
 import gzip
+import hashlib
 import logging
 import multiprocessing
 import os
 import re
 import shutil
+import stat
 import tarfile
+import tempfile
+import threading
 from multiprocessing.pool import ThreadPool
+from queue import Queue
 from subprocess import Popen, PIPE
 
 import pandas as pd
 import pypeliner
 import single_cell
 import yaml
+from single_cell.utils import gziputils
 
 
 class InputException(Exception):
@@ -128,15 +134,19 @@ def copyfile(source, dest):
 
 
 class getFileHandle(object):
-    def __init__(self, filename, mode='rt'):
+    def __init__(self, filename, mode='rt', threads=None):
+        """
+        :param threads: gzip compression threads, see gziputils
+        """
         self.filename = filename
         self.mode = mode
+        self.threads = threads
 
     def __enter__(self):
         if self.get_file_format(self.filename) in ["csv", 'plain-text']:
             self.handle = open(self.filename, self.mode)
         elif self.get_file_format(self.filename) == "gzip":
-            self.handle = gzip.open(self.filename, self.mode)
+            self.handle = gziputils.open(self.filename, self.mode, threads=self.threads)
         elif self.get_file_format(self.filename) == "h5":
             self.handle = pd.HDFStore(self.filename, self.mode)
         return self.handle
@@ -395,6 +405,93 @@ def run_in_parallel(worker, args, ncores=None):
     del pool
 
 
+def read_ahead(iterable, maxsize=4):
+    """
+    iterates over iterable in a background thread, up to maxsize
+    items ahead of the consumer. useful when producing the items
+    releases the GIL (decompression, file io)
+    """
+    queue = Queue(maxsize)
+    done = object()
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for item in iterable:
+                queue.put(item)
+                if stop.is_set():
+                    break
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            queue.put(done)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        for item in iter(queue.get, done):
+            yield item
+    finally:
+        stop.set()
+        # unblock the producer if the consumer stopped early
+        while thread.is_alive():
+            while not queue.empty():
+                queue.get()
+            thread.join(0.01)
+
+    if errors:
+        raise errors[0]
+
+
+class ThreadedWriter(object):
+    """
+    calls func on each item passed to write in a background thread,
+    up to maxsize items behind the caller. errors in func are raised
+    from write or close.
+    """
+
+    def __init__(self, func, maxsize=4):
+        self.func = func
+        self.queue = Queue(maxsize)
+        self.errors = []
+        self.thread = threading.Thread(target=self.__consume)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __consume(self):
+        for item in iter(self.queue.get, None):
+            # keep draining after an error so that write never blocks
+            if self.errors:
+                continue
+            try:
+                self.func(*item)
+            except BaseException as exc:
+                self.errors.append(exc)
+
+    def __raise_errors(self):
+        if self.errors:
+            raise self.errors[0]
+
+    def write(self, *item):
+        self.__raise_errors()
+        self.queue.put(item)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.__raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def run_cmd(cmd, output=None):
     stdout = PIPE
     if output:
@@ -437,6 +534,52 @@ def makedirs(directory, isfile=False):
             raise
 
 
+def makedirs_private(directory):
+    """
+    creates directory with mode 0700, readable and writable by the
+    current user only. missing parents are created as in makedirs
+    """
+    makedirs(os.path.dirname(directory.rstrip(os.sep)))
+
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def is_private(path):
+    """
+    True if path is not a symlink, is owned by the current user and
+    has no permissions for group and others
+    """
+    info = os.lstat(path)
+
+    return not stat.S_ISLNK(info.st_mode) and info.st_uid == os.getuid() \
+        and not info.st_mode & 0o077
+
+
+def get_file_checksum(filepath, blocksize=16 * 1024 * 1024):
+    checksum = hashlib.sha1()
+    with open(filepath, 'rb') as reader:
+        for block in iter(lambda: reader.read(blocksize), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def get_default_cache_dir():
+    """
+    node local cache dir, one per user. SINGLE_CELL_CACHE_DIR overrides
+    the default
+    """
+    cache_dir = os.environ.get('SINGLE_CELL_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(
+            tempfile.gettempdir(), 'single_cell_cache_{}'.format(os.getuid())
+        )
+    return cache_dir
+
+
 def make_tarfile(output_filename, source_dir):
     with tarfile.open(output_filename, "w:gz") as tar:
         tar.add(source_dir, arcname=os.path.basename(source_dir))
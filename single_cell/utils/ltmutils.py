@@ -6,7 +6,9 @@ Created on July 31, 2018
 
 import logging
 
+import numpy as np
 import pandas as pd
+from single_cell.utils import clusteringutils
 
 
 def read_input_file(input_file):
@@ -29,47 +31,134 @@ def read_input_file(input_file):
     return hmmcopy, timepoints
 
 
-def get_cn_matrix_from_hdf(hmmcopy_hdf_file, ploidy='0'):
-    df = pd.read_hdf(hmmcopy_hdf_file, '/hmmcopy/reads/' + ploidy)
+def get_cn_matrix_from_hdf(
+        hmmcopy_hdf_file, ploidy='0', quality_threshold=0.75,
+        map_threshold=0.99, chunksize=10 ** 6
+):
+    """
+    builds the bins x cells copy number matrix in one scan of the reads
+    :param quality_threshold: drop cells with lower quality
+    :param map_threshold: drop bins with lower mappability
+    :returns bins dataframe (chr, start, end, width), cell ids and
+    int8 matrix of states
+    """
+    metrics = pd.read_hdf(
+        hmmcopy_hdf_file, '/hmmcopy/metrics/' + ploidy, columns=['cell_id', 'quality']
+    )
+    cells = pd.Index(
+        metrics.loc[~(metrics['quality'] < quality_threshold), 'cell_id'].astype(str).unique()
+    )
+
+    bin_keys = pd.Index([], dtype=np.int64)
+    chroms = pd.Index([], dtype=object)
+    bins = []
+
+    matrix = np.full((0, len(cells)), -1, dtype=np.int8)
+
+    for chunk in pd.read_hdf(
+            hmmcopy_hdf_file, '/hmmcopy/reads/' + ploidy, chunksize=chunksize,
+            columns=['cell_id', 'chr', 'start', 'end', 'state', 'map']
+    ):
+        cell_idx = cells.get_indexer(chunk['cell_id'].astype(str))
+        chunk = chunk[cell_idx >= 0]
+        cell_idx = cell_idx[cell_idx >= 0]
+
+        chroms, chrom_idx = clusteringutils.update_index(
+            chroms, chunk['chr'].astype(str).values
+        )
+        keys = (chrom_idx.astype(np.int64) << 32) | chunk['start'].values.astype(np.int64)
+
+        num_bins = len(bin_keys)
+        bin_keys, bin_idx = clusteringutils.update_index(bin_keys, keys)
+        if len(bin_keys) > num_bins:
+            new_bins = chunk.loc[bin_idx >= num_bins, ['chr', 'start', 'end', 'map']]
+            bins.append(new_bins.drop_duplicates(['chr', 'start']))
+
+            # rows are doubled to keep the number of copies small
+            if len(bin_keys) > matrix.shape[0]:
+                resized = np.full(
+                    (max(len(bin_keys), 2 * matrix.shape[0]), len(cells)), -1, dtype=np.int8
+                )
+                resized[:matrix.shape[0]] = matrix
+                matrix = resized
+
+        states = chunk['state'].values
+        present = ~pd.isnull(states)
+        matrix[bin_idx[present], cell_idx[present]] = states[present].astype(np.int8)
+
+    bins = pd.concat(bins) if bins else pd.DataFrame(columns=['chr', 'start', 'end', 'map'])
+    bins = bins.astype({'chr': str}).reset_index(drop=True)
+    bins['position'] = np.arange(len(bins))
+
+    bins = clusteringutils.get_bin_index(bins)
+    bins = bins[bins['map'] >= map_threshold]
+
+    matrix = matrix[bins['position'].values]
+
+    dropped_cells = cells[(matrix < 0).all(axis=0)].tolist()
+    if dropped_cells:
+        logging.getLogger("single_cell.helpers.ltmutils").warning(
+            'Dropping {} cells: {}'.format(len(dropped_cells), dropped_cells)
+        )
+    keep = ~(matrix < 0).all(axis=0)
+    cells = cells[keep]
+    matrix = matrix[:, keep]
 
-    df["bin"] = list(zip(df.chr, df.start, df.end))
-    df = df.pivot(index='cell_id', columns='bin', values='state')
-    chromosomes = map(str, range(1, 23)) + ['X', 'Y']
-    bins = pd.DataFrame(df.columns.values.tolist(),
-                        columns=['chr', 'start', 'end'])
-    bins["chr"] = pd.Categorical(bins["chr"], chromosomes)
-    bins = bins.sort_values(['start', ])
-    bins = [tuple(v) for v in bins.values.tolist()]
-    df = df.sort_values(bins, axis=0).T
+    if (matrix < 0).any():
+        raise ValueError('missing copy number states in {}'.format(hmmcopy_hdf_file))
 
-    dropped_cells = df.columns[df.isna().all()].tolist()
+    bins = bins[['chr', 'start', 'end']].reset_index(drop=True)
+    bins['width'] = bins['end'] - bins['start'] + 1
+
+    return bins, cells.tolist(), matrix
+
+
+def merge_cn_matrices(matrices):
+    """
+    merges matrices from several libraries on the bins they share
+    :param matrices: list of (bins, cells, matrix), see get_cn_matrix_from_hdf
+    :returns bins, cells and matrix
+    """
+    keys = [
+        pd.MultiIndex.from_frame(bins[['chr', 'start', 'end', 'width']])
+        for bins, _, _ in matrices
+    ]
+
+    shared = keys[0]
+    for key in keys[1:]:
+        shared = shared[shared.isin(key)]
+
+    cells = [cell for _, lib_cells, _ in matrices for cell in lib_cells]
+
+    merged = np.empty((len(shared), len(cells)), dtype=np.int8)
+
+    offset = 0
+    for key, (_, lib_cells, matrix) in zip(keys, matrices):
+        merged[:, offset:offset + len(lib_cells)] = matrix[key.get_indexer(shared)]
+        offset += len(lib_cells)
+
+    bins = shared.to_frame(index=False)
+
+    return bins, cells, merged
+
+
+def read_cn_matrix(infile):
+    """
+    :returns bins, cells and matrix, see write_cn_matrix
+    """
+    data = pd.read_csv(infile, dtype={'chr': str})
+    bins = data.iloc[:, :4]
+    return bins, data.columns[4:].tolist(), data.iloc[:, 4:].values.astype(np.int8)
 
-    if len(dropped_cells) != 0:
-        logging.getLogger("single_cell.helpers.ltmutils").warn(
-            'Dropping {} cells: {}'.format(len(dropped_cells), dropped_cells)
-        )
 
-    df = df.loc[:, ~df.isna().all()].astype(int)
-    df.columns = df.columns.astype(str)
-    df = df.reset_index()
-
-    chrom = []
-    start = []
-    end = []
-    width = []
-    for i, b in df['bin'].items():
-        chrom.append(b[0])
-        start.append(b[1])
-        end.append(b[2])
-        width.append(b[2] - b[1] + 1)
-    df['chr'] = chrom
-    df['start'] = start
-    df['end'] = end
-    df['width'] = width
-
-    df = df.drop(columns='bin')
-
-    return df, dropped_cells
+def write_cn_matrix(bins, cells, matrix, outfile):
+    """
+    writes the chr, start, end and width columns followed by one
+    column per cell
+    """
+    data = pd.DataFrame(matrix, columns=cells)
+    data = pd.concat([bins.reset_index(drop=True), data], axis=1)
+    data.to_csv(outfile, index=False)
 
 
 def get_root(cells_list, root_id_file):
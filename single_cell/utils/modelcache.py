@@ -0,0 +1,107 @@
+'''
+node local cache for models fitted on reference training data (quality
+and species classifiers). a model is a deterministic function of the
+training file and the hyperparameters, so it is fitted once per node and
+loaded with joblib on later runs. loading unpickles the file, so models
+are only loaded from a directory that is private to the current user.
+'''
+import hashlib
+import logging
+import os
+import tempfile
+
+import joblib
+import sklearn
+
+from single_cell.utils import helpers
+
+
+def get_model_path(name, training_data, params, cache_dir):
+    """cache key: sha1 over the content of the training file, the
+    hyperparameters and the scikit-learn version, pickled models are
+    not portable across versions
+    """
+    key = hashlib.sha1()
+
+    key.update(helpers.get_file_checksum(training_data).encode())
+    key.update(repr(sorted(params.items())).encode())
+    key.update(sklearn.__version__.encode())
+
+    return os.path.join(cache_dir, 'models', '{}.{}.joblib'.format(name, key.hexdigest()))
+
+
+def save_model(model, path):
+    """writes to a temp path and renames so that concurrent jobs on the
+    same node never see a partial model
+    """
+    helpers.makedirs_private(os.path.dirname(path))
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+
+    try:
+        joblib.dump(model, temp_path)
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_model(name, training_data, params, train, cache_dir=None, **kwargs):
+    """loads a fitted model from the cache, fitting it on first use
+
+    :param name: model name, part of the cache file name
+    :param training_data: path to the training data
+    :param params: dict of hyperparameters, passed to train as kwargs
+    and part of the cache key
+    :param train: function of (training_data, **params, **kwargs) that
+    returns the fitted model
+    :param cache_dir: cache directory, see helpers.get_default_cache_dir
+    :param kwargs: passed to train, not part of the cache key. for
+    settings that do not change the fitted model, such as n_jobs
+    :returns fitted model
+    """
+    logger = logging.getLogger('single_cell.modelcache')
+
+    if not cache_dir:
+        cache_dir = helpers.get_default_cache_dir()
+
+    path = get_model_path(name, training_data, params, cache_dir)
+    model_dir = os.path.dirname(path)
+
+    def fit():
+        return train(training_data, **dict(params, **kwargs))
+
+    try:
+        helpers.makedirs_private(model_dir)
+        private = helpers.is_private(model_dir)
+    except (IOError, OSError) as e:
+        logger.warning('unable to create model cache {}: {}'.format(model_dir, e))
+        return fit()
+
+    if not private:
+        # other users could plant a pickle in the cache
+        logger.warning(
+            'not using model cache {}, it is not private to the current user'.format(model_dir)
+        )
+        return fit()
+
+    if os.path.exists(path):
+        try:
+            if not helpers.is_private(path):
+                raise IOError('not private to the current user')
+            return joblib.load(path)
+        except Exception as e:
+            logger.warning('unable to load cached model {}: {}'.format(path, e))
+
+    logger.info('caching {} model for {} to {}'.format(name, training_data, path))
+
+    model = fit()
+
+    try:
+        save_model(model, path)
+    except (IOError, OSError) as e:
+        # cache is an optimization, carry on with the fitted model
+        logger.warning('unable to cache {} model: {}'.format(name, e))
+
+    return model
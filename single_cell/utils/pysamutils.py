@@ -3,8 +3,15 @@ Created on Jun 1, 2018
 
 @author: dgrewal
 '''
+import bisect
+import collections
+import heapq
+import multiprocessing
+import os
 from collections import OrderedDict
+
 import pysam
+from single_cell.utils import helpers
 
 def load_chromosome_lengths(file_name, chromosomes=None):
 
@@ -45,3 +52,367 @@ def get_regions(chromosome_lengths, split_size):
             regions.append('{}-{}-{}'.format(chrom, beg, end))
 
     return regions
+
+
+def parse_region(region):
+    """
+    :param region: chrom-beg-end, 1 based and inclusive as in get_regions
+    :returns chrom and 0 based, half open start and end
+    """
+    chrom, beg, end = region.rsplit('-', 2)
+    return chrom, int(beg) - 1, int(end)
+
+
+def get_read_count(bam):
+    """
+    number of records from the index, counting every record once
+    :returns None if the bam has no index
+    """
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        if not reader.has_index():
+            return None
+        return reader.mapped + reader.unmapped
+
+
+def split_bam_by_read_name(bam, outputs, num_reads=None, threads=1):
+    """
+    splits a bam grouped by read name (samtools collate) into len(outputs)
+    bams with about the same number of records, without splitting the
+    records of a read name across outputs
+    :param bam: read name grouped bam
+    :param outputs: list of output bams
+    :param num_reads: number of records in bam, counted if None
+    :param threads: bgzf compression threads for the outputs
+    """
+    with pysam.AlignmentFile(bam, 'rb', check_sq=False) as reader:
+        if num_reads is None:
+            num_reads = sum(1 for _ in reader.fetch(until_eof=True))
+            reader.reset()
+
+        def open_writer(index):
+            return pysam.AlignmentFile(
+                outputs[index], 'wb', template=reader, threads=threads
+            )
+
+        shard = 0
+        boundary = num_reads / len(outputs)
+        writer = open_writer(shard)
+
+        count = 0
+        last_name = None
+
+        for read in reader.fetch(until_eof=True):
+            name = read.query_name
+
+            if count >= boundary and name != last_name and shard < len(outputs) - 1:
+                writer.close()
+                shard += 1
+                boundary = num_reads * (shard + 1) / len(outputs)
+                writer = open_writer(shard)
+
+            writer.write(read)
+            count += 1
+            last_name = name
+
+        writer.close()
+
+        # bams with fewer read names than outputs leave some empty
+        for index in range(shard + 1, len(outputs)):
+            open_writer(index).close()
+
+
+class RegionBamSplitter(object):
+    """
+    splits a coordinate sorted and indexed bam into regions in one pass.
+    a read goes to every region its alignment overlaps, the same reads
+    that samtools view returns for the region. each chromosome is
+    streamed once and reads are routed with a sorted interval lookup.
+    a region's writer is opened at its first read and closed and indexed
+    once the stream passes its end, so only the regions around the
+    current position are open at a time.
+    """
+
+    def __init__(self, bam, outputs, threads=1, processes=1):
+        """
+        :param bam: coordinate sorted bam with index
+        :param outputs: dict of region (see parse_region) to output bam
+        :param threads: bgzf compression threads per output
+        :param processes: chromosomes split in parallel
+        """
+        self.bam = bam
+        self.outputs = outputs
+        self.threads = threads
+        self.processes = processes
+
+        self.regions = self.get_chrom_regions(outputs.keys())
+
+        self.header = self.get_header()
+
+        # regions with a finished and indexed output
+        self.done = set()
+
+    @staticmethod
+    def get_chrom_regions(regions):
+        """
+        :returns dict of chrom to (starts, ends, regions) sorted by start
+        """
+        chrom_regions = {}
+        for region in regions:
+            chrom, start, end = parse_region(region)
+            chrom_regions.setdefault(chrom, []).append((start, end, region))
+
+        for chrom, intervals in chrom_regions.items():
+            intervals.sort()
+
+            starts, ends, names = zip(*intervals)
+
+            if list(ends) != sorted(ends):
+                raise ValueError('nested regions on {} are not supported'.format(chrom))
+
+            chrom_regions[chrom] = (list(starts), list(ends), list(names))
+
+        return chrom_regions
+
+    def get_header(self):
+        with pysam.AlignmentFile(self.bam, 'rb') as reader:
+            return reader.header.to_dict()
+
+    def get_chroms(self):
+        """
+        :returns chromosomes with regions, longest first so that the
+        largest chromosomes start first when split in parallel
+        """
+        lengths = [
+            (seq['SN'], seq['LN']) for seq in self.header['SQ']
+            if seq['SN'] in self.regions
+        ]
+
+        return [chrom for chrom, _ in sorted(lengths, key=lambda val: -val[1])]
+
+    def get_sorted_chroms(self):
+        """
+        :returns chromosomes with regions in the order of the header
+        """
+        return [seq['SN'] for seq in self.header['SQ'] if seq['SN'] in self.regions]
+
+    def open_writer(self, region):
+        return pysam.AlignmentFile(
+            self.outputs[region], 'wb', header=self.header, threads=self.threads
+        )
+
+    def close_writer(self, region, writer):
+        writer.close()
+        pysam.index(self.outputs[region])
+        self.done.add(region)
+
+    def route(self, reads, chrom):
+        """
+        writes coordinate sorted reads from chrom to the regions they overlap
+        """
+        starts, ends, names = self.regions[chrom]
+        bisect_left = bisect.bisect_left
+        bisect_right = bisect.bisect_right
+
+        # sentinels for the bounds of the first and past the last region
+        bounds_starts = [float('-inf')] + starts + [float('inf')]
+        bounds_ends = ends + [float('inf')]
+
+        writers = {}
+        # regions with an open writer, in order of start and end
+        active = collections.deque()
+
+        # writers for the regions of the last read, reused while the
+        # next read overlaps the same regions: pos before the end of
+        # the first region and end between the starts around the last
+        targets = []
+        lo_end = hi_prev_start = hi_start = float('-inf')
+
+        for read in reads:
+            pos = read.reference_start
+
+            while active and ends[active[0]] <= pos:
+                index = active.popleft()
+                self.close_writer(names[index], writers.pop(index))
+
+            # unmapped reads and reads without reference bases span one base
+            end = read.reference_end
+            if end is None or end <= pos:
+                end = pos + 1
+
+            if pos >= lo_end or end <= hi_prev_start or end > hi_start:
+                lo = bisect_right(ends, pos)
+                hi = bisect_left(starts, end)
+
+                lo_end = bounds_ends[lo]
+                hi_prev_start = bounds_starts[hi]
+                hi_start = bounds_starts[hi + 1]
+
+                targets = []
+                for index in range(lo, hi):
+                    writer = writers.get(index)
+                    if writer is None:
+                        writer = writers[index] = self.open_writer(names[index])
+                        active.append(index)
+                    targets.append(writer)
+
+            for writer in targets:
+                writer.write(read)
+
+        for index in active:
+            self.close_writer(names[index], writers[index])
+
+    def split_chrom(self, chrom):
+        with pysam.AlignmentFile(self.bam, 'rb') as reader:
+            self.route(reader.fetch(chrom), chrom)
+
+        return self.done
+
+    def split(self):
+        chroms = self.get_chroms()
+
+        if self.processes > 1 and len(chroms) > 1:
+            args = [(self, chrom) for chrom in chroms]
+            for done in _map_in_pool(_split_chrom, args, self.processes):
+                self.done.update(done)
+        else:
+            for chrom in chroms:
+                self.split_chrom(chrom)
+
+        # regions without reads get a bam with just the header
+        for region in self.outputs:
+            if region not in self.done:
+                self.close_writer(region, self.open_writer(region))
+
+
+class RegionBamMerger(RegionBamSplitter):
+    """
+    merges coordinate sorted and indexed bams (one per cell) into regions.
+    every input is read once per chromosome and the reads are merged with
+    a k-way heap merge in the order of samtools merge (position, strand,
+    then input order) and routed to the regions as in RegionBamSplitter.
+    with more than max_open inputs, batches of max_open inputs are merged
+    into temporary bams first so that no more than max_open inputs are
+    open per process.
+    """
+
+    def __init__(self, bams, outputs, tempdir, threads=1, processes=1, max_open=500):
+        """
+        :param bams: list of coordinate sorted bams with index
+        :param outputs: dict of region (see parse_region) to output bam
+        :param tempdir: temp directory for the batch merges
+        :param threads: bgzf compression threads per output
+        :param processes: chromosomes merged in parallel
+        :param max_open: maximum number of inputs open at a time
+        """
+        self.bams = list(bams)
+        self.tempdir = tempdir
+        self.max_open = max_open
+
+        super(RegionBamMerger, self).__init__(
+            self.bams[0], outputs, threads=threads, processes=processes
+        )
+
+    def get_header(self):
+        """
+        header of the first bam, with the read groups and programs of the
+        others added
+        """
+        with pysam.AlignmentFile(self.bams[0], 'rb') as reader:
+            header = reader.header.to_dict()
+
+        seen = {
+            tag: set(val['ID'] for val in header.get(tag, [])) for tag in ('RG', 'PG')
+        }
+
+        for bam in self.bams[1:]:
+            with pysam.AlignmentFile(bam, 'rb') as reader:
+                bam_header = reader.header.to_dict()
+
+            for tag in ('RG', 'PG'):
+                for val in bam_header.get(tag, []):
+                    if val['ID'] not in seen[tag]:
+                        seen[tag].add(val['ID'])
+                        header.setdefault(tag, []).append(val)
+
+        return header
+
+    @staticmethod
+    def merge_reads(readers, chrom):
+        return heapq.merge(
+            *[reader.fetch(chrom) for reader in readers],
+            key=lambda read: (read.reference_start, read.is_reverse)
+        )
+
+    def split_chrom(self, chrom):
+        readers = [pysam.AlignmentFile(bam, 'rb') for bam in self.bams]
+
+        try:
+            self.route(self.merge_reads(readers, chrom), chrom)
+        finally:
+            for reader in readers:
+                reader.close()
+
+        return self.done
+
+    def merge_batch(self, bams, output):
+        """
+        merges the chromosomes with regions from bams into one indexed bam
+        """
+        readers = [pysam.AlignmentFile(bam, 'rb') for bam in bams]
+
+        try:
+            with pysam.AlignmentFile(output, 'wb', header=self.header) as writer:
+                for chrom in self.get_sorted_chroms():
+                    for read in self.merge_reads(readers, chrom):
+                        writer.write(read)
+        finally:
+            for reader in readers:
+                reader.close()
+
+        pysam.index(output)
+
+        return output
+
+    def merge_batches(self):
+        """
+        merges the inputs in batches until at most max_open are left.
+        batches are contiguous so ties between reads keep the input order
+        """
+        level = 0
+        while len(self.bams) > self.max_open:
+            args = []
+            for i in range(0, len(self.bams), self.max_open):
+                output = os.path.join(self.tempdir, 'batch_{}_{}.bam'.format(level, i))
+                args.append((self, self.bams[i:i + self.max_open], output))
+
+            if self.processes > 1:
+                self.bams = _map_in_pool(_merge_batch, args, self.processes)
+            else:
+                self.bams = [self.merge_batch(bams, output) for _, bams, output in args]
+
+            level += 1
+
+    def merge(self):
+        helpers.makedirs(self.tempdir)
+
+        self.merge_batches()
+
+        self.split()
+
+
+def _map_in_pool(func, args, processes):
+    pool = multiprocessing.Pool(min(processes, len(args)))
+    try:
+        results = [pool.apply_async(func, arg) for arg in args]
+        return [result.get() for result in results]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _split_chrom(splitter, chrom):
+    return splitter.split_chrom(chrom)
+
+
+def _merge_batch(merger, bams, output):
+    return merger.merge_batch(bams, output)
@@ -1,4 +1,14 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
 import pandas as pd
+import yaml
+
+from single_cell.utils import helpers
+from single_cell.utils import wigutils
 
 default_chromosomes = [str(a) for a in range(1, 23)] + ['X', 'Y']
 
@@ -30,3 +40,345 @@ def get_split_regions(split_size, refgenome, chromosomes=default_chromosomes):
             regions.append('{}-{}-{}'.format(chrom, beg, end))
 
     return regions
+
+
+class BinAnnotationError(Exception):
+    pass
+
+
+def read_exclude_list(exclude_list):
+    """reads the tab separated exclude list (chrom, start, end with a
+    header line), same format as the hmmcopy read counter
+    """
+    excluded = pd.read_csv(exclude_list, sep='\t')
+    excluded.columns = ['chrom', 'start', 'end']
+    excluded['chrom'] = excluded['chrom'].astype(str)
+    return excluded
+
+
+def get_excluded_bins(excluded, chrom, bins, bin_size):
+    """flags bins that overlap an excluded region
+    :param excluded: dataframe from read_exclude_list
+    :param bins: numpy array of consecutive bin numbers
+    :returns bool numpy array
+    """
+    flags = np.zeros(len(bins) + 1, dtype=np.int64)
+
+    if not len(bins):
+        return flags[:-1].astype(bool)
+
+    regions = excluded.loc[excluded['chrom'] == chrom, ['start', 'end']].values
+    regions = regions[regions[:, 1] > regions[:, 0]]
+
+    # half open regions, mark the first and one past the last bin
+    first = np.clip(regions[:, 0] // bin_size - bins[0], 0, len(bins))
+    last = np.clip((regions[:, 1] - 1) // bin_size + 1 - bins[0], 0, len(bins))
+
+    np.add.at(flags, first, 1)
+    np.add.at(flags, last, -1)
+
+    return np.cumsum(flags[:-1]) > 0
+
+
+class BinAnnotations(object):
+    """
+    genome wide bins table with one contiguous array per column,
+    chromosomes are stored back to back in the order of the gc wig
+    """
+
+    columns = [
+        ('chrom', np.int16),
+        ('start', np.int64),
+        ('end', np.int64),
+        ('gc', np.float64),
+        ('map', np.float64),
+        ('exclude', np.bool_),
+    ]
+
+    def __init__(self, bin_size, chromosomes, offsets, first_bins, arrays):
+        """
+        :param bin_size: bin size
+        :param chromosomes: chromosome names, chrom holds indices into it
+        :param offsets: dict of chromosome to index of its first bin
+        :param first_bins: dict of chromosome to bin number of its first bin
+        :param arrays: dict of column name to numpy array (or memmap)
+        """
+        self.bin_size = bin_size
+        self.chromosomes = chromosomes
+        self.offsets = offsets
+        self.first_bins = first_bins
+        self.arrays = arrays
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get('arrays', {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.arrays['start'])
+
+    @classmethod
+    def build(cls, gc_wig, map_wig, bin_size=None, exclude_list=None, chromosomes=None):
+        """builds the table from the gc and mappability wigs, bins
+        that are in both wigs are kept
+        :param bin_size: expected bin size of the wigs
+        :param exclude_list: regions to flag in the exclude column
+        :param chromosomes: chromosomes to keep, all chromosomes in
+        the gc wig if not set
+        """
+        gc = wigutils.WigTrack.from_wig(gc_wig)
+        mapp = wigutils.WigTrack.from_wig(map_wig)
+
+        if bin_size is None:
+            bin_size = gc.winsize
+
+        for wigfile, track in ((gc_wig, gc), (map_wig, mapp)):
+            if not track.winsize == bin_size:
+                raise BinAnnotationError(
+                    '{} has bin size {}, expected {}'.format(wigfile, track.winsize, bin_size)
+                )
+
+        if chromosomes is None:
+            chromosomes = gc.chromosomes
+        chromosomes = [chrom for chrom in chromosomes if chrom in gc.offsets and chrom in mapp.offsets]
+
+        excluded = read_exclude_list(exclude_list) if exclude_list else None
+
+        offsets = {}
+        first_bins = {}
+        arrays = {name: [] for name, _ in cls.columns}
+
+        offset = 0
+        for idx, chrom in enumerate(chromosomes):
+            first = max(gc.first_bins[chrom], mapp.first_bins[chrom])
+            last = min(
+                gc.first_bins[chrom] + gc.get_nbins(chrom),
+                mapp.first_bins[chrom] + mapp.get_nbins(chrom)
+            )
+            bins = np.arange(first, max(first, last))
+
+            offsets[chrom] = offset
+            first_bins[chrom] = int(first)
+            offset += len(bins)
+
+            arrays['chrom'].append(np.full(len(bins), idx))
+            arrays['start'].append(bins * bin_size + 1)
+            arrays['end'].append((bins + 1) * bin_size)
+            arrays['gc'].append(gc.values[gc.get_index(chrom, bins)])
+            arrays['map'].append(mapp.values[mapp.get_index(chrom, bins)])
+
+            if excluded is None:
+                arrays['exclude'].append(np.zeros(len(bins), dtype=bool))
+            else:
+                arrays['exclude'].append(get_excluded_bins(excluded, chrom, bins, bin_size))
+
+        arrays = {
+            name: np.concatenate(arrays[name] or [[]]).astype(dtype)
+            for name, dtype in cls.columns
+        }
+
+        return cls(bin_size, chromosomes, offsets, first_bins, arrays)
+
+    def get_nbins(self, chrom):
+        idx = self.chromosomes.index(chrom)
+        if idx + 1 < len(self.chromosomes):
+            return self.offsets[self.chromosomes[idx + 1]] - self.offsets[chrom]
+        return len(self) - self.offsets[chrom]
+
+    def get_index(self, chrom, bins):
+        """converts bin numbers on a chromosome to row indices
+
+        :param chrom: chromosome name
+        :param bins: numpy array with bin numbers
+        :returns numpy array with indices, -1 for bins not in the table
+        """
+        if chrom not in self.offsets:
+            return np.full(len(bins), -1, dtype=np.int64)
+
+        local = bins - self.first_bins[chrom]
+        valid = (local >= 0) & (local < self.get_nbins(chrom))
+
+        return np.where(valid, local + self.offsets[chrom], -1)
+
+    def get_chrom(self, chrom):
+        """zero copy views of the columns for a chromosome
+        :returns dict of column name to numpy array
+        """
+        start = self.offsets[chrom]
+        end = start + self.get_nbins(chrom)
+        return {name: values[start:end] for name, values in self.arrays.items()}
+
+    def to_dataframe(self):
+        """
+        :returns dataframe with chr, start, end, gc, map and exclude columns
+        """
+        data = pd.DataFrame({name: self.arrays[name] for name, _ in self.columns[1:]})
+        data.insert(0, 'chr', np.array(self.chromosomes, dtype=object)[self.arrays['chrom']])
+        return data
+
+    def metadata(self):
+        return {
+            'bin_size': self.bin_size,
+            'chromosomes': self.chromosomes,
+            'offsets': self.offsets,
+            'first_bins': self.first_bins,
+            'dtypes': {name: str(np.dtype(dtype)) for name, dtype in self.columns},
+            'length': len(self),
+        }
+
+    def save(self, prefix):
+        """writes every column as prefix.<column>.bin and the metadata
+        as prefix.yaml. files are written to temp paths and renamed, the
+        yaml goes last so that a table is only visible once complete
+        """
+        dirname = os.path.dirname(prefix)
+        helpers.makedirs_private(dirname)
+
+        def write(suffix, writer):
+            fd, temp_path = tempfile.mkstemp(dir=dirname, suffix=suffix + '.tmp')
+            os.close(fd)
+            writer(temp_path)
+            os.rename(temp_path, prefix + suffix)
+
+        for name, _ in self.columns:
+            write('.{}.bin'.format(name), self.arrays[name].tofile)
+
+        write('.yaml', lambda path: helpers.write_to_yaml(path, self.metadata()))
+
+    @classmethod
+    def get_paths(cls, prefix):
+        """
+        :returns paths of the metadata and column files of a saved table
+        """
+        return [prefix + '.yaml'] + [
+            '{}.{}.bin'.format(prefix, name) for name, _ in cls.columns
+        ]
+
+    @classmethod
+    def load(cls, prefix):
+        """maps the columns read only, pages are shared between all
+        processes on the node that load the same table
+        """
+        with open(prefix + '.yaml') as reader:
+            metadata = yaml.safe_load(reader)
+
+        arrays = {}
+        for name, _ in cls.columns:
+            if metadata['length']:
+                arrays[name] = np.memmap(
+                    '{}.{}.bin'.format(prefix, name), dtype=metadata['dtypes'][name],
+                    mode='r', shape=(metadata['length'],)
+                )
+            else:
+                arrays[name] = np.zeros(0, dtype=metadata['dtypes'][name])
+
+        return cls(
+            metadata['bin_size'], metadata['chromosomes'], metadata['offsets'],
+            metadata['first_bins'], arrays
+        )
+
+
+def get_bin_annotations_key(gc_wig, map_wig, bin_size=None,
+                            exclude_list=None, chromosomes=None):
+    """cache key: sha1 over the content of the reference files, the
+    bin size and the chromosomes. reads the reference files in full,
+    workflows compute it once and pass it to every get_bin_annotations
+    call
+    """
+    key = hashlib.sha1()
+
+    for filepath in (gc_wig, map_wig, exclude_list):
+        checksum = helpers.get_file_checksum(filepath) if filepath else 'None'
+        key.update(checksum.encode())
+
+    key.update(str(bin_size).encode())
+    key.update(str(chromosomes).encode())
+
+    return key.hexdigest()
+
+
+def get_bin_annotations_prefix(gc_wig, map_wig, cache_dir, bin_size=None,
+                               exclude_list=None, chromosomes=None, key=None):
+    """
+    :param key: from get_bin_annotations_key, computed if not set
+    """
+    if key is None:
+        key = get_bin_annotations_key(
+            gc_wig, map_wig, bin_size=bin_size, exclude_list=exclude_list,
+            chromosomes=chromosomes
+        )
+
+    name = os.path.basename(gc_wig)
+    if bin_size:
+        name = '{}.ws_{}'.format(name, bin_size)
+
+    return os.path.join(cache_dir, 'bin_annotations', '{}.{}'.format(name, key))
+
+
+def get_bin_annotations(gc_wig, map_wig, bin_size=None, exclude_list=None,
+                        chromosomes=None, cache_dir=None, key=None):
+    """loads the bins table for a reference as memory mapped
+    BinAnnotations, building it into the cache on first use
+
+    :param gc_wig: gc fixedStep wiggle file
+    :param map_wig: mappability fixedStep wiggle file
+    :param bin_size: expected bin size of the wigs
+    :param exclude_list: regions to flag in the exclude column
+    :param chromosomes: chromosomes to keep
+    :param cache_dir: cache directory, see helpers.get_default_cache_dir
+    :param key: from get_bin_annotations_key for the same arguments,
+    saves hashing the reference files on every call
+    :returns BinAnnotations
+    """
+    logger = logging.getLogger('single_cell.refgenome')
+
+    if not cache_dir:
+        cache_dir = helpers.get_default_cache_dir()
+
+    prefix = get_bin_annotations_prefix(
+        gc_wig, map_wig, cache_dir, bin_size=bin_size,
+        exclude_list=exclude_list, chromosomes=chromosomes, key=key
+    )
+    annotations_dir = os.path.dirname(prefix)
+
+    def build():
+        return BinAnnotations.build(
+            gc_wig, map_wig, bin_size=bin_size, exclude_list=exclude_list,
+            chromosomes=chromosomes
+        )
+
+    try:
+        helpers.makedirs_private(annotations_dir)
+        private = helpers.is_private(annotations_dir)
+    except (IOError, OSError) as e:
+        logger.warning('unable to create bin annotations cache {}: {}'.format(annotations_dir, e))
+        return build()
+
+    if not private:
+        # other users could plant or modify the tables in the cache
+        logger.warning(
+            'not using bin annotations cache {}, it is not private to the current user'.format(
+                annotations_dir)
+        )
+        return build()
+
+    if os.path.exists(prefix + '.yaml'):
+        try:
+            if not all(helpers.is_private(path) for path in BinAnnotations.get_paths(prefix)):
+                raise IOError('not private to the current user')
+            return BinAnnotations.load(prefix)
+        except Exception as e:
+            logger.warning('unable to load cached bin annotations {}: {}'.format(prefix, e))
+
+    logger.info('caching bin annotations for {} to {}'.format(gc_wig, prefix))
+
+    annotations = build()
+
+    try:
+        annotations.save(prefix)
+    except (IOError, OSError) as e:
+        # cache is an optimization, carry on with the built table
+        logger.warning('unable to cache bin annotations for {}: {}'.format(gc_wig, e))
+
+    return annotations
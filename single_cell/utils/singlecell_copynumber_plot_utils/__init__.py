@@ -2,4 +2,5 @@
 from .plot_metrics import PlotMetrics
 from .plot_kernel_density import PlotKernelDensity
 from .plot_pcolormesh import PlotPcolor
+from .plot_hmmcopy import BatchHmmPlots
 from .plot_hmmcopy import GenHmmPlots
\ No newline at end of file
@@ -15,14 +15,74 @@ from matplotlib.colors import ListedColormap
 from matplotlib.colors import rgb2hex
 
 
+def get_block_starts(length, num_blocks):
+    """
+    first index of each of num_blocks near equal blocks
+    """
+    return np.arange(num_blocks) * length // num_blocks
+
+
+def downsample_matrix(mat, shape, method='mode'):
+    """aggregates blocks of rows and columns so that the matrix
+    fits in shape
+    :param mat: 2d array, nan for missing values
+    :param shape: max (rows, columns) of the output
+    :param method: mode: most frequent integer value in each block,
+    values must be non negative. max: max value in each block
+    :returns 2d array, nan for blocks without values
+    """
+    rows = min(shape[0], mat.shape[0])
+    cols = min(shape[1], mat.shape[1])
+
+    if (rows, cols) == mat.shape:
+        return mat
+
+    row_starts = get_block_starts(mat.shape[0], rows)
+    col_starts = get_block_starts(mat.shape[1], cols)
+
+    if method == 'max':
+        mat = np.fmax.reduceat(mat, row_starts, axis=0)
+        return np.fmax.reduceat(mat, col_starts, axis=1)
+
+    if not method == 'mode':
+        raise ValueError('unknown aggregation method {}'.format(method))
+
+    num_states = int(np.nanmax(mat)) + 2 if not np.isnan(mat).all() else 1
+
+    col_blocks = np.repeat(np.arange(cols), np.diff(np.append(col_starts, mat.shape[1])))
+
+    image = np.full((rows, cols), np.nan)
+
+    # one row of blocks at a time, counts of every state per block
+    row_ends = np.append(row_starts[1:], mat.shape[0])
+    for row, (start, end) in enumerate(zip(row_starts, row_ends)):
+        block = np.rint(mat[start:end])
+        valid = ~np.isnan(block)
+
+        keys = (col_blocks * num_states)[None, :] + np.where(valid, block, 0).astype(np.int64)
+
+        counts = np.bincount(keys[valid], minlength=cols * num_states)
+        counts = counts.reshape((cols, num_states))
+
+        image[row] = np.where(counts.any(axis=1), counts.argmax(axis=1), np.nan)
+
+    return image
+
+
 class ClusterMap(object):
 
     def __init__(self, data, colordata, max_cn, chromosomes=None,
-                 scale_by_cells=False, distance_matrix=None):
+                 scale_by_cells=False, distance_matrix=None,
+                 image_size=None, image_aggregation='mode'):
         """
         :param data pandas dataframe with bins as columns and samples as rows
         :param colordata: dict with samples and their corresponding type
                         used for adding a colorbar
+        :param image_size: max (rows, columns) of the heatmap image. the
+                        matrix is downsampled to fit and drawn as a single
+                        raster image, every cell and bin is drawn with
+                        pcolormesh if not set
+        :param image_aggregation: mode or max, see downsample_matrix
         """
 
         if chromosomes:
@@ -32,6 +92,9 @@ class ClusterMap(object):
 
         self.scale_by_cells = scale_by_cells
 
+        self.image_size = image_size
+        self.image_aggregation = image_aggregation
+
         self.max_cn = max_cn + 1
 
         self.colordata = colordata
@@ -39,7 +102,7 @@ class ClusterMap(object):
 
         self.bins = data.columns.values
 
-        self.data = data.as_matrix()
+        self.data = data.values
 
         # set max for data
         self.data = np.clip(self.data, 0, self.max_cn)
@@ -91,8 +154,8 @@ class ClusterMap(object):
         low_states = np.arange(3, low_max)
         hi_states = np.arange(low_max, hi_max)
 
-        low_cmap = matplotlib.cm.get_cmap('OrRd', low_max + 1)
-        hi_cmap = matplotlib.cm.get_cmap('RdPu', hi_max + 1)
+        low_cmap = plt.get_cmap('OrRd', low_max + 1)
+        hi_cmap = plt.get_cmap('RdPu', hi_max + 1)
 
         for cn_level in low_states:
             rgb = low_cmap(int(cn_level))[:3]
@@ -130,7 +193,8 @@ class ClusterMap(object):
         else:
             linkage = hc.linkage(self.distance_matrix, method='average')
 
-        hc.dendrogram(linkage, orientation='left')
+        # leaf labels are cleared below, skip creating them
+        hc.dendrogram(linkage, orientation='left', no_labels=True)
         ax1.set_xticks([])
         ax1.set_yticks([])
         ax1.set_facecolor("white")
@@ -194,20 +258,41 @@ class ClusterMap(object):
 
         axm = fig.add_axes(placement)
 
-        mat = np.ma.masked_where(np.isnan(mat), mat)
+        vmin = np.nanmin(mat)
+        vmax = np.nanmax(mat)
+
+        if self.image_size:
+            image = downsample_matrix(mat, self.image_size, method=self.image_aggregation)
+            image = np.ma.masked_where(np.isnan(image), image)
+
+            # image stretched over the matrix coordinates, so the
+            # vector labels and chromosome lines line up
+            axm.imshow(
+                image,
+                cmap=cmap,
+                vmin=vmin,
+                vmax=vmax,
+                origin='lower',
+                aspect='auto',
+                interpolation='nearest',
+                extent=(0, mat.shape[1], 0, mat.shape[0]))
+        else:
+            mat = np.ma.masked_where(np.isnan(mat), mat)
 
-        axm.pcolormesh(
-            mat,
-            cmap=cmap,
-            rasterized=True,
-            vmin=np.nanmin(mat),
-            vmax=np.nanmax(mat))
+            axm.pcolormesh(
+                mat,
+                cmap=cmap,
+                rasterized=True,
+                vmin=vmin,
+                vmax=vmax)
 
         axm.set_yticks([])
 
-        for i in range(mat.shape[0]):
-            axm.text(mat.shape[1] - 0.5, i, self.rows[leaves[i]],
-                     fontsize=12)
+        # labels only fit if every cell has its own row in the image
+        if not self.image_size or mat.shape[0] <= self.image_size[0]:
+            for i in range(mat.shape[0]):
+                axm.text(mat.shape[1] - 0.5, i, self.rows[leaves[i]],
+                         fontsize=12)
 
         chr_idxs = self.get_chr_idxs(self.bins)
         axm.set_xticks(chr_idxs)
@@ -238,16 +323,17 @@ class ClusterMap(object):
 
         cbar = matplotlib.colorbar.ColorbarBase(axes, cmap=cmap, norm=norm,
                                                 orientation='horizontal')
-        cbar.set_ticks([v + 0.5 for v in bounds])
+        # one tick per color
+        cbar.set_ticks([v + 0.5 for v in bounds[:-1]])
 
         if not ticklabels:
             ticklabels = [
                 str(v).replace(str(self.max_cn), str(self.max_cn - 1) + "+") for v in bounds]
 
-        if ticklabels:
-            cbar.set_ticklabels(ticklabels)
-        else:
-            cbar.set_ticklabels(bounds)
+        ticklabels = list(ticklabels)[:cmap.N]
+        ticklabels += [''] * (cmap.N - len(ticklabels))
+
+        cbar.set_ticklabels(ticklabels)
 
     def generate_plot(self):
         """generates a figure with dendrogram, colorbar, heatmap and legends
@@ -6,6 +6,11 @@ Created on Nov 16, 2016
 from __future__ import division
 
 import argparse
+import collections
+import io
+import multiprocessing
+import tarfile
+import time
 
 import matplotlib
 import pandas as pd
@@ -120,6 +125,17 @@ class GenHmmPlots(object):
 
         self.max_cn = kwargs.get("max_cn")
 
+        # layout and colors can be shared between cells, see BatchHmmPlots
+        self.chromosome_info = kwargs.get("chromosome_info")
+        if self.chromosome_info is None:
+            self.chromosome_info = utl.extract_chromosome_info(self.ref_genome)
+
+        self.colors = kwargs.get("colors")
+        if not self.colors:
+            self.colors = self.get_colors(self.num_states)
+
+        self.corrected_reads = None
+
     def __enter__(self):
         return self
 
@@ -127,6 +143,9 @@ class GenHmmPlots(object):
         pass
 
     def read_csv(self, infile):
+        # tables of a single cell are passed in directly in batch mode
+        if isinstance(infile, pd.DataFrame):
+            return infile.copy()
         return csvutils.read_csv_and_yaml(infile)
 
     def read_metrics(self):
@@ -147,14 +166,22 @@ class GenHmmPlots(object):
         """
 
         """
+        if self.corrected_reads is not None:
+            return self.corrected_reads
+
         reads_file = self.reads
         df = self.read_csv(reads_file)
 
         df = utl.normalize_reads(df)
-        df = utl.compute_chromosome_coordinates(df, self.ref_genome)
+        df = utl.compute_chromosome_coordinates(
+            df, self.ref_genome, chromosome_info=self.chromosome_info
+        )
 
         # clip the copy column to 40 to avoid crashes due to super high outliers in data
         df["copy"] = np.clip(df["copy"], 0, 40)
+
+        # used by both the segments and the bias plots
+        self.corrected_reads = df
         return df
 
     def read_segments(self):
@@ -173,7 +200,9 @@ class GenHmmPlots(object):
             chromosomes = list(map(str, range(1, 23))) + ['X', 'Y']
             df["chr"] = pd.Categorical(df["chr"], chromosomes)
             df = df.sort_values(['chr', 'start', 'end'])
-            df = utl.compute_chromosome_coordinates(df, self.ref_genome)
+            df = utl.compute_chromosome_coordinates(
+                df, self.ref_genome, chromosome_info=self.chromosome_info
+            )
             return df
         else:
             return None
@@ -282,7 +311,8 @@ class GenHmmPlots(object):
         plt.savefig(pdfout, pad_inches=0.2, format='png')
         plt.close()
 
-    def get_colors(self, num_states):
+    @staticmethod
+    def get_colors(num_states):
 
         color_reference = {0: '#3498DB', 1: '#85C1E9', 2: '#808080'}
 
@@ -291,8 +321,8 @@ class GenHmmPlots(object):
         low_states = np.arange(3, low_max)
         hi_states = np.arange(low_max, hi_max)
 
-        low_cmap = matplotlib.cm.get_cmap('OrRd', low_max + 1)
-        hi_cmap = matplotlib.cm.get_cmap('RdPu', hi_max + 1)
+        low_cmap = plt.get_cmap('OrRd', low_max + 1)
+        hi_cmap = plt.get_cmap('RdPu', hi_max + 1)
 
         for cn_level in low_states:
             rgb = low_cmap(int(cn_level))[:3]
@@ -326,7 +356,7 @@ class GenHmmPlots(object):
 
         fig = plt.figure(figsize=(width_plot, height_plot))
 
-        cmap = self.get_colors(self.num_states)
+        cmap = self.colors
 
         utl.add_legend(
             fig,
@@ -348,7 +378,9 @@ class GenHmmPlots(object):
             reads = reads[reads['chr'] != 'Y']
 
         ax = plt.subplot(gs[0, 0])
-        ax = utl.create_chromosome_plot_axes(ax, self.ref_genome)
+        ax = utl.create_chromosome_plot_axes(
+            ax, self.ref_genome, chromosome_info=self.chromosome_info
+        )
 
         # we pass None if we don't have data
         cols = reads["state"].replace(cmap)
@@ -485,6 +517,269 @@ class GenHmmPlots(object):
         self.plot_segments(self.segs_pdf)
         self.plot_bias(self.bias_pdf)
 
+
+# per process state, set once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(ref_genome, kwargs):
+    _worker_state['ref_genome'] = ref_genome
+    _worker_state['kwargs'] = kwargs
+
+
+def _plot_cell(cell_id, reads, segments, params, metrics, sample_info):
+    """renders the plots of one cell in memory
+    :returns cell id, segments png and bias png
+    """
+    segs_out = io.BytesIO()
+    bias_out = io.BytesIO()
+
+    with GenHmmPlots(
+            reads, segments, params, metrics, _worker_state['ref_genome'],
+            segs_out, bias_out, cell_id, sample_info=sample_info,
+            **_worker_state['kwargs']
+    ) as plot:
+        plot.main()
+
+    return cell_id, segs_out.getvalue(), bias_out.getvalue()
+
+
+class CellTableReader(object):
+    """
+    reads a merged per cell table one cell at a time. cells are
+    requested in the order of the table (the merged tables are all
+    concatenated in the same cell order), so only the current chunk
+    and cell are in memory. cells that are read ahead of the one
+    requested are buffered, cells that are never requested are skipped.
+    """
+
+    def __init__(self, filepath, cells, usecols=None, chunksize=10 ** 5):
+        """
+        :param filepath: merged table with a cell_id column
+        :param cells: cells in the order they are requested
+        :param usecols: only load these columns
+        :param chunksize: rows read at a time
+        """
+        self.filepath = filepath
+        self.ranks = {cell_id: rank for rank, cell_id in enumerate(cells)}
+
+        reader = csvutils.CsvInput(filepath)
+        columns = [col for col in reader.columns if not usecols or col in usecols]
+        self.empty = reader.cast_dataframe(pd.DataFrame(columns=columns))
+        self.chunks = reader.read_csv(chunksize=chunksize, usecols=usecols)
+
+        # complete cells read ahead of the current one
+        self.buffer = {}
+        # rows of the last cell in the chunks read so far, the cell
+        # can continue in the next chunk
+        self.partial = []
+        # rank of the last requested cell seen in the table
+        self.last_rank = -1
+        # cells that were not found before a later cell
+        self.missing = set()
+        self.exhausted = False
+
+    def add_cell(self, frames):
+        cell_id = frames[0]['cell_id'].iloc[0]
+
+        if cell_id in self.missing:
+            raise ValueError(
+                '{} is not in the same cell order as the metrics, '
+                '{} was found after a later cell'.format(self.filepath, cell_id)
+            )
+
+        if cell_id not in self.ranks:
+            return
+
+        if cell_id in self.buffer:
+            frames = [self.buffer[cell_id]] + frames
+
+        self.buffer[cell_id] = frames[0] if len(frames) == 1 else pd.concat(frames)
+
+    def read_chunk(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            if self.partial:
+                self.add_cell(self.partial)
+                self.partial = []
+            self.exhausted = True
+            return
+
+        cell_ids = chunk['cell_id'].values
+        bounds = np.flatnonzero(cell_ids[1:] != cell_ids[:-1]) + 1
+        bounds = [0] + bounds.tolist() + [len(chunk)]
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+
+            cell_id = cell_ids[start]
+
+            if self.partial and self.partial[0]['cell_id'].iloc[0] != cell_id:
+                self.add_cell(self.partial)
+                self.partial = []
+
+            self.partial.append(chunk.iloc[start:end])
+            self.last_rank = max(self.last_rank, self.ranks.get(cell_id, -1))
+
+    def get_cell(self, cell_id):
+        """
+        :returns rows of the cell, empty if the cell is not in the table
+        """
+        rank = self.ranks[cell_id]
+
+        while cell_id not in self.buffer and not self.exhausted \
+                and self.last_rank <= rank:
+            self.read_chunk()
+
+        if cell_id not in self.buffer:
+            self.missing.add(cell_id)
+            return self.empty
+
+        return self.buffer.pop(cell_id)
+
+    def close(self):
+        """
+        reads the rest of the table to check that none of the missing
+        cells turn up later
+        """
+        while not self.exhausted:
+            self.read_chunk()
+
+
+class BatchHmmPlots(object):
+    """
+    segments and bias plots for all cells from the merged hmmcopy
+    tables. the tables are streamed one cell at a time, see
+    CellTableReader. chromosome layout and colors are computed once,
+    cells are rendered in a process pool and the pngs are written
+    straight into the output tarballs.
+    """
+
+    reads_columns = [
+        'cell_id', 'chr', 'start', 'end', 'reads', 'gc', 'map', 'copy',
+        'state', 'valid', 'ideal', 'modal_curve', 'cor_gc'
+    ]
+
+    def __init__(self, reads, segments, params, metrics, ref_genome,
+                 segs_tar, bias_tar, processes=1, sample_info=None,
+                 **kwargs):
+        """
+        :param reads: merged hmmcopy reads
+        :param segments: merged hmmcopy segments
+        :param params: merged hmmcopy params
+        :param metrics: merged hmmcopy metrics
+        :param segs_tar: output tarball with <cell>_segments.png files
+        under segments/
+        :param bias_tar: output tarball with <cell>_bias.png files
+        under bias/
+        :param processes: size of the process pool
+        :param sample_info: dict of cell id to dict of annotations
+        :param kwargs: passed on to GenHmmPlots
+        """
+        self.reads = reads
+        self.segments = segments
+        self.params = params
+        self.metrics = metrics
+        self.ref_genome = ref_genome
+        self.segs_tar = segs_tar
+        self.bias_tar = bias_tar
+        self.processes = processes
+        self.sample_info = sample_info or {}
+
+        num_states = kwargs.get('num_states') or 7
+
+        self.kwargs = dict(kwargs)
+        self.kwargs['chromosome_info'] = utl.extract_chromosome_info(ref_genome)
+        self.kwargs['colors'] = GenHmmPlots.get_colors(num_states)
+
+    def get_tasks(self):
+        """
+        cells are plotted in the order of the metrics. reads, segments
+        and params are streamed one cell at a time, metrics are small
+        and loaded at once
+        """
+        metrics = csvutils.read_csv_and_yaml(self.metrics)
+        metrics_indices = metrics.groupby('cell_id').indices
+
+        cells = metrics['cell_id'].unique().tolist()
+
+        readers = [
+            CellTableReader(self.reads, cells, usecols=self.reads_columns),
+            CellTableReader(self.segments, cells),
+            CellTableReader(self.params, cells),
+        ]
+
+        for cell_id in cells:
+            data = [reader.get_cell(cell_id) for reader in readers]
+            data.append(metrics.iloc[metrics_indices.get(cell_id, [])])
+            yield [cell_id] + data + [self.sample_info.get(cell_id)]
+
+        for reader in readers:
+            reader.close()
+
+    def plot(self):
+        """
+        :returns generator of (cell id, segments png, bias png) in
+        the order of the cells
+        """
+        tasks = self.get_tasks()
+
+        if self.processes <= 1:
+            _init_worker(self.ref_genome, self.kwargs)
+            for task in tasks:
+                yield _plot_cell(*task)
+            return
+
+        pool = multiprocessing.Pool(
+            processes=self.processes,
+            initializer=_init_worker,
+            initargs=(self.ref_genome, self.kwargs)
+        )
+
+        # bounded number of cells in flight, so that only those are
+        # copied to the workers
+        pending = collections.deque()
+        try:
+            for task in tasks:
+                pending.append(pool.apply_async(_plot_cell, task))
+                if len(pending) >= 4 * self.processes:
+                    yield pending.popleft().get()
+
+            while pending:
+                yield pending.popleft().get()
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def add_to_tar(tar, name, data=None):
+        info = tarfile.TarInfo(name)
+        info.mtime = time.time()
+
+        if data is None:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            tar.addfile(info)
+        else:
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+
+    def main(self):
+        with tarfile.open(self.segs_tar, 'w:gz') as segs_tar, \
+                tarfile.open(self.bias_tar, 'w:gz') as bias_tar:
+            self.add_to_tar(segs_tar, 'segments')
+            self.add_to_tar(bias_tar, 'bias')
+
+            for cell_id, segs_png, bias_png in self.plot():
+                self.add_to_tar(segs_tar, 'segments/{}_segments.png'.format(cell_id), segs_png)
+                self.add_to_tar(bias_tar, 'bias/{}_bias.png'.format(cell_id), bias_png)
+
+
 if __name__ == '__main__':
     args = parse_args()
 
@@ -18,8 +18,9 @@ from collections import defaultdict
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import logging
-from single_cell.utils import helpers
+from single_cell.utils import clusteringutils
 from single_cell.utils import csvutils
+from single_cell.utils import helpers
 from .heatmap import ClusterMap
 
 sys.setrecursionlimit(2000)
@@ -54,6 +55,10 @@ class PlotPcolor(object):
 
         self.scale_by_cells = kwargs.get("scale_by_cells")
 
+        # draw the heatmap as a downsampled image, see ClusterMap
+        self.image_size = kwargs.get("image_size")
+        self.image_aggregation = kwargs.get("image_aggregation") or 'mode'
+
         self.color_by_col = kwargs.get('color_by_col')
         self.plot_by_col = kwargs.get('plot_by_col')
 
@@ -95,22 +100,6 @@ class PlotPcolor(object):
 
         return lbl_idx
 
-    def sort_bins_hdf(self, bins):
-
-        bins = bins.drop_duplicates()
-
-        # just the sort order in here, dont need to change for mouse.
-        # might need to extend if reference has more genomes than human
-        chromosomes = map(str, range(1, 23)) + ['X', 'Y']
-
-        bins["chr"] = pd.Categorical(bins["chr"], chromosomes)
-
-        bins = bins.sort_values(['chr', 'start', ])
-
-        bins = [tuple(v) for v in bins.values.tolist()]
-
-        return bins
-
     def read_segs(self):
 
         extension = os.path.splitext(self.input)[-1]
@@ -120,126 +109,59 @@ class PlotPcolor(object):
         else:
             return self.read_segs_csv()
 
-    def sum_two_dataframes(self, df):
-        def sum_nan(y):
-            if np.isnan(y).all():
-                return float("nan")
-            return np.nansum(y)
-
-        if len(df) == 1:
-            return df.iloc[0]
-        else:
-            return df.apply(sum_nan)
+    def get_segs_columns(self):
+        columns = ['cell_id', 'chr', 'start', 'end', self.column_name]
+        if self.mappability_threshold:
+            columns.append('map')
+        return columns
 
     def read_segs_hdf(self):
+        chunks = pd.read_hdf(
+            self.input, chunksize=10 ** 6, key=self.segs_tablename,
+            columns=self.get_segs_columns()
+        )
 
-        data = []
-        chunksize = 10 ** 6
-        for chunk in pd.read_hdf(
-                self.input, chunksize=chunksize, key=self.segs_tablename):
-            # set low mapp regions to white
-            chunk[
-                self.column_name].loc[
-                chunk['map'] <= self.mappability_threshold] = float("nan")
-
-            chunk["bin"] = list(zip(chunk.chr, chunk.start, chunk.end))
-
-            chunk = chunk.pivot(
-                index='cell_id',
-                columns='bin',
-                values=self.column_name)
-
-            data.append(chunk)
-
-        # merge chunks, sum cells that get split across chunks
-        table = pd.concat(data)
-        table = table.groupby(table.index).apply(self.sum_two_dataframes)
-
-        bins = pd.DataFrame(
-            table.columns.values.tolist(),
-            columns=[
-                'chr',
-                'start',
-                'end'])
-
-        bins = self.sort_bins_hdf(bins)
-
-        table = table[bins]
-
-        return table
+        return self.get_segs_matrix(chunks)
 
     def read_segs_csv(self):
         """
         read the input file
         """
-        data = {}
-
-        bins = {}
-
-        header, _, columns = csvutils.get_metadata(self.input)
-
-        with helpers.getFileHandle(self.input, 'rt') as freader:
-            idxs = self.build_label_indices(columns)
-
-            if header:
-                assert freader.readline().strip().split(',') == columns
-
-            for line in freader:
-                line = line.strip().split(self.sep)
-
-                sample_id = line[idxs['cell_id']]
-
-                val = line[idxs[self.column_name]]
-
-                val = float('nan') if val == "NA" else float(val)
-
-                chrom = line[idxs['chr']]
-                start = int(line[idxs['start']])
-                end = int(line[idxs['end']])
-
-                seg = (chrom, start, end)
-
-                if self.mappability_threshold and float(line[idxs["map"]]) <= self.mappability_threshold:
-                    val = float("nan")
-
-                if chrom not in bins:
-                    bins[chrom] = set()
-                bins[chrom].add((start, end))
-
-                # just a sanity check, not required
-                if sample_id in data and seg in data[sample_id]:
-                    raise Exception("repeated val")
-
-                if sample_id not in data:
-                    data[sample_id] = {}
-
-                data[sample_id][seg] = val
-
-            samples = sorted(data.keys())
-            bins = self.sort_bins_csv(bins)
-
-            data = self.conv_to_matrix(data, bins, samples)
-            data = self.get_pandas_dataframe(data, bins)
+        chunks = csvutils.read_csv_and_yaml(
+            self.input, chunksize=10 ** 6, usecols=self.get_segs_columns()
+        )
 
-        return data
+        return self.get_segs_matrix(chunks)
 
-    def sort_bins_csv(self, bins):
+    def mask_low_mappability(self, chunks):
         """
-        sort the bins based on genomic coords
+        set low mapp regions to white
         """
-        assert set(self.chromosomes) == set(bins.keys())
+        for chunk in chunks:
+            if self.mappability_threshold:
+                chunk.loc[chunk['map'] <= self.mappability_threshold, self.column_name] = float('nan')
+            yield chunk
 
-        sort_bins = []
-        for chrom in self.chromosomes:
-            bin_vals = bins[chrom]
-
-            bin_vals = sorted(bin_vals)
+    def get_segs_matrix(self, chunks):
+        """
+        load the values into a cells x bins float32 matrix, bins are
+        sorted by genomic coords
+        :returns dataframe with cells as rows and (chr, start, end)
+        bins as columns
+        """
+        cells, bins, data = clusteringutils.get_cell_bin_matrix(
+            self.mask_low_mappability(chunks), self.column_name,
+            chromosomes=self.chromosomes
+        )
 
-            bin_vals = [(chrom, bin_v[0], bin_v[1]) for bin_v in bin_vals]
+        # skip sample if all vals are nan or inf
+        keep = ~(np.isnan(data).all(axis=1) | np.isinf(data).all(axis=1))
 
-            sort_bins += bin_vals
+        columns = pd.MultiIndex.from_arrays(
+            [bins['chr'].values, bins['start'].values, bins['end'].values]
+        )
 
-        return sort_bins
+        return pd.DataFrame(data[keep], index=cells[keep], columns=columns)
 
     def read_metrics_csv(self, cndata):
         """
@@ -355,36 +277,6 @@ class PlotPcolor(object):
         else:
             return self.read_metrics_csv(cndata)
 
-    def conv_to_matrix(self, data, bins, samples):
-        """
-        convert dict to numpy array
-        """
-        outdata = {}
-
-        for sample in samples:
-            cndata = [data[sample][bin_v] for bin_v in bins]
-
-            # skip sample if all vals are nan or inf
-            if np.isnan(cndata).all() or np.isinf(cndata).all():
-                continue
-
-            outdata[sample] = cndata
-
-        return outdata
-
-    def get_pandas_dataframe(self, data, bins):
-        """
-        convert array into dataframe
-        provides an elegant way to annotate samples on the plot
-        to remove nan rows and mask NA values
-        only adds ~5s to runtime
-        """
-        df = pd.DataFrame(data)
-        df = df.T
-        df.columns = bins
-
-        return df
-
     def filter_data(
             self, data, ccdata, mad_scores, numreads_data, reads_per_bin):
         """
@@ -429,7 +321,9 @@ class PlotPcolor(object):
             self.max_cn,
             chromosomes=self.chromosomes,
             scale_by_cells=self.scale_by_cells,
-            distance_matrix=distance_matrix
+            distance_matrix=distance_matrix,
+            image_size=self.image_size,
+            image_aggregation=self.image_aggregation
         )
 
         plt.suptitle(title)
@@ -479,7 +373,8 @@ class PlotPcolor(object):
             if len(samples) < 2:
                 continue
 
-            if len(samples) > 1000 and not self.high_memory:
+            # the image mode draws any number of cells at a fixed size
+            if len(samples) > 1000 and not self.high_memory and not self.image_size:
                 logging.getLogger("single_cell.plot_heatmap").warn(
                     'The output file will only plot 1000 cells per page,'
                     ' add --high_memory to override'
@@ -599,6 +494,19 @@ def parse_args():
                         action="store_true",
                         help="scale the height of plot by number of cells")
 
+    parser.add_argument('--image_size',
+                        nargs=2,
+                        type=int,
+                        default=None,
+                        metavar=('ROWS', 'COLUMNS'),
+                        help='draw the heatmap as a raster image of at most this many'
+                             ' rows and columns, cells and bins are aggregated to fit')
+
+    parser.add_argument('--image_aggregation',
+                        default='mode',
+                        choices=('mode', 'max'),
+                        help='aggregation of cells and bins for --image_size')
+
     parser.add_argument('--high_memory',
                         action='store_true',
                         help='set this flag to override the default limit of 1000 cells'
@@ -619,5 +527,6 @@ if __name__ == '__main__':
                    high_memory=ARGS.high_memory, plot_title=ARGS.plot_title,
                    color_by_col=ARGS.color_by_col, plot_by_col=ARGS.plot_by_col,
                    separator=ARGS.separator, max_cn=ARGS.max_cn, scale_by_cells=ARGS.scale_by_cells,
-                   mappability_threshold=ARGS.mappability_threshold)
+                   mappability_threshold=ARGS.mappability_threshold,
+                   image_size=ARGS.image_size, image_aggregation=ARGS.image_aggregation)
     m.main()
@@ -50,8 +50,9 @@ def extract_chromosome_info(ref_genome):
     return (chromosome_info)
 
 
-def create_chromosome_plot_axes(ax, ref_genome):
-    chromosome_info = extract_chromosome_info(ref_genome)
+def create_chromosome_plot_axes(ax, ref_genome, chromosome_info=None):
+    if chromosome_info is None:
+        chromosome_info = extract_chromosome_info(ref_genome)
     ax.set_xlim((-0.5, chromosome_info['end'].max()))
     ax.set_xticks([0] + list(chromosome_info['end'].values))
     ax.set_xticklabels([])
@@ -61,8 +62,9 @@ def create_chromosome_plot_axes(ax, ref_genome):
     return (ax)
 
 
-def compute_chromosome_coordinates(df, ref_genome):
-    chromosome_info = extract_chromosome_info(ref_genome)
+def compute_chromosome_coordinates(df, ref_genome, chromosome_info=None):
+    if chromosome_info is None:
+        chromosome_info = extract_chromosome_info(ref_genome)
     df = df[df['chr'].isin(chromosome_info.index.values)]
     df.set_index('chr', inplace=True)
     df['chromosome_start'] = chromosome_info['start']
@@ -130,6 +130,67 @@ class TestAnnotateCsv(helpers.AnnotationHelpers):
 
         assert self.validate_annotation_test(csv, annotation, annotated, "cell_id")
 
+    def test_annotate_csv_chunks(self, tmpdir, n_rows):
+        """
+        test annotating csv a few rows at a time
+        :param tmpdir: temporary directory to write in
+        :param n_rows: number of rows in test csvs
+        """
+        dtypes = {v: "int" for v in 'ABCD'}
+        dtypes["cell_id"] = "str"
+        ann_dtypes = {v: "int" for v in 'ERF'}
+        annotated = os.path.join(tmpdir, "annotated.csv.gz")
+
+        csv, annotation = self.make_ann_test_inputs(tmpdir, n_rows, dtypes,
+                                                    ann_dtypes)
+
+        csvutils.annotate_csv(csv, annotation, annotated, ann_dtypes, chunksize=2)
+
+        assert self.validate_annotation_test(csv, annotation, annotated, "cell_id")
+
+    def test_annotate_csv_existing_col(self, tmpdir, n_rows):
+        """
+        test that rows without annotation keep their values in
+        annotation columns that are already in the csv
+        :param tmpdir: temporary directory to write in
+        :param n_rows: number of rows in test csvs
+        """
+        dtypes = {v: "int" for v in 'ABCD'}
+        dtypes["cell_id"] = "str"
+        annotated = os.path.join(tmpdir, "annotated.csv.gz")
+
+        csv, _ = self.make_ann_test_inputs(tmpdir, n_rows, dtypes, {})
+
+        df = csvutils.CsvInput(csv).read_csv()
+        annotation = {df["cell_id"][0]: {"A": 100}}
+
+        csvutils.annotate_csv(csv, annotation, annotated, {"A": "int"})
+
+        expected = df.copy()
+        expected.loc[0, "A"] = 100
+
+        assert self.dfs_exact_match(expected, annotated)
+
+    def test_annotate_csv_missing_dtype(self, tmpdir, n_rows):
+        """
+        test annotating csv with columns missing from annotation_dtypes
+        :param tmpdir: temporary directory to write in
+        :param n_rows: number of rows in test csvs
+        """
+        dtypes = {v: "int" for v in 'ABCD'}
+        dtypes["cell_id"] = "str"
+        ann_dtypes = {v: "int" for v in 'ERF'}
+        annotated = os.path.join(tmpdir, "annotated.csv.gz")
+
+        csv, annotation = self.make_ann_test_inputs(tmpdir, n_rows, dtypes,
+                                                    ann_dtypes)
+
+        with pytest.raises(csvutils.CsvAnnotateError):
+            csvutils.annotate_csv(csv, annotation, annotated, {"E": "int"})
+
+        with pytest.raises(csvutils.CsvAnnotateError):
+            csvutils.annotate_csv(csv, annotation, annotated, dict(ann_dtypes, A="float"))
+
 
 class TestConcatCsv(helpers.ConcatHelpers):
     """
@@ -352,6 +413,51 @@ class TestConcatCsvFilesPandas(helpers.ConcatHelpers):
         assert self.dfs_exact_match(ref, concatenated)
 
 
+class TestConcatCsvFilesStreaming(helpers.ConcatHelpers):
+    """
+    test class for csvutils concatenate_csv_files_streaming
+    """
+    def test_streaming_concat_reordered_cols(self, tmpdir, n_rows, n_frames):
+        """
+        inputs with the same columns in different orders, read in small chunks
+        """
+        dtypes = {v: "int" for v in 'ABCD'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs = self.make_test_dfs([dtypes] * n_frames, n_rows)
+        dfs = [df[list(np.random.permutation(df.columns))] for df in dfs]
+        csvs = self.write_dfs(tmpdir, dfs, [dtypes] * n_frames)
+
+        columns = list('ABCD')
+        csvutils.concatenate_csv_files_streaming(
+            csvs, concatenated, dtypes, columns, chunksize=2
+        )
+
+        ref = pd.concat(dfs, ignore_index=True)
+        assert self.dfs_exact_match(ref, concatenated)
+        assert csvutils.CsvInput(concatenated).columns == columns
+
+    def test_streaming_concat_missing_cols(self, tmpdir, n_rows):
+        """
+        columns missing from an input are filled with NaN
+        """
+        dtypes1 = {v: "float" for v in 'ABCD'}
+        dtypes2 = {v: "float" for v in 'ABGF'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs, csvs, ref = self.base_test_concat(n_rows, [dtypes1, dtypes2], write=True,
+                                               get_ref=True, dir=tmpdir)
+
+        columns = csvutils.get_union_columns([list('ABCD'), list('ABGF')])
+        assert columns == list('ABCDGF')
+
+        csvutils.concatenate_csv_files_streaming(
+            csvs, concatenated, csvutils.merge_dtypes([dtypes1, dtypes2]), columns
+        )
+
+        assert self.dfs_exact_match(ref, concatenated)
+
+
 class TestConcatCsvFilesQuickLowMem(helpers.ConcatHelpers):
     """
     test class for csvutils concat_csv_files_quick_lowmem
@@ -835,3 +941,144 @@ class TestMergeCsv(helpers.MergeHelpers):
         assert os.path.exists(merged)
 
         assert self.dfs_exact_match(ref, merged)
+
+
+class TestReadCsvChunks(helpers.TestInputs):
+    """
+    class to test reading csv files in chunks
+    """
+    dtypes = {"A": "int", "B": "float", "C": "str"}
+
+    def open_tracked(self, monkeypatch):
+        """
+        records the file handles opened by csvutils
+        """
+        handles = []
+        gzip_open = csvutils.gziputils.open
+
+        def tracked_open(*args, **kwargs):
+            handle = gzip_open(*args, **kwargs)
+            handles.append(handle)
+            return handle
+
+        monkeypatch.setattr(csvutils.gziputils, "open", tracked_open)
+        return handles
+
+    def test_read_csv_chunks(self, tmpdir, n_rows, monkeypatch):
+        """
+        chunks add up to the file and the file is closed at the end
+        """
+        df = self.make_test_df(self.dtypes, n_rows)
+        csv = self.write_dfs(tmpdir, [df], [self.dtypes])[0]
+
+        handles = self.open_tracked(monkeypatch)
+
+        chunks = list(csvutils.read_csv_and_yaml(csv, chunksize=2))
+
+        assert all(len(chunk) <= 2 for chunk in chunks)
+        data = pd.concat(chunks, ignore_index=True)
+        assert data["A"].tolist() == df["A"].tolist()
+
+        assert len(handles) == 1
+        assert handles[0].closed
+
+    def test_read_csv_chunks_not_consumed(self, tmpdir, n_rows, monkeypatch):
+        """
+        an unconsumed generator opens nothing, a partly consumed
+        generator closes the file when it is closed
+        """
+        df = self.make_test_df(self.dtypes, n_rows)
+        csv = self.write_dfs(tmpdir, [df], [self.dtypes])[0]
+
+        handles = self.open_tracked(monkeypatch)
+
+        chunks = csvutils.read_csv_and_yaml(csv, chunksize=2)
+        assert not handles
+        del chunks
+
+        chunks = csvutils.read_csv_and_yaml(csv, chunksize=2)
+        next(chunks)
+        assert not handles[0].closed
+        chunks.close()
+        assert handles[0].closed
+
+
+class TestColumnarStorage(helpers.TestInputs):
+    """
+    class to test the columnar (.npz) storage backend
+    """
+    dtypes = {"A": "int", "B": "float", "C": "str", "D": "bool"}
+
+    def write_pair(self, tmpdir, df, name, write_header=True):
+        """
+        writes df as gzipped csv and as columnar table
+        """
+        outputs = []
+        for ext in ("csv.gz", "npz"):
+            filename = os.path.join(tmpdir, "{}.{}".format(name, ext))
+            csvutils.write_dataframe_to_csv_and_yaml(
+                df.copy(), filename, self.dtypes, write_header=write_header
+            )
+            outputs.append(filename)
+        return outputs
+
+    def test_columnar_round_trip(self, tmpdir, n_rows):
+        """
+        columnar tables read back the same as csv
+        """
+        df = self.make_test_df(self.dtypes, n_rows)
+        df.loc[0, "B"] = np.nan
+        df.loc[1, "C"] = np.nan
+
+        csv, columnar = self.write_pair(tmpdir, df, "data")
+
+        assert csvutils.get_metadata(csv) == csvutils.get_metadata(columnar)
+        pd.testing.assert_frame_equal(
+            csvutils.read_csv_and_yaml(csv), csvutils.read_csv_and_yaml(columnar)
+        )
+
+    def test_columnar_usecols_and_chunks(self, tmpdir, n_rows):
+        """
+        read a subset of columns, in chunks
+        """
+        df = self.make_test_df(self.dtypes, n_rows)
+        _, columnar = self.write_pair(tmpdir, df, "data")
+
+        chunks = list(csvutils.read_csv_and_yaml(
+            columnar, chunksize=2, usecols=["C", "A"]
+        ))
+
+        assert all(len(chunk) <= 2 for chunk in chunks)
+        data = pd.concat(chunks, ignore_index=True)
+        assert list(data.columns) == ["A", "C"]
+        assert data["A"].tolist() == df["A"].tolist()
+        assert data["C"].tolist() == df["C"].tolist()
+
+        with pytest.raises(csvutils.CsvParseError):
+            csvutils.read_csv_and_yaml(columnar, usecols=["A", "E"])
+
+    def test_columnar_concat(self, tmpdir, n_rows):
+        """
+        concatenate headerless csv and columnar inputs into both formats
+        """
+        dfs = [self.make_test_df(self.dtypes, n_rows) for _ in range(3)]
+        inputs = [
+            self.write_pair(tmpdir, df, str(i), write_header=False)[i % 2]
+            for i, df in enumerate(dfs)
+        ]
+
+        expected = pd.concat(dfs, ignore_index=True)
+
+        for ext in ("csv.gz", "npz"):
+            output = os.path.join(tmpdir, "concat.{}".format(ext))
+            csvutils.concatenate_csv(inputs, output)
+            pd.testing.assert_frame_equal(
+                csvutils.read_csv_and_yaml(output), expected, check_exact=False
+            )
+
+    def test_unsupported_extension(self, tmpdir):
+        """
+        extensions other than .gz and .npz are rejected
+        """
+        with pytest.raises(csvutils.CsvWriterError):
+            csvutils.CsvOutput(os.path.join(tmpdir, "data.parquet"), self.dtypes)
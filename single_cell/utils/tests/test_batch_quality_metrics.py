@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+import pytest
+from single_cell.workflows.hmmcopy.scripts import batch_quality_metrics
+from single_cell.workflows.hmmcopy.scripts.extract_quality_metrics import ExtractHmmMetrics
+
+BIN_SIZE = 100
+
+
+def make_reads(cell_id, bins):
+    """
+    :param bins: list of (chrom, reads, copy, state), consecutive bins
+    per chromosome
+    """
+    rows = []
+    starts = {}
+    for chrom, reads, copy, state in bins:
+        start = starts.get(chrom, 0) * BIN_SIZE + 1
+        starts[chrom] = starts.get(chrom, 0) + 1
+        rows.append({
+            'cell_id': cell_id, 'chr': chrom, 'start': start,
+            'end': start + BIN_SIZE - 1, 'reads': reads, 'copy': copy,
+            'state': state, 'integer_copy_scale': copy * 1.1,
+            'integer_copy_number': state,
+        })
+    return pd.DataFrame(rows)
+
+
+def make_segments(cell_id, segments):
+    """
+    :param segments: list of (chrom, first bin, last bin, median, state)
+    """
+    return pd.DataFrame([{
+        'cell_id': cell_id, 'chr': chrom, 'start': first * BIN_SIZE + 1,
+        'end': (last + 1) * BIN_SIZE, 'integer_median': median,
+        'integer_copy_number': state,
+    } for chrom, first, last, median, state in segments])
+
+
+@pytest.fixture
+def tables():
+    nan = np.nan
+
+    # nan copy rows, including in a segment, and a single bin chromosome
+    reads_a = make_reads('cell_a', [
+        ('1', 10, 2.1, 2), ('1', 12, nan, 2), ('1', 9, 1.9, 2),
+        ('1', 30, 3.2, 3), ('1', 28, 2.8, 3), ('1', 0, nan, 3),
+        ('19', 31, 3.1, 3), ('19', 25, 2.9, 3), ('19', 33, 3.3, 3),
+        ('X', 0, 1.2, 1),
+        ('Y', 0, 0.1, 0), ('Y', 3, nan, 0),
+    ])
+    segments_a = make_segments('cell_a', [
+        ('1', 0, 2, 2.05, 2), ('1', 3, 5, 3.1, 3), ('19', 0, 2, 2.9, 3),
+        ('X', 0, 0, 1.2, 1), ('Y', 0, 1, 0.4, 0),
+    ])
+
+    # no segments
+    reads_b = make_reads('cell_b', [
+        ('1', 20, 3.0, 3), ('1', 0, 2.2, 2), ('1', 22, 3.4, 3),
+        ('19', 18, 2.7, 3), ('19', 17, nan, 3), ('19', 21, 3.5, 3),
+        ('X', 11, 1.1, 1), ('X', 12, 0.9, 1),
+    ])
+
+    # single bin chromosomes only partly covered by segments
+    reads_c = make_reads('cell_c', [
+        ('1', 15, 2.4, 2), ('1', 14, 1.6, 2), ('1', 41, 4.1, 4),
+        ('2', 29, 3.0, 3),
+        ('19', 30, 2.6, 3), ('19', 0, nan, 3), ('19', 35, 3.7, 3),
+        ('Y', 0, 0.2, 0),
+    ])
+    segments_c = make_segments('cell_c', [
+        ('1', 0, 1, 2.0, 2), ('1', 2, 2, 4.1, 4), ('2', 0, 0, 3.0, 3),
+    ])
+
+    reads = pd.concat([reads_c, reads_a, reads_b], ignore_index=True)
+    segments = pd.concat([segments_a, segments_c], ignore_index=True)
+
+    return reads, segments
+
+
+def per_cell_metrics(reads, segments):
+    extractor = ExtractHmmMetrics(None, None, None, 'metrics.csv', None)
+
+    segments = dict(list(segments.groupby('cell_id')))
+
+    metrics = []
+    for cell_id, cell_reads in reads.groupby('cell_id'):
+        cell_segments = segments.get(cell_id)
+        if cell_segments is not None:
+            cell_segments = cell_segments.reset_index(drop=True)
+        metrics.append(
+            extractor.compute_quality_metrics(
+                cell_reads.reset_index(drop=True), cell_segments, cell_id
+            )
+        )
+
+    return pd.DataFrame(metrics).sort_values('cell_id').reset_index(drop=True)
+
+
+def test_compute_quality_metrics(tables):
+    reads, segments = tables
+
+    metrics = batch_quality_metrics.compute_quality_metrics(reads, segments)
+    reference = per_cell_metrics(reads, segments)
+
+    assert metrics['cell_id'].tolist() == ['cell_a', 'cell_b', 'cell_c']
+    assert list(metrics.columns) == list(reference.columns)
+
+    for column in batch_quality_metrics.METRICS_COLUMNS:
+        assert np.allclose(
+            metrics[column].values.astype(np.float64),
+            reference[column].values.astype(np.float64),
+            rtol=1e-9, atol=0, equal_nan=True
+        ), column
+
+    # the cell without segments has no segment metrics
+    cell_b = metrics.set_index('cell_id').loc['cell_b']
+    assert np.isnan(cell_b['MBRSM_dispersion'])
+    assert np.isnan(cell_b['MSRSI_non_integerness'])
+
+
+def test_compute_quality_metrics_no_segments(tables):
+    reads, _ = tables
+
+    metrics = batch_quality_metrics.compute_quality_metrics(reads, None)
+    reference = per_cell_metrics(reads, reads.iloc[:0])
+
+    for column in batch_quality_metrics.METRICS_COLUMNS:
+        assert np.allclose(
+            metrics[column].values.astype(np.float64),
+            reference[column].values.astype(np.float64),
+            rtol=1e-9, atol=0, equal_nan=True
+        ), column
+
+
+def test_group_median():
+    codes = np.array([0, 0, 0, 2, 2, 2, 2, 3, 3])
+    values = np.array([3.0, 1.0, 2.0, 4.0, 1.0, 3.0, 2.0, np.nan, 1.0])
+
+    median = batch_quality_metrics.group_median(codes, values, 5)
+
+    assert np.allclose(median, [2.0, np.nan, 2.5, np.nan, np.nan], equal_nan=True)
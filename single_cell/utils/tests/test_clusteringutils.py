@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.spatial as sp
+from single_cell.utils import clusteringutils
+from single_cell.utils import csvutils
+
+
+@pytest.fixture
+def reads(tmpdir):
+    rand = np.random.RandomState(0)
+
+    bins = pd.DataFrame({
+        'chr': ['2', '2', '10', 'X', '1', '1'],
+        'start': [1, 501, 1, 1, 501, 1],
+        'end': [500, 1000, 500, 500, 1000, 500],
+    })
+
+    data = []
+    for cell in ['cell_b', 'cell_a', 'cell_c']:
+        df = bins.copy()
+        df['cell_id'] = cell
+        df['state'] = rand.randint(0, 8, len(bins))
+        data.append(df)
+    data = pd.concat(data).reset_index(drop=True)
+    data['state'] = data['state'].astype(float)
+    data.loc[3, 'state'] = np.nan
+
+    filename = os.path.join(str(tmpdir), 'reads.csv.gz')
+    csvutils.write_dataframe_to_csv_and_yaml(
+        data, filename,
+        {'cell_id': 'str', 'chr': 'str', 'start': 'int64', 'end': 'int64', 'state': 'float64'},
+        write_header=True
+    )
+
+    return filename, data
+
+
+def test_get_state_matrix(reads):
+    filename, data = reads
+
+    cells, bins, matrix = clusteringutils.get_state_matrix(
+        filename, chromosomes=['1', '2', '10'], chunksize=4
+    )
+
+    assert list(cells) == ['cell_a', 'cell_b', 'cell_c']
+    assert bins.values.tolist() == [
+        ['1', 1, 500], ['1', 501, 1000], ['2', 1, 500],
+        ['2', 501, 1000], ['10', 1, 500], ['X', 1, 500],
+    ]
+    assert matrix.dtype == np.int8
+
+    states = data.fillna(0).set_index(['cell_id', 'chr', 'start'])['state']
+    for i, cell in enumerate(cells):
+        for j, (chrom, start, _) in enumerate(bins.values):
+            assert matrix[i, j] == states[(cell, chrom, start)]
+
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_cityblock_pdist(threads):
+    matrix = np.random.RandomState(0).randint(0, 12, (100, 40)).astype(np.int8)
+
+    distances = clusteringutils.cityblock_pdist(matrix, threads=threads, tile_size=16)
+
+    assert np.array_equal(distances, sp.distance.pdist(matrix.astype(float), 'cityblock'))
+
+
+def test_approximate_ward_order():
+    rand = np.random.RandomState(0)
+    clones = rand.randint(0, 5, (3, 200))
+    labels = rand.randint(0, 3, 300)
+    matrix = clones[labels].astype(np.int8)
+
+    order = clusteringutils.approximate_ward_order(matrix, max_clusters=20)
+
+    assert sorted(order) == list(range(300))
+    # cells from the same clone are next to each other
+    assert (np.diff(labels[order]) != 0).sum() == 2
+
+
+@pytest.mark.parametrize('max_cluster_size', [1, 300])
+def test_approximate_ward_order_cluster_size(max_cluster_size):
+    rand = np.random.RandomState(0)
+    clones = rand.randint(0, 5, (3, 200))
+    labels = rand.randint(0, 3, 300)
+    matrix = clones[labels].astype(np.int8)
+
+    # one k-means group with all cells, ordered by ward linkage
+    # or by the first principal component if it is too large
+    order = clusteringutils.approximate_ward_order(
+        matrix, max_clusters=1, max_cluster_size=max_cluster_size
+    )
+
+    assert sorted(order) == list(range(300))
+    assert (np.diff(labels[order]) != 0).sum() == 2
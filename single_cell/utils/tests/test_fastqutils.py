@@ -0,0 +1,75 @@
+import collections
+import os
+
+import pytest
+from single_cell.utils import fastqutils
+
+FLAGS = ['100', '200', '010', '001', '110', '000', '101', '010']
+
+
+def write_fastq(filename, read_end, num_reads):
+    with open(filename, 'w') as writer:
+        for i in range(num_reads):
+            tag = FLAGS[(i * read_end) % len(FLAGS)]
+            if i == 0:
+                tag = 'grch37:mm10:salmon:' + tag
+            writer.write('@READ:{0} {1}:N:0#FQST:{2}\nACGT\n+\nIIII\n'.format(i, read_end, tag))
+    return filename
+
+
+@pytest.fixture
+def fastqs(tmpdir, monkeypatch):
+    # small blocks to exercise the block boundaries
+    monkeypatch.setattr(fastqutils, 'READ_BLOCK_SIZE', 100)
+    return (
+        write_fastq(os.path.join(str(tmpdir), 'R1.fastq'), 1, 50),
+        write_fastq(os.path.join(str(tmpdir), 'R2.fastq'), 2, 50),
+    )
+
+
+@pytest.mark.parametrize('read_ahead', [False, True])
+@pytest.mark.parametrize('reference', [None, 'grch37', 'mm10'])
+def test_tag_and_count_blocks(fastqs, reference, read_ahead):
+    """
+    the single pass matches gather_counts, filter_read_iterator and
+    add_tag_to_read_comment
+    """
+    reader = fastqutils.PairedTaggedFastqReader(*fastqs)
+    expected_counts = reader.gather_counts()
+
+    reader = fastqutils.PairedTaggedFastqReader(*fastqs)
+    if reference is None:
+        pairs = reader.get_read_pair_iterator()
+    else:
+        pairs = reader.filter_read_iterator(reference)
+    expected_r1 = []
+    expected_r2 = []
+    for read_1, read_2 in pairs:
+        expected_r1.extend(reader.add_tag_to_read_comment(read_1))
+        expected_r2.extend(reader.add_tag_to_read_comment(read_2))
+
+    counts = {'R1': collections.defaultdict(int), 'R2': collections.defaultdict(int)}
+    reader = fastqutils.PairedTaggedFastqReader(*fastqs)
+    lines_r1 = []
+    lines_r2 = []
+    for block_r1, block_r2 in reader.tag_and_count_blocks(
+            counts, reference=reference, read_ahead=read_ahead
+    ):
+        lines_r1.extend(block_r1)
+        lines_r2.extend(block_r2)
+
+    assert counts == expected_counts
+    assert lines_r1 == expected_r1
+    assert lines_r2 == expected_r2
+
+
+def test_mismatched_pairs(tmpdir):
+    r1 = write_fastq(os.path.join(str(tmpdir), 'R1.fastq'), 1, 10)
+    r2 = write_fastq(os.path.join(str(tmpdir), 'R2.fastq'), 2, 9)
+
+    reader = fastqutils.PairedFastqReader(r1, r2)
+    with pytest.raises(Exception, match='mismatching number of reads'):
+        list(reader.get_read_pair_iterator())
+
+    with pytest.raises(Exception, match='mismatching number of reads'):
+        list(reader.get_read_block_pairs(read_ahead=True))
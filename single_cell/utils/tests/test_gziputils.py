@@ -0,0 +1,59 @@
+import gzip
+import os
+
+import pytest
+from single_cell.utils import gziputils
+
+
+@pytest.fixture
+def data():
+    lines = ['{},cell_{},{}\n'.format(i, i % 7, i * 0.5) for i in range(100000)]
+    return ''.join(lines)
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_round_trip(tmpdir, data, threads):
+    """
+    bgzf output reads back with gziputils and with the gzip module
+    """
+    filename = os.path.join(str(tmpdir), 'data.csv.gz')
+
+    with gziputils.open(filename, 'wt', threads=threads) as writer:
+        for i in range(0, len(data), 10000):
+            writer.write(data[i:i + 10000])
+
+    assert gziputils.is_bgzf(filename)
+
+    with gziputils.open(filename, 'rt', threads=threads) as reader:
+        assert reader.read() == data
+
+    with gzip.open(filename, 'rt') as reader:
+        assert reader.read() == data
+
+
+def test_append(tmpdir):
+    filename = os.path.join(str(tmpdir), 'data.txt.gz')
+
+    with gziputils.open(filename, 'wt') as writer:
+        writer.write('a\n')
+
+    with gziputils.open(filename, 'at', threads=2) as writer:
+        writer.write('b\n')
+
+    with gziputils.open(filename, 'rt', threads=2) as reader:
+        assert reader.readlines() == ['a\n', 'b\n']
+
+
+def test_read_plain_gzip(tmpdir, data):
+    """
+    files written by other gzip writers are read with the gzip module
+    """
+    filename = os.path.join(str(tmpdir), 'data.csv.gz')
+
+    with gzip.open(filename, 'wt') as writer:
+        writer.write(data)
+
+    assert not gziputils.is_bgzf(filename)
+
+    with gziputils.open(filename, 'rt', threads=4) as reader:
+        assert reader.read() == data
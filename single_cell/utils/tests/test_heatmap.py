@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from single_cell.utils.singlecell_copynumber_plot_utils import heatmap
+
+
+@pytest.fixture
+def matrix():
+    return np.array([
+        [2, 2, 3, 1, np.nan, np.nan],
+        [2, 4, 3, 1, np.nan, 0],
+        [1, 1, 2, 2, 5, 5],
+        [1, 0, 2, 2, 5, 6],
+    ])
+
+
+def test_downsample_mode(matrix):
+    image = heatmap.downsample_matrix(matrix, (2, 3), method='mode')
+
+    assert np.array_equal(image, [[2, 1, 0], [1, 2, 5]], equal_nan=True)
+
+
+def test_downsample_max(matrix):
+    image = heatmap.downsample_matrix(matrix, (2, 3), method='max')
+
+    assert np.array_equal(image, [[4, 3, 0], [1, 2, 6]], equal_nan=True)
+
+
+def test_downsample_missing_blocks(matrix):
+    image = heatmap.downsample_matrix(matrix, (4, 3), method='mode')
+
+    assert np.isnan(image[0, 2])
+    assert image[1, 2] == 0
+
+
+def test_downsample_fits(matrix):
+    assert heatmap.downsample_matrix(matrix, (10, 10)) is matrix
+
+    with pytest.raises(ValueError):
+        heatmap.downsample_matrix(matrix, (2, 2), method='mean')
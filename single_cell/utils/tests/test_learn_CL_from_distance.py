@@ -0,0 +1,86 @@
+import networkx as nx
+import numpy as np
+import pytest
+import scipy.spatial as sp
+from single_cell.workflows.ltm.scripts import learn_CL_from_distance
+
+
+def edge_set(edges):
+    return {frozenset((node, parent)) for node, parent, _ in edges}
+
+
+def networkx_mst(distances, n):
+    square = sp.distance.squareform(distances)
+    graph = nx.Graph()
+    graph.add_nodes_from(range(n))
+    for i in range(n):
+        for j in range(i + 1, n):
+            graph.add_edge(i, j, weight=square[i, j])
+    return nx.minimum_spanning_tree(graph)
+
+
+def test_get_distance_row():
+    rand = np.random.RandomState(0)
+    distances = sp.distance.pdist(rand.rand(7, 3))
+    square = sp.distance.squareform(distances)
+
+    for node in range(7):
+        row = learn_CL_from_distance.get_distance_row(distances, 7, node)
+        assert np.array_equal(row, square[node])
+
+
+@pytest.mark.parametrize('n', [2, 3, 10, 50])
+def test_minimum_spanning_tree_matches_networkx(n):
+    # continuous random distances, no ties
+    rand = np.random.RandomState(n)
+    distances = rand.rand(n * (n - 1) // 2)
+
+    edges = learn_CL_from_distance.minimum_spanning_tree(distances, n)
+    expected = networkx_mst(distances, n)
+
+    assert len(edges) == n - 1
+    assert edge_set(edges) == {frozenset(edge) for edge in expected.edges()}
+
+    square = sp.distance.squareform(distances)
+    for node, parent, weight in edges:
+        assert weight == square[node, parent]
+
+
+def test_minimum_spanning_tree_float32():
+    rand = np.random.RandomState(0)
+    distances = rand.rand(45).astype(np.float32)
+
+    edges = learn_CL_from_distance.minimum_spanning_tree(distances, 10)
+    expected = networkx_mst(distances.astype(np.float64), 10)
+
+    assert edge_set(edges) == {frozenset(edge) for edge in expected.edges()}
+
+
+def test_minimum_spanning_tree_ties():
+    # all cells identical, every tree is minimal. the tree grows from
+    # node 0 in index order and every node attaches to node 0
+    distances = np.zeros(10, dtype=np.float32)
+
+    edges = learn_CL_from_distance.minimum_spanning_tree(distances, 5)
+
+    assert edges == [(1, 0, 0.0), (2, 0, 0.0), (3, 0, 0.0), (4, 0, 0.0)]
+
+
+def test_minimum_spanning_tree_ties_weight():
+    # small integer distances, lots of ties
+    rand = np.random.RandomState(0)
+    profiles = rand.randint(0, 3, (30, 4))
+    distances = sp.distance.pdist(profiles, 'cityblock').astype(np.float32)
+
+    edges = learn_CL_from_distance.minimum_spanning_tree(distances, 30)
+    expected = networkx_mst(distances, 30)
+
+    tree = nx.Graph()
+    tree.add_nodes_from(range(30))
+    tree.add_edges_from((node, parent) for node, parent, _ in edges)
+    assert nx.is_tree(tree)
+
+    assert sum(weight for _, _, weight in edges) == expected.size(weight='weight')
+
+    # same input, same tree
+    assert edges == learn_CL_from_distance.minimum_spanning_tree(distances, 30)
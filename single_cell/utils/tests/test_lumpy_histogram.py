@@ -0,0 +1,188 @@
+import os
+import warnings
+
+import numpy as np
+import pysam
+import pytest
+from single_cell.workflows.lumpy import generate_histogram
+from single_cell.workflows.lumpy import merge_histograms
+
+HEADER = {
+    'HD': {'VN': '1.0', 'SO': 'coordinate'},
+    'SQ': [{'SN': '1', 'LN': 100000}],
+    'RG': [{'ID': 'a'}],
+}
+
+# paired, mate reverse strand, read 1
+PROPER_READ1 = 97
+
+
+def make_read(pos, isize, readgroup='a', flag=PROPER_READ1):
+    read = pysam.AlignedSegment()
+    read.query_name = 'read{}'.format(pos)
+    read.flag = flag
+    read.reference_id = 0
+    read.reference_start = pos
+    read.mapping_quality = 60
+    read.cigartuples = [(0, 10)]
+    read.next_reference_id = 0
+    read.next_reference_start = pos + isize - 10
+    read.template_length = isize
+    read.query_sequence = 'A' * 10
+    read.query_qualities = pysam.qualitystring_to_array('I' * 10)
+    read.set_tag('RG', readgroup)
+    return read
+
+
+def test_unscaled_upper_mad():
+    med, umad = generate_histogram.unscaled_upper_mad(np.array([1, 2, 3, 4, 10]))
+
+    assert med == 3
+    assert umad == 4
+
+
+def test_unscaled_upper_mad_nothing_above_median():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        med, umad = generate_histogram.unscaled_upper_mad(np.array([1, 5, 5, 5]))
+
+    assert med == 5
+    assert umad == 0
+
+
+def test_sampler_done():
+    sampler = generate_histogram.InsertSizeSampler(
+        ['a', 'b'], 2, 1, reads_per_rg={'a': 100, 'b': 100}
+    )
+
+    sampler.add(make_read(100, 300, 'a'))
+    sampler.add(make_read(200, 310, 'a'))
+    # sampling goes on until every read group has enough insert sizes
+    sampler.add(make_read(300, 320, 'a'))
+    # negative template length and secondary alignments are not sampled
+    sampler.add(make_read(400, -300, 'b'))
+    sampler.add(make_read(500, 300, 'b', flag=PROPER_READ1 | 256))
+    assert not sampler.done
+
+    sampler.add(make_read(600, 330, 'b'))
+    sampler.add(make_read(700, 340, 'b'))
+
+    assert sampler.done
+    sampler.add(make_read(800, 350, 'a'))
+
+    assert sampler.data == {'a': [300, 310, 320], 'b': [330, 340]}
+    assert sampler.reads_per_rg == {'a': 100, 'b': 100}
+
+
+def test_sampler_counting_reads():
+    # without reads per read group, every read has to be counted
+    sampler = generate_histogram.InsertSizeSampler(['a'], 1, 3)
+
+    for pos in range(0, 1000, 100):
+        sampler.add(make_read(pos, 300 + pos))
+
+    assert not sampler.done
+    assert sampler.reads_per_rg == {'a': 10}
+    # first two reads are skipped
+    assert sampler.data == {'a': [500]}
+
+
+def test_read_bam_file_stops_early(tmpdir):
+    path = os.path.join(str(tmpdir), 'input.bam')
+    with pysam.AlignmentFile(path, 'wb', header=HEADER) as writer:
+        for pos in range(0, 10000, 100):
+            writer.write(make_read(pos, 300 + pos))
+    pysam.index(path)
+
+    reads_per_rg, isizes, counts = generate_histogram.read_bam_file(path, ['a'], 5, 1)
+
+    # read count from the index, insert sizes from the first reads only
+    assert reads_per_rg == {'a': 100}
+    assert isizes == {'a': [300, 400, 500, 600, 700]}
+    assert counts == {'a': 5}
+
+
+@pytest.fixture
+def isizes():
+    return {
+        'a': [101, 102, 102, 103, 104, 1000],
+        'b': [100, 100, 101, 101],
+    }
+
+
+def test_calculate_histogram(isizes):
+    counts = {rg: len(values) for rg, values in isizes.items()}
+    reads_per_rg = {'a': 10, 'b': 30}
+
+    histograms, mean, stdev = generate_histogram.calculate_histogram(
+        ['a', 'b'], isizes, counts, 1, 10, 100, 2, reads_per_rg
+    )
+
+    # a: median 102.5, upper mad 1.5, 1000 is an outlier. mean 102.4,
+    # stdev 1.02, bins 100 to 103
+    H, total = histograms['a']
+    assert list(H) == [0, 1, 2, 1]
+    assert total == 5
+
+    # b: mean 100.5, stdev 0.5, bin 100
+    H, total = histograms['b']
+    assert list(H) == [2]
+    assert total == 4
+
+    assert mean == pytest.approx((102.4 * 10 + 100.5 * 30) / 40)
+    assert stdev == pytest.approx((np.sqrt(1.04) * 10 + 0.5 * 30) / 40)
+
+
+def test_calculate_histogram_nothing_above_median():
+    isizes = {'a': [100, 102, 102, 102]}
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        histograms, mean, _ = generate_histogram.calculate_histogram(
+            ['a'], isizes, {'a': 4}, 1, 10, 100, 2, {'a': 4}
+        )
+
+    # no upper outliers, every insert size is kept
+    H, total = histograms['a']
+    assert total == 4
+    assert list(H) == [1, 0, 3]
+    assert mean == 101.5
+
+
+def test_merge_readgroups():
+    histograms = {
+        'a': (np.array([0, 1, 2, 1]), 5),
+        'b': (np.array([2]), 4),
+        'c': None,
+    }
+
+    density = generate_histogram.merge_readgroups(['a', 'b', 'c'], histograms)
+
+    # running counts over running totals of the read groups that
+    # have the insert size, summed
+    assert np.allclose(density, [0 / 5. + 2 / 9., 1 / 5., 2 / 5., 1 / 5.])
+
+
+def test_merge_readgroups_empty():
+    density = generate_histogram.merge_readgroups(['a'], {'a': None})
+
+    assert len(density) == 0
+
+
+def test_write_histogram_round_trip(tmpdir, isizes):
+    outfile = os.path.join(str(tmpdir), 'histogram.npy')
+    counts = {rg: len(values) for rg, values in isizes.items()}
+    reads_per_rg = {'a': 10, 'b': 30}
+
+    generate_histogram.write_histogram(
+        ['a', 'b'], reads_per_rg, isizes, counts, outfile,
+        min_elements=1, mads=10, X=2, read_length=100
+    )
+
+    density, mean, stdev, numreads = merge_histograms.load_histogram(outfile)
+
+    assert np.allclose(density, [2 / 9., 1 / 5., 2 / 5., 1 / 5.])
+    assert mean == pytest.approx((102.4 * 10 + 100.5 * 30) / 40)
+    assert stdev == pytest.approx((np.sqrt(1.04) * 10 + 0.5 * 30) / 40)
+    assert numreads == 40
+    assert isinstance(numreads, int)
@@ -0,0 +1,155 @@
+import os
+
+import pysam
+import pytest
+from single_cell.workflows.lumpy import preprocess
+
+HEADER = {
+    'HD': {'VN': '1.0', 'SO': 'coordinate'},
+    'SQ': [{'SN': '1', 'LN': 10000}],
+}
+
+PROPER_READ1 = 99
+PROPER_READ2 = 147
+DISCORDANT_READ1 = 65
+DUPLICATE = 1024
+
+
+def make_read(name, flag, cigar, supplementary=None, pos=100):
+    """
+    :param cigar: list of (op, length) in reference order
+    :param supplementary: value of the SA tag
+    """
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    read.flag = flag
+    read.reference_id = 0
+    read.reference_start = pos
+    read.mapping_quality = 60
+    read.cigartuples = cigar
+    read.next_reference_id = 0
+    read.next_reference_start = pos + 200
+    read.template_length = 300
+
+    length = sum(size for op, size in cigar if op in (0, 1, 4))
+    read.query_sequence = 'A' * length
+    read.query_qualities = pysam.qualitystring_to_array('I' * length)
+
+    if supplementary:
+        read.set_tag('SA', supplementary)
+    return read
+
+
+def test_get_query_span():
+    cigar = [('H', 5), ('S', 3), ('M', 10), ('I', 2), ('D', 3), ('M', 4), ('S', 6)]
+
+    # clips after the aligned part and deletions do not move the span
+    assert preprocess.get_query_span(cigar) == (8, 24)
+    assert preprocess.get_query_span([('M', 100)]) == (0, 100)
+
+
+def test_split_read():
+    read = make_read('r', PROPER_READ1, [(0, 60), (4, 40)], '1,5000,+,60S40M,60,0;')
+
+    assert preprocess.get_split_read_name(read) == 'r_1'
+
+
+def test_split_read2_suffix():
+    read = make_read('r', PROPER_READ2, [(4, 40), (0, 60)], '1,5000,+,60S40M,60,0;')
+
+    assert preprocess.get_split_read_name(read) == 'r_2'
+
+
+def test_not_split():
+    read = make_read('r', PROPER_READ1, [(0, 100)])
+    assert preprocess.get_split_read_name(read) is None
+
+    # supplementary covers all but 10 bases of the primary
+    read = make_read('r', PROPER_READ1, [(0, 60), (4, 40)], '1,5000,+,10S90M,60,0;')
+    assert preprocess.get_split_read_name(read) is None
+
+
+@pytest.mark.parametrize('num_supplementary,expected', [(1, 'r_1'), (2, None), (3, None)])
+def test_supplementary_count(num_supplementary, expected):
+    supplementary = '1,5000,+,60S40M,60,0;' * num_supplementary
+    read = make_read('r', PROPER_READ1, [(0, 60), (4, 40)], supplementary)
+
+    assert preprocess.get_split_read_name(read) == expected
+    assert preprocess.get_split_read_name(read, num_splits=4) == 'r_1'
+
+
+def test_reverse_strand_primary():
+    # aligned to the reverse strand, the clip is at the start of the read:
+    # query span is 0-60, not 40-100
+    read = make_read('r', PROPER_READ2, [(4, 40), (0, 60)], '1,5000,+,60S40M,60,0;')
+    assert preprocess.get_query_span(preprocess.get_read_cigar(read)) == (0, 60)
+    assert preprocess.get_split_read_name(read) == 'r_2'
+
+    # same cigar on the forward strand overlaps the supplementary
+    read = make_read('r', PROPER_READ1, [(4, 40), (0, 60)], '1,5000,+,60S40M,60,0;')
+    assert preprocess.get_split_read_name(read) is None
+
+
+def test_reverse_strand_supplementary():
+    cigar = preprocess.get_supplementary_cigar('1,5000,-,40M60S,60,0;')
+    assert preprocess.get_query_span(cigar) == (60, 100)
+
+    read = make_read('r', PROPER_READ1, [(0, 60), (4, 40)], '1,5000,-,40M60S,60,0;')
+    assert preprocess.get_split_read_name(read) == 'r_1'
+
+    read = make_read('r', PROPER_READ1, [(0, 60), (4, 40)], '1,5000,+,40M60S,60,0;')
+    assert preprocess.get_split_read_name(read) is None
+
+
+def test_duplicates():
+    read = make_read(
+        'r', PROPER_READ1 | DUPLICATE, [(0, 60), (4, 40)], '1,5000,+,60S40M,60,0;'
+    )
+
+    assert preprocess.get_split_read_name(read) is None
+    assert preprocess.get_split_read_name(read, include_dups=True) == 'r_1'
+
+
+def test_is_discordant():
+    assert preprocess.is_discordant(make_read('r', DISCORDANT_READ1, [(0, 100)]))
+    assert not preprocess.is_discordant(make_read('r', PROPER_READ1, [(0, 100)]))
+    assert not preprocess.is_discordant(
+        make_read('r', DISCORDANT_READ1 | DUPLICATE, [(0, 100)])
+    )
+
+
+@pytest.fixture
+def bam(tmpdir):
+    split = [(0, 60), (4, 40)]
+    supplementary = '1,5000,+,60S40M,60,0;'
+    reads = [
+        make_read('concordant', PROPER_READ1, [(0, 100)], pos=100),
+        make_read('discordant', DISCORDANT_READ1, [(0, 100)], pos=200),
+        make_read('split', PROPER_READ1, split, supplementary, pos=300),
+        make_read('both', DISCORDANT_READ1, split, supplementary, pos=400),
+        make_read('duplicate', DISCORDANT_READ1 | DUPLICATE, split, supplementary, pos=500),
+        make_read('split', PROPER_READ2, [(4, 40), (0, 60)], supplementary, pos=600),
+    ]
+
+    path = os.path.join(str(tmpdir), 'input.bam')
+    with pysam.AlignmentFile(path, 'wb', header=HEADER) as writer:
+        for read in reads:
+            writer.write(read)
+    return path
+
+
+def read_names(bam):
+    with pysam.AlignmentFile(bam, 'rb', check_sq=False) as reader:
+        return [read.query_name for read in reader.fetch(until_eof=True)]
+
+
+@pytest.mark.parametrize('tag', [None, 'SA123-A1-R01-C01'])
+def test_extract_reads(bam, tmpdir, tag):
+    discordant_bam = os.path.join(str(tmpdir), 'discordant.bam')
+    split_bam = os.path.join(str(tmpdir), 'split.bam')
+
+    preprocess.extract_reads(bam, discordant_bam, split_bam, tag=tag)
+
+    prefix = tag + ':' if tag else ''
+    assert read_names(discordant_bam) == [prefix + 'discordant', prefix + 'both']
+    assert read_names(split_bam) == [prefix + 'split_1', prefix + 'both_1', prefix + 'split_2']
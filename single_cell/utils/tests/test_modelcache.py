@@ -0,0 +1,107 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+from single_cell.utils import modelcache
+from sklearn.ensemble import RandomForestClassifier
+
+
+@pytest.fixture
+def training_data(tmpdir):
+    rand = np.random.RandomState(0)
+    filename = os.path.join(str(tmpdir), 'training.csv')
+    data = rand.rand(200, 3)
+    labels = (data[:, 0] > 0.5).astype(int)
+    np.savetxt(filename, np.column_stack([data, labels]), delimiter=',')
+    return filename
+
+
+class Trainer(object):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, filename, n_estimators=10, random_state=0, n_jobs=1):
+        self.calls.append((n_estimators, random_state, n_jobs))
+        data = np.loadtxt(filename, delimiter=',')
+        clf = RandomForestClassifier(
+            n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs
+        )
+        return clf.fit(data[:, :-1], data[:, -1])
+
+
+def test_cache_hit(tmpdir, training_data):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    params = {'n_estimators': 10, 'random_state': 0}
+    train = Trainer()
+
+    model = modelcache.get_model('rf', training_data, params, train, cache_dir=cache_dir, n_jobs=2)
+    cached = modelcache.get_model('rf', training_data, params, train, cache_dir=cache_dir, n_jobs=1)
+
+    # n_jobs is not part of the key
+    assert train.calls == [(10, 0, 2)]
+
+    test_data = np.random.RandomState(1).rand(50, 3)
+    assert np.array_equal(model.predict_proba(test_data), cached.predict_proba(test_data))
+
+
+def test_cache_key(tmpdir, training_data):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    train = Trainer()
+
+    modelcache.get_model('rf', training_data, {'n_estimators': 10}, train, cache_dir=cache_dir)
+    modelcache.get_model('rf', training_data, {'n_estimators': 5}, train, cache_dir=cache_dir)
+
+    with open(training_data, 'a') as writer:
+        writer.write('0.1,0.2,0.3,0\n')
+
+    modelcache.get_model('rf', training_data, {'n_estimators': 5}, train, cache_dir=cache_dir)
+
+    assert len(train.calls) == 3
+
+
+def test_corrupt_cache(tmpdir, training_data):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    params = {'n_estimators': 10}
+    train = Trainer()
+
+    modelcache.get_model('rf', training_data, params, train, cache_dir=cache_dir)
+
+    path = modelcache.get_model_path('rf', training_data, params, cache_dir)
+    with open(path, 'w') as writer:
+        writer.write('truncated')
+
+    model = modelcache.get_model('rf', training_data, params, train, cache_dir=cache_dir)
+
+    assert len(train.calls) == 2
+    assert isinstance(model, RandomForestClassifier)
+
+
+def test_cache_dir_private(tmpdir, training_data):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    params = {'n_estimators': 10}
+    train = Trainer()
+
+    modelcache.get_model('rf', training_data, params, train, cache_dir=cache_dir)
+
+    path = modelcache.get_model_path('rf', training_data, params, cache_dir)
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+    assert not os.stat(path).st_mode & 0o077
+
+
+@pytest.mark.parametrize('target', ['dir', 'model'])
+def test_shared_cache_ignored(tmpdir, training_data, target):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    params = {'n_estimators': 10}
+    train = Trainer()
+
+    modelcache.get_model('rf', training_data, params, train, cache_dir=cache_dir)
+
+    path = modelcache.get_model_path('rf', training_data, params, cache_dir)
+    os.chmod(os.path.dirname(path) if target == 'dir' else path, 0o777)
+
+    model = modelcache.get_model('rf', training_data, params, train, cache_dir=cache_dir)
+
+    # a cache that others can write to is never loaded
+    assert len(train.calls) == 2
+    assert isinstance(model, RandomForestClassifier)
@@ -0,0 +1,206 @@
+import os
+
+import pysam
+import pytest
+from single_cell.utils import pysamutils
+
+HEADER = {
+    'HD': {'VN': '1.0', 'SO': 'coordinate'},
+    'SQ': [{'SN': '1', 'LN': 1000}, {'SN': '2', 'LN': 1000}],
+}
+
+
+def make_read(name, chrom, pos, cigar=None, is_reverse=False):
+    """
+    :param cigar: list of (op, length), unmapped read placed at pos if None
+    """
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    read.reference_id = [seq['SN'] for seq in HEADER['SQ']].index(chrom)
+    read.reference_start = pos
+
+    if cigar is None:
+        read.flag = 4
+        length = 10
+    else:
+        read.flag = 16 if is_reverse else 0
+        read.mapping_quality = 60
+        read.cigartuples = cigar
+        length = sum(size for op, size in cigar if op in (0, 1, 4))
+
+    read.query_sequence = 'A' * length
+    read.query_qualities = pysam.qualitystring_to_array('I' * length)
+    return read
+
+
+def write_bam(path, reads, header=None, index=True):
+    with pysam.AlignmentFile(path, 'wb', header=header or HEADER) as writer:
+        for read in reads:
+            writer.write(read)
+    if index:
+        pysam.index(path)
+    return path
+
+
+def read_names(bam, chrom=None):
+    with pysam.AlignmentFile(bam, 'rb', check_sq=False) as reader:
+        if chrom is None:
+            return [read.query_name for read in reader.fetch(until_eof=True)]
+        return [read.query_name for read in reader.fetch(chrom)]
+
+
+def fetch_region(bam, region):
+    """
+    reads that samtools view returns for the region
+    """
+    chrom, start, end = pysamutils.parse_region(region)
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        return [read.query_name for read in reader.fetch(chrom, start, end)]
+
+
+@pytest.fixture
+def regions():
+    return ['1-1-100', '1-101-200', '1-201-300', '2-1-500', '2-501-1000']
+
+
+@pytest.fixture
+def coordinate_bam(tmpdir):
+    reads = [
+        make_read('before_boundary', '1', 90, [(0, 10)]),
+        make_read('across_boundary', '1', 95, [(0, 10)]),
+        make_read('after_boundary', '1', 100, [(0, 10)]),
+        make_read('deletion', '1', 150, [(0, 5), (2, 100), (0, 5)]),
+        make_read('unmapped', '1', 160, None),
+        make_read('soft_clipped', '1', 195, [(4, 20), (0, 5)]),
+        make_read('last', '2', 495, [(0, 10)]),
+        make_read('other', '2', 700, [(0, 10)]),
+    ]
+    return write_bam(os.path.join(str(tmpdir), 'input.bam'), reads)
+
+
+def split_outputs(tmpdir, regions, label):
+    outdir = os.path.join(str(tmpdir), label)
+    os.makedirs(outdir)
+    return {region: os.path.join(outdir, '{}.bam'.format(region)) for region in regions}
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_region_splitter(tmpdir, coordinate_bam, regions, processes):
+    outputs = split_outputs(tmpdir, regions, 'split')
+
+    pysamutils.RegionBamSplitter(coordinate_bam, outputs, processes=processes).split()
+
+    for region in regions:
+        assert os.path.exists(outputs[region] + '.bai')
+        chrom = pysamutils.parse_region(region)[0]
+        assert read_names(outputs[region], chrom) == fetch_region(coordinate_bam, region)
+
+    assert read_names(outputs['1-1-100'], '1') == [
+        'before_boundary', 'across_boundary'
+    ]
+    # reads spanning several regions go to each of them
+    assert read_names(outputs['1-101-200'], '1') == [
+        'across_boundary', 'after_boundary', 'deletion', 'unmapped', 'soft_clipped'
+    ]
+    assert read_names(outputs['1-201-300'], '1') == ['deletion']
+    assert read_names(outputs['2-1-500'], '2') == ['last']
+
+
+def test_region_splitter_empty_region(tmpdir, coordinate_bam):
+    regions = ['1-1-100', '1-501-600']
+    outputs = split_outputs(tmpdir, regions, 'split')
+
+    pysamutils.RegionBamSplitter(coordinate_bam, outputs).split()
+
+    assert read_names(outputs['1-501-600'], '1') == []
+    assert os.path.exists(outputs['1-501-600'] + '.bai')
+
+
+def test_region_splitter_nested_regions(tmpdir, coordinate_bam):
+    outputs = split_outputs(tmpdir, ['1-1-300', '1-101-200'], 'split')
+
+    with pytest.raises(ValueError):
+        pysamutils.RegionBamSplitter(coordinate_bam, outputs)
+
+
+@pytest.fixture
+def cell_bams(tmpdir):
+    """
+    three cells with reads at the same positions and strands
+    """
+    bams = []
+    for cell in range(3):
+        header = dict(HEADER, RG=[{'ID': 'cell{}'.format(cell)}])
+        reads = [
+            make_read('cell{}_fwd'.format(cell), '1', 100, [(0, 10)]),
+            make_read('cell{}_rev'.format(cell), '1', 100, [(0, 10)], is_reverse=True),
+            make_read('cell{}_span'.format(cell), '1', 195, [(0, 10)]),
+            make_read('cell{}_chr2'.format(cell), '2', 10 * cell, [(0, 10)]),
+        ]
+        bams.append(write_bam(os.path.join(str(tmpdir), 'cell{}.bam'.format(cell)), reads, header=header))
+    return bams
+
+
+@pytest.mark.parametrize('max_open', [500, 2])
+def test_region_merger(tmpdir, cell_bams, regions, max_open):
+    outputs = split_outputs(tmpdir, regions, 'merge')
+
+    pysamutils.RegionBamMerger(
+        cell_bams, outputs, os.path.join(str(tmpdir), 'temp'), max_open=max_open
+    ).merge()
+
+    # position, then forward before reverse, then input order, as samtools merge
+    assert read_names(outputs['1-101-200'], '1') == [
+        'cell0_fwd', 'cell1_fwd', 'cell2_fwd',
+        'cell0_rev', 'cell1_rev', 'cell2_rev',
+        'cell0_span', 'cell1_span', 'cell2_span',
+    ]
+    assert read_names(outputs['1-201-300'], '1') == ['cell0_span', 'cell1_span', 'cell2_span']
+    assert read_names(outputs['1-1-100'], '1') == []
+    assert read_names(outputs['2-1-500'], '2') == ['cell0_chr2', 'cell1_chr2', 'cell2_chr2']
+
+    with pysam.AlignmentFile(outputs['1-1-100'], 'rb') as reader:
+        assert [rg['ID'] for rg in reader.header.to_dict()['RG']] == ['cell0', 'cell1', 'cell2']
+
+
+def write_collated_bam(path, names):
+    """
+    :param names: list of (read name, number of records)
+    """
+    reads = []
+    for name, count in names:
+        for i in range(count):
+            reads.append(make_read(name, '1', i * 10, [(0, 10)]))
+
+    header = dict(HEADER, HD={'VN': '1.0', 'SO': 'unsorted'})
+    return write_bam(path, reads, header=header, index=False)
+
+
+@pytest.mark.parametrize('num_reads', [None, 14])
+def test_split_by_read_name(tmpdir, num_reads):
+    names = [('a', 2), ('b', 1), ('c', 4), ('d', 2), ('e', 2), ('f', 3)]
+    bam = write_collated_bam(os.path.join(str(tmpdir), 'collated.bam'), names)
+    outputs = [os.path.join(str(tmpdir), '{}.bam'.format(i)) for i in range(3)]
+
+    pysamutils.split_bam_by_read_name(bam, outputs, num_reads=num_reads)
+
+    shards = [read_names(output) for output in outputs]
+
+    # every record once, in input order
+    assert sum(shards, []) == read_names(bam)
+
+    # no read name split across shards
+    for i, shard in enumerate(shards):
+        for other in shards[i + 1:]:
+            assert not set(shard) & set(other)
+
+    assert all(shards)
+
+
+def test_split_by_read_name_more_outputs_than_names(tmpdir):
+    bam = write_collated_bam(os.path.join(str(tmpdir), 'collated.bam'), [('a', 2), ('b', 2)])
+    outputs = [os.path.join(str(tmpdir), '{}.bam'.format(i)) for i in range(4)]
+
+    pysamutils.split_bam_by_read_name(bam, outputs)
+
+    assert [read_names(output) for output in outputs] == [['a', 'a'], ['b', 'b'], [], []]
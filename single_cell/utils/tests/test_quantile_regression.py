@@ -0,0 +1,111 @@
+import warnings
+
+import numpy as np
+import pytest
+from single_cell.workflows.hmmcopy.scripts import quantile_regression
+from statsmodels.regression.quantile_regression import QuantReg
+
+QUANTILES = np.array([0.1, 0.25, 0.5, 0.75, 0.9])
+
+
+def gc_reads(nobs, seed=0):
+    rng = np.random.RandomState(seed)
+    gc = rng.uniform(0.3, 0.6, nobs)
+    reads = 100 + 200 * gc - 150 * gc ** 2 + rng.normal(0, 5, nobs)
+    return gc, reads
+
+
+def fit_statsmodels(exog, endog, quantiles):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return np.array(
+            [QuantReg(endog, exog).fit(q=q).params for q in quantiles]
+        )
+
+
+def fit_batched(exog, endog, quantiles):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return quantile_regression.fit_quantiles(exog, endog, quantiles)
+
+
+def test_poly2_design():
+    exog = quantile_regression.poly2_design([0.5, 2])
+
+    assert np.array_equal(exog, [[1, 0.5, 0.25], [1, 2, 4]])
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_matches_statsmodels(seed):
+    gc, reads = gc_reads(500, seed=seed)
+    exog = quantile_regression.poly2_design(gc)
+
+    params, iterations = fit_batched(exog, reads, QUANTILES)
+    expected = fit_statsmodels(exog, reads, QUANTILES)
+
+    # converged fits agree to the convergence tolerance (rounding can
+    # move the stop by one iteration), fits that stop at max_iter
+    # only up to summation order
+    converged = iterations < 1000
+    assert converged.any()
+    assert np.allclose(params[converged], expected[converged], rtol=0, atol=1e-4)
+    assert np.allclose(params, expected, rtol=1e-3)
+
+
+def test_all_modal_quantiles():
+    gc, reads = gc_reads(300)
+    exog = quantile_regression.poly2_design(gc)
+    quantiles = np.arange(10, 91) / 100
+
+    params, _ = fit_batched(exog, reads, quantiles)
+    expected = fit_statsmodels(exog, reads, quantiles)
+
+    assert params.shape == (len(quantiles), 3)
+    assert np.allclose(
+        np.dot(exog, params.T), np.dot(exog, expected.T), rtol=1e-3
+    )
+
+
+def test_rank_deficient():
+    # constant gc, the three design columns are collinear
+    _, reads = gc_reads(50)
+    exog = quantile_regression.poly2_design(np.full(50, 0.4))
+
+    params, _ = fit_batched(exog, reads, QUANTILES)
+    expected = fit_statsmodels(exog, reads, QUANTILES)
+
+    assert np.allclose(params, expected, rtol=1e-8, atol=1e-8)
+
+
+def test_constant_reads():
+    gc, _ = gc_reads(50)
+    exog = quantile_regression.poly2_design(gc)
+    reads = np.full(50, 7.0)
+
+    params, iterations = fit_batched(exog, reads, QUANTILES)
+    expected = fit_statsmodels(exog, reads, QUANTILES)
+
+    assert np.allclose(params, expected, rtol=1e-8, atol=1e-8)
+    assert np.allclose(np.dot(exog, params.T), 7.0)
+    assert (iterations < 1000).all()
+
+
+def test_few_distinct_points():
+    gc, reads = gc_reads(5)
+    exog = quantile_regression.poly2_design(np.repeat(gc, 10))
+    reads = np.repeat(reads, 10)
+
+    params, _ = fit_batched(exog, reads, QUANTILES)
+    expected = fit_statsmodels(exog, reads, QUANTILES)
+
+    assert np.allclose(
+        np.dot(exog, params.T), np.dot(exog, expected.T), rtol=1e-6
+    )
+
+
+@pytest.mark.parametrize('quantile', [0, 1, -0.5])
+def test_invalid_quantiles(quantile):
+    with pytest.raises(ValueError):
+        quantile_regression.fit_quantiles(
+            np.ones((3, 1)), np.ones(3), [0.5, quantile]
+        )
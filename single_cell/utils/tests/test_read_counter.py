@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import pysam
+import pytest
+from single_cell.utils.refgenome import read_exclude_list
+from single_cell.workflows.hmmcopy.scripts import read_counter
+
+WINDOW_SIZE = 100
+
+# neither length is a multiple of the window size, last bin is partial
+HEADER = {
+    'HD': {'VN': '1.0', 'SO': 'coordinate'},
+    'SQ': [{'SN': '1', 'LN': 1050}, {'SN': '2', 'LN': 730}],
+}
+
+
+def make_read(name, chrom, pos, mapq=60, is_duplicate=False):
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    read.reference_id = [seq['SN'] for seq in HEADER['SQ']].index(chrom)
+    read.reference_start = pos
+    read.flag = 1024 if is_duplicate else 0
+    read.mapping_quality = mapq
+    read.cigartuples = [(0, 10)]
+    read.query_sequence = 'A' * 10
+    read.query_qualities = pysam.qualitystring_to_array('I' * 10)
+    return read
+
+
+@pytest.fixture
+def bam(tmpdir):
+    reads = [
+        make_read('first_base', '1', 0),
+        make_read('first_bin', '1', 50),
+        make_read('bin_end', '1', 100),
+        make_read('after_bin_end', '1', 101),
+        make_read('low_mapq', '1', 120, mapq=5),
+        make_read('threshold_mapq', '1', 130, mapq=10),
+        make_read('duplicate', '1', 140, is_duplicate=True),
+        make_read('excluded', '1', 310),
+        make_read('excluded_end', '1', 349),
+        make_read('after_excluded', '1', 350),
+        make_read('last_full_bin', '1', 999),
+        make_read('partial_bin', '1', 1020),
+        make_read('partial_bin_low_mapq', '1', 1030, mapq=0),
+        make_read('chr2', '2', 400),
+        make_read('chr2_excluded', '2', 650),
+        make_read('chr2_partial_bin', '2', 720),
+    ]
+
+    path = os.path.join(str(tmpdir), 'input.bam')
+    with pysam.AlignmentFile(path, 'wb', header=HEADER) as writer:
+        for read in reads:
+            writer.write(read)
+    pysam.index(path)
+    return path
+
+
+@pytest.fixture
+def exclude_list(tmpdir):
+    path = os.path.join(str(tmpdir), 'exclude.txt')
+    with open(path, 'w') as outfile:
+        outfile.write('chrom\tstart\tend\n')
+        outfile.write('1\t300\t350\n')
+        # overlaps the first region, must be merged
+        outfile.write('1\t320\t340\n')
+        # runs past the end of the chromosome
+        outfile.write('2\t600\t5000\n')
+    return path
+
+
+def count(tmpdir, bam, name, **kwargs):
+    output = os.path.join(str(tmpdir), name)
+    with read_counter.ReadCounter(
+            bam, output, WINDOW_SIZE, ['1', '2'], 10, **kwargs
+    ) as rcount:
+        rcount.main()
+    with open(output) as reader:
+        return reader.read()
+
+
+def wig_counts(wig):
+    counts = {}
+    for line in wig.splitlines():
+        if line.startswith('fixedStep'):
+            chrom = line.split()[1].split('=')[1]
+            counts[chrom] = []
+        else:
+            counts[chrom].append(int(line))
+    return counts
+
+
+@pytest.mark.parametrize('seg', [False, True])
+def test_vectorized_matches_per_read(tmpdir, bam, exclude_list, seg):
+    vectorized = count(
+        tmpdir, bam, 'vectorized', seg=seg, excluded=exclude_list
+    )
+    per_read = count(
+        tmpdir, bam, 'per_read', seg=seg, excluded=exclude_list,
+        vectorize=False
+    )
+
+    assert vectorized == per_read
+
+
+def test_vectorized_matches_per_read_no_exclude(tmpdir, bam):
+    vectorized = count(tmpdir, bam, 'vectorized')
+    per_read = count(tmpdir, bam, 'per_read', vectorize=False)
+
+    assert vectorized == per_read
+
+
+def test_vectorized_counts(tmpdir, bam, exclude_list):
+    counts = wig_counts(count(tmpdir, bam, 'vectorized', excluded=exclude_list))
+
+    # a read starting at a bin end is counted in that bin,
+    # mapq below 10, duplicates and excluded starts are dropped
+    assert counts['1'] == [3, 2, 0, 1, 0, 0, 0, 0, 0, 1, 1]
+    assert counts['2'] == [0, 0, 0, 1, 0, 0, 0, 0]
+
+    # partial bin at the end of each chromosome
+    assert len(counts['1']) == 1050 // WINDOW_SIZE + 1
+    assert len(counts['2']) == 730 // WINDOW_SIZE + 1
+
+
+def test_shared_excluded_intervals(tmpdir, bam, exclude_list):
+    excluded = read_exclude_list(exclude_list)
+    intervals = {
+        chrom: read_counter.get_chrom_excluded_intervals(excluded, chrom, length)
+        for chrom, length in [('1', 1050), ('2', 730)]
+    }
+
+    shared = count(tmpdir, bam, 'shared', excluded_intervals=intervals)
+    per_read = count(
+        tmpdir, bam, 'per_read', excluded=exclude_list, vectorize=False
+    )
+
+    assert shared == per_read
+
+    starts, ends = intervals['1']
+    assert np.array_equal(starts, [300])
+    assert np.array_equal(ends, [350])
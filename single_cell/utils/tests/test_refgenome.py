@@ -0,0 +1,130 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+from single_cell.utils import refgenome
+
+from .test_wigutils import write_wig
+
+
+@pytest.fixture
+def wigfiles(tmpdir):
+    gc = write_wig(
+        os.path.join(str(tmpdir), 'gc.wig'),
+        [('1', [0.1, 0.2, 0.3]), ('2', [0.4, 0.5]), ('X', [0.6])], 1000
+    )
+    mapp = write_wig(
+        os.path.join(str(tmpdir), 'map.wig'),
+        [('1', [1.0, 0.9]), ('2', [0.8, 0.7]), ('X', [0.6])], 1000
+    )
+    return gc, mapp
+
+
+@pytest.fixture
+def exclude_list(tmpdir):
+    path = os.path.join(str(tmpdir), 'exclude.tsv')
+    with open(path, 'w') as writer:
+        writer.write('chrom\tstart\tend\n2\t1500\t1600\n')
+    return path
+
+
+def test_build(wigfiles, exclude_list):
+    annotations = refgenome.BinAnnotations.build(
+        *wigfiles, bin_size=1000, exclude_list=exclude_list
+    )
+
+    data = annotations.to_dataframe()
+
+    assert list(data.columns) == ['chr', 'start', 'end', 'gc', 'map', 'exclude']
+    # bins on chromosome 1 are limited to those in both wigs
+    assert list(data['chr']) == ['1', '1', '2', '2', 'X']
+    assert list(data['start']) == [1, 1001, 1, 1001, 1]
+    assert list(data['end']) == [1000, 2000, 1000, 2000, 1000]
+    assert np.allclose(data['map'], [1.0, 0.9, 0.8, 0.7, 0.6])
+    assert list(data['exclude']) == [False, False, False, True, False]
+
+
+def test_get_bin_annotations_cached(wigfiles, exclude_list, tmpdir):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+
+    built = refgenome.get_bin_annotations(
+        *wigfiles, bin_size=1000, exclude_list=exclude_list, cache_dir=cache_dir
+    )
+    cached = refgenome.get_bin_annotations(
+        *wigfiles, bin_size=1000, exclude_list=exclude_list, cache_dir=cache_dir
+    )
+
+    assert isinstance(cached.gc, np.memmap)
+    assert built.to_dataframe().equals(cached.to_dataframe())
+    assert np.allclose(cached.get_chrom('2')['gc'], [0.4, 0.5])
+    assert list(cached.get_index('2', np.array([0, 1, 2]))) == [2, 3, -1]
+    assert list(cached.get_index('Y', np.array([0]))) == [-1]
+
+    # a different exclude list is a different table
+    other = refgenome.get_bin_annotations(*wigfiles, bin_size=1000, cache_dir=cache_dir)
+    assert not other.exclude.any()
+    assert len(os.listdir(os.path.join(cache_dir, 'bin_annotations'))) == 14
+
+
+def test_bin_size_mismatch(wigfiles, tmpdir):
+    with pytest.raises(refgenome.BinAnnotationError):
+        refgenome.get_bin_annotations(*wigfiles, bin_size=500, cache_dir=str(tmpdir))
+
+
+def test_cache_dir_private(wigfiles, tmpdir):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+
+    refgenome.get_bin_annotations(*wigfiles, bin_size=1000, cache_dir=cache_dir)
+
+    prefix = refgenome.get_bin_annotations_prefix(*wigfiles, cache_dir, bin_size=1000)
+    assert stat.S_IMODE(os.stat(os.path.dirname(prefix)).st_mode) == 0o700
+    for path in refgenome.BinAnnotations.get_paths(prefix):
+        assert not os.stat(path).st_mode & 0o077
+
+
+@pytest.mark.parametrize('target', ['dir', 'yaml', 'column'])
+def test_shared_cache_ignored(wigfiles, tmpdir, target):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+
+    refgenome.get_bin_annotations(*wigfiles, bin_size=1000, cache_dir=cache_dir)
+
+    prefix = refgenome.get_bin_annotations_prefix(*wigfiles, cache_dir, bin_size=1000)
+    paths = {
+        'dir': os.path.dirname(prefix),
+        'yaml': prefix + '.yaml',
+        'column': prefix + '.gc.bin',
+    }
+    os.chmod(paths[target], 0o777)
+
+    annotations = refgenome.get_bin_annotations(*wigfiles, bin_size=1000, cache_dir=cache_dir)
+
+    # a cache that others can write to is never loaded, the table
+    # is built in memory instead
+    assert not isinstance(annotations.gc, np.memmap)
+    assert np.allclose(annotations.get_chrom('2')['gc'], [0.4, 0.5])
+
+
+def test_precomputed_key(wigfiles, exclude_list, tmpdir, monkeypatch):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+
+    key = refgenome.get_bin_annotations_key(
+        *wigfiles, bin_size=1000, exclude_list=exclude_list
+    )
+    built = refgenome.get_bin_annotations(
+        *wigfiles, bin_size=1000, exclude_list=exclude_list, cache_dir=cache_dir
+    )
+
+    def get_file_checksum(filepath):
+        raise AssertionError('reference files hashed again')
+
+    monkeypatch.setattr(refgenome.helpers, 'get_file_checksum', get_file_checksum)
+
+    cached = refgenome.get_bin_annotations(
+        *wigfiles, bin_size=1000, exclude_list=exclude_list, cache_dir=cache_dir,
+        key=key
+    )
+
+    # same table as with the key computed per call
+    assert isinstance(cached.gc, np.memmap)
+    assert built.to_dataframe().equals(cached.to_dataframe())
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+from single_cell.utils import wigutils
+
+
+def write_wig(path, blocks, winsize):
+    with open(path, 'w') as wig:
+        for chrom, values in blocks:
+            wig.write('fixedStep chrom={0} start=1 step={1} span={1}\n'.format(chrom, winsize))
+            for value in values:
+                wig.write('{}\n'.format(value))
+    return path
+
+
+@pytest.fixture
+def wigfile(tmpdir):
+    blocks = [('1', [0.1, 0.2, 0.3]), ('2', [0.4, 0.5]), ('X', [0.6])]
+    return write_wig(os.path.join(str(tmpdir), 'gc.wig'), blocks, 1000)
+
+
+def test_read_wig_arrays(wigfile):
+    blocks = wigutils.read_wig_arrays(wigfile)
+
+    assert [(chrom, start, winsize) for chrom, start, winsize, _ in blocks] == \
+        [('1', 1, 1000), ('2', 1, 1000), ('X', 1, 1000)]
+    assert np.allclose(blocks[1][3], [0.4, 0.5])
+
+
+def test_wig_track(wigfile):
+    track = wigutils.WigTrack.from_wig(wigfile)
+
+    assert track.winsize == 1000
+    assert track.chromosomes == ['1', '2', 'X']
+    assert np.allclose(track.get_values('2'), [0.4, 0.5])
+    assert list(track.get_index('2', np.array([0, 1, 2]))) == [3, 4, -1]
+    assert list(track.get_index('Y', np.array([0]))) == [-1]
+
+
+def test_wig_track_multiple_step_sizes(tmpdir):
+    wigfile = os.path.join(str(tmpdir), 'gc.wig')
+    write_wig(wigfile, [('1', [0.1])], 1000)
+    with open(wigfile, 'a') as wig:
+        wig.write('fixedStep chrom=2 start=1 step=500 span=500\n0.2\n')
+
+    with pytest.raises(wigutils.WigTrackError):
+        wigutils.WigTrack.from_wig(wigfile)
@@ -0,0 +1,130 @@
+'''
+wiggle file parsing into numpy arrays for genome wide
+reference tracks (gc, mappability)
+'''
+import numpy as np
+
+
+class WigTrackError(Exception):
+    pass
+
+
+def read_wig_arrays(infile, dtype=np.float64):
+    """read fixedStep wiggle file into one numpy array per block
+
+    :param infile: input wiggle file
+    :param dtype: numpy dtype of the values
+    :returns list of (chrom, start, winsize, values) tuples, in file order
+    """
+    blocks = []
+
+    def flush(header, values):
+        if header is not None:
+            blocks.append(header + (np.array(values, dtype=dtype),))
+
+    header = None
+    values = []
+
+    with open(infile) as wig:
+        for line in wig:
+            line = line.strip()
+
+            if not line:
+                continue
+
+            if line.startswith('fixedStep'):
+                flush(header, values)
+
+                line = line.split()
+                chrom = line[1].split('=')[1]
+                start = int(line[2].split('=')[1])
+                winsize = int(line[3].split('=')[1])
+
+                header = (chrom, start, winsize)
+                values = []
+            else:
+                values.append(line)
+
+    flush(header, values)
+
+    return blocks
+
+
+def get_first_bin(start, winsize):
+    """index of the first bin in a fixedStep block
+    """
+    return 0 if start < winsize else start // winsize
+
+
+class WigTrack(object):
+    """
+    genome wide bin values, one contiguous array for all chromosomes
+    """
+
+    def __init__(self, winsize, chromosomes, offsets, first_bins, values):
+        """
+        :param winsize: bin size
+        :param chromosomes: chromosome names in file order
+        :param offsets: dict of chromosome to index of its first value
+        :param first_bins: dict of chromosome to bin number of its first value
+        :param values: numpy array with all values
+        """
+        self.winsize = winsize
+        self.chromosomes = chromosomes
+        self.offsets = offsets
+        self.first_bins = first_bins
+        self.values = values
+
+    @classmethod
+    def from_wig(cls, wigfile):
+        blocks = read_wig_arrays(wigfile)
+
+        winsizes = set(winsize for _, _, winsize, _ in blocks)
+        if len(winsizes) != 1:
+            raise WigTrackError('{} has multiple step sizes: {}'.format(wigfile, winsizes))
+
+        chromosomes = []
+        offsets = {}
+        first_bins = {}
+        offset = 0
+        for chrom, start, winsize, values in blocks:
+            if chrom in offsets:
+                raise WigTrackError('{} has multiple blocks for {}'.format(wigfile, chrom))
+            chromosomes.append(chrom)
+            offsets[chrom] = offset
+            first_bins[chrom] = get_first_bin(start, winsize)
+            offset += len(values)
+
+        values = np.concatenate([block[3] for block in blocks])
+
+        return cls(winsizes.pop(), chromosomes, offsets, first_bins, values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get_nbins(self, chrom):
+        idx = self.chromosomes.index(chrom)
+        if idx + 1 < len(self.chromosomes):
+            return self.offsets[self.chromosomes[idx + 1]] - self.offsets[chrom]
+        return len(self.values) - self.offsets[chrom]
+
+    def get_index(self, chrom, bins):
+        """converts bin numbers on a chromosome to indices into values
+
+        :param chrom: chromosome name
+        :param bins: numpy array with bin numbers
+        :returns numpy array with indices, -1 for bins not in the track
+        """
+        if chrom not in self.offsets:
+            return np.full(len(bins), -1, dtype=np.int64)
+
+        local = bins - self.first_bins[chrom]
+        valid = (local >= 0) & (local < self.get_nbins(chrom))
+
+        return np.where(valid, local + self.offsets[chrom], -1)
+
+    def get_values(self, chrom):
+        """zero copy view of the values for a chromosome
+        """
+        start = self.offsets[chrom]
+        return self.values[start:start + self.get_nbins(chrom)]
@@ -176,34 +176,37 @@ def write_summary_counts(counts, outfile, cell_id, fastqscreen_params):
         writer.write(values)
 
 
-def filter_reads(
-        input_r1, input_r2, output_r1, output_r2, reference
+def filter_and_count_reads(
+        input_r1, input_r2, output_r1, output_r2, reference=None, threads=None
 ):
+    """
+    counts the fastq_screen tags and writes re-tagged reads in a single
+    pass over the tagged fastqs. inputs are read ahead and outputs are
+    written in background threads, parsing runs in the calling thread.
+
+    :param reference: only write pairs that belong to this genome,
+    write all pairs if not set
+    :param threads: compression threads per output
+    :returns counts, see fastqutils.PairedTaggedFastqReader.gather_counts
+    """
     reader = fastqutils.PairedTaggedFastqReader(input_r1, input_r2)
 
-    with helpers.getFileHandle(output_r1, 'wt') as writer_r1, helpers.getFileHandle(output_r2, 'wt') as writer_r2:
-        for read_1, read_2 in reader.filter_read_iterator(reference):
+    counts = {'R1': defaultdict(int), 'R2': defaultdict(int)}
 
-            read_1 = reader.add_tag_to_read_comment(read_1)
-            read_2 = reader.add_tag_to_read_comment(read_2)
+    with helpers.getFileHandle(output_r1, 'wt', threads=threads) as writer_r1, \
+            helpers.getFileHandle(output_r2, 'wt', threads=threads) as writer_r2:
 
-            for line in read_1:
-                writer_r1.write(line)
+        def write_block(lines_r1, lines_r2):
+            writer_r1.writelines(lines_r1)
+            writer_r2.writelines(lines_r2)
 
-            for line in read_2:
-                writer_r2.write(line)
+        with helpers.ThreadedWriter(write_block) as writer:
+            for lines_r1, lines_r2 in reader.tag_and_count_blocks(
+                    counts, reference=reference, read_ahead=True
+            ):
+                writer.write(lines_r1, lines_r2)
 
-
-def re_tag_reads(infile, outfile):
-    reader = fastqutils.TaggedFastqReader(infile)
-
-    with helpers.getFileHandle(outfile, 'wt') as writer:
-
-        for read in reader.get_read_iterator():
-            read = reader.add_tag_to_read_comment(read)
-
-            for line in read:
-                writer.write(line)
+    return counts
 
 
 def organism_filter(
@@ -221,23 +224,20 @@ def organism_filter(
         fastq_r1, fastq_r2, tempdir, params, docker_image=docker_image
     )
 
-    reader = fastqutils.PairedTaggedFastqReader(tagged_fastq_r1, tagged_fastq_r2)
-    counts = reader.gather_counts()
-
-    write_detailed_counts(counts, detailed_metrics, cell_id, params)
-    write_summary_counts(counts, summary_metrics, cell_id, params)
+    threads = params.get('compression_threads', 1)
 
+    # without filtering, use the full tagged fastq downstream
+    # with organism type information in readname
+    ref_name = None
     if filter_contaminated_reads:
         ref_name = [entry['name'] for entry in params['genomes'] if entry['path'] == reference]
         assert len(ref_name) == 1, 'duplicate reference paths detected in fastqscreen params'
         ref_name = ref_name[0]
 
-        filter_reads(
-            tagged_fastq_r1, tagged_fastq_r2, filtered_fastq_r1,
-            filtered_fastq_r2, ref_name
-        )
-    else:
-        # use the full tagged fastq downstream
-        # with organism type information in readname
-        re_tag_reads(tagged_fastq_r1, filtered_fastq_r1)
-        re_tag_reads(tagged_fastq_r2, filtered_fastq_r2)
+    counts = filter_and_count_reads(
+        tagged_fastq_r1, tagged_fastq_r2, filtered_fastq_r1,
+        filtered_fastq_r2, reference=ref_name, threads=threads
+    )
+
+    write_detailed_counts(counts, detailed_metrics, cell_id, params)
+    write_summary_counts(counts, summary_metrics, cell_id, params)
@@ -33,13 +33,48 @@ def create_hmmcopy_workflow(
         obj=mgd.TempOutputObj('sampleinfo', 'cell_id', axes_origin=[]),
         value=sample_info)
 
+    max_cores = hmmparams.get('max_cores', 8)
+    compression_threads = hmmparams.get('compression_threads', 4)
+
+    run_hmmcopy_kwargs = {}
+    if hmmparams.get('batch_read_counting', False):
+        # count reads for all cells in one multi process job
+        workflow.transform(
+            name='count_reads',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': max_cores,
+                 'docker_image': baseimage},
+            func="single_cell.workflows.hmmcopy.tasks.count_reads_batch",
+            args=(
+                mgd.InputFile('bam_markdups', 'cell_id', fnames=bam_file, extensions=['.bai'], axes_origin=[]),
+                mgd.TempOutputFile('readcounter.wig', 'cell_id', axes_origin=[]),
+                hmmparams,
+            ),
+            kwargs={'ncores': max_cores}
+        )
+        run_hmmcopy_kwargs['readcount_wig'] = mgd.TempInputFile('readcounter.wig', 'cell_id')
+        # the cell bams are only read by count_reads
+        hmmcopy_bam = None
+    else:
+        hmmcopy_bam = mgd.InputFile('bam_markdups', 'cell_id', fnames=bam_file, extensions=['.bai'])
+
+    if hmmparams['smoothing_function'] == 'modal':
+        # hash the reference files once, not in every cell job
+        workflow.transform(
+            name='get_bin_annotations_key',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
+            func="single_cell.workflows.hmmcopy.tasks.get_bin_annotations_key",
+            ret=mgd.TempOutputObj('bin_annotations_key'),
+            args=(hmmparams,)
+        )
+        run_hmmcopy_kwargs['bin_annotations_key'] = mgd.TempInputObj('bin_annotations_key')
+
     workflow.transform(
         name='run_hmmcopy',
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
         func="single_cell.workflows.hmmcopy.tasks.run_hmmcopy",
         axes=('cell_id',),
         args=(
-            mgd.InputFile('bam_markdups', 'cell_id', fnames=bam_file, extensions=['.bai']),
+            hmmcopy_bam,
             mgd.TempOutputFile('reads.csv.gz', 'cell_id', extensions=['.yaml']),
             mgd.TempOutputFile('segs.csv.gz', 'cell_id', extensions=['.yaml']),
             mgd.TempOutputFile('params.csv.gz', 'cell_id', extensions=['.yaml']),
@@ -50,36 +85,43 @@ def create_hmmcopy_workflow(
             mgd.TempSpace('hmmcopy_temp', 'cell_id'),
             hmmcopy_docker
         ),
+        kwargs=run_hmmcopy_kwargs,
     )
 
     workflow.transform(
         name='merge_reads',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
+        ctx={'mem': hmmparams['memory']['med'], 'ncpus': compression_threads,
+             'docker_image': baseimage},
         func="single_cell.workflows.hmmcopy.tasks.concatenate_csv",
         args=(
             mgd.TempInputFile('reads.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            mgd.TempOutputFile('reads_merged.csv.gz', extensions=['.yaml']),
+            mgd.TempOutputFile('reads_merged.npz', extensions=['.yaml']),
         ),
+        kwargs={'threads': compression_threads}
     )
 
     workflow.transform(
         name='add_mappability_bool',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
+        ctx={'mem': hmmparams['memory']['med'], 'ncpus': compression_threads,
+             'docker_image': baseimage},
         func="single_cell.workflows.hmmcopy.tasks.get_mappability_col",
         args=(
-            mgd.TempInputFile('reads_merged.csv.gz', extensions=['.yaml']),
+            mgd.TempInputFile('reads_merged.npz', extensions=['.yaml']),
             mgd.OutputFile(reads, extensions=['.yaml']),
         ),
+        kwargs={'threads': compression_threads}
     )
 
     workflow.transform(
         name='merge_segs',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
+        ctx={'mem': hmmparams['memory']['med'], 'ncpus': compression_threads,
+             'docker_image': baseimage},
         func="single_cell.workflows.hmmcopy.tasks.concatenate_csv",
         args=(
             mgd.TempInputFile('segs.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
             mgd.OutputFile(segs, extensions=['.yaml']),
         ),
+        kwargs={'threads': compression_threads}
     )
 
     workflow.transform(
@@ -112,31 +154,76 @@ def create_hmmcopy_workflow(
         )
     )
 
-    workflow.transform(
-        name='hmmcopy_plots',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
-        func="single_cell.workflows.hmmcopy.tasks.plot_hmmcopy",
-        axes=('cell_id',),
-        args=(
-            mgd.TempInputFile('reads.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            mgd.TempInputFile('segs.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            mgd.TempInputFile('params.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            mgd.TempInputFile('hmm_metrics.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            hmmparams['ref_genome'],
-            mgd.TempOutputFile('segments.png', 'cell_id', axes_origin=[]),
-            mgd.TempOutputFile('bias.png', 'cell_id', axes_origin=[]),
-            mgd.InputInstance('cell_id'),
-        ),
-        kwargs={
-            'num_states': hmmparams['num_states'],
-            'sample_info': mgd.TempInputObj('sampleinfo', 'cell_id'),
-            'max_cn': mgd.TempInputObj("max_cn")
-        }
-    )
+    if hmmparams.get('batch_plotting', False):
+        # plot all cells in one multi process job, straight into the tarballs
+        workflow.transform(
+            name='hmmcopy_plots',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': max_cores,
+                 'docker_image': baseimage},
+            func="single_cell.workflows.hmmcopy.tasks.plot_hmmcopy_batch",
+            args=(
+                mgd.InputFile(reads, extensions=['.yaml']),
+                mgd.InputFile(segs, extensions=['.yaml']),
+                mgd.InputFile(params, extensions=['.yaml']),
+                mgd.TempInputFile('hmm_metrics.csv.gz', extensions=['.yaml']),
+                hmmparams['ref_genome'],
+                mgd.OutputFile(segs_pdf),
+                mgd.OutputFile(bias_pdf),
+            ),
+            kwargs={
+                'num_states': hmmparams['num_states'],
+                'sample_info': sample_info,
+                'max_cn': mgd.TempInputObj("max_cn"),
+                'processes': max_cores,
+            }
+        )
+    else:
+        workflow.transform(
+            name='hmmcopy_plots',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
+            func="single_cell.workflows.hmmcopy.tasks.plot_hmmcopy",
+            axes=('cell_id',),
+            args=(
+                mgd.TempInputFile('reads.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+                mgd.TempInputFile('segs.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+                mgd.TempInputFile('params.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+                mgd.TempInputFile('hmm_metrics.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+                hmmparams['ref_genome'],
+                mgd.TempOutputFile('segments.png', 'cell_id', axes_origin=[]),
+                mgd.TempOutputFile('bias.png', 'cell_id', axes_origin=[]),
+                mgd.InputInstance('cell_id'),
+            ),
+            kwargs={
+                'num_states': hmmparams['num_states'],
+                'sample_info': mgd.TempInputObj('sampleinfo', 'cell_id'),
+                'max_cn': mgd.TempInputObj("max_cn")
+            }
+        )
+
+        workflow.transform(
+            name='merge_hmm_copy_plots',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
+            func="single_cell.workflows.hmmcopy.tasks.merge_pdf",
+            args=(
+                [
+                    mgd.TempInputFile('segments.png', 'cell_id'),
+                    mgd.TempInputFile('bias.png', 'cell_id'),
+                ],
+                [
+                    mgd.OutputFile(segs_pdf),
+                    mgd.OutputFile(bias_pdf),
+                ],
+                mgd.InputFile(metrics, extensions=['.yaml']),
+                None,
+                mgd.TempSpace("hmmcopy_plot_merge_temp"),
+                ['segments', 'bias']
+            )
+        )
 
     workflow.transform(
         name='annotate_metrics_with_info_and_clustering',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
+        ctx={'mem': hmmparams['memory']['med'], 'ncpus': max_cores,
+             'docker_image': baseimage},
         func="single_cell.workflows.hmmcopy.tasks.add_clustering_order",
         args=(
             mgd.InputFile(reads, extensions=['.yaml']),
@@ -145,30 +232,12 @@ def create_hmmcopy_workflow(
         ),
         kwargs={
             'chromosomes': hmmparams["chromosomes"],
-            'sample_info': sample_info
+            'sample_info': sample_info,
+            'threads': max_cores,
+            'max_exact_cells': hmmparams.get('clustering_max_exact_cells'),
         }
     )
 
-    workflow.transform(
-        name='merge_hmm_copy_plots',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
-        func="single_cell.workflows.hmmcopy.tasks.merge_pdf",
-        args=(
-            [
-                mgd.TempInputFile('segments.png', 'cell_id'),
-                mgd.TempInputFile('bias.png', 'cell_id'),
-            ],
-            [
-                mgd.OutputFile(segs_pdf),
-                mgd.OutputFile(bias_pdf),
-            ],
-            mgd.InputFile(metrics, extensions=['.yaml']),
-            None,
-            mgd.TempSpace("hmmcopy_plot_merge_temp"),
-            ['segments', 'bias']
-        )
-    )
-
     workflow.transform(
         name='create_igv_seg',
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1, 'docker_image': baseimage},
@@ -222,7 +291,8 @@ def create_hmmcopy_workflow(
             'chromosomes': chromosomes,
             'max_cn': hmmparams['num_states'],
             'scale_by_cells': False,
-            'mappability_threshold': hmmparams["map_cutoff"]
+            'mappability_threshold': hmmparams["map_cutoff"],
+            'image_size': hmmparams.get('heatmap_image_size', [1000, 3000]),
         }
     )
 
@@ -22,6 +22,14 @@ def dtypes():
         'is_low_mappability': 'bool'
     }
 
+    readcounts = {
+        'cell_id': 'str',
+        'chr': 'str',
+        'start': 'int',
+        'end': 'int',
+        'reads': 'int',
+    }
+
     segs = {
         'chr': 'str',
         'start': 'int',
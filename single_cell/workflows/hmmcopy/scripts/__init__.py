@@ -10,4 +10,6 @@ from .filter_data import FilterHmmData
 from .read_counter import ReadCounter
 from .convert_csv_to_seg import ConvertCSVToSEG
 from .read_counter import ReadCounter
+from .batch_read_counter import BatchReadCounter
+from .batch_quality_metrics import BatchExtractHmmMetrics
 from .correct_read_count import CorrectReadCount
@@ -0,0 +1,347 @@
+'''
+quality metrics for all cells in the merged hmmcopy tables at once.
+
+rows are assigned an integer cell code and every metric is a grouped
+numpy reduction over the codes: sums and moments with bincount, medians
+by sorting on (cell, value) and picking the middle elements. the output
+matches ExtractHmmMetrics.compute_quality_metrics run on every cell.
+'''
+import argparse
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import csvutils
+
+from single_cell.workflows.hmmcopy.scripts.extract_quality_metrics import ExtractHmmMetrics
+
+READS_COLUMNS = [
+    'cell_id', 'chr', 'start', 'end', 'reads', 'copy', 'state',
+    'integer_copy_scale', 'integer_copy_number'
+]
+
+SEGMENTS_COLUMNS = [
+    'cell_id', 'chr', 'start', 'end', 'integer_median', 'integer_copy_number'
+]
+
+METRICS_COLUMNS = [
+    'total_mapped_reads_hmmcopy', 'total_reads_hmmcopy', 'mad_chr19',
+    'mad_hmmcopy', 'mad_neutral_state', 'mad_autosomes', 'cv_hmmcopy',
+    'cv_neutral_state', 'autocorrelation_hmmcopy', 'mean_hmmcopy_reads_per_bin',
+    'median_hmmcopy_reads_per_bin', 'std_hmmcopy_reads_per_bin',
+    'empty_bins_hmmcopy', 'empty_bins_hmmcopy_chrY',
+    'MBRSI_dispersion_non_integerness', 'MBRSM_dispersion', 'MSRSI_non_integerness'
+]
+
+
+def group_count(codes, num_groups, mask=None):
+    if mask is not None:
+        codes = codes[mask]
+    return np.bincount(codes, minlength=num_groups)
+
+
+def group_sum(codes, values, num_groups):
+    return np.bincount(codes, weights=values, minlength=num_groups)
+
+
+def factorize(values):
+    """
+    :returns sorted unique values and the position of each value in them
+    """
+    codes, uniques = pd.factorize(values)
+    order = np.argsort(uniques, kind='mergesort')
+
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+
+    return np.asarray(uniques)[order], ranks[codes]
+
+
+def group_mean(codes, values, num_groups):
+    """
+    same as np.mean per group, nan for empty groups
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return group_sum(codes, values, num_groups) / group_count(codes, num_groups)
+
+
+def group_std(codes, values, num_groups, mean=None):
+    """
+    same as np.std (ddof 0) per group, nan for empty groups
+    """
+    if mean is None:
+        mean = group_mean(codes, values, num_groups)
+    return np.sqrt(group_mean(codes, (values - mean[codes]) ** 2, num_groups))
+
+
+def group_median(codes, values, num_groups):
+    """
+    same as np.median per group: nan for empty groups and for groups
+    with a nan value
+    """
+    values = np.asarray(values, dtype=np.float64)
+
+    median = np.full(num_groups, np.nan)
+    if not len(values):
+        return median
+
+    has_nan = group_count(codes, num_groups, np.isnan(values)) > 0
+
+    # sort by value, then a stable sort by group. much faster than
+    # lexsort, more so with the group codes in a small integer type
+    order = np.argsort(values)
+    group_codes = codes[order].astype(np.min_scalar_type(num_groups))
+    order = order[np.argsort(group_codes, kind='stable')]
+    values = values[order]
+
+    counts = group_count(codes, num_groups)
+    starts = np.cumsum(counts) - counts
+
+    present = counts > 0
+    lower = (starts + (counts - 1) // 2)[present]
+    upper = (starts + counts // 2)[present]
+    median[present] = (values[lower] + values[upper]) / 2
+    median[has_nan] = np.nan
+
+    return median
+
+
+def group_mad(codes, values, num_groups):
+    """
+    median absolute deviation from the median per group, the same as
+    statsmodels mad with c=1
+    """
+    values = np.asarray(values, dtype=np.float64)
+    median = group_median(codes, values, num_groups)
+    return group_median(codes, np.abs(values - median[codes]), num_groups)
+
+
+def group_autocorrelation(codes, values, num_groups):
+    """
+    lag 1 autocorrelation per group in row order, the same as
+    statsmodels acf(values, nlags=1)[1]
+    """
+    values = np.asarray(values, dtype=np.float64)
+
+    order = np.argsort(codes, kind='mergesort')
+    codes = codes[order]
+    values = values[order]
+
+    deviation = values - group_mean(codes, values, num_groups)[codes]
+
+    consecutive = codes[1:] == codes[:-1]
+    lagged = group_sum(
+        codes[1:][consecutive],
+        (deviation[1:] * deviation[:-1])[consecutive],
+        num_groups
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return lagged / group_sum(codes, deviation ** 2, num_groups)
+
+
+def assign_bins_to_segments(bin_groups, bin_starts, bin_ends, seg_groups, seg_starts, seg_ends):
+    """
+    finds the segment that contains each bin. bins and segments are
+    matched on group (cell and chromosome), segments in a group must
+    not overlap
+    :returns index of the segment for each bin, -1 if the bin is not
+    in a segment
+    """
+    seg_keys = (seg_groups.astype(np.int64) << 32) | seg_starts.astype(np.int64)
+    order = np.argsort(seg_keys, kind='mergesort')
+
+    bin_keys = (bin_groups.astype(np.int64) << 32) | bin_starts.astype(np.int64)
+
+    # last segment starting at or before the bin
+    candidate = np.searchsorted(seg_keys[order], bin_keys, side='right') - 1
+    segment = order[np.maximum(candidate, 0)]
+
+    contained = (
+        (candidate >= 0) &
+        (seg_groups[segment] == bin_groups) &
+        (bin_ends <= seg_ends[segment])
+    )
+
+    return np.where(contained, segment, -1)
+
+
+def _get_codes(keys, values):
+    """
+    positions of values in the sorted keys, -1 if missing
+    """
+    positions = np.searchsorted(keys, values)
+    positions = np.minimum(positions, len(keys) - 1)
+    return np.where(keys[positions] == values, positions, -1)
+
+
+def compute_quality_metrics(reads, segments=None):
+    """
+    computes the quality metrics of ExtractHmmMetrics for all cells
+    :param reads: hmmcopy reads dataframe with a cell_id column
+    :param segments: hmmcopy segments dataframe with a cell_id column,
+    cells without segments get nan for the segment metrics
+    :returns metrics dataframe, one row per cell sorted by cell_id
+    """
+    cells, codes = factorize(reads['cell_id'].values)
+    num_cells = len(cells)
+
+    metrics = pd.DataFrame({'cell_id': cells})
+
+    if 'copy' not in reads.columns:
+        for column in METRICS_COLUMNS:
+            metrics[column] = np.nan
+        return metrics
+
+    chrom = reads['chr'].astype(str).values
+    counts = reads['reads'].values.astype(np.float64)
+    copy = reads['copy'].values.astype(np.float64)
+
+    hmm = ~np.isnan(copy)
+    hmm_codes = codes[hmm]
+    hmm_copy = copy[hmm]
+    hmm_counts = counts[hmm]
+
+    total_reads = group_sum(codes, counts, num_cells)
+    total_reads_hmmcopy = group_sum(hmm_codes, hmm_counts, num_cells)
+    if not np.isnan(counts).any():
+        total_reads = total_reads.astype(np.int64)
+        total_reads_hmmcopy = total_reads_hmmcopy.astype(np.int64)
+    metrics['total_mapped_reads_hmmcopy'] = total_reads
+    metrics['total_reads_hmmcopy'] = total_reads_hmmcopy
+
+    chr19 = chrom[hmm] == '19'
+    metrics['mad_chr19'] = group_mad(hmm_codes[chr19], hmm_copy[chr19], num_cells)
+
+    metrics['mad_hmmcopy'] = group_mad(hmm_codes, hmm_copy, num_cells)
+
+    neutral = reads['state'].values[hmm] == 3
+    metrics['mad_neutral_state'] = group_mad(hmm_codes[neutral], hmm_copy[neutral], num_cells)
+
+    # nan copy is kept, as in compute_mad_autosomes
+    autosomes = (chrom != 'X') & (chrom != 'Y')
+    metrics['mad_autosomes'] = group_mad(codes[autosomes], copy[autosomes], num_cells)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = group_mean(hmm_codes, hmm_copy, num_cells)
+        metrics['cv_hmmcopy'] = group_std(hmm_codes, hmm_copy, num_cells, mean=mean) / mean
+
+        mean = group_mean(hmm_codes[neutral], hmm_copy[neutral], num_cells)
+        metrics['cv_neutral_state'] = group_std(
+            hmm_codes[neutral], hmm_copy[neutral], num_cells, mean=mean
+        ) / mean
+
+    metrics['autocorrelation_hmmcopy'] = group_autocorrelation(hmm_codes, hmm_copy, num_cells)
+
+    mean = group_mean(hmm_codes, hmm_counts, num_cells)
+    metrics['mean_hmmcopy_reads_per_bin'] = mean
+    metrics['median_hmmcopy_reads_per_bin'] = group_median(hmm_codes, hmm_counts, num_cells)
+    metrics['std_hmmcopy_reads_per_bin'] = group_std(hmm_codes, hmm_counts, num_cells, mean=mean)
+
+    empty = hmm_counts == 0
+    metrics['empty_bins_hmmcopy'] = group_count(hmm_codes, num_cells, empty)
+    metrics['empty_bins_hmmcopy_chrY'] = group_count(
+        hmm_codes, num_cells, empty & (chrom[hmm] == 'Y')
+    )
+
+    copy_scale = reads['integer_copy_scale'].values[hmm].astype(np.float64)
+    metrics['MBRSI_dispersion_non_integerness'] = group_median(
+        hmm_codes,
+        np.abs(copy_scale - reads['integer_copy_number'].values[hmm].astype(np.float64)),
+        num_cells
+    )
+
+    metrics['MBRSM_dispersion'] = np.nan
+    metrics['MSRSI_non_integerness'] = np.nan
+
+    if segments is not None and not segments.empty:
+        seg_codes = _get_codes(cells, segments['cell_id'].values)
+        segments = segments[seg_codes >= 0]
+        seg_codes = seg_codes[seg_codes >= 0]
+
+        seg_chrom = segments['chr'].astype(str).values
+        chroms, chrom_codes = factorize(np.concatenate([chrom[hmm], seg_chrom]))
+        num_chroms = len(chroms)
+
+        seg_median = segments['integer_median'].values.astype(np.float64)
+
+        segment = assign_bins_to_segments(
+            hmm_codes.astype(np.int64) * num_chroms + chrom_codes[:len(hmm_codes)],
+            reads['start'].values[hmm],
+            reads['end'].values[hmm],
+            seg_codes.astype(np.int64) * num_chroms + chrom_codes[len(hmm_codes):],
+            segments['start'].values,
+            segments['end'].values,
+        )
+        in_segment = segment >= 0
+
+        segmented = group_count(seg_codes, num_cells) > 0
+
+        residuals = np.abs(copy_scale[in_segment] - seg_median[segment[in_segment]])
+        mbrsm = group_median(hmm_codes[in_segment], residuals, num_cells)
+        metrics['MBRSM_dispersion'] = np.where(segmented, mbrsm, np.nan)
+
+        residuals = np.abs(
+            seg_median - segments['integer_copy_number'].values.astype(np.float64)
+        )
+        metrics['MSRSI_non_integerness'] = group_median(seg_codes, residuals, num_cells)
+
+    return metrics
+
+
+def get_log_likelihood(params, cells):
+    """
+    final log likelihood of each cell from the merged params table
+    """
+    loglik = params[params['parameter'] == 'loglik']
+    loglik = loglik.drop_duplicates('cell_id').set_index('cell_id')['final']
+    return loglik.reindex(cells).values.astype(np.float64)
+
+
+class BatchExtractHmmMetrics(ExtractHmmMetrics):
+    """
+    ExtractHmmMetrics over the merged reads, segments and params tables
+    of all cells
+    """
+
+    def __init__(self, params, reads, segments, output, table_name=None):
+        super(BatchExtractHmmMetrics, self).__init__(
+            params, reads, segments, output, None,
+            table_name=table_name or 'hmmcopy/metrics'
+        )
+
+    def main(self):
+        reads = csvutils.read_csv_and_yaml(self.reads, usecols=READS_COLUMNS)
+        segments = csvutils.read_csv_and_yaml(self.segments, usecols=SEGMENTS_COLUMNS)
+        params = csvutils.read_csv_and_yaml(
+            self.params, usecols=['cell_id', 'parameter', 'final']
+        )
+
+        metrics = compute_quality_metrics(reads, segments)
+
+        metrics['log_likelihood'] = get_log_likelihood(params, metrics['cell_id'].values)
+
+        self.write_df_to_file(metrics)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('reads')
+
+    parser.add_argument('segments')
+
+    parser.add_argument('params')
+
+    parser.add_argument('output')
+
+    parser.add_argument('--table_name', default=None)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    BatchExtractHmmMetrics(
+        args.params, args.reads, args.segments, args.output, table_name=args.table_name
+    ).main()
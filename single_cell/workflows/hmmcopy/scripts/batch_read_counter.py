@@ -0,0 +1,344 @@
+'''
+batch read counting over many cells in a process pool
+'''
+import argparse
+import collections
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import csvutils
+
+from single_cell.workflows.hmmcopy.scripts.read_counter import ReadCounter
+from single_cell.workflows.hmmcopy.scripts.read_counter import get_chrom_excluded_intervals
+from single_cell.utils.refgenome import read_exclude_list
+
+# per process state, set once by _init_worker. exclude intervals are
+# inherited read-only from the parent when the pool forks.
+_worker_state = {}
+
+# bams kept open per worker process
+MAX_OPEN_BAMS = 4
+
+
+def _init_worker(params, excluded_intervals):
+    _worker_state['params'] = params
+    _worker_state['excluded_intervals'] = excluded_intervals
+    _worker_state['counters'] = collections.OrderedDict()
+
+
+def _get_counter(bam):
+    """returns a ReadCounter for the bam. counters are reused across
+    tasks so that a bam is opened once per worker and not once per chromosome
+    """
+    counters = _worker_state['counters']
+
+    if bam in counters:
+        counters[bam] = counters.pop(bam)
+        return counters[bam]
+
+    if len(counters) >= MAX_OPEN_BAMS:
+        _, oldest = counters.popitem(last=False)
+        oldest.bam.close()
+
+    params = _worker_state['params']
+    counters[bam] = ReadCounter(
+        bam, None, params['window_size'], params['chromosomes'],
+        params['mapq'], reference=params['reference'],
+        excluded_intervals=_worker_state['excluded_intervals']
+    )
+
+    return counters[bam]
+
+
+def _record_cell_tags(data, cell_tag, cell_index, cell_codes):
+    """passes reads through, storing the code of each read's cell tag.
+    reads without the tag get code -1
+    """
+    for read in data:
+        cell = read.get_tag(cell_tag) if read.has_tag(cell_tag) else None
+        cell_codes.append(cell_index.get(cell, -1))
+        yield read
+
+
+def _count_cell_chrom(task):
+    """counts reads for one chromosome of a single cell bam
+    :param task: tuple of cell_id, bam path and chromosome name
+    :returns tuple of cell_id, chromosome, counts array
+    """
+    cell_id, bam, chrom = task
+
+    counter = _get_counter(bam)
+    reflen = counter.chr_lengths[chrom]
+
+    data = counter.bam.fetch(chrom, 0, reflen)
+    positions, flags, mapqs, fs_codes, fs_values = counter.get_read_arrays(data)
+
+    keep = counter.filter_arrays(
+        chrom, reflen, positions, flags, mapqs, fs_codes, fs_values
+    )
+
+    counts = counter.count_bins(positions[keep], reflen)
+
+    return [(cell_id, chrom, counts.astype(np.int32))]
+
+
+def _count_tagged_chrom(task):
+    """counts reads for one chromosome of a merged bam, split by cell tag
+    :param task: tuple of bam path and chromosome name
+    :returns list of (cell_id, chromosome, counts array) tuples
+    """
+    bam, chrom = task
+
+    params = _worker_state['params']
+    cells = params['cells']
+    cell_index = {cell: i for i, cell in enumerate(cells)}
+
+    counter = _get_counter(bam)
+    reflen = counter.chr_lengths[chrom]
+    nbins = reflen // counter.window_size + 1
+
+    cell_codes = []
+    data = counter.bam.fetch(chrom, 0, reflen)
+    data = _record_cell_tags(data, params['cell_tag'], cell_index, cell_codes)
+    positions, flags, mapqs, fs_codes, fs_values = counter.get_read_arrays(data)
+    cell_codes = np.array(cell_codes, dtype=np.int64)
+
+    keep = counter.filter_arrays(
+        chrom, reflen, positions, flags, mapqs, fs_codes, fs_values
+    )
+    keep &= cell_codes >= 0
+
+    bin_index = np.maximum(positions[keep] - 1, 0) // counter.window_size
+    bin_index += cell_codes[keep] * nbins
+
+    counts = np.bincount(bin_index, minlength=len(cells) * nbins)
+    counts = counts.reshape((len(cells), nbins)).astype(np.int32)
+
+    return [(cell, chrom, counts[i]) for i, cell in enumerate(cells)]
+
+
+class BatchReadCounter(object):
+    """
+    calculate reads per bin for many cells in a process pool.
+    inputs are either one bam per cell or a single bam where
+    reads are labelled with a cell tag (CB or RG).
+    """
+
+    def __init__(
+            self, bams, window_size, chromosomes, mapq, excluded=None,
+            reference=None, cell_tag=None, cells=None, ncores=None
+    ):
+        """
+        :param bams: dict of cell_id to bam path, or a path to a merged bam
+        :param cell_tag: bam tag with the cell id, required for merged bams
+        :param cells: cell ids to count from a merged bam, read group ids
+        from the header are used if not set and cell_tag is RG
+        :param ncores: number of processes, defaults to cpu count
+        """
+        self.bams = bams
+        self.window_size = window_size
+        self.mapq = mapq
+        self.reference = reference
+        self.cell_tag = cell_tag
+        self.ncores = ncores if ncores else multiprocessing.cpu_count()
+
+        if isinstance(bams, dict):
+            self.merged = False
+            template_bam = list(bams.values())[0]
+        else:
+            if not cell_tag:
+                raise Exception("cell_tag is required to count reads from a merged bam")
+            self.merged = True
+            template_bam = bams
+
+        # used for the header, chromosome lengths and output formatting
+        self.template = ReadCounter(
+            template_bam, None, window_size, chromosomes, mapq,
+            reference=reference
+        )
+        self.chromosomes = list(self.template.chromosomes)
+        self.chr_lengths = self.template.chr_lengths
+
+        if self.merged:
+            self.cells = list(cells) if cells else self.__get_read_groups()
+        else:
+            self.cells = list(bams.keys())
+
+        self.excluded_intervals = None
+        if excluded is not None:
+            self.excluded_intervals = self.__get_excluded_intervals(excluded)
+
+    def __get_read_groups(self):
+        if not self.cell_tag == 'RG':
+            raise Exception("cells must be provided when cell_tag is not RG")
+        return [readgroup['ID'] for readgroup in self.template.bam.header['RG']]
+
+    def __get_excluded_intervals(self, excluded):
+        """builds the excluded regions for every chromosome once
+        """
+        excluded = read_exclude_list(excluded)
+        return {
+            chrom: get_chrom_excluded_intervals(excluded, chrom, self.chr_lengths[chrom])
+            for chrom in self.chromosomes
+        }
+
+    def __get_tasks(self):
+        if self.merged:
+            return _count_tagged_chrom, [(self.bams, chrom) for chrom in self.chromosomes]
+
+        tasks = [
+            (cell, bam, chrom) for cell, bam in self.bams.items()
+            for chrom in self.chromosomes
+        ]
+        return _count_cell_chrom, tasks
+
+    def count(self):
+        """counts reads for all cells and chromosomes
+        :returns dict of cell_id to dict of chromosome to counts array
+        """
+        params = {
+            'window_size': self.window_size,
+            'chromosomes': self.chromosomes,
+            'mapq': self.mapq,
+            'reference': self.reference,
+            'cell_tag': self.cell_tag,
+            'cells': self.cells,
+        }
+
+        worker, tasks = self.__get_tasks()
+
+        counts = {cell: {} for cell in self.cells}
+
+        pool = multiprocessing.Pool(
+            processes=max(1, min(self.ncores, len(tasks))),
+            initializer=_init_worker,
+            initargs=(params, self.excluded_intervals)
+        )
+        try:
+            for result in pool.imap_unordered(worker, tasks):
+                for cell, chrom, chrom_counts in result:
+                    counts[cell][chrom] = chrom_counts
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return counts
+
+    def write_wigs(self, outputs, counts=None):
+        """writes one wig per cell, identical to ReadCounter output
+        :param outputs: dict of cell_id to output wig path
+        :param counts: output of count(), computed if not provided
+        """
+        if counts is None:
+            counts = self.count()
+
+        for cell, output in outputs.items():
+            with open(output, 'w') as outfile:
+                for chrom in self.chromosomes:
+                    self.template.write_header(chrom, outfile)
+                    self.template.write_bins(
+                        chrom, counts[cell][chrom], self.chr_lengths[chrom], outfile
+                    )
+
+    def get_bins(self):
+        """bin coordinates in the same convention as the hmmcopy reads table
+        :returns dataframe with chr, start and end columns
+        """
+        bins = []
+        for chrom in self.chromosomes:
+            nbins = self.chr_lengths[chrom] // self.window_size + 1
+            starts = np.arange(nbins) * self.window_size
+            bins.append(
+                pd.DataFrame({'chr': chrom, 'start': starts + 1, 'end': starts + self.window_size})
+            )
+        return pd.concat(bins, ignore_index=True)
+
+    def write_table(self, output, dtypes, counts=None):
+        """writes one long form table with cell_id, chr, start, end
+        and reads columns
+        :param output: csv.gz output path
+        :param dtypes: dtypes for the output columns
+        :param counts: output of count(), computed if not provided
+        """
+        if counts is None:
+            counts = self.count()
+
+        bins = self.get_bins()
+
+        def cell_frames():
+            for cell in self.cells:
+                df = bins.copy()
+                df['reads'] = np.concatenate([counts[cell][chrom] for chrom in self.chromosomes])
+                df['cell_id'] = cell
+                yield df[['cell_id', 'chr', 'start', 'end', 'reads']]
+
+        csvoutput = csvutils.CsvOutput(output, dtypes, header=True)
+        csvoutput.write_df(cell_frames(), chunks=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--bams', nargs='*', required=True,
+                        help='one bam per cell, or one merged bam with --cell_tag')
+
+    parser.add_argument('--cell_ids', nargs='*',
+                        help='cell ids, in the same order as --bams for per cell bams')
+
+    parser.add_argument('--cell_tag', choices=['CB', 'RG'],
+                        help='tag with the cell id in a merged bam')
+
+    parser.add_argument('--wig_outputs', nargs='*',
+                        help='per cell wig output paths, in the same order as cell ids')
+
+    parser.add_argument('--table_output',
+                        help='long form counts table output (csv.gz)')
+
+    parser.add_argument('--chromosomes',
+                        nargs='*',
+                        default=list(map(str, range(1, 23))) + ['X', 'Y'],
+                        help='specify target chromosomes')
+
+    parser.add_argument('-w', '--window_size', type=int, default=1000,
+                        help='specify bin size')
+
+    parser.add_argument('-m', '--mapping_quality_threshold', type=int, default=0,
+                        help='threshold for the mapping quality')
+
+    parser.add_argument('--exclude_list', default=None,
+                        help='regions to skip')
+
+    parser.add_argument('--reference', default=None)
+
+    parser.add_argument('--ncores', type=int, default=None)
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    from single_cell.workflows.hmmcopy.dtypes import dtypes
+
+    args = parse_args()
+
+    if args.cell_tag:
+        bams = args.bams[0]
+    else:
+        bams = dict(zip(args.cell_ids, args.bams))
+
+    counter = BatchReadCounter(
+        bams, args.window_size, args.chromosomes, args.mapping_quality_threshold,
+        excluded=args.exclude_list, reference=args.reference,
+        cell_tag=args.cell_tag, cells=args.cell_ids, ncores=args.ncores
+    )
+
+    counts = counter.count()
+
+    if args.wig_outputs:
+        counter.write_wigs(dict(zip(counter.cells, args.wig_outputs)), counts=counts)
+
+    if args.table_output:
+        counter.write_table(args.table_output, dtypes()['readcounts'], counts=counts)
@@ -11,6 +11,10 @@ import pandas as pd
 import statsmodels.formula.api as smf
 from statsmodels.nonparametric.smoothers_lowess import lowess
 from scipy.stats.mstats import mquantiles
+from single_cell.utils import refgenome
+from single_cell.utils import wigutils
+
+from single_cell.workflows.hmmcopy.scripts import quantile_regression
 
 
 class CorrectReadCount(object):
@@ -22,42 +26,36 @@ class CorrectReadCount(object):
 
     def __init__(self, gc, mapp, wig, output, mappability=0.9,
                  smoothing_function='lowess',
-                 polynomial_degree=2):
+                 polynomial_degree=2, bin_size=None, cache_dir=None,
+                 quantreg_engine='batched', exclude_list=None,
+                 bin_annotations_key=None):
         self.mappability = mappability
 
+        # 'batched' fits all quantiles together, 'statsmodels' one at a time
+        self.quantreg_engine = quantreg_engine
+
+        # bin annotations are cached per node, keyed by the reference
+        # files, bin size and exclude list. the key can be precomputed
+        # with refgenome.get_bin_annotations_key
+        self.bin_size = bin_size
+        self.cache_dir = cache_dir
+        self.exclude_list = exclude_list
+        self.bin_annotations_key = bin_annotations_key
+
         self.gc = gc
         self.mapp = mapp
         self.wig = wig
         self.output = output
 
-    def read_wig(self, infile, counts=False):
-        """read wiggle files
-
-        :param infile: input wiggle file
-        :param counts: set to true if infile wiggle has integer values
+    def read_annotations(self):
+        """load the gc and mappability of all bins as memory mapped
+        BinAnnotations
         """
-
-        data = []
-
-        with open(infile) as wig:
-            for line in wig:
-                line = line.strip()
-
-                if line.startswith('fixedStep'):
-                    line = line.strip().split()
-
-                    chrom = line[1].split('=')[1]
-                    winsize = int(line[3].split('=')[1])
-                    start = int(line[2].split('=')[1])
-
-                    bin_start = 0 if start < winsize else start / winsize
-                else:
-                    value = int(line) if counts else float(line)
-                    data.append((chrom, (bin_start * winsize) + 1,
-                                 (bin_start + 1) * winsize, winsize, value))
-                    bin_start += 1
-
-        return data
+        return refgenome.get_bin_annotations(
+            self.gc, self.mapp, bin_size=self.bin_size,
+            exclude_list=self.exclude_list, cache_dir=self.cache_dir,
+            key=self.bin_annotations_key
+        )
 
     def valid(self, df):
         """adds valid column (calls with atleast one reads and non negative gc)
@@ -100,35 +98,48 @@ class CorrectReadCount(object):
         return df
 
 
-    def create_dataframe(self, reads, mapp, gc):
-        """merge data from reads, mappability and gc wig files
-        into pandas dataframe
+    def create_dataframe(self, reads, annotations):
+        """merge data from reads and the bin annotations
+        into pandas dataframe, joining on bin index
 
-        :param reads: list of tuples, formatted as [(chromosome,
-                    start, end, count), ]
-        :param mapp: list of tuples, formatted as [(chromosome,
-                    start, end, mappability value), ]
-        :param reads: list of tuples, formatted as [(chromosome,
-                    start, end, gc content), ]
+        :param reads: read counts, output of wigutils.read_wig_arrays
+        :param annotations: refgenome.BinAnnotations
         """
         err_str = 'please ensure that reads, mappability and '\
-            'gc wig files have the same sort order'
+            'gc wig files have the same bins'
 
         data = []
-        for read_v, mapp_v, gc_v in zip(reads, mapp, gc):
-            assert read_v[0] == mapp_v[0] == gc_v[0], err_str
-            assert read_v[1] == mapp_v[1] == gc_v[1], err_str
-            assert read_v[2] == mapp_v[2] == gc_v[2], err_str
-            assert read_v[3] == mapp_v[3] == gc_v[3], err_str
+        for chrom, start, winsize, counts in reads:
+            assert winsize == annotations.bin_size, err_str
+
+            bins = wigutils.get_first_bin(start, winsize) + np.arange(len(counts))
+
+            index = annotations.get_index(chrom, bins)
+            assert (index >= 0).all(), err_str
 
-            data.append((read_v[0], read_v[1], read_v[2], read_v[3], gc_v[4],
-                         mapp_v[4], read_v[4],))
+            data.append(pd.DataFrame({
+                'chr': chrom,
+                'start': annotations.start[index],
+                'end': annotations.end[index],
+                'width': winsize,
+                'gc': annotations.gc[index],
+                'map': annotations.map[index],
+                'reads': counts,
+            }, columns=['chr', 'start', 'end', 'width', 'gc', 'map', 'reads']))
 
-        labels = ['chr', 'start', 'end', 'width', 'gc', 'map', 'reads']
-        data = pd.DataFrame(data, columns=labels)
+        data = pd.concat(data, ignore_index=True)
 
         return data
 
+    def fit_quantiles_statsmodels(self, df_regression, quantiles):
+        """fit one statsmodels quantreg model per quantile
+
+        :returns len(quantiles) x 3 array of intercept, gc and gc ** 2
+        coefficients
+        """
+        poly2_quantile_model = smf.quantreg('reads ~ gc + I(gc ** 2.0)', data=df_regression)
+        poly2_quantile_fit = [poly2_quantile_model.fit(q=q) for q in quantiles]
+        return np.array([fit.params.values for fit in poly2_quantile_fit])
 
     def modal_quantile_regression(self, df_regression, lowess_frac=0.2):
         '''
@@ -144,31 +155,34 @@ class CorrectReadCount(object):
         if len(df_regression) < 10:
             return df_regression
 
-        poly2_quantile_model = smf.quantreg('reads ~ gc + I(gc ** 2.0)', data=df_regression)
-        poly2_quantile_fit = [poly2_quantile_model.fit(q=q) for q in quantiles]
-        poly2_quantile_predict = [poly2_quantile_fit[i].predict(df_regression) for i in range(len(quantiles))]
-        
-        poly2_quantile_params = pd.DataFrame()
-        
-        for i in range(len(quantiles)):
-            df_regression[quantile_names[i]] = poly2_quantile_predict[i]
-            poly2_quantile_params[quantile_names[i]] = poly2_quantile_fit[i].params
-        
+        if self.quantreg_engine == 'statsmodels':
+            params = self.fit_quantiles_statsmodels(df_regression, quantiles)
+        else:
+            exog = quantile_regression.poly2_design(df_regression['gc'])
+            params, _ = quantile_regression.fit_quantiles(
+                exog, df_regression['reads'], quantiles
+            )
+
+        # predictions for all quantiles from the shared design matrix
+        poly2_quantile_predict = pd.DataFrame(
+            np.dot(quantile_regression.poly2_design(df_regression['gc']), params.T),
+            index=df_regression.index, columns=quantile_names
+        )
+        df_regression = pd.concat([df_regression, poly2_quantile_predict], axis=1)
+
         # integration and mode selection
-        
+
         gc_min = df_regression['gc'].quantile(q=0.10)
         gc_max = df_regression['gc'].quantile(q=0.90)
-        
-        poly2_quantile_integration = np.zeros(len(quantiles)+1)
-        
-        for i in range(len(quantiles)):
-            params = poly2_quantile_params[quantile_names[i]].tolist()
-            params.reverse()
-            poly2 = np.poly1d(params)
-            integ = poly2.integ()
-            integrand = integ(gc_max) - integ(gc_min)
-            poly2_quantile_integration[i+1] = integrand
-        
+
+        # integral of params[0] + params[1] * gc + params[2] * gc ** 2
+        integ_powers = np.array([
+            (gc_max ** k - gc_min ** k) / k for k in range(1, params.shape[1] + 1)
+        ])
+
+        poly2_quantile_integration = np.zeros(len(quantiles) + 1)
+        poly2_quantile_integration[1:] = np.dot(params, integ_powers)
+
         # find the modal quantile
         
         distances = poly2_quantile_integration[1:] - poly2_quantile_integration[:-1]
@@ -197,11 +211,10 @@ class CorrectReadCount(object):
         df.to_csv(self.output, index=False, sep=',', na_rep="NA")
 
     def main(self):
-        gc = self.read_wig(self.gc)
-        mapp = self.read_wig(self.mapp)
-        reads = self.read_wig(self.wig, counts=True)
+        annotations = self.read_annotations()
+        reads = wigutils.read_wig_arrays(self.wig, dtype=np.int64)
 
-        df = self.create_dataframe(reads, mapp, gc)
+        df = self.create_dataframe(reads, annotations)
 
         df = self.valid(df)
         df = self.ideal(df)
@@ -223,9 +236,9 @@ class CorrectReadCount(object):
         df_regression = self.modal_quantile_regression(df_regression, lowess_frac=0.2)
 
         # map results back to full data frame
-        df.ix[df_regression.index, 'modal_quantile'] = df_regression['modal_quantile']
-        df.ix[df_regression.index, 'modal_curve'] = df_regression['modal_curve']
-        df.ix[df_regression.index, 'modal_corrected'] = df_regression['modal_corrected']
+        df.loc[df_regression.index, 'modal_quantile'] = df_regression['modal_quantile']
+        df.loc[df_regression.index, 'modal_curve'] = df_regression['modal_curve']
+        df.loc[df_regression.index, 'modal_corrected'] = df_regression['modal_corrected']
         
         # filter by mappability
         df['copy'] = df['modal_corrected']
@@ -269,6 +282,19 @@ def parse_args():
                         type=float,
                         help='specify mappability threshold')
 
+    parser.add_argument('--bin_size',
+                        default=None,
+                        type=int,
+                        help='expected bin size of the wig files')
+
+    parser.add_argument('--cache_dir',
+                        default=None,
+                        help='directory for cached bin annotations')
+
+    parser.add_argument('--exclude_list',
+                        default=None,
+                        help='regions to flag in the cached bin annotations')
+
     args = parser.parse_args()
 
     return args
@@ -279,6 +305,9 @@ if __name__ == '__main__':
 
     corr = CorrectReadCount(args.gc, args.map, args.reads, args.output,
                             mappability=args.mappability,
+                            bin_size=args.bin_size,
+                            cache_dir=args.cache_dir,
+                            exclude_list=args.exclude_list
                             )
 
     corr.main()
@@ -10,7 +10,7 @@ import numpy as np
 import pandas as pd
 import logging
 
-from statsmodels.robust.scale import stand_mad
+from statsmodels.robust.scale import mad
 from statsmodels.tsa.stattools import acf
 
 #=========================================================================
@@ -75,7 +75,7 @@ class ExtractHmmMetrics(object):
         df_chr = df_hmmcopy[df_hmmcopy['chr'] == str(chrom)]
 
         if len(df_chr) > 0:
-            mad_chr = stand_mad(df_chr['copy'], c=1)
+            mad_chr = mad(df_chr['copy'], c=1)
 
         else:
             mad_chr = float('NaN')
@@ -86,7 +86,7 @@ class ExtractHmmMetrics(object):
         df_hmmcopy = df[~df['copy'].isnull()]
 
         if len(df_hmmcopy) > 0:
-            mad_hmmcopy = stand_mad(df_hmmcopy['copy'], c=1)
+            mad_hmmcopy = mad(df_hmmcopy['copy'], c=1)
 
         else:
             mad_hmmcopy = float('NaN')
@@ -97,7 +97,7 @@ class ExtractHmmMetrics(object):
         df_neutral_state = df[(df['state'] == 3) & (~df['copy'].isnull())]
 
         if len(df_neutral_state) > 0:
-            mad_neutral_state = stand_mad(df_neutral_state['copy'], c=1)
+            mad_neutral_state = mad(df_neutral_state['copy'], c=1)
 
         else:
             mad_neutral_state = float('NaN')
@@ -108,7 +108,7 @@ class ExtractHmmMetrics(object):
         df_autosomes = df[(df['chr'] != 'X') & (df['chr'] != 'Y')]
 
         if len(df_autosomes) > 0:
-            mad_autosomes = stand_mad(df_autosomes['copy'], c=1)
+            mad_autosomes = mad(df_autosomes['copy'], c=1)
 
         else:
             mad_autosomes = float('NaN')
@@ -0,0 +1,119 @@
+'''
+batched quantile regression for the modal gc correction.
+
+fits all quantiles at once with the same iteratively reweighted least
+squares as statsmodels QuantReg.fit (same start, update, stopping rule
+and cycle check). fits that converge match statsmodels to ~1e-10
+relative, or to the convergence tolerance when rounding moves the stop
+by one iteration. fits that stop at max_iter match to ~1e-4 since
+summation order differs.
+
+the per iteration work is shared across quantiles: the weighted normal
+equations for every quantile come from one matrix product against the
+precomputed outer products of the design matrix rows.
+'''
+import warnings
+
+import numpy as np
+
+
+def poly2_design(x):
+    """design matrix for 'y ~ x + I(x ** 2.0)'
+
+    :param x: 1d numpy array
+    :returns n x 3 numpy array with intercept, x and x ** 2 columns
+    """
+    x = np.asarray(x, dtype=np.float64)
+    return np.column_stack([np.ones(len(x)), x, x ** 2.0])
+
+
+def fit_quantiles(exog, endog, quantiles, max_iter=1000, p_tol=1e-6):
+    """quantile regression for many quantiles on a shared design matrix
+
+    :param exog: n x k design matrix
+    :param endog: n response values
+    :param quantiles: quantiles, strictly between 0 and 1
+    :param max_iter: maximum number of iterations per quantile
+    :param p_tol: convergence tolerance for the parameter estimates
+    :returns tuple: len(quantiles) x k array of parameters and
+        array with the number of iterations used per quantile
+    """
+    exog = np.asarray(exog, dtype=np.float64)
+    endog = np.asarray(endog, dtype=np.float64)
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+
+    if np.any(quantiles <= 0) or np.any(quantiles >= 1):
+        raise ValueError("quantiles must be strictly between 0 and 1")
+
+    nobs, nparams = exog.shape
+    nquantiles = len(quantiles)
+
+    # row wise outer products (upper triangle, xtx is symmetric),
+    # xtx for any weights is weights @ outer
+    upper = np.triu_indices(nparams)
+    outer = exog[:, upper[0]] * exog[:, upper[1]]
+    exog_endog = exog * endog[:, np.newaxis]
+    exog_t = np.ascontiguousarray(exog.T)
+
+    params = np.ones((nquantiles, nparams))
+    iterations = np.zeros(nquantiles, dtype=np.int64)
+
+    # state of the quantiles that are still iterating, compacted
+    # whenever some of them converge
+    idx = np.arange(nquantiles)
+    q = quantiles[:, np.newaxis]
+    beta = params.copy()
+    # the first iteration is unweighted (ordinary least squares)
+    weights = np.ones((nquantiles, nobs))
+    resid = np.empty((nquantiles, nobs))
+    # last 10 estimates per quantile, for the cycle check
+    history = np.full((10, nquantiles, nparams), np.nan)
+
+    n_iter = 0
+    while n_iter < max_iter and len(idx):
+        n_iter += 1
+
+        previous = beta
+        xtx = np.empty((len(idx), nparams, nparams))
+        xtx[:, upper[0], upper[1]] = xtx[:, upper[1], upper[0]] = np.dot(weights, outer)
+        xty = np.dot(weights, exog_endog)
+        beta = np.einsum('qij,qj->qi', np.linalg.pinv(xtx), xty)
+
+        np.dot(beta, exog_t, out=resid)
+        np.subtract(endog, resid, out=resid)
+
+        # same weights as statsmodels: residuals are clipped to at
+        # least 1e-6 in absolute value, then scaled by q or 1 - q
+        negative = resid < 0
+        np.abs(resid, out=resid)
+        np.maximum(resid, 0.000001, out=resid)
+        resid *= np.where(negative, q, 1 - q)
+        np.divide(1.0, resid, out=weights)
+
+        params[idx] = beta
+        iterations[idx] = n_iter
+        history[n_iter % 10, idx] = beta
+
+        converged = np.max(np.abs(beta - previous), axis=1) <= p_tol
+
+        if n_iter >= 300 and n_iter % 100 == 0:
+            # convergence cycle, matches the check in statsmodels
+            for lag in range(2, 10):
+                lagged = history[(n_iter - lag + 1) % 10, idx]
+                converged |= np.all(beta == lagged, axis=1)
+
+        if converged.any():
+            keep = ~converged
+            idx = idx[keep]
+            q = q[keep]
+            beta = beta[keep]
+            weights = weights[keep]
+            resid = resid[keep]
+
+    if (iterations == max_iter).any():
+        warnings.warn(
+            "Maximum number of iterations ({}) reached for {} quantiles".format(
+                max_iter, (iterations == max_iter).sum())
+        )
+
+    return params, iterations
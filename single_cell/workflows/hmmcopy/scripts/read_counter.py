@@ -7,9 +7,68 @@ import argparse
 import os
 
 import numpy as np
-import pandas as pd
 import pysam
 import logging
+from single_cell.utils.refgenome import read_exclude_list
+
+
+def get_chrom_excluded(excluded, chrom, chrom_length):
+    """builds a per base mask of excluded positions for a chromosome
+    :param excluded: dataframe from read_exclude_list
+    :param chrom: chromosome name
+    :param chrom_length: chromosome length
+    :returns numpy uint8 array, 1 for excluded positions
+    """
+    # chrom_excluded = np.zeros(chrom_length, dtype=np.uint8)
+    # add some padding in case the list is 1 based and chr length is 0 based
+    chrom_excluded = np.zeros(chrom_length + 1, dtype=np.uint8)
+
+    for start, end in excluded.loc[excluded['chrom'] == chrom, ['start', 'end']].values:
+        start = min(start, chrom_length)
+        end = min(end, chrom_length)
+        chrom_excluded[start:end] = 1
+
+    return chrom_excluded
+
+
+def get_chrom_excluded_intervals(excluded, chrom, chrom_length):
+    """same regions as get_chrom_excluded, stored as sorted
+    non overlapping [start, end) intervals instead of a per base mask
+    :param excluded: dataframe from read_exclude_list
+    :param chrom: chromosome name
+    :param chrom_length: chromosome length
+    :returns tuple of numpy arrays: interval starts and ends
+    """
+    regions = excluded.loc[excluded['chrom'] == chrom, ['start', 'end']].values
+    regions = np.minimum(regions.astype(np.int64), chrom_length).reshape((-1, 2))
+    regions = regions[regions[:, 0] < regions[:, 1]]
+    regions = regions[np.argsort(regions[:, 0], kind='mergesort')]
+
+    starts = []
+    ends = []
+    for start, end in regions.tolist():
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def in_intervals(intervals, positions):
+    """checks positions against intervals from get_chrom_excluded_intervals
+    :param intervals: tuple of interval starts and ends
+    :param positions: numpy array of positions
+    :returns boolean numpy array, True if position is inside an interval
+    """
+    starts, ends = intervals
+    if not len(starts):
+        return np.zeros(len(positions), dtype=bool)
+
+    idx = np.searchsorted(starts, positions, side='right') - 1
+    return (idx >= 0) & (positions < ends[np.maximum(idx, 0)])
+
 
 class ReadCounter(object):
     """
@@ -18,7 +77,8 @@ class ReadCounter(object):
 
     def __init__(
             self, bam, output, window_size, chromosomes, mapq,
-            seg=None, excluded=None, reference=None
+            seg=None, excluded=None, reference=None, vectorize=True,
+            excluded_intervals=None
     ):
         self.bam = bam
 
@@ -39,27 +99,41 @@ class ReadCounter(object):
         self.seg = seg
 
         if excluded is not None:
-            self.excluded = pd.read_csv(excluded, sep="\t", )
-            self.excluded.columns = ["chrom", "start", "end"]
+            self.excluded = read_exclude_list(excluded)
         else:
             self.excluded = None
 
+        # prebuilt {chrom: intervals} from get_chrom_excluded_intervals,
+        # lets many counters share one copy of the exclude list
+        self.excluded_intervals = excluded_intervals
+
         self.reference = reference
 
+        self.vectorize = vectorize
+
+        # FS tag string -> filter decision, tags repeat heavily across reads
+        self.__fs_tag_cache = {}
+
     def __get_bam_header(self):
         return self.bam.header
 
+    def __has_excluded(self):
+        return self.excluded is not None or self.excluded_intervals is not None
+
     def __get_chrom_excluded(self, chrom, chrom_length):
-        # chrom_excluded = np.zeros(chrom_length, dtype=np.uint8)
-        # add some padding in case the list is 1 based and chr length is 0 based
-        chrom_excluded = np.zeros(chrom_length + 1, dtype=np.uint8)
+        if self.excluded is None:
+            starts, ends = self.__get_chrom_excluded_intervals(chrom, chrom_length)
+            chrom_excluded = np.zeros(chrom_length + 1, dtype=np.uint8)
+            for start, end in zip(starts, ends):
+                chrom_excluded[start:end] = 1
+            return chrom_excluded
 
-        for start, end in self.excluded.loc[self.excluded['chrom'] == chrom, ['start', 'end']].values:
-            start = min(start, chrom_length)
-            end = min(end, chrom_length)
-            chrom_excluded[start:end] = 1
+        return get_chrom_excluded(self.excluded, chrom, chrom_length)
 
-        return chrom_excluded
+    def __get_chrom_excluded_intervals(self, chrom, chrom_length):
+        if self.excluded_intervals is not None:
+            return self.excluded_intervals[chrom]
+        return get_chrom_excluded_intervals(self.excluded, chrom, chrom_length)
 
     def __enter__(self):
         return self
@@ -173,7 +247,7 @@ class ReadCounter(object):
         reflen = self.chr_lengths[chrom]
 
         chrom_excluded = None
-        if self.excluded is not None:
+        if self.__has_excluded():
             chrom_excluded = self.__get_chrom_excluded(chrom, reflen)
 
         count = 0
@@ -201,6 +275,152 @@ class ReadCounter(object):
                 self.write(chrom, start, reflen, count, outfile)
                 break
 
+    def filter_fastqscreen_tag(self, fastqscreen_tags):
+        """decides whether a read is filtered based on its FS tag.
+        decisions are cached per tag string.
+        :param fastqscreen_tags: FS tag string or None
+        :returns boolean: True if the read should be removed
+        :rtype boolean
+        """
+        if not fastqscreen_tags or not self.reference:
+            return False
+
+        try:
+            return self.__fs_tag_cache[fastqscreen_tags]
+        except KeyError:
+            pass
+
+        tags = [val.split('_') for val in fastqscreen_tags.split(',')]
+        tags = {val[0]: val[1] for val in tags}
+        decision = int(tags[self.reference]) == 0
+
+        self.__fs_tag_cache[fastqscreen_tags] = decision
+        return decision
+
+    def get_read_arrays(self, data):
+        """collects start position, flag, mapping quality and FS tag
+        of every read in the iterator into numpy arrays.
+        FS tags are stored as integer codes into a list of distinct tags.
+        :param data: pysam iterator over reads
+        :returns tuple: positions, flags, mapqs, fs_codes (numpy arrays)
+        and fs_values (list of distinct FS tags, None for missing tag)
+        """
+        positions = []
+        flags = []
+        mapqs = []
+        fs_codes = []
+
+        fs_index = {None: 0}
+        fs_values = [None]
+
+        for read in data:
+            positions.append(read.reference_start)
+            flags.append(read.flag)
+            mapqs.append(read.mapping_quality)
+
+            if not self.reference:
+                continue
+
+            tag = read.get_tag('FS') if read.has_tag('FS') else None
+            code = fs_index.get(tag)
+            if code is None:
+                code = fs_index[tag] = len(fs_values)
+                fs_values.append(tag)
+            fs_codes.append(code)
+
+        positions = np.array(positions, dtype=np.int64)
+        flags = np.array(flags, dtype=np.int64)
+        mapqs = np.array(mapqs, dtype=np.int64)
+        fs_codes = np.array(fs_codes, dtype=np.int64)
+
+        return positions, flags, mapqs, fs_codes, fs_values
+
+    def filter_arrays(self, chrom, reflen, positions, flags, mapqs, fs_codes, fs_values):
+        """array version of filter, applies the same filters in the same order
+        :returns boolean numpy array, True if the read passes filters.
+        :rtype numpy array
+        """
+        keep = np.ones(len(positions), dtype=bool)
+
+        if self.__has_excluded():
+            intervals = self.__get_chrom_excluded_intervals(chrom, reflen)
+            keep &= ~in_intervals(intervals, positions)
+
+        # duplicates
+        keep &= (flags & 0x400) == 0
+
+        keep &= mapqs >= self.mapq_threshold
+
+        if self.reference:
+            missing = keep & (fs_codes == 0)
+            if missing.any():
+                logging.getLogger("read_counter").warn(
+                    "couldn't get FS tag from bam for {} reads".format(missing.sum())
+                )
+
+            # only decode tags that are seen on reads that passed so far
+            fs_decisions = np.zeros(len(fs_values), dtype=bool)
+            for code in np.unique(fs_codes[keep]):
+                fs_decisions[code] = self.filter_fastqscreen_tag(fs_values[code])
+
+            keep &= ~fs_decisions[fs_codes]
+
+        return keep
+
+    def count_bins(self, positions, reflen):
+        """bins read start positions into windows. matches get_data:
+        a read starting at exactly the end of a bin is counted in that bin.
+        :param positions: numpy array with start positions of reads to count
+        :param reflen: int: chromosome length
+        :returns numpy array with one count per bin
+        """
+        nbins = reflen // self.window_size + 1
+
+        bin_index = np.maximum(positions - 1, 0) // self.window_size
+
+        return np.bincount(bin_index, minlength=nbins)[:nbins]
+
+    def write_bins(self, chrom, counts, reflen, outfile):
+        """writes all bins for a chromosome in a single call.
+        :param chrom: str: chromosome name
+        :param counts: numpy array with one count per bin
+        :param reflen: int: chromosome length
+        :param outfile: output file object.
+        """
+        if not self.seg:
+            outfile.write('\n'.join(map(str, counts.tolist())) + '\n')
+            return
+
+        starts = np.arange(len(counts)) * self.window_size
+        ends = np.minimum(starts + self.window_size, reflen)
+        # first bin is never clipped to chromosome length in get_data
+        ends[0] = self.window_size
+
+        lines = [
+            'reads\t{}\t{}\t{}\t{}\n'.format(chrom, start, end, count)
+            for start, end, count in zip(starts.tolist(), ends.tolist(), counts.tolist())
+        ]
+        outfile.write(''.join(lines))
+
+    def get_data_vectorized(self, data, chrom, outfile):
+        """reads all reads for a chromosome into arrays, counts
+        and writes the chromosome block to output in one call
+        :param data: pysam iterator over reads
+        :param chrom: str: chromosome name
+        :param outfile: output file object
+        """
+        reflen = self.chr_lengths[chrom]
+
+        positions, flags, mapqs, fs_codes, fs_values = self.get_read_arrays(data)
+
+        keep = self.filter_arrays(
+            chrom, reflen, positions, flags, mapqs, fs_codes, fs_values
+        )
+
+        counts = self.count_bins(positions[keep], reflen)
+
+        self.write_bins(chrom, counts, reflen, outfile)
+
     def main(self):
         """for each chromosome, iterate over all reads. use starting position
         of the read to calculate read counts per bin (no double counting).
@@ -219,7 +439,10 @@ class ReadCounter(object):
                 # code assumes the iterator is sorted.
                 data = self.__fetch(chrom, 0, reflen)
 
-                self.get_data(data, chrom, outfile)
+                if self.vectorize:
+                    self.get_data_vectorized(data, chrom, outfile)
+                else:
+                    self.get_data(data, chrom, outfile)
 
 
 def parse_args():
@@ -256,6 +479,11 @@ def parse_args():
 
     parser.add_argument('--reference', default=None)
 
+    parser.add_argument('--no_vectorize',
+                        default=False,
+                        action='store_true',
+                        help='count reads one at a time instead of in batches')
+
     args = parser.parse_args()
 
     return args
@@ -266,5 +494,6 @@ if __name__ == "__main__":
     with ReadCounter(args.bam, args.output, args.window_size,
                      args.chromosomes, args.mapping_quality_threshold,
                      args.seg, excluded=args.exclude_list,
-                     reference=args.reference) as rcount:
+                     reference=args.reference,
+                     vectorize=not args.no_vectorize) as rcount:
         rcount.main()
@@ -9,16 +9,18 @@ import shutil
 import numpy as np
 import pandas as pd
 import pypeliner
-import scipy.cluster.hierarchy as hc
-import scipy.spatial as sp
+from single_cell.utils import clusteringutils
 from single_cell.utils import csvutils
 from single_cell.utils import helpers
+from single_cell.utils import refgenome
+from single_cell.utils.singlecell_copynumber_plot_utils import BatchHmmPlots
 from single_cell.utils.singlecell_copynumber_plot_utils import GenHmmPlots
 from single_cell.utils.singlecell_copynumber_plot_utils import PlotKernelDensity
 from single_cell.utils.singlecell_copynumber_plot_utils import PlotMetrics
 from single_cell.utils.singlecell_copynumber_plot_utils import PlotPcolor
 from single_cell.workflows.hmmcopy.dtypes import dtypes
 
+from .scripts import BatchReadCounter
 from .scripts import ConvertCSVToSEG
 from .scripts import CorrectReadCount
 from .scripts import ReadCounter
@@ -30,22 +32,38 @@ scripts_directory = os.path.join(
     'scripts')
 run_hmmcopy_rscript = os.path.join(scripts_directory, 'hmmcopy.R')
 
+plot_annotation_cols = [
+    'cell_call', 'experimental_condition', 'sample_type',
+    'mad_neutral_state', 'MSRSI_non_integerness',
+    'total_mapped_reads_hmmcopy'
+]
+
 
 def get_max_cn(reads):
-    df = csvutils.read_csv_and_yaml(reads)
+    df = csvutils.read_csv_and_yaml(reads, usecols=['copy'])
     max_cn = np.nanpercentile(df['copy'], 99)
     return max_cn
 
 
+def get_bin_annotations_key(hmmparams):
+    return refgenome.get_bin_annotations_key(
+        hmmparams['gc_wig_file'], hmmparams['map_wig_file'],
+        bin_size=hmmparams['bin_size'], exclude_list=hmmparams['exclude_list']
+    )
+
+
 def run_correction_hmmcopy(
-        bam_file, correct_reads_out, readcount_wig, hmmparams, docker_image):
+        bam_file, correct_reads_out, readcount_wig, hmmparams, docker_image,
+        bin_annotations_key=None):
     run_readcount_rscript = os.path.join(
         scripts_directory,
         'correct_read_count.R')
 
-    rc = ReadCounter(bam_file, readcount_wig, hmmparams['bin_size'], hmmparams['chromosomes'],
-                     hmmparams['min_mqual'], excluded=hmmparams['exclude_list'])
-    rc.main()
+    # bam_file is None if the wig was generated by count_reads_batch
+    if bam_file is not None:
+        rc = ReadCounter(bam_file, readcount_wig, hmmparams['bin_size'], hmmparams['chromosomes'],
+                         hmmparams['min_mqual'], excluded=hmmparams['exclude_list'])
+        rc.main()
 
     if hmmparams["smoothing_function"] == 'loess':
         cmd = ['Rscript', run_readcount_rscript,
@@ -60,7 +78,11 @@ def run_correction_hmmcopy(
                          hmmparams['map_wig_file'],
                          readcount_wig,
                          correct_reads_out,
-                         mappability=hmmparams['map_cutoff']).main()
+                         mappability=hmmparams['map_cutoff'],
+                         bin_size=hmmparams['bin_size'],
+                         cache_dir=hmmparams.get('ref_cache_dir'),
+                         exclude_list=hmmparams['exclude_list'],
+                         bin_annotations_key=bin_annotations_key).main()
     else:
         raise Exception(
             "smoothing function %s not supported. pipeline supports loess and modal" %
@@ -94,6 +116,15 @@ def run_hmmcopy_script(corrected_reads, tempdir, cell_id, hmmparams, docker_imag
     pypeliner.commandline.execute(*cmd, docker_image=docker_image)
 
 
+def count_reads_batch(bam_files, readcount_wigs, hmmparams, ncores=None):
+    counter = BatchReadCounter(
+        bam_files, hmmparams['bin_size'], hmmparams['chromosomes'],
+        hmmparams['min_mqual'], excluded=hmmparams['exclude_list'],
+        ncores=ncores
+    )
+    counter.write_wigs(readcount_wigs)
+
+
 def gzip_file(inputfile, gzipped_csv):
     import gzip
     with open(inputfile) as inputdata, gzip.open(gzipped_csv, 'w') as gzipped_out:
@@ -111,19 +142,25 @@ def run_hmmcopy(
         cell_id,
         hmmparams,
         tempdir,
-        docker_image
+        docker_image,
+        readcount_wig=None,
+        bin_annotations_key=None
 ):
     # generate wig file for hmmcopy
     helpers.makedirs(tempdir)
-    readcount_wig = os.path.join(tempdir, 'readcounter.wig')
     corrected_reads = os.path.join(tempdir, 'corrected_reads.csv')
 
+    # with readcount_wig from count_reads_batch, bam_file is None
+    if readcount_wig is None:
+        readcount_wig = os.path.join(tempdir, 'readcounter.wig')
+
     run_correction_hmmcopy(
         bam_file,
         corrected_reads,
         readcount_wig,
         hmmparams,
-        docker_image
+        docker_image,
+        bin_annotations_key=bin_annotations_key
     )
 
     hmmcopy_tempdir = os.path.join(tempdir, '{}_hmmcopy'.format(cell_id))
@@ -162,85 +199,57 @@ def run_hmmcopy(
     helpers.make_tarfile(hmmcopy_tar, hmmcopy_tempdir)
 
 
-def concatenate_csv(inputs, output):
+def concatenate_csv(inputs, output, threads=None):
     csvutils.concatenate_csv(
         inputs,
         output,
-        write_header=True
+        write_header=True,
+        threads=threads
     )
 
 
 def get_hierarchical_clustering_order(
-        reads_filename, chromosomes=None):
-    data = []
-    chunksize = 10 ** 5
-    for chunk in csvutils.read_csv_and_yaml(
-            reads_filename, chunksize=chunksize):
-        chunk["bin"] = list(zip(chunk.chr, chunk.start, chunk.end))
-
-        # for some reason pivot doesnt like an Int64 state col
-        chunk['state'] = chunk['state'].astype('float')
-
-        chunk = chunk.pivot(index='cell_id', columns='bin', values='state')
-
-        data.append(chunk)
-
-    # merge chunks, sum cells that get split across chunks
-    table = pd.concat(data)
-    table = table.groupby(table.index).sum()
-
-    bins = pd.DataFrame(
-        table.columns.values.tolist(),
-        columns=[
-            'chr',
-            'start',
-            'end'])
-
-    bins['chr'] = bins['chr'].astype(str)
-
-    bins = sort_bins(bins, chromosomes)
-
-    table = table.sort_values(bins, axis=0)
-
-    data_mat = np.array(table.values)
-
-    data_mat[np.isnan(data_mat)] = -1
+        reads_filename, chromosomes=None, threads=1, max_exact_cells=None):
+    cells, _, data_mat = clusteringutils.get_state_matrix(
+        reads_filename, chromosomes=chromosomes
+    )
 
-    row_linkage = hc.linkage(sp.distance.pdist(data_mat, 'cityblock'),
-                             method='ward')
+    # sort cells by their states in genome order before clustering,
+    # so ties in the linkage are broken the same way every run
+    presort = np.lexsort(data_mat.T[::-1])
+    data_mat = data_mat[presort]
+    samps = cells[presort]
 
-    order = hc.leaves_list(row_linkage)
+    order = clusteringutils.get_clustering_order(
+        data_mat, threads=threads, max_exact_cells=max_exact_cells
+    )
 
-    samps = table.index
     order = [samps[i] for i in order]
     order = {v: i for i, v in enumerate(order)}
 
     return order
 
 
-def get_mappability_col(reads, annotated_reads):
-    reads = csvutils.read_csv_and_yaml(reads, chunksize=100)
-
-    alldata = []
-    for read_data in reads:
-        read_data['is_low_mappability'] = (read_data['map'] <= 0.9)
-        alldata.append(read_data)
-
-    alldata = pd.concat(alldata)
+def get_mappability_col(reads, annotated_reads, threads=None):
+    alldata = csvutils.read_csv_and_yaml(reads)
+    alldata['is_low_mappability'] = (alldata['map'] <= 0.9)
 
     csvutils.write_dataframe_to_csv_and_yaml(
-        alldata, annotated_reads, dtypes()['reads'], write_header=True
+        alldata, annotated_reads, dtypes()['reads'], write_header=True,
+        threads=threads
     )
 
 
 def add_clustering_order(
-        reads, metrics, output, chromosomes=None, sample_info=None):
+        reads, metrics, output, chromosomes=None, sample_info=None,
+        threads=1, max_exact_cells=None):
     """
     adds sample information to metrics in place
     """
 
     order = get_hierarchical_clustering_order(
-        reads, chromosomes=chromosomes
+        reads, chromosomes=chromosomes, threads=threads,
+        max_exact_cells=max_exact_cells
     )
 
     if not sample_info:
@@ -319,9 +328,7 @@ def plot_hmmcopy(reads, segments, params, metrics, ref_genome, segs_out,
                  bias_out, cell_id, num_states=7,
                  annotation_cols=None, sample_info=None, max_cn=None):
     if not annotation_cols:
-        annotation_cols = ['cell_call', 'experimental_condition', 'sample_type',
-                           'mad_neutral_state', 'MSRSI_non_integerness',
-                           'total_mapped_reads_hmmcopy']
+        annotation_cols = plot_annotation_cols
 
     with GenHmmPlots(reads, segments, params, metrics, ref_genome, segs_out,
                      bias_out, cell_id, num_states=num_states,
@@ -330,6 +337,23 @@ def plot_hmmcopy(reads, segments, params, metrics, ref_genome, segs_out,
         plot.main()
 
 
+def plot_hmmcopy_batch(reads, segments, params, metrics, ref_genome, segs_tar,
+                       bias_tar, num_states=7, annotation_cols=None,
+                       sample_info=None, max_cn=None, processes=1):
+    """
+    plot_hmmcopy and merge_pdf for all cells in one job, from the
+    merged tables
+    """
+    if not annotation_cols:
+        annotation_cols = plot_annotation_cols
+
+    BatchHmmPlots(
+        reads, segments, params, metrics, ref_genome, segs_tar, bias_tar,
+        processes=processes, sample_info=sample_info, num_states=num_states,
+        annotation_cols=annotation_cols, max_cn=max_cn
+    ).main()
+
+
 def get_good_cells(metrics, cell_filters):
     metrics_data = csvutils.read_csv_and_yaml(metrics)
 
@@ -341,21 +365,6 @@ def get_good_cells(metrics, cell_filters):
     return metrics_data.cell_id.tolist()
 
 
-def sort_bins(bins, chromosomes):
-    bins = bins.drop_duplicates()
-
-    if not chromosomes:
-        chromosomes = list(map(str, range(1, 23))) + ['X', 'Y']
-
-    bins["chr"] = pd.Categorical(bins["chr"], chromosomes)
-
-    bins = bins.sort_values(['start', ])
-
-    bins = [tuple(v) for v in bins.values.tolist()]
-
-    return bins
-
-
 def plot_metrics(metrics, output, plot_title):
     plot = PlotMetrics(
         metrics,
@@ -380,7 +389,8 @@ def plot_pcolor(infile, metrics, output, plot_title=None,
                 column_name=None, plot_by_col=None,
                 chromosomes=None, max_cn=None,
                 scale_by_cells=None, color_by_col=None,
-                cell_filters=None, mappability_threshold=None):
+                cell_filters=None, mappability_threshold=None,
+                image_size=None):
     cells = get_good_cells(metrics, cell_filters)
 
     plot = PlotPcolor(
@@ -391,7 +401,8 @@ def plot_pcolor(infile, metrics, output, plot_title=None,
         scale_by_cells=scale_by_cells,
         color_by_col=color_by_col,
         cells=cells,
-        mappability_threshold=mappability_threshold
+        mappability_threshold=mappability_threshold,
+        image_size=image_size
     )
     plot.main()
 
@@ -52,35 +52,16 @@ def create_ltm_workflow(hmmcopy,
         ),
     )
 
-    node_pair_csvs = []
-    for job in range(number_jobs):
-        node_pair_csvs.append('list_{}.csv'.format(job))
-
-    workflow.transform(
-        name='generate_input_csvs',
-        ctx={'mem': config['memory']['med'], 'pool_id': config['pools']['standard'], 'ncpus': 1},
-        func='single_cell.workflows.ltm.tasks.generate_node_pair_csvs',
-        args=(
-            mgd.InputFile(cn_matrix),
-            number_jobs,
-            [mgd.TempOutputFile(csv) for csv in node_pair_csvs],
-        ),
-    )
-
-    distance_csvs = []
-    for job in range(number_jobs):
-        distance_csvs.append('distance_list_{}.csv'.format(job))
-
     workflow.transform(
         name='calculate_distances',
         ctx={'mem': config['memory']['med'], 'pool_id': config['pools']['standard'], 'ncpus': 1},
         func='single_cell.workflows.ltm.tasks.calculate_distances',
         args=(
-            [mgd.TempInputFile(csv) for csv in node_pair_csvs],
             mgd.InputFile(cn_matrix),
-            [mgd.TempOutputFile(csv) for csv in distance_csvs],
+            mgd.TempOutputFile('distances.npy'),
             config,
         ),
+        kwargs={'num_chunks': number_jobs},
     )
 
     # Generates a minimum spanning tree
@@ -89,7 +70,8 @@ def create_ltm_workflow(hmmcopy,
         ctx={'mem': config['memory']['med'], 'pool_id': config['pools']['standard'], 'ncpus': 1},
         func='single_cell.workflows.ltm.scripts.learn_CL_from_distance.learn_CL_from_distance',
         args=(
-            [mgd.TempInputFile(csv) for csv in distance_csvs],
+            mgd.InputFile(cn_matrix),
+            mgd.TempInputFile('distances.npy'),
             mgd.OutputFile(output_gml),
         ),
     )
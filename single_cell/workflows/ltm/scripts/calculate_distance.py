@@ -1,145 +1,195 @@
-import numpy as np
-import networkx as nx
-import timeit
-from sklearn.metrics import mutual_info_score
-import sklearn
+'''
+mutual information distances between the cells of a copy number matrix.
+
+each cell is discretized once into the histogram bins that calc_MI
+uses, stored as small integer codes. joint counts for a block of cell
+pairs are one bincount over the combined codes. workers share the codes
+and the output through memory mapped .npy files, the output is the
+condensed (scipy pdist order) float32 matrix of -MI.
+'''
 import argparse
-import string
-import pandas as pd
-
-
-def convert_n_alpha_cn(inar):
-    num2alpha = dict(zip(range(0, 27), string.ascii_lowercase))
-    
-    s=''
-    for n in inar:
-        t=int(n)
-        s+=num2alpha[t]
-    return s
+import multiprocessing
+import os
 
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mutual_info_score
 
-def breakpoint_conevert(bps_list, pre_cns):
-    res_list=[]
-    for i in range(len(pre_cns)):
-        if i in bps_list:
-            res_list.append(pre_cns[i])
-    return res_list
+# max number of elements in the combined codes of one block of pairs
+BLOCK_ELEMENTS = 2 ** 23
 
 
 def calc_MI(x, y):
-    bins=len(x)/10
+    bins = int(len(x) / 10)
     c_xy = np.histogram2d(x, y, bins)[0]
     mi = mutual_info_score(None, None, contingency=c_xy)
     return -mi
 
 
-def calculate_distance(cell_data, infile_path, outfile_path):
-    outfile=open(outfile_path,'w')
-    pairs=set([])
-    infile=open(infile_path)
-    for line in infile:
-        tmp=line.strip().split(',')
-        t1=timeit.default_timer()
-        weight = calc_MI(cell_data[tmp[0]],cell_data[tmp[1]])
-        t2=timeit.default_timer()
-        outfile.write(tmp[0]+','+tmp[1]+','+str(weight)+','+str(t2-t1)+'\n')
-    outfile.close()
-    infile.close()
-
-
-def break_points_finder(infile_path):
-    data = pd.read_hdf(data_path)
-
-    # find breakpoint
-    bps_set=set([])
-    for j in range(data.shape[1]):
-        for i in range(1,data.shape[0]):
-            if data.iloc[i,j]!=data.iloc[i-1,j]:
-                bps_set.add(i)
-    bps_set.add(0)
-    bps_list=list(bps_set)
-
-    return bps_list
-
-
-def with_break_point_correction_read_input_np(data_path, infile_path):
-   
-    bps_list= break_points_finder(data_path)
-
-    cell_data={}
-    
-    ###### read list of filtered cells
-    cells_set=set([])
-    cells_file=open(infile_path)
-    for line in cells_file:
-        tmp=line.strip().split(',')
-        cells_set.add(tmp[0])
-        cells_set.add(tmp[1])
-    
-    #######
-    
-    data = pd.read_hdf(data_path)
+def read_cn_matrix(cn_matrix):
+    """
+    :returns cell ids and cells x bins array of copy number states
+    """
+    data = pd.read_csv(cn_matrix)
     cell_ids = data.columns.values.tolist()[4:]
+    return cell_ids, data.iloc[:, 4:].values.T
 
-    for cell_id in cell_ids:
-        #cell_data[i]=convert_n_alpha_cn(data[:,i])
-        j=cell_ids.index(cell_id)
-        if cell_id in cells_set:
-            #cell_data[i]=breakpoint_conevert(bps_list, data[:,j])
-            cell_data[cell_id]=breakpoint_conevert(bps_list, data.iloc[:,j+4])
-
-    return cell_data
-
-
-def read_input_np(data_path, infile_path):
-
-    cell_data={}
-    
-    ###### read list of filtered cells
-    cells_set=set([])
-    cells_file=open(infile_path)
-    for line in cells_file:
-        tmp=line.strip().split(',')
-        cells_set.add(tmp[0])
-        cells_set.add(tmp[1])
-    
-    #######
-    
-    data = pd.read_csv(data_path)
-    cell_ids = data.columns.values.tolist()[4:]
 
-    for cell_id in cell_ids:
-        j=cell_ids.index(cell_id)
-        if cell_id in cells_set:
-            cell_data[cell_id]=data.iloc[:,j+4]
+def discretize(data):
+    """
+    assigns every value to its bin in the histogram calc_MI uses for
+    its cell: int(num_bins / 10) equal width bins from the min to the
+    max of the cell. bins are then renumbered in order of use, empty
+    bins do not change the mutual information.
+    :param data: cells x bins array
+    :returns cells x bins uint8 array of codes, number of codes
+    """
+    num_cells, num_bins = data.shape
+    num_hist_bins = max(int(num_bins / 10), 1)
+
+    codes = np.zeros(data.shape, dtype=np.int64)
+    for i in range(num_cells):
+        values = data[i].astype(np.float64)
+
+        low, high = values.min(), values.max()
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+
+        edges = np.linspace(low, high, num_hist_bins + 1)
+        cell_codes = np.searchsorted(edges, values, side='right') - 1
+        cell_codes[values == edges[-1]] = num_hist_bins - 1
 
-    return cell_data
+        codes[i] = np.unique(cell_codes, return_inverse=True)[1]
 
+    num_codes = int(codes.max()) + 1 if codes.size else 1
+    if num_codes > np.iinfo(np.uint8).max:
+        raise ValueError('too many distinct copy number states: {}'.format(num_codes))
 
-def read_hmm_cn_data(data_path, outfile_path, infile_path):
-    
-    cell_data = read_input_np(data_path, infile_path)
+    return codes.astype(np.uint8), num_codes
 
-    CL_start = timeit.default_timer()
-    calculate_distance(cell_data, infile_path, outfile_path)
-    CL_end = timeit.default_timer()
-    
-    print ("total time "+str(CL_end-CL_start))
-    
 
-if __name__=='__main__':
-    
+def mutual_information(joint):
+    """
+    same as sklearn mutual_info_score with a contingency table
+    :param joint: pairs x codes x codes joint counts
+    :returns mutual information per pair
+    """
+    joint = joint.astype(np.float64)
+    total = joint.sum(axis=(1, 2))[:, None, None]
+    row = joint.sum(axis=2)[:, :, None]
+    col = joint.sum(axis=1)[:, None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mi = joint / total * np.log(joint * total / (row * col))
+
+    mi = np.where(joint > 0, mi, 0).sum(axis=(1, 2))
+
+    return np.clip(mi, 0, None)
+
+
+def _condensed_offset(i, n):
+    """
+    position of distance(i, i + 1) in a condensed distance matrix
+    """
+    return n * i - i * (i + 1) // 2
+
+
+def calculate_distance_rows(codes_path, distances_path, num_codes, row_start, row_end):
+    """
+    fills in the distances of cells row_start to row_end to all cells
+    after them
+    """
+    codes = np.load(codes_path, mmap_mode='r')
+    distances = np.load(distances_path, mmap_mode='r+')
+
+    num_cells, num_bins = codes.shape
+    block_size = max(BLOCK_ELEMENTS // max(num_bins, 1), 1)
+
+    for i in range(row_start, row_end):
+        cell = codes[i].astype(np.int32) * num_codes
+        offset = _condensed_offset(i, num_cells)
+
+        for start in range(i + 1, num_cells, block_size):
+            end = min(start + block_size, num_cells)
+
+            # one set of num_codes x num_codes counts per pair
+            combined = codes[start:end].astype(np.int32)
+            combined += cell
+            combined += (np.arange(end - start, dtype=np.int32) * num_codes ** 2)[:, None]
+
+            joint = np.bincount(combined.ravel(), minlength=(end - start) * num_codes ** 2)
+            joint = joint.reshape((end - start, num_codes, num_codes))
+
+            block_offset = offset + start - i - 1
+            distances[block_offset:block_offset + end - start] = -mutual_information(joint)
+
+    distances.flush()
+
+
+def _split_rows(num_cells, num_chunks):
+    """
+    splits the rows of the condensed matrix into chunks with about the
+    same number of pairs
+    """
+    pairs = np.cumsum(np.arange(num_cells - 1, -1, -1))
+    bounds = np.searchsorted(pairs, np.linspace(0, pairs[-1], num_chunks + 1)[1:-1])
+    bounds = np.unique(np.concatenate([[0], bounds, [num_cells]]))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def calculate_distances(cn_matrix, distances, processes=1, num_chunks=None):
+    """
+    writes the -MI distances between all cells in cn_matrix
+    :param cn_matrix: copy number matrix csv, cells from the 5th column on
+    :param distances: output .npy, condensed float32 matrix with the
+    cells in cn_matrix column order
+    :param processes: size of the process pool
+    :param num_chunks: number of tasks, defaults to 4 per process
+    """
+    _, data = read_cn_matrix(cn_matrix)
+    codes, num_codes = discretize(data)
+
+    num_cells = codes.shape[0]
+
+    codes_path = distances + '.codes.npy'
+    np.save(codes_path, codes)
+
+    output = np.lib.format.open_memmap(
+        distances, mode='w+', dtype=np.float32, shape=(num_cells * (num_cells - 1) // 2,)
+    )
+    del output
+
+    if not num_chunks:
+        num_chunks = 4 * processes
+
+    chunks = _split_rows(num_cells, num_chunks) if num_cells > 1 else []
+
+    try:
+        if processes > 1:
+            pool = multiprocessing.Pool(processes=processes)
+            tasks = [
+                pool.apply_async(
+                    calculate_distance_rows,
+                    args=(codes_path, distances, num_codes, row_start, row_end)
+                )
+                for row_start, row_end in chunks
+            ]
+            pool.close()
+            pool.join()
+            [task.get() for task in tasks]
+        else:
+            for row_start, row_end in chunks:
+                calculate_distance_rows(codes_path, distances, num_codes, row_start, row_end)
+    finally:
+        os.remove(codes_path)
+
+
+if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("-input_file", help="path to the edges lists folder.")
-    parser.add_argument("-output_path", help="Path to the results.")
     parser.add_argument("-data_path", help="Path to the cn data.")
+    parser.add_argument("-output_path", help="Path to the condensed distance matrix.")
+    parser.add_argument("-processes", type=int, default=1)
 
     args = parser.parse_args()
-    input_file=args.input_file
-    output_path=args.output_path
-    data_path=args.data_path
-    
-    read_hmm_cn_data(data_path, output_path, input_file)
-    
-
-    
\ No newline at end of file
+
+    calculate_distances(args.data_path, args.output_path, processes=args.processes)
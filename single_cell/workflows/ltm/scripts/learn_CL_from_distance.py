@@ -1,4 +1,6 @@
 import networkx as nx
+import numpy as np
+import pandas as pd
 
 
 def learn_CL(cell_data):
@@ -14,17 +16,74 @@ def learn_CL(cell_data):
     return T
 
 
-def learn_CL_from_distance(d_files, tree_path):
-    G = nx.Graph()
+def _condensed_offset(i, n):
+    """
+    position of distance(i, i + 1) in a condensed distance matrix
+    """
+    return n * i - i * (i + 1) // 2
 
-    for file in d_files:
-        infile=open(file)
-        for line in infile:
-            tmp=line.strip().split(',')
-            G.add_edge(tmp[0],tmp[1], weight=float(tmp[2]))
-        infile.close()
 
-    T = nx.minimum_spanning_tree(G)
+def get_distance_row(distances, n, node):
+    """
+    :returns distances from node to all nodes, 0 to itself
+    """
+    before = np.arange(node)
+    row = np.empty(n, dtype=np.float64)
+    row[:node] = distances[_condensed_offset(before, n) + node - before - 1]
+    row[node] = 0
+    offset = _condensed_offset(node, n)
+    row[node + 1:] = distances[offset:offset + n - node - 1]
+    return row
+
+
+def minimum_spanning_tree(distances, n):
+    """
+    dense prim's algorithm, O(n^2) time and O(n) memory on top of the
+    distance matrix. reads one row of the condensed matrix per node.
+    ties (e.g. cells with identical profiles) are broken deterministically:
+    the tree grows from node 0, the lowest numbered of the equally close
+    nodes is added next and it is attached to the earliest added node at
+    that distance. with ties the tree can differ from
+    networkx.minimum_spanning_tree, the total weight is the same
+    :param distances: condensed distance matrix, can be memory mapped
+    :param n: number of nodes
+    :returns list of (node, parent, distance) for all nodes but the first
+    """
+    in_tree = np.zeros(n, dtype=bool)
+    best = np.full(n, np.inf)
+    parent = np.zeros(n, dtype=np.int64)
+
+    edges = []
+
+    node = 0
+    for _ in range(n - 1):
+        in_tree[node] = True
+
+        row = get_distance_row(distances, n, node)
+        closer = ~in_tree & (row < best)
+        best[closer] = row[closer]
+        parent[closer] = node
+
+        candidates = np.where(in_tree, np.inf, best)
+        node = int(np.argmin(candidates))
+        edges.append((node, int(parent[node]), float(best[node])))
+
+    return edges
+
+
+def learn_CL_from_distance(cn_matrix, distances, tree_path):
+    """
+    :param cn_matrix: copy number matrix csv, cells from the 5th column on
+    :param distances: condensed distance matrix in cn_matrix cell order,
+    see calculate_distance.calculate_distances
+    """
+    cell_ids = pd.read_csv(cn_matrix, nrows=0).columns.tolist()[4:]
+    distances = np.load(distances, mmap_mode='r')
+
+    T = nx.Graph()
+    T.add_nodes_from(cell_ids)
+
+    for node, parent, weight in minimum_spanning_tree(distances, len(cell_ids)):
+        T.add_edge(cell_ids[parent], cell_ids[node], weight=weight)
+
     nx.write_gml(T, tree_path)
-    
-    
@@ -8,10 +8,11 @@ import multiprocessing
 import os
 
 import pandas as pd
-from scipy.special import comb
 from single_cell.utils import helpers
 from single_cell.utils import ltmutils
 
+from .scripts import calculate_distance
+
 import pypeliner
 
 scripts_directory = os.path.join(
@@ -21,95 +22,22 @@ scripts_directory = os.path.join(
 
 
 def generate_cn_matrices(hmmcopy, cn_matrix, ploidy='0'):
-    cn_df, dropped_cells = ltmutils.get_cn_matrix_from_hdf(hmmcopy, ploidy)
-    metrics_summary_df = pd.read_hdf(hmmcopy, '/hmmcopy/metrics/' + ploidy)
-    reads_df = pd.read_hdf(hmmcopy, '/hmmcopy/reads/' + ploidy)
-
-    if dropped_cells:
-        metrics_summary_df = metrics_summary_df.drop(
-            index=metrics_summary_df.loc[metrics_summary_df['cell_id'].isin(dropped_cells)].index)
-
-    # Filter out cells with quality less than 0.75
-    cn_df = cn_df.drop(columns=metrics_summary_df[metrics_summary_df['quality'] < 0.75]['cell_id'])
-
-    # Filter out bins with mappability < 0.99
-    i = reads_df.loc[(reads_df['cell_id'] == reads_df.iloc[0]['cell_id']) & (reads_df['map'] >= 0.99)].index
-    cn_df = cn_df.iloc[i]
-
-    cn_df.to_csv(cn_matrix, index=False)
+    bins, cells, matrix = ltmutils.get_cn_matrix_from_hdf(hmmcopy, ploidy)
+    ltmutils.write_cn_matrix(bins, cells, matrix, cn_matrix)
 
 
 def merge_cn_matrices(infiles, outfile):
-    cn_list = []
-
-    for cn_matrix in infiles.values():
-        cn_list.append(pd.read_csv(cn_matrix))
-
-    cn_matrix = pd.concat(cn_list, axis=1, join='outer')
-    cn_matrix = cn_matrix.T.drop_duplicates().T  # Get rid of any duplicate columns
-    cn_matrix = cn_matrix.set_index(['chr', 'start', 'end', 'width'])
-
-    cn_matrix.to_csv(outfile)
-
-
-def generate_node_pair_csvs(cn_matrix, desired_job_no, node_pair_csvs):
-    cells_list = pd.read_csv(cn_matrix).columns.tolist()[4:]
-
-    total_edges = comb(len(cells_list), 2)
-    edg_per_node = int(total_edges / float(desired_job_no))
-
-    tmp_counter = 0
-    global_counter = 0
-    file_counter = 1
-
-    outfile = open(node_pair_csvs[0], 'w')
+    matrices = [ltmutils.read_cn_matrix(cn_matrix) for cn_matrix in infiles.values()]
+    bins, cells, matrix = ltmutils.merge_cn_matrices(matrices)
+    ltmutils.write_cn_matrix(bins, cells, matrix, outfile)
 
-    for i in range(len(cells_list)):
-        for j in range(i + 1, len(cells_list)):
-            outfile.write(cells_list[i] + ',' + cells_list[j] + '\n')
 
-            tmp_counter += 1
-            global_counter += 1
-
-            if tmp_counter == edg_per_node and global_counter < total_edges and file_counter < desired_job_no:
-                tmp_counter = 0
-                outfile.close()
-
-                outfile = open(node_pair_csvs[file_counter], 'w')
-                file_counter += 1
-
-            if global_counter == total_edges:
-                outfile.close()
-
-
-def _calculate_distances_worker(node_pair_csv, outfile, cn_matrix):
-    script = os.path.join(scripts_directory, 'calculate_distance.py')
-
-    cmd = ['python', script, '-input_file', node_pair_csv,
-           '-output_path', outfile, '-data_path', cn_matrix]
-
-    helpers.run_cmd(cmd)
-
-
-def calculate_distances(node_pair_csvs, cn_matrix, outfiles, config):
+def calculate_distances(cn_matrix, distances, config, num_chunks=None):
     count = config.get('threads', multiprocessing.cpu_count())
-    pool = multiprocessing.Pool(processes=count)
-
-    tasks = []
-
-    for job in zip(node_pair_csvs, outfiles):
-        node_pair_csv = job[0]
-        outfile = job[1]
-
-        task = pool.apply_async(_calculate_distances_worker,
-                                args=(node_pair_csv, outfile, cn_matrix))
-
-        tasks.append(task)
-
-    pool.close()
-    pool.join()
 
-    [task.get() for task in tasks]
+    calculate_distance.calculate_distances(
+        cn_matrix, distances, processes=count, num_chunks=num_chunks
+    )
 
 
 ## VISUALIZATION ##
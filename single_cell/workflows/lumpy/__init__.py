@@ -47,7 +47,7 @@ def lumpy_preprocess_workflow(
                 mgd.InputFile(bam_files, extensions=['.bai']),
                 mgd.OutputFile(discordants),
                 mgd.OutputFile(split_reads),
-                mgd.TempOutputFile('hist_normal.csv'),
+                mgd.TempOutputFile('hist_normal.npy'),
                 mgd.TempSpace("lumpy_normal_processing"),
             ),
             kwargs=histogram_settings,
@@ -57,7 +57,7 @@ def lumpy_preprocess_workflow(
             ctx={'mem': 8, 'ncpus': 1},
             func='single_cell.workflows.lumpy.merge_histograms.merge_histograms',
             args=(
-                mgd.TempInputFile('hist_normal.csv'),
+                mgd.TempInputFile('hist_normal.npy'),
                 mgd.OutputFile(histogram),
                 mgd.OutputFile(mean_stdev)
             ),
@@ -96,7 +96,7 @@ def lumpy_preprocess_cells(
             mgd.InputFile('tumour_bam', 'cell_id', fnames=bam_files, extensions=['.bai']),
             mgd.TempOutputFile('tumour.discordants.sorted.bam', 'cell_id'),
             mgd.TempOutputFile('tumour.splitters.sorted.bam', 'cell_id'),
-            mgd.TempOutputFile('hist.csv', 'cell_id'),
+            mgd.TempOutputFile('hist.npy', 'cell_id'),
             mgd.TempSpace("lumpy_tumour_processing", "cell_id"),
         ),
         kwargs=dict(tag=mgd.InputInstance('cell_id'), **histogram_settings),
@@ -131,7 +131,7 @@ def lumpy_preprocess_cells(
         ctx={'mem': 8, 'ncpus': 1},
         func='single_cell.workflows.lumpy.merge_histograms.merge_histograms',
         args=(
-            mgd.TempInputFile('hist.csv', 'cell_id'),
+            mgd.TempInputFile('hist.npy', 'cell_id'),
             mgd.OutputFile(hist_csv),
             mgd.OutputFile(mean_stdev_obj)
         ),
@@ -2,6 +2,9 @@ import pysam
 import sys
 import logging
 
+import numpy as np
+
+
 def get_flag_mask():
     required = 97
     restricted = 3484
@@ -10,31 +13,15 @@ def get_flag_mask():
     return flag_mask
 
 
-def mean_std(L):
-    s = sum(L)
-    mean = s / float(len(L))
-    sq_sum = 0.0
-    for v in L:
-        sq_sum += (v - mean) ** 2.0
-    var = sq_sum / float(len(L))
-    return mean, var ** 0.5
-
-
-def median(L):
-    if len(L) % 2 == 1:
-        return L[int(len(L) / 2)]  # cast to int since divisions always return floats in python3
-    mid = int(len(L) / 2) - 1
-    return (L[mid] + L[mid + 1]) / 2.0
-
-
 def unscaled_upper_mad(xs):
     """Return a tuple consisting of the median of xs followed by the
     unscaled median absolute deviation of the values in xs that lie
-    above the median.
+    above the median. the deviation is 0 if no value lies above the
+    median.
     """
-    xs.sort()
-    med = median(xs)
-    umad = median([x - med for x in xs if x > med])
+    med = np.median(xs)
+    above = xs[xs > med]
+    umad = np.median(above - med) if len(above) else 0
     return med, umad
 
 
@@ -45,46 +32,106 @@ def get_read_groups(infile):
     return readgroups
 
 
-def read_bam_file(infile, readgroups, N, skip):
-
-    flag_mask = get_flag_mask()
-    required = 97
+def get_reads_per_rg(infile, readgroups):
+    """
+    number of reads per read group from the index. the index only counts
+    reads per contig, so this is limited to bams with a single read group
+    (cell bams)
+    :returns dict of read group to reads, None if not available
+    """
+    if len(readgroups) != 1:
+        return None
 
-    skip_count = {rg: 0 for rg in readgroups}
     with pysam.AlignmentFile(infile) as samfile:
-        data = {v: [] for v in readgroups}
-        counts = {v: 0 for v in readgroups}
-        reads_per_rg = {v:0 for v in readgroups}
-        for i, read in enumerate(samfile.fetch()):
-            readgroup = read.get_tag('RG')
-            reads_per_rg[readgroup] += 1
+        if not samfile.has_index():
+            return None
+
+        # placed reads, the reads that fetch() returns
+        numreads = sum(stat.total for stat in samfile.get_index_statistics())
 
-            if skip_count[readgroup] < (skip - 1):
-                skip_count[readgroup] += 1
-                continue
+    return {readgroups[0]: numreads}
+
+
+class InsertSizeSampler(object):
+    """
+    collects insert sizes of proper pairs per read group, fed one read at
+    a time so that it can share a pass over the bam with other consumers.
+    with reads_per_rg known up front, reads are no longer needed once
+    every read group has N insert sizes, see done
+    """
 
-            if all([val >= N for val in counts.values()]):
-                continue
+    def __init__(self, readgroups, N, skip, reads_per_rg=None):
+        self.flag_mask = get_flag_mask()
+        self.required = 97
 
-            flag = read.flag
+        self.N = N
+        self.skip = skip
 
-            refname = read.reference_id
+        self.skip_count = {rg: 0 for rg in readgroups}
+        self.data = {v: [] for v in readgroups}
+        self.counts = {v: 0 for v in readgroups}
 
-            mate_refname = read.next_reference_id
+        self.count_reads = reads_per_rg is None
+        if self.count_reads:
+            self.reads_per_rg = {v: 0 for v in readgroups}
+        else:
+            self.reads_per_rg = dict(reads_per_rg)
 
-            isize = read.template_length
+        # read groups with fewer than N insert sizes
+        self.incomplete = len(readgroups) if N > 0 else 0
 
-            want = mate_refname == refname and flag & flag_mask == required and isize >= 0
-            if want:
-                data[readgroup].append(isize)
-                counts[readgroup] += 1
+    @property
+    def done(self):
+        return not self.count_reads and not self.incomplete
 
-    return reads_per_rg, data, counts
+    def add(self, read):
+        readgroup = read.get_tag('RG')
+
+        if self.count_reads:
+            self.reads_per_rg[readgroup] += 1
+
+        if self.skip_count[readgroup] < (self.skip - 1):
+            self.skip_count[readgroup] += 1
+            return
+
+        if not self.incomplete:
+            return
+
+        isize = read.template_length
+
+        want = read.next_reference_id == read.reference_id and \
+            read.flag & self.flag_mask == self.required and isize >= 0
+        if want:
+            self.data[readgroup].append(isize)
+            self.counts[readgroup] += 1
+
+            if self.counts[readgroup] == self.N:
+                self.incomplete -= 1
+
+
+def read_bam_file(infile, readgroups, N, skip):
+    reads_per_rg = get_reads_per_rg(infile, readgroups)
+
+    sampler = InsertSizeSampler(readgroups, N, skip, reads_per_rg=reads_per_rg)
+
+    with pysam.AlignmentFile(infile) as samfile:
+        for read in samfile.fetch():
+            sampler.add(read)
+
+            if sampler.done:
+                break
+
+    return sampler.reads_per_rg, sampler.data, sampler.counts
 
 
 def calculate_histogram(readgroups, data, counts, min_elements, mads, read_length, X, reads_per_rg):
-    means=[]
-    stdevs=[]
+    """
+    :returns dict of read group to (counts, total) where counts holds the
+    number of insert sizes at read_length + i for i in range(len(counts))
+    and total the number in the histogram range, the mean and the stdev
+    """
+    means = []
+    stdevs = []
 
     finaldata = {v: None for v in readgroups}
     for readgroup, rgdata in data.items():
@@ -93,34 +140,30 @@ def calculate_histogram(readgroups, data, counts, min_elements, mads, read_lengt
             logging.getLogger("lumpy.histogram").warn(warn_str)
             continue
 
+        rgdata = np.asarray(rgdata, dtype=np.int64)
+
         c = counts[readgroup]
         med, umad = unscaled_upper_mad(rgdata)
         upper_cutoff = med + mads * umad
 
-        L = [v for v in rgdata if v < upper_cutoff]
+        # nothing above the median (umad is 0), so no upper outliers
+        L = rgdata[rgdata < upper_cutoff] if umad else rgdata
         new_len = len(L)
         removed = c - new_len
         sys.stderr.write("Removed %d outliers with isize >= %d\n" %
                          (removed, upper_cutoff))
-        c = new_len
 
-        mean, stdev = mean_std(L)
+        mean = L.mean()
+        stdev = L.std()
 
         start = read_length
         end = int(mean + X * stdev)
+        size = max(end - start, 0)
 
-        H = [0] * (end - start + 1)
-        s = 0
-
-        for x in L:
-            if (x >= start) and (x <= end):
-                j = int(x - start)
-                H[j] = H[int(x - start)] + 1
-                s += 1
-
-        result = {i: (H[i], s) for i in range(end - start)}
+        L = L[(L >= start) & (L <= end)]
+        H = np.bincount(L - start, minlength=size)[:size]
 
-        finaldata[readgroup] = result
+        finaldata[readgroup] = (H, len(L))
 
         means.append(mean * reads_per_rg[readgroup])
         stdevs.append(stdev * reads_per_rg[readgroup])
@@ -139,41 +182,56 @@ def calculate_histogram(readgroups, data, counts, min_elements, mads, read_lengt
 
 
 def merge_readgroups(readgroups, histogram_data):
-    keys = set()
-    for readgroup, rgdata in histogram_data.items():
-        if not rgdata:
-            continue
-        for isize in rgdata:
-            keys.add(isize)
-    if not keys:
-        return
-    keys = sorted(keys)
-
-    finalresult = []
-    for i in keys:
-        j = 0
-        k = 0
-        for rg in readgroups:
-            if not histogram_data[rg]:
-                continue
-            values = histogram_data[rg].get(i, None)
-            if not values:
-                continue
-            j += values[0]
-            k += values[1]
-
-            finalresult.append((i, (float(j) / k)))
-    return finalresult
-
-def write_output(data, mean , stdev, outfile, numreads):
-
-    with open(outfile, 'w') as output:
-        output.write('#mean:{}\n'.format(mean))
-        output.write('#stdev:{}\n'.format(stdev))
-        output.write("#numreads:{}\n".format(numreads))
-        if data:
-            for idx, value in data:
-                output.write("{},{}\n".format(idx,value))
+    """
+    density per insert size over the read groups: for every read group
+    that has the insert size, the running counts over the total in the
+    histogram range, summed
+    :returns array of densities indexed as in calculate_histogram
+    """
+    histograms = [
+        histogram_data[rg] for rg in readgroups
+        if histogram_data[rg] is not None and len(histogram_data[rg][0])
+    ]
+    if not histograms:
+        return np.zeros(0)
+
+    size = max(len(H) for H, _ in histograms)
+
+    counts = np.zeros((len(histograms), size))
+    totals = np.zeros((len(histograms), size))
+    for i, (H, total) in enumerate(histograms):
+        counts[i, :len(H)] = H
+        totals[i, :len(H)] = total
+
+    present = totals > 0
+    cum_counts = np.cumsum(counts, axis=0)
+    cum_totals = np.cumsum(totals, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        density = np.where(present, cum_counts / cum_totals, 0)
+
+    return density.sum(axis=0)
+
+
+def write_output(data, mean, stdev, outfile, numreads):
+    """
+    writes the histogram as one npy array: the number of reads, mean and
+    stdev followed by the densities, see merge_histograms.load_histogram
+    """
+    with open(outfile, 'wb') as output:
+        np.save(output, np.concatenate([[numreads, mean, stdev], data]))
+
+
+def write_histogram(
+        readgroups, reads_per_rg, isizes, counts, outfile,
+        min_elements=1000, mads=10, X=4, read_length=101,
+):
+    histodata, mean, stdev = calculate_histogram(readgroups, isizes, counts, min_elements, mads, read_length, X, reads_per_rg)
+
+    numreads = sum(reads_per_rg.values())
+    merged_histo = merge_readgroups(readgroups, histodata)
+
+    write_output(merged_histo, mean, stdev, outfile, numreads)
 
 
 def gen_histogram(
@@ -185,9 +243,7 @@ def gen_histogram(
 
     reads_per_rg, isizes, counts = read_bam_file(infile, readgroups, N, skip)
 
-    histodata, mean, stdev = calculate_histogram(readgroups, isizes, counts, min_elements, mads, read_length, X, reads_per_rg)
-
-    numreads = sum(reads_per_rg.values())
-    merged_histo = merge_readgroups(readgroups, histodata)
-
-    write_output(merged_histo, mean, stdev, outfile, numreads)
\ No newline at end of file
+    write_histogram(
+        readgroups, reads_per_rg, isizes, counts, outfile,
+        min_elements=min_elements, mads=mads, X=X, read_length=read_length
+    )
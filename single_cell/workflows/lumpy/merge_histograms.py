@@ -1,58 +1,39 @@
+import numpy as np
 import yaml
 
 
-def parse_histogram(infile):
-    data = []
+def load_histogram(infile):
+    """
+    reads a histogram written by generate_histogram.write_output
+    :returns density array, mean, stdev and the number of reads
+    """
+    data = np.load(infile)
 
-    with open(infile) as inputdata:
-        for line in inputdata:
-            if line.startswith('#'):
-                line = line.strip().split(':')
-                if line[0] == "#numreads":
-                    numreads = int(line[1])
-                elif line[0] == "#mean":
-                    mean = float(line[1])
-                elif line[0] == "#stdev":
-                    stdev = float(line[1])
-                else:
-                    raise Exception()
-                continue
-
-            line = line.strip().split(',')
-            i = int(line[0])
-            val = float(line[1])
-            data.append((i, val))
-
-    return data, mean, stdev, numreads
+    return data[3:], float(data[1]), float(data[2]), int(data[0])
 
 
 def merge_histo(indata, merged_data, numreads):
-    for (i, val) in indata:
-        if not i in merged_data:
-            merged_data[i] = 0
-        merged_data[i] += (val * numreads)
+    if len(indata) > len(merged_data):
+        merged_data = np.concatenate(
+            [merged_data, np.zeros(len(indata) - len(merged_data))]
+        )
+    merged_data[:len(indata)] += indata * numreads
     return merged_data
 
 
 def normalize_histo(merged_data, total_reads):
-    data = []
-    indices = sorted(merged_data.keys())
-    for idx in indices:
-        value = merged_data[idx]
-        value = value / total_reads
-        data.append((idx, value))
-    return data
+    return merged_data / total_reads
 
 
 def prune_histogram(histogram):
     # towards the tail end, most cells will be 0
     # dividing by total reads will make most of these almost 0
     # remove these
-    if not histogram:
+    if not len(histogram):
         return histogram
-    for idx in range(len(histogram) - 1, -1, -1):
-        if float(histogram[idx][1]) >= 0.0001:
-            break
+
+    above = np.flatnonzero(histogram >= 0.0001)
+    idx = above[-1] if len(above) else 0
 
     histogram = histogram[:idx]
 
@@ -61,7 +42,7 @@ def prune_histogram(histogram):
 
 def write_histo_file(data, outfile):
     with open(outfile, 'w') as histo_file:
-        for i, val in data:
+        for i, val in enumerate(data.tolist()):
             histo_file.write("{}\t{}\n".format(i, val))
 
 
@@ -71,7 +52,7 @@ def write_metadata(mean, stdev, outfile):
 
 
 def merge_histograms(infiles, outfile, metadata):
-    merged_data = {}
+    merged_data = np.zeros(0)
     total_reads = 0
 
     means = 0
@@ -85,7 +66,7 @@ def merge_histograms(infiles, outfile, metadata):
         infiles = [infiles]
 
     for infile in infiles:
-        data, mean, stdev, numreads = parse_histogram(infile)
+        data, mean, stdev, numreads = load_histogram(infile)
 
         merged_data = merge_histo(data, merged_data, numreads)
 
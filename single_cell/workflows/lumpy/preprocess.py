@@ -0,0 +1,121 @@
+'''
+single pass lumpy preprocessing of a bam: discordant pairs (samtools
+view -F 1294), split reads (extractSplitReads_BwaMem with its defaults)
+and the insert size sample for the histogram
+'''
+import re
+
+import pysam
+
+DISCORDANT_EXCLUDE = 1294
+
+CIGAR_OPS = {0: 'M', 1: 'I', 2: 'D', 3: 'N', 4: 'S', 5: 'H', 6: 'P'}
+
+CIGAR_PATTERN = re.compile('([0-9]+)([MIDNSHP])')
+
+
+def is_discordant(read):
+    return not read.flag & DISCORDANT_EXCLUDE
+
+
+def get_query_span(cigar):
+    """
+    start and end of the aligned part of the query, as calcQueryPosFromCigar
+    in extractSplitReads_BwaMem
+    :param cigar: list of (op, length) in query order
+    """
+    start = end = 0
+    aligned = False
+
+    for op, length in cigar:
+        if op in 'HS':
+            if not aligned:
+                start += length
+                end += length
+        elif op in 'MI':
+            end += length
+            aligned = True
+
+    return start, end
+
+
+def get_read_cigar(read):
+    cigar = [
+        (CIGAR_OPS[op], length) for op, length in read.cigartuples or []
+        if op in CIGAR_OPS
+    ]
+    return cigar[::-1] if read.is_reverse else cigar
+
+
+def get_supplementary_cigar(supplementary):
+    """
+    :param supplementary: value of the SA tag
+    """
+    fields = supplementary.split(',')
+    cigar = [(op, int(length)) for length, op in CIGAR_PATTERN.findall(fields[3])]
+    return cigar[::-1] if fields[2] == '-' else cigar
+
+
+def get_split_read_name(read, num_splits=2, min_non_overlap=20, include_dups=False):
+    """
+    extractSplitReads_BwaMem: reads with at most num_splits - 1 supplementary
+    alignments whose query spans overlap the primary's by less than
+    min_non_overlap on both sides
+    :returns the name of the split read, None if the read is not one
+    """
+    if not include_dups and read.is_duplicate:
+        return None
+
+    if not read.has_tag('SA'):
+        return None
+
+    supplementary = read.get_tag('SA')
+    if len(supplementary.split(';')) > num_splits:
+        return None
+
+    start, end = get_query_span(get_read_cigar(read))
+    sa_start, sa_end = get_query_span(get_supplementary_cigar(supplementary))
+
+    overlap = max(0, 1 + min(end, sa_end) - max(start, sa_start))
+    non_overlap = min(1 + end - start - overlap, 1 + sa_end - sa_start - overlap)
+
+    if non_overlap < min_non_overlap:
+        return None
+
+    return '{}_{}'.format(read.query_name, '1' if read.is_read1 else '2')
+
+
+def extract_reads(input_bam, discordant_bam, split_bam, sampler=None, tag=None):
+    """
+    reads input_bam once, writing discordant pairs and split reads in input
+    order and feeding every read to the insert size sampler
+    :param sampler: generate_histogram.InsertSizeSampler
+    :param tag: prefix for the read names in the outputs, tag:name
+    """
+    with pysam.AlignmentFile(input_bam, 'rb') as reader:
+        discordants = pysam.AlignmentFile(discordant_bam, 'wb', template=reader)
+        split_reads = pysam.AlignmentFile(split_bam, 'wb', template=reader)
+
+        for read in reader.fetch(until_eof=True):
+            # the sampler counts the placed reads, as fetch() returns them
+            if sampler and not sampler.done and read.reference_id >= 0:
+                sampler.add(read)
+
+            discordant = is_discordant(read)
+            split_name = get_split_read_name(read)
+
+            if not discordant and split_name is None:
+                continue
+
+            if tag:
+                read.query_name = '{}:{}'.format(tag, read.query_name)
+
+            if discordant:
+                discordants.write(read)
+
+            if split_name is not None:
+                read.query_name = '{}:{}'.format(tag, split_name) if tag else split_name
+                split_reads.write(read)
+
+        discordants.close()
+        split_reads.close()
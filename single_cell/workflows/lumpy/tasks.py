@@ -5,6 +5,7 @@ import pysam
 import single_cell.utils.helpers as helpers
 import yaml
 from single_cell.workflows.lumpy import generate_histogram
+from single_cell.workflows.lumpy import preprocess
 
 
 def process_bam(
@@ -13,57 +14,40 @@ def process_bam(
         N=10000, skip=100000, min_elements=1000, mads=10,
         X=4, read_length=101
 ):
+    """
+    discordants, split reads and the insert size histogram from one pass
+    over input_bam, see preprocess.extract_reads. the outputs keep the
+    order of the input, so they only need sorting if it is not coordinate
+    sorted
+    """
     helpers.makedirs(tempdir)
 
-    discordants = os.path.join(tempdir, "discordants.bam")
-    run_samtools_view(input_bam, discordants, docker_image=docker_image)
-    if tag:
-        sorted_discordants = os.path.join(tempdir, 'discordants.sorted.bam')
-        run_samtools_sort(discordants, sorted_discordants, docker_image=docker_image)
-        tag_reads(sorted_discordants, discordant_bam, tag)
-    else:
-        run_samtools_sort(discordants, discordant_bam, docker_image=docker_image)
+    readgroups = generate_histogram.get_read_groups(input_bam)
+    reads_per_rg = generate_histogram.get_reads_per_rg(input_bam, readgroups)
+    sampler = generate_histogram.InsertSizeSampler(
+        readgroups, N, skip, reads_per_rg=reads_per_rg
+    )
 
-    split_reads = os.path.join(tempdir, "split_reads.bam")
-    run_lumpy_extract_split_reads_bwamem(input_bam, split_reads, docker_image=docker_image)
-    if tag:
-        sorted_split_reads = os.path.join(tempdir, 'split.sorted.bam')
-        run_samtools_sort(split_reads, sorted_split_reads, docker_image=docker_image)
-        tag_reads(sorted_split_reads, split_bam, tag)
+    if is_coordinate_sorted(input_bam):
+        preprocess.extract_reads(input_bam, discordant_bam, split_bam, sampler=sampler, tag=tag)
+        pysam.index(discordant_bam)
+        pysam.index(split_bam)
     else:
+        discordants = os.path.join(tempdir, "discordants.bam")
+        split_reads = os.path.join(tempdir, "split_reads.bam")
+        preprocess.extract_reads(input_bam, discordants, split_reads, sampler=sampler, tag=tag)
+        run_samtools_sort(discordants, discordant_bam, docker_image=docker_image)
         run_samtools_sort(split_reads, split_bam, docker_image=docker_image)
 
-    generate_histogram.gen_histogram(
-        input_bam, histogram, N=N, skip=skip, min_elements=min_elements,
-        mads=mads, X=X, read_length=read_length
+    generate_histogram.write_histogram(
+        readgroups, sampler.reads_per_rg, sampler.data, sampler.counts, histogram,
+        min_elements=min_elements, mads=mads, X=X, read_length=read_length
     )
 
 
-def tag_reads(infile, outfile, sample_id):
-    infile = pysam.AlignmentFile(infile, 'rb')
-    taggedreads = pysam.AlignmentFile(outfile, "wb", template=infile)
-    for read in infile.fetch():
-        read.query_name = "{}:{}".format(sample_id, read.query_name)
-        taggedreads.write(read)
-    infile.close()
-    taggedreads.close()
-
-
-def run_samtools_view(infile, outfile, docker_image=None):
-    cmd = ['samtools', 'view', '-b', '-F', '1294', infile, '>', outfile]
-
-    pypeliner.commandline.execute(*cmd, docker_image=docker_image)
-
-
-def run_lumpy_extract_split_reads_bwamem(infile, outfile, docker_image=None):
-    cmd = [
-        'samtools', 'view', '-h', infile, '|',
-        'extractSplitReads_BwaMem', '-i', 'stdin', '|',
-        'samtools', 'view', '-Sb', '-',
-        '>', outfile
-    ]
-
-    pypeliner.commandline.execute(*cmd, docker_image=docker_image)
+def is_coordinate_sorted(bam):
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        return reader.header.to_dict().get('HD', {}).get('SO') == 'coordinate'
 
 
 def run_samtools_sort(infile, outfile, docker_image=None):
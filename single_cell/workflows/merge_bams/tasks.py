@@ -6,7 +6,7 @@ Created on Jul 24, 2017
 import os
 
 from single_cell.utils import bamutils
-from single_cell.utils import helpers
+from single_cell.utils import pysamutils
 
 
 def cell_region_merge_bams(cell_bams, region_bam, region, docker_image):
@@ -23,22 +23,22 @@ def cell_region_merge_bams(cell_bams, region_bam, region, docker_image):
         docker_image=docker_image)
 
 
-def merge_bams(bams, outputs, regions, samtools_docker, tempdir, ncores=None):
-    merge_tempdir = os.path.join(tempdir, "merge")
-    commands = []
-    for region in regions:
-        output = outputs[region]
-        region = '{}:{}-{}'.format(*region.split('-'))
-        cmd = list(['samtools', 'merge', '-f', '-R', region])
-        cmd.append(output)
-        cmd.extend(bams.values())
-        commands.append(cmd)
-    helpers.run_in_gnu_parallel(commands, merge_tempdir, samtools_docker, ncores=ncores)
-
-    index_tempdir = os.path.join(tempdir, "index")
-    commands = []
-    for region in regions:
-        output = outputs[region]
-        commands.append(['samtools', 'index', output, output + ".bai"])
-
-    helpers.run_in_gnu_parallel(commands, index_tempdir, samtools_docker, ncores=ncores)
+def merge_bams(bams, outputs, regions, tempdir, ncores=None):
+    """
+    merges the cell bams into all regions in a single pass over the cells,
+    see pysamutils.RegionBamMerger. chromosomes are merged in parallel,
+    cores left over go to bgzf compression
+    :param tempdir: temp space for the batch merges of more cells than
+    RegionBamMerger opens at a time
+    """
+    outputs = {region: outputs[region] for region in regions}
+
+    ncores = ncores or 1
+    nchroms = len(set(pysamutils.parse_region(region)[0] for region in regions))
+    processes = max(min(ncores, nchroms), 1)
+
+    merger = pysamutils.RegionBamMerger(
+        list(bams.values()), outputs, os.path.join(tempdir, 'merge'),
+        threads=max(ncores // processes, 1), processes=processes
+    )
+    merger.merge()
@@ -15,6 +15,8 @@ def create_qc_annotation_workflow(
 ):
     ctx = {'docker_image': config['docker']['single_cell_pipeline']}
 
+    max_cores = config.get('max_cores', 8)
+
     workflow = pypeliner.workflow.Workflow(ctx=ctx)
 
     workflow.transform(
@@ -32,7 +34,7 @@ def create_qc_annotation_workflow(
 
     workflow.transform(
         name="add_quality",
-        ctx={'mem': config['memory']['med'], 'ncpus': 1},
+        ctx={'mem': config['memory']['med'], 'ncpus': max_cores},
         func="single_cell.workflows.qc_annotation.tasks.add_quality",
         args=(
             mgd.TempInputFile('cell_state_classifier.csv.gz', extensions=['.yaml']),
@@ -41,6 +43,7 @@ def create_qc_annotation_workflow(
             config['classifier_training_data'],
             mgd.TempSpace("hmmcopy_classify_tempdir")
         ),
+        kwargs={'ncores': max_cores}
     )
 
     workflow.transform(
@@ -70,6 +73,7 @@ def create_qc_annotation_workflow(
 
     workflow.transform(
         name='generate_qc_report',
+        ctx={'ncpus': max_cores},
         func="single_cell.workflows.qc_annotation.tasks.generate_qc_report",
         args=(
             mgd.TempSpace("QC_report_singlecellpipeline"),
@@ -79,7 +83,8 @@ def create_qc_annotation_workflow(
             mgd.InputFile(gc_metrics, extensions=['.yaml']),
             mgd.OutputFile(qc_report),
             mgd.TempOutputFile('merged_metrics_contamination_species.csv.gz', extensions=['.yaml']),
-        )
+        ),
+        kwargs={'ncores': max_cores}
     )
 
     workflow.transform(
@@ -112,7 +117,8 @@ def create_qc_annotation_workflow(
             'max_cn': config['num_states'],
             'scale_by_cells': False,
             'cell_filters': config["good_cells"],
-            'mappability_threshold': config["map_cutoff"]
+            'mappability_threshold': config["map_cutoff"],
+            'image_size': config.get('heatmap_image_size', [1000, 3000]),
         }
     )
 
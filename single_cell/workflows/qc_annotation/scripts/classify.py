@@ -12,6 +12,9 @@ import shutil
 from sklearn.ensemble import RandomForestClassifier
 
 from single_cell.utils import csvutils
+from single_cell.utils import modelcache
+
+CLASSIFIER_PARAMS = {'n_estimators': 500, 'random_state': 0}
 
 
 def parse_args():
@@ -71,14 +74,16 @@ def read_data(filename, tablename, gzipped=True):
     return data
 
 
-def train_classifier(filename):
+def train_classifier(filename, n_estimators=500, random_state=0, n_jobs=1):
     training_data = read_from_h5(filename, '/training_data')
 
     labels = training_data["label"]
 
     del training_data["label"]
 
-    clf = RandomForestClassifier(n_estimators=500)
+    clf = RandomForestClassifier(
+        n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs
+    )
 
     model = clf.fit(training_data, labels)
 
@@ -88,6 +93,22 @@ def train_classifier(filename):
     return model
 
 
+def get_classifier(filename, ncores=1, cache_dir=None):
+    """
+    loads the classifier for the training data from the model cache,
+    trains it with ncores on a cache miss
+    """
+    model = modelcache.get_model(
+        'quality_classifier', filename, CLASSIFIER_PARAMS, train_classifier,
+        cache_dir=cache_dir, n_jobs=ncores
+    )
+
+    # trees are evaluated in parallel in predict_proba
+    model.n_jobs = ncores
+
+    return model
+
+
 def load_data(hmmcopy_filename, alignment_filename,
               colnames):
 
@@ -164,7 +185,7 @@ if __name__ == "__main__":
 
     shutil.copy(args.hmmcopy_metrics, args.output)
 
-    model = train_classifier(args.training_data)
+    model = get_classifier(args.training_data)
 
     feature_names = model.feature_names_
 
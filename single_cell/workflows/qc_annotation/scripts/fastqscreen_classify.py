@@ -1,10 +1,14 @@
 import pandas as pd
 from single_cell.utils import csvutils
+from single_cell.utils import modelcache
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import *
 import numpy as np
 
-def train(training_data_path):
+CLASSIFIER_PARAMS = {'n_estimators': 10, 'random_state': 42}
+
+
+def train(training_data_path, n_estimators=10, random_state=42, n_jobs=1):
     '''
     Train the model using the provided training data.
     Return a feature scaler and a classifier.
@@ -22,15 +26,32 @@ def train(training_data_path):
     transformer = RobustScaler().fit(features)
     features = transformer.transform(features)
     # train the random forest model
-    rf = RandomForestClassifier(n_estimators=10, random_state=42)
+    rf = RandomForestClassifier(
+        n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs
+    )
     rf.fit(features, labels)
 
     return features, transformer, rf
 
 
-def classify_fastqscreen(training_data_path, metrics_path, metrics_output, dtypes):
+def get_model(training_data_path, ncores=1, cache_dir=None):
+    '''
+    Load the output of train from the model cache, train with ncores
+    on a cache miss.
+    '''
+    features, transformer, rf = modelcache.get_model(
+        'fastqscreen_classifier', training_data_path, CLASSIFIER_PARAMS, train,
+        cache_dir=cache_dir, n_jobs=ncores
+    )
+
+    rf.n_jobs = ncores
+
+    return features, transformer, rf
+
+
+def classify_fastqscreen(training_data_path, metrics_path, metrics_output, dtypes, ncores=1):
     df = csvutils.read_csv_and_yaml(metrics_path)
-    features_train, feature_transformer, model = train(training_data_path)
+    features_train, feature_transformer, model = get_model(training_data_path, ncores=ncores)
 
     features = ["fastqscreen_nohit_ratio", "fastqscreen_grch37_ratio", "fastqscreen_mm10_ratio",
                 "fastqscreen_salmon_ratio"]
@@ -53,26 +53,21 @@ def add_contamination_status(
 def annotate_metrics(
         metrics, output, sample_info, cells):
     """
-    adds sample information to metrics in place
+    adds sample information for cells to metrics
     """
+    annotation = {cellid: sample_info[cellid] for cellid in cells}
 
-    metrics = csvutils.read_csv_and_yaml(metrics)
-
-    for cellid in cells:
-        cellinfo = sample_info[cellid]
-
-        for colname, value in cellinfo.items():
-            metrics.loc[metrics["cell_id"] == cellid, colname] = value
-
-    csvutils.write_dataframe_to_csv_and_yaml(metrics, output, dtypes()['metrics'])
+    csvutils.annotate_csv(
+        metrics, annotation, output, dtypes()['metrics'], chunksize=10 ** 5
+    )
 
 
-def add_quality(hmmcopy_metrics, alignment_metrics, output, training_data, tempdir):
+def add_quality(hmmcopy_metrics, alignment_metrics, output, training_data, tempdir, ncores=1):
     helpers.makedirs(tempdir)
 
     intermediate_output = os.path.join(tempdir, 'metrics_with_quality.csv')
 
-    model = classify.train_classifier(training_data)
+    model = classify.get_classifier(training_data, ncores=ncores)
 
     feature_names = model.feature_names_
 
@@ -104,11 +99,12 @@ def merge_metrics(hmmcopy_metrics, alignment_metrics, merged_output):
 
 def generate_qc_report(
         tempdir, reference_gc, fastqscreen_training_data,
-        metrics_df, gc_metrics_df, qc_report, metrics_df_annotated
+        metrics_df, gc_metrics_df, qc_report, metrics_df_annotated, ncores=1
 ):
     helpers.makedirs(tempdir)
     fastqscreen_classify.classify_fastqscreen(
-        fastqscreen_training_data, metrics_df, metrics_df_annotated, dtypes()['metrics']
+        fastqscreen_training_data, metrics_df, metrics_df_annotated, dtypes()['metrics'],
+        ncores=ncores
     )
 
     generate_qc.generate_html_report(tempdir, qc_report, reference_gc, metrics_df_annotated, gc_metrics_df)
@@ -188,7 +184,8 @@ def plot_pcolor(infile, metrics, output, corrupt_tree=None, plot_title=None,
                 column_name=None, plot_by_col=None,
                 chromosomes=None, max_cn=None,
                 scale_by_cells=None, color_by_col=None,
-                mappability_threshold=None, cell_filters=None
+                mappability_threshold=None, cell_filters=None,
+                image_size=None
                 ):
     cells = get_good_cells(metrics, cell_filters)
 
@@ -202,5 +199,6 @@ def plot_pcolor(infile, metrics, output, corrupt_tree=None, plot_title=None,
         corrupt_tree=corrupt_tree,
         mappability_threshold=mappability_threshold,
         cells=cells,
+        image_size=image_size,
     )
     plot.main()
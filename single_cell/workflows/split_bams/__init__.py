@@ -44,6 +44,7 @@ def create_split_workflow(
                 regions,
                 samtoolsimage
             ),
+            kwargs={"ncores": config["max_cores"]}
         )
 
     elif one_split_job:
@@ -59,8 +60,6 @@ def create_split_workflow(
                     extensions=['.bai'],
                 ),
                 regions,
-                samtoolsimage,
-                mgd.TempSpace("one_job_split_tempdir")
             ),
             kwargs={"ncores": config["max_cores"]}
         )